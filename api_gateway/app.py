@@ -1,333 +1,301 @@
 import os
+import sys
 import logging
 import json
-import requests
-from flask import Flask, jsonify, request, render_template
-from utils.circuit_breaker import circuit_breaker
-from utils.rate_limiter import rate_limit
-from utils.retry import retry_request
-from utils.time_limiter import time_limit
-
-# Cấu hình logging
-logging.basicConfig(level=logging.DEBUG)
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Package common/ (metrics, tracing, logging, phân trang) nằm ở thư mục gốc dự án;
+# thêm vào sys.path khi gateway được chạy trực tiếp từ thư mục của nó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request, render_template, has_request_context
+from config import SERVICE_URLS
+from orders import (define_order_saga, order_id_for, order_response, order_status,
+                    retry_order_data, sync_step, validate_order)
+from routes import PROXY_ROUTES, retry_policy_for
+from utils.circuit_breaker import breaker_name, circuit_breaker, _registry as breaker_registry
+from utils.health_monitor import create_health_monitor
+from utils.hedging import _hedger, HEDGING_ENABLED
+from utils.idempotency import IDEMPOTENCY_HEADER, idempotent, _idempotency_store
+from utils.http_client import create_upstream_client
+from common.logging_config import configure_logging
+from common.metrics import instrument_app
+from common.pagination import NEXT_CURSOR_HEADER
+from utils.rate_limiter import rate_limit, _rate_limiter
+from utils.response_cache import cached_response, _response_cache
+from utils.retry import get_retry_budget, get_retry_stats
+from utils.saga import SagaExistsError, create_saga_orchestrator
+from utils.single_flight import flight_key, _single_flight
+from utils.time_limiter import time_limit, get_time_limit_stats
+from common.tracing import (_tracer, current_trace_id, instrument_tracing, inject_headers, is_valid_trace_id,
+                            read_trace)
+from utils.traffic_recorder import record_traffic, _traffic_recorder
+
+# Cấu hình logging (hàng đợi + thread nền, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
+configure_logging('gateway', trace_id=current_trace_id)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key")
 
-# Cấu hình các service URLs
-SERVICE_URLS = {
-    'payment': 'http://localhost:8001',
-    'inventory': 'http://localhost:8002',
-    'shipping': 'http://localhost:8003'
-}
+# Đếm request, đo latency theo route và thêm GET /metrics (Prometheus)
+instrument_app(app)
+
+# Tạo/nhận trace cho mỗi request, truyền traceparent sang các service phía sau
+instrument_tracing(app, 'gateway')
+
+# Ghi lại traffic vào file JSONL để replay khi đặt GATEWAY_TRAFFIC_RECORD_PATH
+record_traffic(app)
+
+# Client dùng chung với connection pool keep-alive cho từng service
+upstream = create_upstream_client(SERVICE_URLS)
+
+# Kiểm tra trạng thái các service trong nền, /health chỉ đọc kết quả
+health_monitor = create_health_monitor(upstream, SERVICE_URLS.keys())
+
+# Điều phối saga (create_order), lưu từng bước vào SQLite để chạy tiếp sau khi khởi động lại
+_sagas = create_saga_orchestrator()
+
+def retry_policy():
+    """Chính sách retry cho route hiện tại"""
+    return retry_policy_for(request.endpoint if has_request_context() else None)
+
+def call_service(service, method, path, timeout=5, **kwargs):
+    """Gọi một service phía sau qua circuit breaker, retry và time limit"""
+    policy = retry_policy()
+    endpoint = request.endpoint if has_request_context() else None
+
+    def send():
+        return upstream.request(service, method, path, **kwargs)
+
+    if HEDGING_ENABLED and method in ('GET', 'HEAD'):
+        # Đọc idempotent: gửi thêm bản sao nếu upstream chậm hơn percentile latency
+        hedge_key = (service, endpoint or path)
+        send_once = send
+
+        def send():
+            return _hedger.execute(hedge_key, send_once)
+
+    def call():
+        # Span bao cả retry/hedge để thấy thời gian từng chặng (/check, /payments, ...)
+        with _tracer.span(f"call {service} {method} {path}", service=service):
+            return circuit_breaker(lambda: policy.execute(
+                lambda: time_limit(send, seconds=timeout),
+                method=method,
+                headers=kwargs.get('headers'),
+                budget=get_retry_budget(service)
+            ), name=breaker_name(service, endpoint))
+
+    key = flight_key(service, method, path, kwargs)
+    if key is not None:
+        return _single_flight.do(key, call)
+
+    return call()
 
 @app.route('/')
 def index():
     """Trang chủ của API Gateway"""
     return render_template('index.html')
 
-@app.route('/api/products', methods=['GET'])
-@rate_limit(limit=10, period=60)  # Giới hạn 10 requests mỗi phút
-def get_products():
-    """Lấy danh sách sản phẩm từ Inventory Service"""
-    try:
-        @circuit_breaker
-        def get_products_with_retry():
-            return retry_request(
-                lambda: time_limit(
-                    lambda: requests.get(f"{SERVICE_URLS['inventory']}/products"),
-                    seconds=5
-                )
-            )
-        
-        response = get_products_with_retry()
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi lấy danh sách sản phẩm: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-
-@app.route('/api/products/<product_id>', methods=['GET'])
-@rate_limit(limit=20, period=60)
-def get_product(product_id):
-    """Lấy thông tin chi tiết sản phẩm từ Inventory Service"""
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.get(f"{SERVICE_URLS['inventory']}/products/{product_id}"),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi lấy thông tin sản phẩm {product_id}: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-
-@app.route('/api/products', methods=['POST'])
-@rate_limit(limit=5, period=60)
-def create_product():
-    """Tạo sản phẩm mới trong Inventory Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['inventory']}/products", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi tạo sản phẩm mới: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-
-@app.route('/api/inventory/update', methods=['POST'])
-@rate_limit(limit=5, period=60)
-def update_inventory():
-    """Cập nhật tồn kho trong Inventory Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['inventory']}/update", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi cập nhật tồn kho: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-
-@app.route('/api/payments', methods=['POST'])
-@rate_limit(limit=5, period=60)
-def create_payment():
-    """Tạo thanh toán mới trong Payment Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['payment']}/payments", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi tạo thanh toán: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Payment Service"}), 503
-
-@app.route('/api/payments/<payment_id>', methods=['GET'])
-@rate_limit(limit=10, period=60)
-def get_payment(payment_id):
-    """Lấy thông tin thanh toán từ Payment Service"""
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.get(f"{SERVICE_URLS['payment']}/payments/{payment_id}"),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi lấy thông tin thanh toán {payment_id}: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Payment Service"}), 503
-
-@app.route('/api/payments/<payment_id>/refund', methods=['POST'])
-@rate_limit(limit=3, period=60)
-def refund_payment(payment_id):
-    """Hoàn tiền thanh toán trong Payment Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['payment']}/payments/{payment_id}/refund", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi hoàn tiền thanh toán {payment_id}: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Payment Service"}), 503
-
-@app.route('/api/shipping', methods=['POST'])
-@rate_limit(limit=5, period=60)
-def create_shipping():
-    """Tạo vận chuyển mới trong Shipping Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['shipping']}/shipping", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi tạo vận chuyển: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Shipping Service"}), 503
-
-@app.route('/api/shipping/<shipping_id>', methods=['GET'])
-@rate_limit(limit=10, period=60)
-def get_shipping(shipping_id):
-    """Lấy thông tin vận chuyển từ Shipping Service"""
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.get(f"{SERVICE_URLS['shipping']}/shipping/{shipping_id}"),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi lấy thông tin vận chuyển {shipping_id}: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Shipping Service"}), 503
-
-@app.route('/api/shipping/<shipping_id>/update', methods=['PUT'])
-@rate_limit(limit=5, period=60)
-def update_shipping(shipping_id):
-    """Cập nhật trạng thái vận chuyển trong Shipping Service"""
-    data = request.json
-    try:
-        response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.put(f"{SERVICE_URLS['shipping']}/shipping/{shipping_id}/update", json=data),
-                seconds=5
-            )
-        ))
-        return jsonify(response.json()), response.status_code
-    except Exception as e:
-        logger.error(f"Lỗi khi cập nhật trạng thái vận chuyển {shipping_id}: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Shipping Service"}), 503
+def proxy_view(route):
+    """View Flask cho một route chỉ chuyển tiếp tới service (khai báo trong routes.PROXY_ROUTES)"""
+    def view(**view_args):
+        body = request.json if route.has_body else None
+        call = route.upstream_call(view_args, request.args, body, request.headers, request.remote_addr)
+        try:
+            response = call_service(call.service, call.method, call.path, **call.kwargs)
+            return route.result(response)
+        except Exception as e:
+            return route.error(view_args, e)
+
+    view.__name__ = route.endpoint
+    view.__doc__ = route.description
+    if route.cache_ttl is not None:
+        view = cached_response(ttl=route.cache_ttl)(view)
+    if route.idempotency_scope is not None:
+        view = idempotent(view)
+    return rate_limit(limit=route.limit, period=route.period)(view)
+
+for _route in PROXY_ROUTES:
+    app.add_url_rule(_route.rule, endpoint=_route.endpoint, view_func=proxy_view(_route), methods=[_route.method])
+
+# Saga tạo đơn hàng: bước sau thất bại thì các bước trước được bù trừ trong nền
+define_order_saga(_sagas, lambda step: sync_step(step, call_service))
+
+# Tiếp tục các saga dở dang (gateway bị tắt giữa chừng) và chạy bù trừ trong nền
+_sagas.ensure_started()
 
 @app.route('/api/orders', methods=['POST'])
 @rate_limit(limit=5, period=60)
+@idempotent
 def create_order():
-    """Tạo đơn hàng mới (kết hợp thanh toán, cập nhật tồn kho và vận chuyển)"""
-    data = request.json
-    
-    # 1. Kiểm tra và cập nhật tồn kho
-    try:
-        inventory_response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['inventory']}/check", json=data['items']),
-                seconds=5
-            )
-        ))
-        
-        if inventory_response.status_code != 200:
-            return jsonify(inventory_response.json()), inventory_response.status_code
-        
-    except Exception as e:
-        logger.error(f"Lỗi khi kiểm tra tồn kho: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-    
-    # 2. Tạo thanh toán
-    try:
-        payment_data = {
-            "amount": data['total_amount'],
-            "payment_method": data['payment_method'],
-            "customer_id": data['customer_id']
-        }
-        
-        payment_response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['payment']}/payments", json=payment_data),
-                seconds=5
-            )
-        ))
-        
-        if payment_response.status_code != 201:
-            return jsonify(payment_response.json()), payment_response.status_code
-        
-        payment_info = payment_response.json()
-        
-    except Exception as e:
-        logger.error(f"Lỗi khi tạo thanh toán: {str(e)}")
-        return jsonify({"error": "Không thể kết nối đến Payment Service"}), 503
-    
-    # 3. Cập nhật tồn kho
-    try:
-        update_response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['inventory']}/update", json=data['items']),
-                seconds=5
-            )
-        ))
-        
-        if update_response.status_code != 200:
-            # Hoàn tiền nếu cập nhật tồn kho thất bại
-            refund_data = {"reason": "Cập nhật tồn kho thất bại"}
-            requests.post(f"{SERVICE_URLS['payment']}/payments/{payment_info['id']}/refund", json=refund_data)
-            return jsonify(update_response.json()), update_response.status_code
-        
-    except Exception as e:
-        logger.error(f"Lỗi khi cập nhật tồn kho: {str(e)}")
-        # Hoàn tiền nếu cập nhật tồn kho thất bại
-        refund_data = {"reason": "Cập nhật tồn kho thất bại"}
-        requests.post(f"{SERVICE_URLS['payment']}/payments/{payment_info['id']}/refund", json=refund_data)
-        return jsonify({"error": "Không thể kết nối đến Inventory Service"}), 503
-    
-    # 4. Tạo vận chuyển
+    """
+    Tạo đơn hàng mới (kết hợp thanh toán, cập nhật tồn kho và vận chuyển).
+
+    Mặc định chờ tất cả các bước rồi trả về 201. Gửi header "Prefer: respond-async"
+    để nhận 202 kèm order_id ngay; theo dõi tiến trình qua GET /api/orders/<order_id>.
+    Gửi kèm Idempotency-Key để gửi lại an toàn: request trùng key nhận lại kết quả của đơn hàng đầu tiên,
+    trừ khi đơn hàng đó thất bại vì lỗi tạm thời (503) và đã bù trừ xong: khi đó đơn hàng được chạy lại.
+    """
+    data = request.get_json(silent=True)
+    error = validate_order(data)
+    if error is not None:
+        return error
+
+    _sagas.ensure_started()
+    order_id = order_id_for(_sagas, request.remote_addr, request.headers.get(IDEMPOTENCY_HEADER))
+    data = dict(data, order_id=order_id)
+    # Đơn hàng cùng key đã thất bại vì lỗi tạm thời (503) thì được chạy lại
+    retry = functools.partial(retry_order_data, data=data)
+
     try:
-        shipping_data = {
-            "customer_id": data['customer_id'],
-            "address": data['shipping_address'],
-            "items": data['items'],
-            "payment_id": payment_info['id']
-        }
-        
-        shipping_response = circuit_breaker(lambda: retry_request(
-            lambda: time_limit(
-                lambda: requests.post(f"{SERVICE_URLS['shipping']}/shipping", json=shipping_data),
-                seconds=5
-            )
-        ))
-        
-        if shipping_response.status_code != 201:
-            # Hoàn tiền nếu tạo vận chuyển thất bại
-            refund_data = {"reason": "Tạo vận chuyển thất bại"}
-            requests.post(f"{SERVICE_URLS['payment']}/payments/{payment_info['id']}/refund", json=refund_data)
-            return jsonify(shipping_response.json()), shipping_response.status_code
-        
-        shipping_info = shipping_response.json()
-        
-    except Exception as e:
-        logger.error(f"Lỗi khi tạo vận chuyển: {str(e)}")
-        # Hoàn tiền nếu tạo vận chuyển thất bại
-        refund_data = {"reason": "Tạo vận chuyển thất bại"}
-        requests.post(f"{SERVICE_URLS['payment']}/payments/{payment_info['id']}/refund", json=refund_data)
-        return jsonify({"error": "Không thể kết nối đến Shipping Service"}), 503
-    
-    # 5. Trả về kết quả
-    result = {
-        "order_id": str(hash(f"{payment_info['id']}_{shipping_info['id']}_{data['customer_id']}")),
-        "payment": payment_info,
-        "shipping": shipping_info,
-        "status": "Đơn hàng đã được tạo thành công"
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            _sagas.submit('create_order', data, saga_id=order_id, retry_data=retry)
+            saga = {'id': order_id, 'status': 'running'}
+        else:
+            saga = _sagas.start('create_order', data, saga_id=order_id, retry_data=retry)
+    except SagaExistsError:
+        saga = _sagas.get(order_id)
+
+    return order_response(saga)
+
+@app.route('/api/orders/<order_id>', methods=['GET'])
+@rate_limit(limit=30, period=60)
+def get_order(order_id):
+    """Trạng thái đơn hàng và nhật ký các bước của saga"""
+    saga = _sagas.get(order_id)
+    if saga is None or saga['name'] != 'create_order':
+        return jsonify({"error": f"Không tìm thấy đơn hàng {order_id}"}), 404
+    return jsonify(order_status(saga)), 200
+
+# Giới hạn của /api/batch
+BATCH_MAX_REQUESTS = int(os.environ.get('GATEWAY_BATCH_MAX_REQUESTS', 20))
+BATCH_FORWARD_HEADERS = ('Idempotency-Key', 'If-None-Match', 'Prefer')
+# Header của sub-response trả lại client: cursor trang kế tiếp, URL theo dõi đơn hàng 202
+BATCH_RESPONSE_HEADERS = ('ETag', 'X-Cache', NEXT_CURSOR_HEADER, 'Location')
+_batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('GATEWAY_BATCH_WORKERS', 32)),
+    thread_name_prefix='batch'
+)
+
+def run_sub_request(sub_request, remote_addr, trace_headers):
+    """Chạy một sub-request qua đúng route /api/* của gateway (kèm rate limit, cache, breaker)"""
+    method = str(sub_request.get('method', 'GET')).upper()
+    path = sub_request['path']
+    headers = {name: value for name, value in (sub_request.get('headers') or {}).items()
+               if name in BATCH_FORWARD_HEADERS}
+    # Các sub-request nằm trong cùng trace với request batch
+    headers.update(trace_headers)
+    context_kwargs = {'method': method, 'headers': headers, 'environ_base': {'REMOTE_ADDR': remote_addr}}
+    if 'body' in sub_request:
+        context_kwargs['json'] = sub_request['body']
+
+    with app.test_request_context(path, **context_kwargs):
+        response = app.full_dispatch_request()
+
+    body = response.get_json(silent=True)
+    if body is None and response.status_code != 304:
+        body = response.get_data(as_text=True)
+    return {
+        "id": sub_request.get('id'),
+        "status": response.status_code,
+        "headers": {name: response.headers[name] for name in BATCH_RESPONSE_HEADERS if name in response.headers},
+        "body": body
     }
-    
-    return jsonify(result), 201
+
+@app.route('/api/batch', methods=['POST'])
+@rate_limit(limit=10, period=60)
+def batch():
+    """
+    Thực hiện nhiều request /api/* trong một lần gọi, các sub-request chạy đồng thời.
+
+    Body: {"requests": [{"id": "p1", "method": "GET", "path": "/api/payments/1"}, ...]}
+    Mỗi sub-request vẫn chịu rate limit, cache và circuit breaker của route tương ứng.
+    """
+    data = request.get_json(silent=True) or {}
+    sub_requests = data.get('requests')
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"error": "Thiếu danh sách requests"}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"Tối đa {BATCH_MAX_REQUESTS} requests mỗi batch"}), 400
+
+    for sub_request in sub_requests:
+        path = sub_request.get('path') if isinstance(sub_request, dict) else None
+        if not isinstance(path, str) or not path.startswith('/api/') or path.startswith('/api/batch'):
+            return jsonify({"error": f"Sub-request không hợp lệ: {sub_request}"}), 400
+
+    remote_addr = request.remote_addr
+    trace_headers = inject_headers()
+    futures = [_batch_executor.submit(run_sub_request, sub_request, remote_addr, trace_headers)
+               for sub_request in sub_requests]
+
+    responses = []
+    for sub_request, future in zip(sub_requests, futures):
+        try:
+            responses.append(future.result())
+        except Exception as e:
+            logger.error("Lỗi khi thực hiện sub-request %s: %s", sub_request.get('path'), e)
+            responses.append({"id": sub_request.get('id'), "status": 500, "headers": {},
+                              "body": {"error": "Lỗi khi thực hiện request"}})
+
+    return jsonify({"responses": responses}), 200
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Kiểm tra trạng thái các service"""
-    health_status = {}
+    """
+    Kiểm tra trạng thái các service.
+    Trả về ngay kết quả của lần kiểm tra nền gần nhất; thêm ?refresh=true để
+    kiểm tra lại tất cả service (đồng thời) trước khi trả lời.
+    """
+    health_monitor.ensure_started()
     
-    for service, url in SERVICE_URLS.items():
-        try:
-            response = requests.get(f"{url}/health", timeout=2)
-            health_status[service] = {
-                "status": "up" if response.status_code == 200 else "down",
-                "details": response.json() if response.status_code == 200 else {}
-            }
-        except:
-            health_status[service] = {
-                "status": "down",
-                "details": {}
-            }
+    if request.args.get('refresh', '').lower() in ('1', 'true') or not health_monitor.has_snapshot():
+        health_monitor.refresh()
     
     return jsonify({
         "gateway": "up",
-        "services": health_status
+        "services": health_monitor.snapshot()
     }), 200
 
+@app.route('/traces/<trace_id>', methods=['GET'])
+@rate_limit(limit=30, period=60)
+def get_trace(trace_id):
+    """Các span của một trace (gateway và các service), sắp theo thời gian bắt đầu"""
+    if not is_valid_trace_id(trace_id):
+        return jsonify({"error": "trace_id phải gồm 32 ký tự hex"}), 400
+    spans = read_trace(trace_id)
+    if not spans:
+        return jsonify({"error": f"Không tìm thấy trace {trace_id}"}), 404
+
+    start = spans[0]['start']
+    end = max(span['start'] + span['duration_ms'] / 1000 for span in spans)
+    for span in spans:
+        span['offset_ms'] = round((span['start'] - start) * 1000, 3)
+
+    return jsonify({
+        "trace_id": trace_id,
+        "duration_ms": round((end - start) * 1000, 3),
+        "spans": spans
+    }), 200
+
+@app.route('/stats/upstream', methods=['GET'])
+def upstream_stats():
+    """Thống kê sử dụng connection pool tới các service"""
+    stats = upstream.get_stats()
+    stats['time_limit'] = get_time_limit_stats()
+    stats['circuit_breakers'] = breaker_registry.get_states()
+    stats['rate_limiter'] = _rate_limiter.get_stats()
+    stats['response_cache'] = _response_cache.get_stats()
+    stats['single_flight'] = _single_flight.get_stats()
+    stats['retry'] = get_retry_stats()
+    stats['hedging'] = _hedger.get_stats()
+    stats['sagas'] = _sagas.get_stats()
+    stats['idempotency'] = _idempotency_store.get_stats()
+    if _traffic_recorder is not None:
+        stats['traffic_recorder'] = _traffic_recorder.get_stats()
+    return jsonify(stats), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,355 @@
+"""
+Entry point ASGI của API Gateway.
+
+Phục vụ cùng các route /api/* như app.py nhưng gọi các service phía sau bằng
+HTTP client bất đồng bộ, nên một process giữ được rất nhiều upstream call đang
+chờ I/O mà không cần thêm worker. Bảng route chuyển tiếp (routes.py), saga đơn
+hàng (orders.py), circuit breaker, single-flight, response cache, rate limit và
+Idempotency-Key dùng chung với app.py; chỉ phần gửi request là bất đồng bộ. Chạy bằng:
+
+    cd api_gateway && hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+import os
+import sys
+import asyncio
+import functools
+import logging
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+# Package common/ (metrics, tracing, logging, phân trang) nằm ở thư mục gốc dự án;
+# thêm vào sys.path khi gateway được chạy trực tiếp từ thư mục của nó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quart import Quart, Response, jsonify, request, render_template, has_request_context, g
+from config import SERVICE_URLS
+from orders import (async_step, define_order_saga, order_id_for, order_response, order_status,
+                    retry_order_data, validate_order)
+from routes import PROXY_ROUTES, retry_policy_for
+from utils.circuit_breaker import breaker_name, get_circuit_breaker, _registry as breaker_registry
+from utils.health_monitor import AsyncHealthMonitor, create_health_monitor
+from utils.hedging import _hedger, HEDGING_ENABLED
+from utils.idempotency import IDEMPOTENCY_HEADER, idempotent, _idempotency_store
+from utils.http_client import create_async_upstream_client
+from common.logging_config import configure_logging
+from common.metrics import _registry as _metrics, REQUESTS, REQUEST_LATENCY
+from common.pagination import NEXT_CURSOR_HEADER
+from utils.rate_limiter import rate_limit, _rate_limiter
+from utils.response_cache import cached_response, _response_cache
+from utils.retry import get_retry_budget, get_retry_stats
+from utils.saga import SagaExistsError, create_saga_orchestrator
+from utils.single_flight import flight_key, _single_flight
+from utils.time_limiter import async_time_limit, get_time_limit_stats
+from common.tracing import (_tracer, current_trace_id, TRACEPARENT_HEADER, TRACE_ID_HEADER, inject_headers,
+                            is_valid_trace_id, read_trace)
+from utils.traffic_recorder import _traffic_recorder
+
+# Cấu hình logging (hàng đợi + thread nền, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
+configure_logging('gateway', trace_id=current_trace_id)
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key")
+
+_tracer.service = 'gateway'
+
+@app.before_request
+async def start_request_timer():
+    g.metrics_start_time = time.perf_counter()
+    if _traffic_recorder is not None and _traffic_recorder.should_record(request.path):
+        g.traffic_start = (time.time(), time.perf_counter())
+    g.trace_span = _tracer.start_span(
+        f"{request.method} {request.path}",
+        kind='server',
+        traceparent=request.headers.get(TRACEPARENT_HEADER),
+        route=request.endpoint
+    )
+
+@app.after_request
+async def record_request_metrics(response):
+    start_time = g.pop('metrics_start_time', None)
+    if start_time is not None:
+        route = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - start_time, route, request.method)
+        REQUESTS.inc(route, request.method, response.status_code)
+
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.set_attribute('status', response.status_code)
+        response.headers[TRACE_ID_HEADER] = span.trace_id
+        span.finish()
+
+    traffic_start = g.pop('traffic_start', None)
+    if traffic_start is not None:
+        entry = {
+            'ts': traffic_start[0],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'route': request.url_rule.rule if request.url_rule else None,
+            'client': request.remote_addr,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - traffic_start[1]) * 1000, 3)
+        }
+        entry.update(_traffic_recorder.encode_body(await request.get_data(), request.content_type))
+        _traffic_recorder.record(entry)
+    return response
+
+# Client bất đồng bộ dùng chung cho từng service
+upstream = create_async_upstream_client(SERVICE_URLS)
+
+# Kiểm tra trạng thái các service trong nền, /health chỉ đọc kết quả
+health_monitor = create_health_monitor(upstream, SERVICE_URLS.keys(), monitor_class=AsyncHealthMonitor)
+
+# Điều phối saga (create_order), lưu từng bước vào SQLite để chạy tiếp sau khi khởi động lại
+_sagas = create_saga_orchestrator()
+
+def retry_policy():
+    """Chính sách retry cho route hiện tại"""
+    return retry_policy_for(request.endpoint if has_request_context() else None)
+
+async def call_service(service, method, path, timeout=5, **kwargs):
+    """Gọi một service phía sau qua circuit breaker, retry và time limit (async)"""
+    policy = retry_policy()
+    endpoint = request.endpoint if has_request_context() else None
+
+    def send():
+        return upstream.request(service, method, path, **kwargs)
+
+    if HEDGING_ENABLED and method in ('GET', 'HEAD'):
+        # Đọc idempotent: gửi thêm bản sao nếu upstream chậm hơn percentile latency
+        hedge_key = (service, endpoint or path)
+        send_once = send
+
+        def send():
+            return _hedger.execute_async(hedge_key, send_once)
+
+    async def call():
+        # Span bao cả retry/hedge để thấy thời gian từng chặng (/check, /payments, ...)
+        with _tracer.span(f"call {service} {method} {path}", service=service):
+            return await get_circuit_breaker(breaker_name(service, endpoint)).call_async(lambda: policy.execute_async(
+                lambda: async_time_limit(send, seconds=timeout),
+                method=method,
+                headers=kwargs.get('headers'),
+                budget=get_retry_budget(service)
+            ))
+
+    key = flight_key(service, method, path, kwargs)
+    if key is not None:
+        return await _single_flight.do_async(key, call)
+
+    return await call()
+
+@app.before_serving
+async def start_saga_worker():
+    # Tiếp tục các saga dở dang và chạy bù trừ trong nền
+    app.add_background_task(_sagas.run_background_async)
+    app.add_background_task(health_monitor.run_async)
+
+@app.after_serving
+async def close_upstream():
+    await upstream.aclose()
+
+@app.route('/')
+async def index():
+    """Trang chủ của API Gateway"""
+    return await render_template('index.html')
+
+def proxy_view(route):
+    """View async cho một route chỉ chuyển tiếp tới service (khai báo trong routes.PROXY_ROUTES)"""
+    async def view(**view_args):
+        body = await request.get_json() if route.has_body else None
+        call = route.upstream_call(view_args, request.args, body, request.headers, request.remote_addr)
+        try:
+            response = await call_service(call.service, call.method, call.path, **call.kwargs)
+            if route.invalidates is not None:
+                # invalidate_cache() ghi SQLite khi cache dùng chung: chạy trong thread pool
+                return await asyncio.to_thread(route.result, response)
+            return route.result(response)
+        except Exception as e:
+            return route.error(view_args, e)
+
+    view.__name__ = route.endpoint
+    view.__doc__ = route.description
+    if route.cache_ttl is not None:
+        view = cached_response(ttl=route.cache_ttl)(view)
+    if route.idempotency_scope is not None:
+        view = idempotent(view)
+    return rate_limit(limit=route.limit, period=route.period)(view)
+
+for _route in PROXY_ROUTES:
+    app.add_url_rule(_route.rule, endpoint=_route.endpoint, view_func=proxy_view(_route), methods=[_route.method])
+
+# Saga tạo đơn hàng, cùng các bước với app.py nhưng lời gọi service là coroutine
+define_order_saga(_sagas, lambda step: async_step(step, call_service))
+
+@app.route('/api/orders', methods=['POST'])
+@rate_limit(limit=5, period=60)
+@idempotent
+async def create_order():
+    """
+    Tạo đơn hàng mới (kết hợp thanh toán, cập nhật tồn kho và vận chuyển).
+    Gửi header "Prefer: respond-async" để nhận 202 kèm order_id ngay.
+    """
+    data = await request.get_json(silent=True)
+    error = validate_order(data)
+    if error is not None:
+        return error
+
+    order_id = order_id_for(_sagas, request.remote_addr, request.headers.get(IDEMPOTENCY_HEADER))
+    data = dict(data, order_id=order_id)
+    # Đơn hàng cùng key đã thất bại vì lỗi tạm thời (503) thì được chạy lại
+    retry = functools.partial(retry_order_data, data=data)
+
+    try:
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            await _sagas.submit_async('create_order', data, saga_id=order_id, retry_data=retry)
+            saga = {'id': order_id, 'status': 'running'}
+        else:
+            saga = await _sagas.start_async('create_order', data, saga_id=order_id, retry_data=retry)
+    except SagaExistsError:
+        saga = await _sagas.get_async(order_id)
+
+    return order_response(saga)
+
+@app.route('/api/orders/<order_id>', methods=['GET'])
+@rate_limit(limit=30, period=60)
+async def get_order(order_id):
+    """Trạng thái đơn hàng và nhật ký các bước của saga"""
+    saga = await _sagas.get_async(order_id)
+    if saga is None or saga['name'] != 'create_order':
+        return jsonify({"error": f"Không tìm thấy đơn hàng {order_id}"}), 404
+    return jsonify(order_status(saga)), 200
+
+# Giới hạn của /api/batch
+BATCH_MAX_REQUESTS = int(os.environ.get('GATEWAY_BATCH_MAX_REQUESTS', 20))
+BATCH_FORWARD_HEADERS = ('Idempotency-Key', 'If-None-Match', 'Prefer')
+# Header của sub-response trả lại client: cursor trang kế tiếp, URL theo dõi đơn hàng 202
+BATCH_RESPONSE_HEADERS = ('ETag', 'X-Cache', NEXT_CURSOR_HEADER, 'Location')
+
+async def run_sub_request(sub_request, remote_addr):
+    """Chạy một sub-request qua đúng route /api/* của gateway (kèm rate limit, breaker)"""
+    method = str(sub_request.get('method', 'GET')).upper()
+    url = urlsplit(sub_request['path'])
+    headers = {name: value for name, value in (sub_request.get('headers') or {}).items()
+               if name in BATCH_FORWARD_HEADERS}
+    # Các sub-request nằm trong cùng trace với request batch
+    headers = inject_headers(headers)
+    context_kwargs = {
+        'method': method,
+        'headers': headers,
+        'query_string': dict(parse_qsl(url.query)),
+        'scope_base': {'client': (remote_addr, 0)}
+    }
+    if 'body' in sub_request:
+        context_kwargs['json'] = sub_request['body']
+
+    async with app.test_request_context(url.path, **context_kwargs):
+        response = await app.full_dispatch_request()
+
+    body = await response.get_json(silent=True)
+    if body is None:
+        body = await response.get_data(as_text=True)
+    return {
+        "id": sub_request.get('id'),
+        "status": response.status_code,
+        "headers": {name: response.headers[name] for name in BATCH_RESPONSE_HEADERS if name in response.headers},
+        "body": body
+    }
+
+@app.route('/api/batch', methods=['POST'])
+@rate_limit(limit=10, period=60)
+async def batch():
+    """Thực hiện nhiều request /api/* trong một lần gọi, các sub-request chạy đồng thời"""
+    data = await request.get_json(silent=True) or {}
+    sub_requests = data.get('requests')
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"error": "Thiếu danh sách requests"}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": f"Tối đa {BATCH_MAX_REQUESTS} requests mỗi batch"}), 400
+
+    for sub_request in sub_requests:
+        path = sub_request.get('path') if isinstance(sub_request, dict) else None
+        if not isinstance(path, str) or not path.startswith('/api/') or path.startswith('/api/batch'):
+            return jsonify({"error": f"Sub-request không hợp lệ: {sub_request}"}), 400
+
+    remote_addr = request.remote_addr
+    results = await asyncio.gather(
+        *(run_sub_request(sub_request, remote_addr) for sub_request in sub_requests),
+        return_exceptions=True
+    )
+
+    responses = []
+    for sub_request, result in zip(sub_requests, results):
+        if isinstance(result, Exception):
+            logger.error("Lỗi khi thực hiện sub-request %s: %s", sub_request.get('path'), result)
+            result = {"id": sub_request.get('id'), "status": 500, "headers": {},
+                      "body": {"error": "Lỗi khi thực hiện request"}}
+        responses.append(result)
+
+    return jsonify({"responses": responses}), 200
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """
+    Kiểm tra trạng thái các service.
+    Trả về ngay kết quả của lần kiểm tra nền gần nhất; thêm ?refresh=true để
+    kiểm tra lại tất cả service (đồng thời) trước khi trả lời.
+    """
+    if request.args.get('refresh', '').lower() in ('1', 'true') or not health_monitor.has_snapshot():
+        await health_monitor.refresh_async()
+
+    return jsonify({
+        "gateway": "up",
+        "services": health_monitor.snapshot()
+    }), 200
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+@rate_limit(limit=30, period=60)
+async def get_trace(trace_id):
+    """Các span của một trace (gateway và các service), sắp theo thời gian bắt đầu"""
+    if not is_valid_trace_id(trace_id):
+        return jsonify({"error": "trace_id phải gồm 32 ký tự hex"}), 400
+    spans = await asyncio.get_running_loop().run_in_executor(None, read_trace, trace_id)
+    if not spans:
+        return jsonify({"error": f"Không tìm thấy trace {trace_id}"}), 404
+
+    start = spans[0]['start']
+    end = max(span['start'] + span['duration_ms'] / 1000 for span in spans)
+    for span in spans:
+        span['offset_ms'] = round((span['start'] - start) * 1000, 3)
+
+    return jsonify({
+        "trace_id": trace_id,
+        "duration_ms": round((end - start) * 1000, 3),
+        "spans": spans
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Metric của gateway theo định dạng Prometheus"""
+    return Response(_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats/upstream', methods=['GET'])
+async def upstream_stats():
+    """Thống kê sử dụng kết nối tới các service (cùng các mục với app.py)"""
+    def collect():
+        stats = upstream.get_stats()
+        stats['time_limit'] = get_time_limit_stats()
+        stats['circuit_breakers'] = breaker_registry.get_states()
+        stats['rate_limiter'] = _rate_limiter.get_stats()
+        stats['response_cache'] = _response_cache.get_stats()
+        stats['single_flight'] = _single_flight.get_stats()
+        stats['retry'] = get_retry_stats()
+        stats['hedging'] = _hedger.get_stats()
+        stats['sagas'] = _sagas.get_stats()
+        stats['idempotency'] = _idempotency_store.get_stats()
+        if _traffic_recorder is not None:
+            stats['traffic_recorder'] = _traffic_recorder.get_stats()
+        return stats
+
+    # Các store dùng chung (saga, cache, idempotency) đọc SQLite: chạy trong thread pool
+    return jsonify(await asyncio.to_thread(collect)), 200
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000, debug=True)
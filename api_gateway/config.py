@@ -0,0 +1,8 @@
+# Cấu hình dùng chung cho các entry point của API Gateway (app.py và asgi_app.py)
+
+# Cấu hình các service URLs
+SERVICE_URLS = {
+    'payment': 'http://localhost:8001',
+    'inventory': 'http://localhost:8002',
+    'shipping': 'http://localhost:8003'
+}
@@ -0,0 +1,282 @@
+# Saga tạo đơn hàng (POST /api/orders), dùng chung cho app.py và asgi_app.py.
+# Các bước là generator: yield UpstreamCall để nhận response, return kết quả của bước;
+# sync_step()/async_step() biến chúng thành action đồng bộ hoặc coroutine cho SagaOrchestrator.
+import os
+import asyncio
+import functools
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from routes import UpstreamCall
+from utils.idempotency import derive_key
+from utils.response_cache import invalidate_cache
+from utils.saga import SagaOrchestrator, SagaStep, SagaStepError
+
+ORDER_REQUIRED_FIELDS = ('items', 'total_amount', 'payment_method', 'customer_id', 'shipping_address')
+ORDER_STEP_SERVICES = {
+    'reserve_inventory': 'Inventory Service',
+    'payment': 'Payment Service',
+    'shipping': 'Shipping Service',
+    'confirm_inventory': 'Inventory Service'
+}
+
+# Thời gian (giây) giữ hàng cho một đơn hàng trước khi tự trả lại tồn kho
+ORDER_RESERVATION_TTL = int(os.environ.get('GATEWAY_ORDER_RESERVATION_TTL', 300))
+
+def response_body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {"error": response.text}
+
+def expect_status(response, status_code, step):
+    """Raise SagaStepError nếu upstream không trả về status_code mong đợi"""
+    if response.status_code not in (status_code if isinstance(status_code, tuple) else (status_code,)):
+        raise SagaStepError(f"{step}: upstream trả về {response.status_code}",
+                            response.status_code, response_body(response))
+
+def step_key(data, step):
+    """
+    Idempotency-Key gửi cho service ở một bước của đơn hàng. Mỗi lần chạy lại đơn
+    hàng (retry_order_data) dùng key mới, để service không trả lại kết quả của lần
+    chạy trước (giao dịch đã hoàn tiền, reservation đã trả hàng).
+    """
+    attempt = data.get('attempt', 1)
+    if attempt == 1:
+        return f"{data['order_id']}:{step}"
+    return f"{data['order_id']}:{step}:{attempt}"
+
+def reserve_inventory_step(data, results):
+    # Giữ hàng nguyên tử (tất cả hoặc không), thay cho /check rồi /update sau khi thanh toán
+    headers = {'Idempotency-Key': step_key(data, 'inventory')}
+    response = yield UpstreamCall('inventory', 'POST', '/reservations', headers=headers,
+                                  json={"items": data['items'], "ttl": ORDER_RESERVATION_TTL})
+    invalidate_cache('/api/products')
+    expect_status(response, (200, 201), 'reserve_inventory')
+    return response.json()
+
+def release_inventory_step(data, results):
+    reservation = results['reserve_inventory']
+    if reservation is None:
+        # Bước giữ hàng lỗi mà không rõ kết quả (timeout...): tìm reservation theo Idempotency-Key
+        found = yield UpstreamCall('inventory', 'GET', f"/reservations/by-key/{step_key(data, 'inventory')}")
+        if found.status_code == 404:
+            return
+        expect_status(found, 200, 'release_inventory')
+        reservation = found.json()
+
+    reservation_id = reservation['id']
+    response = yield UpstreamCall('inventory', 'POST', f"/reservations/{reservation_id}/release")
+    invalidate_cache('/api/products')
+    expect_status(response, 200, 'release_inventory')
+
+def payment_step(data, results):
+    payment_data = {
+        "amount": data['total_amount'],
+        "payment_method": data['payment_method'],
+        "customer_id": data['customer_id']
+    }
+    # Key cố định theo đơn hàng: chạy lại bước này (sau khi gateway khởi động lại) không trừ tiền hai lần
+    headers = {'Idempotency-Key': step_key(data, 'payment')}
+    response = yield UpstreamCall('payment', 'POST', '/payments', json=payment_data, headers=headers)
+    expect_status(response, 201, 'payment')
+    return response.json()
+
+def refund_payment_step(data, results):
+    payment = results['payment']
+    if payment is None:
+        # Bước thanh toán lỗi mà không rõ kết quả: tìm giao dịch theo Idempotency-Key
+        found = yield UpstreamCall('payment', 'GET', f"/payments/by-key/{step_key(data, 'payment')}")
+        if found.status_code == 404:
+            return
+        expect_status(found, 200, 'refund_payment')
+        payment = found.json()
+        if payment.get('status') != 'completed' or payment.get('refunded'):
+            return
+
+    payment_id = payment['id']
+    response = yield UpstreamCall('payment', 'POST', f"/payments/{payment_id}/refund",
+                                  json={"reason": f"Huỷ đơn hàng {data['order_id']}"})
+    if response.status_code == 200:
+        return
+
+    # Lần thử trước có thể đã hoàn tiền xong nhưng mất response
+    current = yield UpstreamCall('payment', 'GET', f"/payments/{payment_id}")
+    if current.status_code == 200 and (current.json().get('refunded') or current.json().get('status') != 'completed'):
+        return
+    raise SagaStepError(f"Hoàn tiền {payment_id} thất bại", response.status_code, response_body(response))
+
+def shipping_step(data, results):
+    shipping_data = {
+        "customer_id": data['customer_id'],
+        "address": data['shipping_address'],
+        "items": data['items'],
+        "payment_id": results['payment']['id']
+    }
+    # Chạy lại bước (sau lỗi tạm thời hoặc khi gateway khởi động lại) không tạo đơn vận chuyển thứ hai
+    headers = {'Idempotency-Key': step_key(data, 'shipping')}
+    response = yield UpstreamCall('shipping', 'POST', '/shipping', json=shipping_data, headers=headers)
+    expect_status(response, 201, 'shipping')
+    return response.json()
+
+def cancel_shipping_step(data, results):
+    shipping = results['shipping']
+    if shipping is None:
+        # Bước vận chuyển lỗi mà không rõ kết quả: tìm đơn vận chuyển theo Idempotency-Key
+        found = yield UpstreamCall('shipping', 'GET', f"/shipping/by-key/{step_key(data, 'shipping')}")
+        if found.status_code == 404:
+            return
+        expect_status(found, 200, 'cancel_shipping')
+        shipping = found.json()
+
+    shipping_id = shipping['id']
+    response = yield UpstreamCall('shipping', 'PUT', f"/shipping/{shipping_id}/update",
+                                  json={"status": "cancelled", "description": f"Huỷ đơn hàng {data['order_id']}"})
+    if response.status_code == 200:
+        return
+
+    current = yield UpstreamCall('shipping', 'GET', f"/shipping/{shipping_id}")
+    if current.status_code == 200 and current.json().get('status') == 'cancelled':
+        return
+    raise SagaStepError(f"Huỷ vận chuyển {shipping_id} thất bại", response.status_code, response_body(response))
+
+def confirm_inventory_step(data, results):
+    reservation_id = results['reserve_inventory']['id']
+    response = yield UpstreamCall('inventory', 'POST', f"/reservations/{reservation_id}/confirm")
+    if response.status_code == 409 and response_body(response).get('status') == 'expired':
+        # Reservation hết hạn trước khi kịp xác nhận (inventory lỗi lâu, gateway khởi động lại...):
+        # đơn hàng đã thanh toán nên giữ hàng lại; hết hàng thì saga chuyển sang needs_attention
+        headers = {'Idempotency-Key': step_key(data, 'inventory:renew')}
+        renewed = yield UpstreamCall('inventory', 'POST', '/reservations', headers=headers,
+                                     json={"items": data['items'], "ttl": ORDER_RESERVATION_TTL})
+        invalidate_cache('/api/products')
+        expect_status(renewed, (200, 201), 'confirm_inventory')
+        response = yield UpstreamCall('inventory', 'POST', f"/reservations/{renewed.json()['id']}/confirm")
+    expect_status(response, 200, 'confirm_inventory')
+    return response.json()
+
+def advance(calls, response) -> Tuple[bool, Any]:
+    """Chạy step tới UpstreamCall kế tiếp: (False, call), hoặc (True, kết quả) khi step đã xong"""
+    try:
+        return False, calls.send(response)
+    except StopIteration as done:
+        return True, done.value
+
+def sync_step(step: Callable, call_service: Callable) -> Callable:
+    """Action đồng bộ: gửi từng UpstreamCall của step bằng call_service và trả response lại cho step"""
+    @functools.wraps(step)
+    def action(data, results):
+        calls = step(data, results)
+        response = None
+        while True:
+            done, call = advance(calls, response)
+            if done:
+                return call
+            response = call_service(call.service, call.method, call.path, **call.kwargs)
+    return action
+
+def async_step(step: Callable, call_service: Callable) -> Callable:
+    """Như sync_step() nhưng trả về coroutine function, call_service là coroutine function"""
+    @functools.wraps(step)
+    async def action(data, results):
+        calls = step(data, results)
+        response = None
+        while True:
+            # Step có thể gọi invalidate_cache() (ghi SQLite khi cache dùng chung): không chạy trên event loop
+            done, call = await asyncio.to_thread(advance, calls, response)
+            if done:
+                return call
+            response = await call_service(call.service, call.method, call.path, **call.kwargs)
+    return action
+
+def define_order_saga(sagas: SagaOrchestrator, bind: Callable[[Callable], Callable]):
+    """
+    Đăng ký saga create_order.
+
+    Args:
+        sagas: SagaOrchestrator của gateway
+        bind: Biến một bước (generator) thành action, ví dụ lambda step: sync_step(step, call_service)
+    """
+    sagas.define('create_order', [
+        SagaStep('reserve_inventory', bind(reserve_inventory_step), compensation=bind(release_inventory_step)),
+        SagaStep('payment', bind(payment_step), compensation=bind(refund_payment_step)),
+        SagaStep('shipping', bind(shipping_step), compensation=bind(cancel_shipping_step)),
+        # Đơn hàng đã thành công khi tạo xong vận chuyển, client không cần chờ bước xác nhận giữ hàng
+        SagaStep('confirm_inventory', bind(confirm_inventory_step), deferred=True)
+    ])
+
+def validate_order(data) -> Optional[Tuple[Dict[str, str], int]]:
+    """Lỗi 400 trả cho client nếu body của POST /api/orders không hợp lệ, None nếu hợp lệ"""
+    if not isinstance(data, dict):
+        return {"error": "Không có dữ liệu được gửi"}, 400
+    missing = [field for field in ORDER_REQUIRED_FIELDS if field not in data]
+    if missing:
+        return {"error": f"Thiếu trường dữ liệu: {', '.join(missing)}"}, 400
+    return None
+
+def order_id_for(sagas: SagaOrchestrator, remote_addr: Optional[str], client_key: Optional[str]) -> str:
+    """
+    Id đơn hàng cho một request. Cùng Idempotency-Key luôn ra cùng order_id, nên
+    request trùng ở worker khác (hoặc sau khi gateway khởi động lại) gặp lại saga
+    cũ thay vì tạo đơn hàng thứ hai.
+    """
+    if client_key:
+        return f"ORD-{derive_key(remote_addr, 'order', client_key)[:12].upper()}"
+    return sagas.new_id('ORD')
+
+def retry_order_data(saga, data) -> Dict[str, Any]:
+    """
+    Data cho lần chạy lại đơn hàng đã thất bại vì lỗi tạm thời, khi client gửi lại
+    cùng Idempotency-Key (dùng làm retry_data của saga)
+
+    Args:
+        saga: Saga của lần chạy trước
+        data: Đơn hàng trong request gửi lại (đã có order_id)
+    """
+    return dict(data, attempt=saga['data'].get('attempt', 1) + 1)
+
+def order_status(saga):
+    """Trạng thái đơn hàng từ saga tương ứng"""
+    results = saga['results']
+    return {
+        "order_id": saga['id'],
+        "status": saga['status'],
+        "attempt": saga['data'].get('attempt', 1),
+        "payment": results.get('payment'),
+        "shipping": results.get('shipping'),
+        "error": saga['error'],
+        "steps": saga.get('log', []),
+        "created_at": datetime.fromtimestamp(saga['created_at']).isoformat(),
+        "updated_at": datetime.fromtimestamp(saga['updated_at']).isoformat()
+    }
+
+def order_response(saga) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    """
+    Response (body, status, headers) của POST /api/orders theo trạng thái saga: 201 khi
+    đã tạo xong vận chuyển, 202 khi còn đang chạy, lỗi của bước thất bại (hoặc 503 nếu
+    không kết nối được service)
+    """
+    order_id = saga['id']
+    error = saga.get('error')
+    # Đã tạo xong vận chuyển thì các bước sau (deferred) không bù trừ đơn hàng nữa
+    if saga.get('results', {}).get('shipping') is not None:
+        return {
+            "order_id": order_id,
+            "payment": saga['results']['payment'],
+            "shipping": saga['results']['shipping'],
+            "status": "Đơn hàng đã được tạo thành công"
+        }, 201, {}
+
+    if error is None:
+        return {
+            "order_id": order_id,
+            "status": saga['status'],
+            "status_url": f"/api/orders/{order_id}"
+        }, 202, {
+            'Location': f"/api/orders/{order_id}",
+            'Preference-Applied': 'respond-async'
+        }
+
+    if error.get('status_code'):
+        return error['body'], error['status_code'], {}
+    return {"error": f"Không thể kết nối đến {ORDER_STEP_SERVICES[error['step']]}"}, 503, {}
@@ -0,0 +1,175 @@
+# Các route /api/* chỉ chuyển tiếp request tới một service, khai báo một lần cho
+# cả hai entry point của gateway (app.py đồng bộ và asgi_app.py bất đồng bộ)
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from common.pagination import NEXT_CURSOR_HEADER
+from utils.idempotency import IDEMPOTENCY_HEADER, derive_key
+from utils.response_cache import invalidate_cache
+from utils.retry import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Tên hiển thị của service trong thông báo lỗi trả cho client
+SERVICE_NAMES = {
+    'inventory': 'Inventory Service',
+    'payment': 'Payment Service',
+    'shipping': 'Shipping Service'
+}
+
+# Chính sách retry mặc định và theo từng route (endpoint)
+DEFAULT_RETRY_POLICY = RetryPolicy(max_retries=2, base_delay=0.1, max_delay=1.0)
+ROUTE_RETRY_POLICIES = {
+    'get_products': RetryPolicy(max_retries=3, base_delay=0.05, max_delay=0.5),
+    'get_product': RetryPolicy(max_retries=3, base_delay=0.05, max_delay=0.5),
+    # Thanh toán và đơn hàng chỉ retry khi request có Idempotency-Key
+    'create_payment': RetryPolicy(max_retries=1, base_delay=0.2, max_delay=1.0),
+    'create_order': RetryPolicy(max_retries=1, base_delay=0.2, max_delay=1.0),
+}
+
+def retry_policy_for(endpoint: Optional[str]) -> RetryPolicy:
+    """Chính sách retry của một endpoint (DEFAULT_RETRY_POLICY nếu không khai báo riêng)"""
+    return ROUTE_RETRY_POLICIES.get(endpoint, DEFAULT_RETRY_POLICY)
+
+class UpstreamCall:
+    """
+    Một lời gọi tới service phía sau, chưa được gửi.
+
+    Route và bước saga chỉ mô tả lời gọi; app.py gửi bằng call_service đồng bộ,
+    asgi_app.py gửi bằng call_service async, nên logic chỉ viết một lần.
+    """
+    __slots__ = ('service', 'method', 'path', 'kwargs')
+
+    def __init__(self, service: str, method: str, path: str, **kwargs):
+        self.service = service
+        self.method = method
+        self.path = path
+        self.kwargs = kwargs
+
+class ProxyRoute:
+    """Một route /api/* chuyển tiếp tới một endpoint của service"""
+
+    def __init__(self, endpoint: str, rule: str, method: str, service: str, path: str, action: str,
+                 description: str, limit: int, period: int = 60, paginated: bool = False,
+                 cache_ttl: Optional[float] = None, invalidates: Optional[str] = None,
+                 invalidate_on: int = 200, idempotency_scope: Optional[str] = None):
+        """
+        Args:
+            endpoint: Tên endpoint (dùng cho rate limit, retry policy, metric)
+            rule: URL rule của gateway, ví dụ /api/products/<product_id>
+            method: HTTP method
+            service: Service phía sau
+            path: Path của service, có thể chứa tham số của rule ({product_id})
+            action: Mô tả thao tác trong log lỗi, có thể chứa tham số của rule
+            description: Docstring của route
+            limit: Số request tối đa mỗi client trong period
+            period: Khoảng thời gian (giây) của rate limit
+            paginated: Endpoint danh sách: chuyển tiếp query string và header cursor
+            cache_ttl: Cache response 200 trong ttl giây
+            invalidates: Prefix cache bị xoá khi service trả về invalidate_on
+            invalidate_on: Status code của service làm cache bị xoá
+            idempotency_scope: Bật Idempotency-Key; key dẫn xuất theo scope được chuyển tiếp cho service
+        """
+        self.endpoint = endpoint
+        self.rule = rule
+        self.method = method
+        self.service = service
+        self.path = path
+        self.action = action
+        self.description = description
+        self.limit = limit
+        self.period = period
+        self.paginated = paginated
+        self.cache_ttl = cache_ttl
+        self.invalidates = invalidates
+        self.invalidate_on = invalidate_on
+        self.idempotency_scope = idempotency_scope
+
+    @property
+    def has_body(self) -> bool:
+        return self.method in ('POST', 'PUT')
+
+    def upstream_call(self, view_args: Dict[str, Any], query_args, body: Any,
+                      headers, remote_addr: Optional[str]) -> UpstreamCall:
+        """
+        Lời gọi service cho một request tới route.
+
+        Args:
+            view_args: Tham số lấy từ URL rule
+            query_args: Query string của request (MultiDict)
+            body: JSON body (route POST/PUT)
+            headers: Header của request
+            remote_addr: Địa chỉ client
+        """
+        kwargs = {}
+        if self.paginated:
+            # Giữ filter, limit, cursor, fields
+            kwargs['params'] = query_args.to_dict()
+        if self.has_body:
+            kwargs['json'] = body
+        if self.idempotency_scope is not None:
+            # Chuyển tiếp key dẫn xuất theo client để service chống trùng
+            # và gateway được phép retry an toàn
+            kwargs['headers'] = {}
+            if headers.get(IDEMPOTENCY_HEADER):
+                kwargs['headers'][IDEMPOTENCY_HEADER] = derive_key(
+                    remote_addr, self.idempotency_scope, headers[IDEMPOTENCY_HEADER])
+        return UpstreamCall(self.service, self.method, self.path.format(**view_args), **kwargs)
+
+    def result(self, response) -> Tuple[Any, int, Dict[str, str]]:
+        """(body, status, headers) trả cho client từ response của service"""
+        if self.invalidates is not None and response.status_code == self.invalidate_on:
+            # Dữ liệu thay đổi, response trong cache không còn đúng
+            invalidate_cache(self.invalidates)
+
+        headers = {}
+        if self.paginated and NEXT_CURSOR_HEADER in response.headers:
+            headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+        return response.json(), response.status_code, headers
+
+    def error(self, view_args: Dict[str, Any], error: Exception) -> Tuple[Dict[str, str], int]:
+        """Ghi log và trả 503 khi không gọi được service"""
+        logger.error("Lỗi khi %s: %s", self.action.format(**view_args), error)
+        return {"error": f"Không thể kết nối đến {SERVICE_NAMES[self.service]}"}, 503
+
+PROXY_ROUTES = [
+    ProxyRoute('get_products', '/api/products', 'GET', 'inventory', '/products',
+               action='lấy danh sách sản phẩm', limit=10, paginated=True, cache_ttl=15,
+               description='Lấy danh sách sản phẩm từ Inventory Service (phân trang: limit, cursor, fields)'),
+    ProxyRoute('get_product', '/api/products/<product_id>', 'GET', 'inventory', '/products/{product_id}',
+               action='lấy thông tin sản phẩm {product_id}', limit=20, cache_ttl=30,
+               description='Lấy thông tin chi tiết sản phẩm từ Inventory Service'),
+    ProxyRoute('create_product', '/api/products', 'POST', 'inventory', '/products',
+               action='tạo sản phẩm mới', limit=5, invalidates='/api/products', invalidate_on=201,
+               description='Tạo sản phẩm mới trong Inventory Service'),
+    ProxyRoute('list_inventory_transactions', '/api/inventory/transactions', 'GET', 'inventory', '/transactions',
+               action='lấy lịch sử giao dịch tồn kho', limit=10, paginated=True,
+               description='Lấy lịch sử giao dịch tồn kho từ Inventory Service (phân trang: limit, cursor, fields)'),
+    ProxyRoute('update_inventory', '/api/inventory/update', 'POST', 'inventory', '/update',
+               action='cập nhật tồn kho', limit=5, invalidates='/api/products',
+               description='Cập nhật tồn kho trong Inventory Service'),
+    ProxyRoute('create_payment', '/api/payments', 'POST', 'payment', '/payments',
+               action='tạo thanh toán', limit=5, idempotency_scope='payment',
+               description='Tạo thanh toán mới trong Payment Service'),
+    ProxyRoute('list_payments', '/api/payments', 'GET', 'payment', '/payments',
+               action='lấy danh sách thanh toán', limit=10, paginated=True,
+               description='Lấy danh sách thanh toán từ Payment Service (phân trang: limit, cursor, fields)'),
+    ProxyRoute('get_payment', '/api/payments/<payment_id>', 'GET', 'payment', '/payments/{payment_id}',
+               action='lấy thông tin thanh toán {payment_id}', limit=10,
+               description='Lấy thông tin thanh toán từ Payment Service'),
+    ProxyRoute('refund_payment', '/api/payments/<payment_id>/refund', 'POST', 'payment', '/payments/{payment_id}/refund',
+               action='hoàn tiền thanh toán {payment_id}', limit=3,
+               description='Hoàn tiền thanh toán trong Payment Service'),
+    ProxyRoute('create_shipping', '/api/shipping', 'POST', 'shipping', '/shipping',
+               action='tạo vận chuyển', limit=5, idempotency_scope='shipping',
+               description='Tạo vận chuyển mới trong Shipping Service'),
+    ProxyRoute('list_shipping', '/api/shipping', 'GET', 'shipping', '/shipping',
+               action='lấy danh sách vận chuyển', limit=10, paginated=True,
+               description='Lấy danh sách vận chuyển từ Shipping Service (phân trang: limit, cursor, fields)'),
+    ProxyRoute('get_shipping', '/api/shipping/<shipping_id>', 'GET', 'shipping', '/shipping/{shipping_id}',
+               action='lấy thông tin vận chuyển {shipping_id}', limit=10,
+               description='Lấy thông tin vận chuyển từ Shipping Service'),
+    ProxyRoute('update_shipping', '/api/shipping/<shipping_id>/update', 'PUT', 'shipping', '/shipping/{shipping_id}/update',
+               action='cập nhật trạng thái vận chuyển {shipping_id}', limit=5,
+               description='Cập nhật trạng thái vận chuyển trong Shipping Service'),
+]
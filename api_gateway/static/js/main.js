@@ -305,41 +305,63 @@ function checkOrderStatus() {
         return;
     }
     
-    let paymentPromise = Promise.resolve(null);
-    let shippingPromise = Promise.resolve(null);
-    
-    // Kiểm tra thông tin thanh toán
+    // Lấy thông tin thanh toán và vận chuyển trong một lần gọi /api/batch
+    const subRequests = [];
     if (paymentId) {
-        paymentPromise = fetch(`/api/payments/${paymentId}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`Không tìm thấy thông tin thanh toán với ID: ${paymentId}`);
-                }
-                return response.json();
-            })
-            .catch(error => {
-                console.error('Lỗi khi tìm thông tin thanh toán:', error);
-                showAlert('Không tìm thấy thông tin thanh toán. Vui lòng kiểm tra lại ID.', 'danger');
-                return null;
-            });
+        subRequests.push({ id: 'payment', method: 'GET', path: `/api/payments/${encodeURIComponent(paymentId)}` });
     }
-    
-    // Kiểm tra thông tin vận chuyển
     if (shippingId) {
-        shippingPromise = fetch(`/api/shipping/${shippingId}`)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`Không tìm thấy thông tin vận chuyển với ID: ${shippingId}`);
-                }
-                return response.json();
-            })
-            .catch(error => {
-                console.error('Lỗi khi tìm thông tin vận chuyển:', error);
-                showAlert('Không tìm thấy thông tin vận chuyển. Vui lòng kiểm tra lại ID.', 'danger');
-                return null;
-            });
+        subRequests.push({ id: 'shipping', method: 'GET', path: `/api/shipping/${encodeURIComponent(shippingId)}` });
     }
     
+    const batchPromise = fetch('/api/batch', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ requests: subRequests })
+    })
+        .then(response => response.json())
+        .then(data => {
+            const results = {};
+            (data.responses || []).forEach(result => {
+                results[result.id] = result;
+            });
+            return results;
+        })
+        .catch(error => {
+            console.error('Lỗi khi tìm thông tin đơn hàng:', error);
+            return {};
+        });
+    
+    // Kiểm tra thông tin thanh toán
+    const paymentPromise = batchPromise.then(results => {
+        if (!paymentId) {
+            return null;
+        }
+        const result = results.payment;
+        if (!result || result.status !== 200) {
+            console.error('Lỗi khi tìm thông tin thanh toán:', `Không tìm thấy thông tin thanh toán với ID: ${paymentId}`);
+            showAlert('Không tìm thấy thông tin thanh toán. Vui lòng kiểm tra lại ID.', 'danger');
+            return null;
+        }
+        return result.body;
+    });
+    
+    // Kiểm tra thông tin vận chuyển
+    const shippingPromise = batchPromise.then(results => {
+        if (!shippingId) {
+            return null;
+        }
+        const result = results.shipping;
+        if (!result || result.status !== 200) {
+            console.error('Lỗi khi tìm thông tin vận chuyển:', `Không tìm thấy thông tin vận chuyển với ID: ${shippingId}`);
+            showAlert('Không tìm thấy thông tin vận chuyển. Vui lòng kiểm tra lại ID.', 'danger');
+            return null;
+        }
+        return result.body;
+    });
+    
     // Kết hợp kết quả
     Promise.all([paymentPromise, shippingPromise])
         .then(([payment, shipping]) => {
@@ -1,41 +1,169 @@
+import os
 import logging
 import time
+import threading
 import functools
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, List, Optional
+from common.metrics import _registry as _metrics
+from utils.shared_state import _syncer, share_circuit_breakers
 
 logger = logging.getLogger(__name__)
 
+class SlidingWindow:
+    """
+    Cửa sổ trượt ghi nhận kết quả các lần gọi (tổng số, lỗi, chậm).
+    Mỗi lần ghi nhận và đọc tỉ lệ đều là O(1) nhờ giữ sẵn tổng đang chạy.
+
+    - COUNT_BASED: giữ kết quả của window_size lần gọi gần nhất (ring buffer)
+    - TIME_BASED: giữ kết quả trong window_size giây gần nhất (bucket theo từng giây)
+
+    Không tự khoá, CircuitBreaker chịu trách nhiệm đồng bộ.
+    """
+
+    COUNT_BASED = 'COUNT_BASED'
+    TIME_BASED = 'TIME_BASED'
+
+    def __init__(self, window_type: str = COUNT_BASED, window_size: int = 20):
+        if window_type not in (self.COUNT_BASED, self.TIME_BASED):
+            raise ValueError(f"Loại cửa sổ không hợp lệ: {window_type}")
+
+        self.window_type = window_type
+        self.window_size = max(1, int(window_size))
+        self.reset()
+
+    def reset(self):
+        """Xoá toàn bộ dữ liệu trong cửa sổ"""
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.slow_calls = 0
+
+        if self.window_type == self.COUNT_BASED:
+            # Mỗi phần tử: (failed, slow) hoặc None nếu chưa dùng
+            self._outcomes: List[Optional[tuple]] = [None] * self.window_size
+            self._index = 0
+        else:
+            # Mỗi bucket: [giây, calls, failures, slow]
+            self._buckets = [[0, 0, 0, 0] for _ in range(self.window_size)]
+            self._last_second = int(time.time())
+
+    def record(self, failed: bool, slow: bool):
+        """Ghi nhận kết quả của một lần gọi"""
+        if self.window_type == self.COUNT_BASED:
+            old = self._outcomes[self._index]
+            if old is not None:
+                self.total_calls -= 1
+                self.failed_calls -= old[0]
+                self.slow_calls -= old[1]
+
+            self._outcomes[self._index] = (int(failed), int(slow))
+            self._index = (self._index + 1) % self.window_size
+        else:
+            now = self._advance()
+            bucket = self._buckets[now % self.window_size]
+            bucket[1] += 1
+            bucket[2] += int(failed)
+            bucket[3] += int(slow)
+
+        self.total_calls += 1
+        self.failed_calls += int(failed)
+        self.slow_calls += int(slow)
+
+    def _advance(self) -> int:
+        """Loại bỏ các bucket đã trượt ra khỏi cửa sổ thời gian"""
+        now = int(time.time())
+        if now > self._last_second:
+            # Chỉ cần dọn tối đa window_size bucket, nên chi phí trung bình là O(1)
+            for second in range(max(self._last_second + 1, now - self.window_size + 1), now + 1):
+                bucket = self._buckets[second % self.window_size]
+                self.total_calls -= bucket[1]
+                self.failed_calls -= bucket[2]
+                self.slow_calls -= bucket[3]
+                bucket[0], bucket[1], bucket[2], bucket[3] = second, 0, 0, 0
+            self._last_second = now
+        return now
+
+    def rates(self) -> tuple:
+        """
+        Tỉ lệ lỗi và tỉ lệ gọi chậm (phần trăm) trong cửa sổ.
+
+        Returns:
+            (total_calls, failure_rate, slow_call_rate)
+        """
+        if self.window_type == self.TIME_BASED:
+            self._advance()
+
+        if self.total_calls == 0:
+            return 0, 0.0, 0.0
+
+        return (
+            self.total_calls,
+            self.failed_calls * 100.0 / self.total_calls,
+            self.slow_calls * 100.0 / self.total_calls
+        )
+
 class CircuitBreaker:
     """
     Circuit Breaker pattern implementation.
     Giúp ngăn chặn các lỗi cascade khi một service bị lỗi bằng cách ngắt kết nối tạm thời
     và khôi phục sau một khoảng thời gian.
+
+    Breaker mở khi tỉ lệ lỗi hoặc tỉ lệ gọi chậm trong cửa sổ trượt vượt ngưỡng
+    (sau khi có tối thiểu failure_threshold lần gọi). Ở trạng thái HALF_OPEN chỉ
+    cho phép một số request thử nghiệm đi qua. Mỗi breaker có lock riêng nên các
+    breaker của những service khác nhau không tranh chấp với nhau.
     """
-    
+
     # Trạng thái của circuit breaker
     STATE_CLOSED = 'CLOSED'      # Bình thường, requests được xử lý
     STATE_OPEN = 'OPEN'          # Đang bị ngắt kết nối, không xử lý requests
     STATE_HALF_OPEN = 'HALF_OPEN'  # Thử nghiệm lại kết nối
-    
-    def __init__(self, 
-                 failure_threshold: int = 5, 
-                 recovery_timeout: int = 30, 
-                 expected_exceptions: tuple = (Exception,)):
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 recovery_timeout: int = 30,
+                 expected_exceptions: tuple = (Exception,),
+                 name: str = 'default',
+                 failure_rate_threshold: float = 50.0,
+                 slow_call_rate_threshold: float = 100.0,
+                 slow_call_duration: float = 5.0,
+                 window_type: str = SlidingWindow.COUNT_BASED,
+                 window_size: int = 20,
+                 half_open_max_calls: int = 1):
         """
         Khởi tạo Circuit Breaker.
-        
+
         Args:
-            failure_threshold: Số lần lỗi liên tiếp trước khi ngắt
+            failure_threshold: Số lần gọi tối thiểu trong cửa sổ trước khi xét tỉ lệ lỗi
             recovery_timeout: Thời gian (giây) trước khi thử kết nối lại
             expected_exceptions: Các loại exception được xem là lỗi
+            name: Tên breaker (thường là tên upstream hoặc upstream:route)
+            failure_rate_threshold: Tỉ lệ lỗi (%) để mở breaker
+            slow_call_rate_threshold: Tỉ lệ gọi chậm (%) để mở breaker
+            slow_call_duration: Thời gian (giây) từ đó một lần gọi bị xem là chậm
+            window_type: SlidingWindow.COUNT_BASED hoặc SlidingWindow.TIME_BASED
+            window_size: Số lần gọi (COUNT_BASED) hoặc số giây (TIME_BASED) của cửa sổ
+            half_open_max_calls: Số request thử nghiệm được phép ở trạng thái HALF_OPEN
         """
+        self.name = name
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
         self.expected_exceptions = expected_exceptions
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
         self.state = self.STATE_CLOSED
-        self.failure_count = 0
-        self.last_failure_time = 0
-        
+        self.opened_at = 0.0
+        self.window = SlidingWindow(window_type, window_size)
+
+        # Số request thử nghiệm đang chạy / đã thành công ở trạng thái HALF_OPEN
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+        self._lock = threading.Lock()
+        self._listeners: List[Callable] = []
+
     def __call__(self, func: Callable) -> Any:
         """
         Decorator để bọc các function cần áp dụng Circuit Breaker.
@@ -44,61 +172,319 @@ class CircuitBreaker:
         def wrapper(*args, **kwargs):
             return self.call(func, *args, **kwargs)
         return wrapper
-    
+
+    def add_listener(self, listener: Callable):
+        """
+        Đăng ký callback listener(name, old_state, new_state) khi breaker đổi trạng thái.
+        """
+        self._listeners.append(listener)
+
     def call(self, func: Callable, *args, **kwargs) -> Any:
         """
         Gọi function với Circuit Breaker pattern.
         """
-        if self.state == self.STATE_OPEN:
-            # Kiểm tra nếu đã đủ thời gian để reset
-            if time.time() - self.last_failure_time >= self.recovery_timeout:
-                logger.info("Circuit Breaker chuyển sang trạng thái HALF-OPEN")
-                self.state = self.STATE_HALF_OPEN
-            else:
-                logger.warning("Circuit Breaker đang OPEN, từ chối request")
-                raise CircuitBreakerOpenException("Circuit Breaker đang mở, từ chối request")
-        
+        probe = self._before_call()
+        start_time = time.monotonic()
+
         try:
             response = func(*args, **kwargs)
-            
-            # Nếu thành công và đang ở trạng thái half-open, đóng lại
-            if self.state == self.STATE_HALF_OPEN:
-                logger.info("Request thành công, Circuit Breaker đóng lại")
-                self.state = self.STATE_CLOSED
-                self.failure_count = 0
-                
-            # Reset failure count khi thành công
-            self.failure_count = 0
-            
-            return response
-            
         except self.expected_exceptions as e:
-            self.failure_count += 1
-            self.last_failure_time = time.time()
-            
-            # Nếu đã vượt quá ngưỡng lỗi, mở circuit breaker
-            if self.failure_count >= self.failure_threshold:
-                logger.error(f"Đã vượt quá ngưỡng lỗi {self.failure_threshold}, Circuit Breaker mở")
-                self.state = self.STATE_OPEN
-            
+            self._on_result(probe, failed=True, duration=time.monotonic() - start_time)
             # Ném lại exception
             raise e
+        except BaseException:
+            self._release_probe(probe)
+            raise
+
+        self._on_result(probe, failed=False, duration=time.monotonic() - start_time)
+        return response
+
+    async def call_async(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Gọi coroutine function với Circuit Breaker pattern (dùng cho gateway async).
+        """
+        probe = self._before_call()
+        start_time = time.monotonic()
+
+        try:
+            response = await func(*args, **kwargs)
+        except self.expected_exceptions as e:
+            self._on_result(probe, failed=True, duration=time.monotonic() - start_time)
+            raise e
+        except BaseException:
+            self._release_probe(probe)
+            raise
+
+        self._on_result(probe, failed=False, duration=time.monotonic() - start_time)
+        return response
+
+    def _before_call(self) -> bool:
+        """
+        Kiểm tra trạng thái trước khi cho phép request đi qua.
+
+        Returns:
+            True nếu request là một request thử nghiệm ở trạng thái HALF_OPEN
+        """
+        transition = None
+
+        with self._lock:
+            if self.state == self.STATE_OPEN:
+                # Kiểm tra nếu đã đủ thời gian để reset
+                if time.time() - self.opened_at >= self.recovery_timeout:
+                    transition = self._transition(self.STATE_HALF_OPEN)
+                else:
+                    logger.warning("Circuit Breaker '%s' đang OPEN, từ chối request", self.name)
+                    raise CircuitBreakerOpenException(f"Circuit Breaker '{self.name}' đang mở, từ chối request")
+
+            probe = self.state == self.STATE_HALF_OPEN
+            if probe:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    raise CircuitBreakerOpenException(f"Circuit Breaker '{self.name}' đang thử kết nối lại, từ chối request")
+                self._half_open_in_flight += 1
+
+        self._notify(transition)
+        return probe
+
+    def _release_probe(self, probe: bool):
+        """Trả lại suất thử nghiệm khi lần gọi bị huỷ giữa chừng"""
+        if probe:
+            with self._lock:
+                if self.state == self.STATE_HALF_OPEN:
+                    self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def _on_result(self, probe: bool, failed: bool, duration: float):
+        """Cập nhật cửa sổ trượt và trạng thái sau một lần gọi"""
+        slow = duration >= self.slow_call_duration
+        transition = None
+
+        with self._lock:
+            if probe:
+                if self.state == self.STATE_HALF_OPEN:
+                    self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                    if failed or slow:
+                        transition = self._transition(self.STATE_OPEN)
+                    else:
+                        self._half_open_successes += 1
+                        # Đủ số request thử nghiệm thành công, đóng lại
+                        if self._half_open_successes >= self.half_open_max_calls:
+                            transition = self._transition(self.STATE_CLOSED)
+            elif self.state == self.STATE_CLOSED:
+                self.window.record(failed, slow)
+                total, failure_rate, slow_rate = self.window.rates()
+
+                # Nếu đã vượt quá ngưỡng lỗi, mở circuit breaker
+                if total >= self.failure_threshold and (
+                        failure_rate >= self.failure_rate_threshold
+                        or slow_rate >= self.slow_call_rate_threshold):
+                    logger.error(
+                        "Circuit Breaker '%s' mở: tỉ lệ lỗi %.1f%%, tỉ lệ gọi chậm %.1f%% trên %s lần gọi", self.name, failure_rate, slow_rate, total
+                    )
+                    transition = self._transition(self.STATE_OPEN)
+
+        self._notify(transition)
+
+    def _transition(self, new_state: str) -> Optional[tuple]:
+        """Đổi trạng thái (gọi khi đang giữ lock), trả về (old, new) để thông báo sau"""
+        old_state = self.state
+        if old_state == new_state:
+            return None
+
+        self.state = new_state
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+        if new_state == self.STATE_OPEN:
+            self.opened_at = time.time()
+        elif new_state == self.STATE_CLOSED:
+            self.window.reset()
+
+        logger.info("Circuit Breaker '%s' chuyển từ %s sang %s", self.name, old_state, new_state)
+        return old_state, new_state
+
+    def _notify(self, transition: Optional[tuple]):
+        """Gọi các listener ngoài lock"""
+        if transition is None:
+            return
+
+        for listener in self._listeners:
+            try:
+                listener(self.name, *transition)
+            except Exception as e:
+                logger.error("Lỗi trong listener của Circuit Breaker '%s': %s", self.name, e)
+
+    def apply_shared_state(self, state: str, opened_at: float):
+        """
+        Áp dụng trạng thái nhận từ worker khác (qua SharedStateStore).
+
+        Args:
+            state: Trạng thái của breaker cùng tên ở worker khác
+            opened_at: Thời điểm breaker đó mở lần gần nhất
+        """
+        transition = None
+
+        with self._lock:
+            if state == self.STATE_OPEN:
+                # Chỉ mở theo khi đó là lần mở mới hơn lần mở cục bộ gần nhất
+                if self.state != self.STATE_OPEN and opened_at > self.opened_at:
+                    transition = self._transition(self.STATE_OPEN)
+                    self.opened_at = opened_at
+            elif state == self.STATE_CLOSED:
+                # Worker khác đã thử lại thành công sau lần mở này
+                if self.state != self.STATE_CLOSED and opened_at >= self.opened_at:
+                    transition = self._transition(self.STATE_CLOSED)
+
+        self._notify(transition)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Trạng thái hiện tại và số liệu của cửa sổ trượt"""
+        with self._lock:
+            total, failure_rate, slow_rate = self.window.rates()
+            return {
+                'state': self.state,
+                'calls': total,
+                'failure_rate': round(failure_rate, 2),
+                'slow_call_rate': round(slow_rate, 2),
+                'window_type': self.window.window_type,
+                'window_size': self.window.window_size
+            }
 
 class CircuitBreakerOpenException(Exception):
     """Exception khi Circuit Breaker đang trong trạng thái mở."""
     pass
 
-# Singleton instance của Circuit Breaker
-_circuit_breaker = CircuitBreaker()
+class CircuitBreakerRegistry:
+    """
+    Registry quản lý các Circuit Breaker theo tên.
+    Mỗi upstream (và tuỳ chọn mỗi route) có breaker riêng, để một service lỗi
+    không làm chặn request tới các service khác.
+    """
+
+    def __init__(self, default_config: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            default_config: Tham số mặc định cho các breaker được tạo mới
+        """
+        self.default_config = dict(default_config or {})
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._listeners: List[Callable] = []
+        self._lock = threading.Lock()
+
+    def configure(self, name: str, **config):
+        """Đặt cấu hình riêng cho breaker có tên name (áp dụng khi breaker được tạo)"""
+        with self._lock:
+            self._configs[name] = config
+
+    def add_listener(self, listener: Callable):
+        """Đăng ký listener đổi trạng thái cho mọi breaker (cả các breaker tạo sau)"""
+        with self._lock:
+            self._listeners.append(listener)
+            breakers = list(self._breakers.values())
+
+        for breaker in breakers:
+            breaker.add_listener(listener)
+
+    def get(self, name: str) -> CircuitBreaker:
+        """Lấy (hoặc tạo) breaker theo tên"""
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                config = dict(self.default_config)
+                # Cấu hình theo upstream ('inventory') áp dụng cho cả breaker theo route ('inventory:get_products')
+                config.update(self._configs.get(name.split(':', 1)[0], {}))
+                config.update(self._configs.get(name, {}))
+                breaker = CircuitBreaker(name=name, **config)
+                for listener in self._listeners:
+                    breaker.add_listener(listener)
+                self._breakers[name] = breaker
+
+        return breaker
+
+    def get_states(self) -> Dict[str, Dict[str, Any]]:
+        """Trạng thái của tất cả các breaker"""
+        return {name: breaker.get_status() for name, breaker in list(self._breakers.items())}
+
+def create_circuit_breaker_registry() -> CircuitBreakerRegistry:
+    """
+    Tạo CircuitBreakerRegistry với cấu hình mặc định đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_BREAKER_MIN_CALLS: Số lần gọi tối thiểu trước khi xét tỉ lệ (mặc định 5)
+        GATEWAY_BREAKER_RECOVERY_TIMEOUT: Thời gian chờ trước khi thử lại, giây (mặc định 30)
+        GATEWAY_BREAKER_FAILURE_RATE: Ngưỡng tỉ lệ lỗi, % (mặc định 50)
+        GATEWAY_BREAKER_SLOW_CALL_RATE: Ngưỡng tỉ lệ gọi chậm, % (mặc định 100)
+        GATEWAY_BREAKER_SLOW_CALL_SECONDS: Thời gian xem là gọi chậm, giây (mặc định 5)
+        GATEWAY_BREAKER_WINDOW_TYPE: COUNT_BASED hoặc TIME_BASED (mặc định COUNT_BASED)
+        GATEWAY_BREAKER_WINDOW_SIZE: Kích thước cửa sổ (mặc định 20)
+        GATEWAY_BREAKER_HALF_OPEN_CALLS: Số request thử nghiệm ở HALF_OPEN (mặc định 1)
+    """
+    return CircuitBreakerRegistry({
+        'failure_threshold': int(os.environ.get('GATEWAY_BREAKER_MIN_CALLS', 5)),
+        'recovery_timeout': float(os.environ.get('GATEWAY_BREAKER_RECOVERY_TIMEOUT', 30)),
+        'failure_rate_threshold': float(os.environ.get('GATEWAY_BREAKER_FAILURE_RATE', 50)),
+        'slow_call_rate_threshold': float(os.environ.get('GATEWAY_BREAKER_SLOW_CALL_RATE', 100)),
+        'slow_call_duration': float(os.environ.get('GATEWAY_BREAKER_SLOW_CALL_SECONDS', 5)),
+        'window_type': os.environ.get('GATEWAY_BREAKER_WINDOW_TYPE', SlidingWindow.COUNT_BASED),
+        'window_size': int(os.environ.get('GATEWAY_BREAKER_WINDOW_SIZE', 20)),
+        'half_open_max_calls': int(os.environ.get('GATEWAY_BREAKER_HALF_OPEN_CALLS', 1))
+    })
+
+# Registry dùng chung cho toàn bộ gateway
+_registry = create_circuit_breaker_registry()
+
+BREAKER_TRANSITIONS = _metrics.counter(
+    'gateway_circuit_breaker_transitions_total',
+    'Số lần circuit breaker đổi trạng thái',
+    ('breaker', 'from_state', 'to_state')
+)
+_registry.add_listener(lambda name, old_state, new_state: BREAKER_TRANSITIONS.inc(name, old_state, new_state))
+
+def _collect_breaker_states():
+    # 0 = CLOSED, 1 = HALF_OPEN, 2 = OPEN
+    levels = {'CLOSED': 0, 'HALF_OPEN': 1, 'OPEN': 2}
+    return [('gateway_circuit_breaker_state', 'gauge', 'Trạng thái hiện tại của breaker (0 CLOSED, 1 HALF_OPEN, 2 OPEN)',
+             [({'breaker': name}, levels.get(status['state'], -1)) for name, status in _registry.get_states().items()])]
+
+_metrics.add_collector(_collect_breaker_states)
+
+# Chia sẻ trạng thái breaker giữa các worker nếu bật GATEWAY_SHARED_STATE_PATH
+if _syncer is not None:
+    share_circuit_breakers(_registry, _syncer)
 
-def circuit_breaker(func: Callable) -> Any:
+# Breaker mặc định, giữ cho các đoạn code dùng circuit_breaker(func) không kèm tên
+_circuit_breaker = _registry.get('default')
+
+# Tách circuit breaker theo cả route (inventory:get_products) thay vì chỉ theo upstream
+BREAKER_PER_ROUTE = os.environ.get('GATEWAY_BREAKER_PER_ROUTE', '0') == '1'
+
+def breaker_name(service: str, endpoint: Optional[str] = None) -> str:
+    """Tên circuit breaker cho một lần gọi tới service từ route endpoint (app.py và asgi_app.py)"""
+    if BREAKER_PER_ROUTE and endpoint:
+        return f"{service}:{endpoint}"
+    return service
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Lấy breaker theo tên (upstream hoặc upstream:route) từ registry dùng chung"""
+    return _registry.get(name)
+
+def circuit_breaker(func: Callable, name: Optional[str] = None) -> Any:
     """
     Decorator để áp dụng Circuit Breaker pattern cho function.
     Nếu truyền vào một lambda function, sẽ thực thi nó ngay lập tức.
+
+    Args:
+        func: Function hoặc lambda cần bảo vệ
+        name: Tên breaker trong registry, mặc định dùng breaker 'default'
     """
+    breaker = _registry.get(name) if name else _circuit_breaker
+
     if hasattr(func, '__name__') and func.__name__ == '<lambda>':
         # Đây là một lambda, thực thi ngay
-        return _circuit_breaker.call(func)
+        return breaker.call(func)
     else:
         # Đây là một function thông thường, trả về decorator
-        return _circuit_breaker(func)
+        return breaker(func)
@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class HealthMonitor:
+    """
+    Theo dõi trạng thái các service phía sau bằng thread nền.
+    Các service được kiểm tra đồng thời theo chu kỳ, kết quả giữ trong bộ nhớ
+    để endpoint /health trả lời ngay mà không phải gọi upstream mỗi lần.
+    """
+
+    def __init__(self, client, services: List[str], interval: float = 10, timeout: float = 2):
+        """
+        Args:
+            client: UpstreamClient dùng để gọi /health của các service
+            services: Danh sách tên service cần theo dõi
+            interval: Chu kỳ kiểm tra (giây)
+            timeout: Thời gian chờ tối đa cho mỗi lần kiểm tra (giây)
+        """
+        self.client = client
+        self.services = list(services)
+        self.interval = interval
+        self.timeout = timeout
+
+        self._snapshot: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.services)), thread_name_prefix='health-probe')
+        self._pid = None
+
+    def _probe(self, service: str) -> Dict[str, Any]:
+        """Gọi /health của một service và đo latency"""
+        start_time = time.monotonic()
+        try:
+            response = self.client.get(service, '/health', timeout=self.timeout)
+        except Exception as e:
+            logger.debug("Health check %s thất bại: %s", service, e)
+            response = None
+        return self._result(response, start_time)
+
+    @staticmethod
+    def _result(response, start_time: float) -> Dict[str, Any]:
+        """Kết quả kiểm tra từ response /health (None nếu không gọi được service)"""
+        up = response is not None and response.status_code == 200
+        return {
+            "status": "up" if up else "down",
+            "details": response.json() if up else {},
+            "latency_ms": round((time.monotonic() - start_time) * 1000, 2),
+            "checked_at": time.time()
+        }
+
+    def refresh(self):
+        """Kiểm tra tất cả service đồng thời và cập nhật snapshot"""
+        # Nhiều request cùng ép refresh chỉ cần một lượt kiểm tra
+        with self._refresh_lock:
+            results = dict(zip(self.services, self._executor.map(self._probe, self.services)))
+
+        with self._lock:
+            self._snapshot.update(results)
+
+    def ensure_started(self):
+        """Khởi động thread kiểm tra nền nếu process hiện tại chưa có"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Lỗi khi kiểm tra trạng thái các service: %s", e)
+            time.sleep(self.interval)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Kết quả kiểm tra gần nhất của từng service.
+
+        Returns:
+            Mapping service -> status, details, latency_ms, checked_at,
+            staleness_seconds (tuổi của kết quả) và stale (quá 2 chu kỳ)
+        """
+        now = time.time()
+        with self._lock:
+            snapshot = {service: dict(result) for service, result in self._snapshot.items()}
+
+        for result in snapshot.values():
+            age = now - result['checked_at']
+            result['staleness_seconds'] = round(age, 3)
+            result['stale'] = age > 2 * self.interval
+            result['checked_at'] = datetime.fromtimestamp(result['checked_at']).isoformat()
+
+        return snapshot
+
+    def has_snapshot(self) -> bool:
+        with self._lock:
+            return len(self._snapshot) == len(self.services)
+
+class AsyncHealthMonitor(HealthMonitor):
+    """
+    HealthMonitor cho gateway async (asgi_app.py): client là AsyncUpstreamClient,
+    các service được kiểm tra đồng thời bằng task nền trên event loop thay vì thread.
+    """
+
+    def __init__(self, client, services: List[str], interval: float = 10, timeout: float = 2):
+        super().__init__(client, services, interval=interval, timeout=timeout)
+        self._async_refresh_lock = asyncio.Lock()
+
+    async def _probe_async(self, service: str) -> Dict[str, Any]:
+        start_time = time.monotonic()
+        try:
+            response = await self.client.get(service, '/health', timeout=self.timeout)
+        except Exception as e:
+            logger.debug("Health check %s thất bại: %s", service, e)
+            response = None
+        return self._result(response, start_time)
+
+    async def refresh_async(self):
+        """Phiên bản bất đồng bộ của refresh()"""
+        async with self._async_refresh_lock:
+            results = await asyncio.gather(*(self._probe_async(service) for service in self.services))
+
+        with self._lock:
+            self._snapshot.update(zip(self.services, results))
+
+    async def run_async(self):
+        """Vòng lặp kiểm tra nền, chạy như background task của app"""
+        while True:
+            try:
+                await self.refresh_async()
+            except Exception as e:
+                logger.error("Lỗi khi kiểm tra trạng thái các service: %s", e)
+            await asyncio.sleep(self.interval)
+
+def create_health_monitor(client, services: List[str], monitor_class: type = HealthMonitor) -> HealthMonitor:
+    """
+    Tạo HealthMonitor (hoặc monitor_class, ví dụ AsyncHealthMonitor) với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_HEALTH_INTERVAL: Chu kỳ kiểm tra, giây (mặc định 10)
+        GATEWAY_HEALTH_TIMEOUT: Thời gian chờ mỗi lần kiểm tra, giây (mặc định 2)
+    """
+    return monitor_class(
+        client,
+        services,
+        interval=float(os.environ.get('GATEWAY_HEALTH_INTERVAL', 10)),
+        timeout=float(os.environ.get('GATEWAY_HEALTH_TIMEOUT', 2))
+    )
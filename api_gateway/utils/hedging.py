@@ -0,0 +1,306 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any, Hashable
+from common.metrics import _registry as _metrics
+
+logger = logging.getLogger(__name__)
+
+class LatencyTracker:
+    """Giữ latency gần nhất của một loại request để tính percentile"""
+
+    def __init__(self, window: int = 200, recompute_every: int = 16):
+        """
+        Args:
+            window: Số mẫu latency gần nhất được giữ lại
+            recompute_every: Tính lại percentile sau mỗi bấy nhiêu mẫu mới
+        """
+        self._samples = deque(maxlen=window)
+        self._recompute_every = recompute_every
+        self._since_recompute = 0
+        self._cached: Dict[float, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_recompute += 1
+            if self._since_recompute >= self._recompute_every:
+                self._since_recompute = 0
+                self._cached.clear()
+
+    def percentile(self, p: float, min_samples: int = 20):
+        """Latency ở percentile p (0-100), None nếu chưa đủ mẫu"""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            value = self._cached.get(p)
+            if value is None:
+                ordered = sorted(self._samples)
+                value = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+                self._cached[p] = value
+            return value
+
+class Hedger:
+    """
+    Hedged request cho các lần đọc idempotent.
+
+    Request chính được gửi trước; nếu sau khoảng trễ bằng percentile latency
+    (ví dụ p95) mà chưa có kết quả thì gửi thêm một bản sao qua một kết nối khác
+    trong pool. Kết quả nào về trước được dùng, bản còn lại bị huỷ hoặc bỏ qua.
+    Số hedge bị giới hạn theo tỉ lệ lưu lượng để tải trung bình không tăng nhiều.
+
+    Request chính cũng chạy trong pool (thread gọi chờ bản nào về trước), nên
+    pool cần khoảng hai thread cho mỗi thread xử lý request. Khi pool đã đầy,
+    request chạy ngay trên thread gọi và không hedge, thay vì xếp hàng chờ thread.
+    """
+
+    def __init__(self,
+                 percentile: float = 95,
+                 min_delay: float = 0.01,
+                 max_delay: float = 1.0,
+                 default_delay: float = 0.2,
+                 max_hedge_ratio: float = 0.1,
+                 max_workers: int = 64):
+        """
+        Args:
+            percentile: Percentile latency dùng làm khoảng trễ trước khi hedge
+            min_delay: Khoảng trễ tối thiểu (giây)
+            max_delay: Khoảng trễ tối đa (giây)
+            default_delay: Khoảng trễ khi chưa đủ mẫu latency (giây)
+            max_hedge_ratio: Tỉ lệ tối đa số request được hedge
+            max_workers: Số thread tối đa để chạy các lần gọi (request chính và bản sao)
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.max_hedge_ratio = max_hedge_ratio
+
+        self.max_workers = max_workers
+        self._trackers: Dict[Hashable, LatencyTracker] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        # Số lần gọi đang chiếm (hoặc chờ) thread của pool
+        self._busy = 0
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped = 0
+        self.saturated = 0
+
+    def _tracker(self, key: Hashable) -> LatencyTracker:
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            with self._lock:
+                tracker = self._trackers.setdefault(key, LatencyTracker())
+        return tracker
+
+    def hedge_delay(self, key: Hashable) -> float:
+        """Khoảng trễ trước khi gửi bản sao cho loại request key"""
+        value = self._tracker(key).percentile(self.percentile)
+        if value is None:
+            value = self.default_delay
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _allow_hedge(self) -> bool:
+        with self._lock:
+            # Cho phép dư một hedge để lưu lượng thấp vẫn được hedge
+            if self.hedged >= self.requests * self.max_hedge_ratio + 1 or self._busy >= self.max_workers:
+                self.skipped += 1
+                return False
+            self.hedged += 1
+            self._busy += 1
+            return True
+
+    def _reserve(self) -> bool:
+        """Giữ một thread của pool cho request chính, False nếu pool đã đầy"""
+        with self._lock:
+            if self._busy >= self.max_workers:
+                self.saturated += 1
+                return False
+            self._busy += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+
+    @staticmethod
+    def _timed(tracker: LatencyTracker, func: Callable) -> Any:
+        start_time = time.monotonic()
+        result = func()
+        tracker.record(time.monotonic() - start_time)
+        return result
+
+    def _submit(self, tracker: LatencyTracker, func: Callable):
+        """Chạy func trong pool; thread đã được giữ bằng _reserve()/_allow_hedge()"""
+        # Chạy trong bản sao context để deadline của time_limit đi theo sang thread
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                return context.run(self._timed, tracker, func)
+            finally:
+                self._release()
+
+        return self._executor.submit(run)
+
+    def _cancel(self, future):
+        """Huỷ lần gọi chưa bắt đầu (trả lại thread đã giữ); đang chạy thì bỏ qua kết quả"""
+        if future.cancel():
+            self._release()
+
+    def execute(self, key: Hashable, func: Callable) -> Any:
+        """
+        Thực hiện func, gửi thêm một bản sao nếu func chậm hơn khoảng trễ hedge.
+
+        Args:
+            key: Loại request (ví dụ: service và route) để theo dõi latency riêng
+            func: Function gửi request; phải idempotent vì có thể chạy hai lần
+
+        Returns:
+            Kết quả thành công về trước
+        """
+        self._count_request()
+        tracker = self._tracker(key)
+        if not self._reserve():
+            return self._timed(tracker, func)
+
+        primary = self._submit(tracker, func)
+        done, _ = wait([primary], timeout=self.hedge_delay(key))
+        if done or not self._allow_hedge():
+            return primary.result()
+
+        hedge = self._submit(tracker, func)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    self._cancel(loser)
+                with self._lock:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    else:
+                        self.primary_wins += 1
+                return future.result()
+
+        raise error
+
+    async def execute_async(self, key: Hashable, func: Callable) -> Any:
+        """Phiên bản bất đồng bộ của execute(); bản thua bị cancel thật sự"""
+        self._count_request()
+        tracker = self._tracker(key)
+
+        async def timed():
+            start_time = time.monotonic()
+            result = await func()
+            tracker.record(time.monotonic() - start_time)
+            return result
+
+        primary = asyncio.ensure_future(timed())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(key))
+            if done or not self._allow_hedge():
+                return await primary
+
+            hedge = asyncio.ensure_future(timed())
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    with self._lock:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        else:
+                            self.primary_wins += 1
+                    return task.result()
+
+            raise error
+        finally:
+            # Huỷ bản thua, hoặc cả hai nếu lời gọi bị huỷ từ bên ngoài (time limit)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số request, số lần hedge, số lần bản sao/bản chính thắng và khoảng trễ hiện tại"""
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'primary_wins': self.primary_wins,
+                'skipped': self.skipped,
+                'saturated': self.saturated,
+                'busy': self._busy,
+                'max_workers': self.max_workers
+            }
+            keys = list(self._trackers.keys())
+        stats['delays_ms'] = {':'.join(map(str, key)) if isinstance(key, tuple) else str(key):
+                              round(self.hedge_delay(key) * 1000, 2) for key in keys}
+        return stats
+
+def create_hedger() -> Hedger:
+    """
+    Tạo Hedger với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_HEDGE_PERCENTILE: Percentile latency dùng làm khoảng trễ (mặc định 95)
+        GATEWAY_HEDGE_MAX_DELAY: Khoảng trễ tối đa, giây (mặc định 1)
+        GATEWAY_HEDGE_MAX_RATIO: Tỉ lệ tối đa số request được hedge (mặc định 0.1)
+        GATEWAY_HEDGE_WORKERS: Số thread của pool (mặc định 2 lần GATEWAY_THREADS, số thread
+            xử lý request của mỗi worker, ví dụ gunicorn --threads; mặc định 32)
+    """
+    threads = int(os.environ.get('GATEWAY_THREADS', 32))
+    return Hedger(
+        percentile=float(os.environ.get('GATEWAY_HEDGE_PERCENTILE', 95)),
+        max_delay=float(os.environ.get('GATEWAY_HEDGE_MAX_DELAY', 1)),
+        max_hedge_ratio=float(os.environ.get('GATEWAY_HEDGE_MAX_RATIO', 0.1)),
+        max_workers=int(os.environ.get('GATEWAY_HEDGE_WORKERS', 2 * threads))
+    )
+
+# Singleton instance của Hedger
+_hedger = create_hedger()
+
+def _collect_hedging_stats():
+    stats = _hedger.get_stats()
+    return [
+        ('gateway_hedge_requests_total', 'counter', 'Số request đọc đi qua hedging',
+         [({}, stats['requests'])]),
+        ('gateway_hedge_total', 'counter', 'Số bản sao (hedge) theo kết quả',
+         [({'result': 'sent'}, stats['hedged']), ({'result': 'skipped'}, stats['skipped']),
+          ({'result': 'saturated'}, stats['saturated'])]),
+        ('gateway_hedge_wins_total', 'counter', 'Số request theo bản trả kết quả về trước',
+         [({'winner': 'hedge'}, stats['hedge_wins']), ({'winner': 'primary'}, stats['primary_wins'])]),
+        ('gateway_hedge_pool_busy', 'gauge', 'Số thread của pool hedging đang được dùng',
+         [({}, stats['busy'])])
+    ]
+
+_metrics.add_collector(_collect_hedging_stats)
+
+# Bật hedging cho các lần đọc bằng GATEWAY_HEDGING=1
+HEDGING_ENABLED = os.environ.get('GATEWAY_HEDGING', '0') == '1'
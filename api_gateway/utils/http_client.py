@@ -0,0 +1,351 @@
+import os
+import time
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from common.metrics import _registry as _metrics
+from utils.time_limiter import io_timeout, read_body
+from common.tracing import _tracer, inject_headers
+
+try:
+    import httpx
+except ImportError:  # httpx chỉ cần thiết cho gateway async (asgi_app.py)
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_LATENCY = _metrics.histogram(
+    'gateway_upstream_request_duration_seconds',
+    'Thời gian của từng lần gọi service phía sau (kể cả retry và hedge)',
+    ('service', 'method', 'status')
+)
+
+
+class UpstreamClient:
+    """
+    Lớp client gọi đến các service phía sau (upstream).
+    Mỗi service có một requests.Session riêng với connection pool keep-alive,
+    nhờ đó các request liên tiếp tái sử dụng kết nối TCP thay vì bắt tay lại từ đầu.
+    """
+
+    def __init__(self,
+                 service_urls: Dict[str, str],
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 20,
+                 pool_block: bool = False,
+                 connect_timeout: float = 2.0):
+        """
+        Khởi tạo UpstreamClient.
+
+        Args:
+            service_urls: Mapping tên service -> base URL
+            pool_connections: Số host pool được cache trong mỗi session
+            pool_maxsize: Số kết nối tối đa giữ lại cho mỗi host
+            pool_block: True để chờ khi pool đã đầy thay vì mở kết nối tạm thời
+            connect_timeout: Thời gian tối đa (giây) để mở kết nối khi chạy trong time_limit
+        """
+        self.service_urls = dict(service_urls)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.connect_timeout = connect_timeout
+
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+        # Thống kê sử dụng cho từng service
+        self._stats: Dict[str, Dict[str, int]] = {
+            service: {'requests': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+            for service in self.service_urls
+        }
+
+    def _create_session(self) -> requests.Session:
+        """Tạo một session mới với HTTPAdapter được cấu hình pool"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session(self, service: str) -> requests.Session:
+        """Lấy (hoặc tạo) session dùng chung cho một service"""
+        session = self._sessions.get(service)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(service)
+                if session is None:
+                    if service not in self.service_urls:
+                        raise KeyError(f"Service không được cấu hình: {service}")
+                    session = self._create_session()
+                    self._sessions[service] = session
+        return session
+
+    def url(self, service: str, path: str) -> str:
+        """Ghép base URL của service với path"""
+        return f"{self.service_urls[service]}{path}"
+
+    def request(self, service: str, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Gửi request đến một service qua session có pool.
+
+        Args:
+            service: Tên service trong service_urls
+            method: HTTP method (GET, POST, PUT, ...)
+            path: Đường dẫn bắt đầu bằng '/'
+            **kwargs: Tham số truyền thẳng cho requests (json, params, headers, timeout, ...)
+
+        Returns:
+            requests.Response
+        """
+        session = self.session(service)
+        stats = self._stats[service]
+
+        # Trong time_limit: áp deadline trực tiếp lên socket (connect/read timeout),
+        # body được đọc từng phần để deadline giới hạn cả tổng thời gian nhận response
+        deadline_bound = False
+        if 'timeout' not in kwargs and not kwargs.get('stream'):
+            timeout = io_timeout(self.connect_timeout)
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+                kwargs['stream'] = True
+                deadline_bound = True
+
+        with self._lock:
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+            if stats['in_flight'] > stats['max_in_flight']:
+                stats['max_in_flight'] = stats['in_flight']
+
+        # Mỗi lần gọi thật sự (kể cả retry, hedge) là một span client, truyền traceparent sang service
+        span = _tracer.start_span(f"{method} {service}{path}", kind='client', service=service)
+        kwargs['headers'] = inject_headers(kwargs.get('headers'))
+        start_time = time.perf_counter()
+        status = 'error'
+        error = None
+        try:
+            response = session.request(method, self.url(service, path), **kwargs)
+            status = response.status_code
+            if deadline_bound:
+                read_body(response)
+            return response
+        except Exception as e:
+            error = e
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start_time, service, method, status)
+            span.set_attribute('status', status)
+            span.finish(error=error)
+            with self._lock:
+                stats['in_flight'] -= 1
+
+    def get(self, service: str, path: str, **kwargs) -> requests.Response:
+        return self.request(service, 'GET', path, **kwargs)
+
+    def post(self, service: str, path: str, **kwargs) -> requests.Response:
+        return self.request(service, 'POST', path, **kwargs)
+
+    def put(self, service: str, path: str, **kwargs) -> requests.Response:
+        return self.request(service, 'PUT', path, **kwargs)
+
+    def _pool_stats(self, service: str) -> Dict[str, Any]:
+        """Đọc trạng thái connection pool của urllib3 cho một service"""
+        session = self._sessions.get(service)
+        if session is None:
+            return {'open_connections': 0, 'idle_connections': 0}
+
+        adapter: Optional[HTTPAdapter] = session.get_adapter(self.service_urls[service])
+        pools = list(adapter.poolmanager.pools.keys()) if adapter is not None else []
+
+        open_connections = 0
+        idle_connections = 0
+        for key in pools:
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            open_connections += pool.num_connections
+            # Hàng đợi của pool được lấp sẵn bằng None, chỉ đếm các kết nối thật đang rảnh
+            if pool.pool is not None:
+                idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        return {
+            'open_connections': open_connections,
+            'idle_connections': idle_connections
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Thống kê sử dụng pool cho từng service.
+
+        Returns:
+            Dict gồm cấu hình pool và số liệu theo từng service
+        """
+        with self._lock:
+            services = {service: dict(stats) for service, stats in self._stats.items()}
+
+        for service in services:
+            services[service].update(self._pool_stats(service))
+
+        return {
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'services': services
+        }
+
+    def close(self):
+        """Đóng tất cả các session và kết nối đang mở"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def create_upstream_client(service_urls: Dict[str, str]) -> UpstreamClient:
+    """
+    Tạo UpstreamClient với cấu hình pool đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_POOL_CONNECTIONS: Số host pool cho mỗi session (mặc định 10)
+        GATEWAY_POOL_MAXSIZE: Số kết nối tối đa cho mỗi host (mặc định 20)
+        GATEWAY_POOL_BLOCK: '1' để chờ khi pool đầy (mặc định '0')
+        GATEWAY_CONNECT_TIMEOUT: Thời gian mở kết nối tối đa, giây (mặc định 2)
+    """
+    return UpstreamClient(
+        service_urls,
+        pool_connections=int(os.environ.get('GATEWAY_POOL_CONNECTIONS', 10)),
+        pool_maxsize=int(os.environ.get('GATEWAY_POOL_MAXSIZE', 20)),
+        pool_block=os.environ.get('GATEWAY_POOL_BLOCK', '0') == '1',
+        connect_timeout=float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', 2))
+    )
+
+
+class AsyncUpstreamClient:
+    """
+    Client bất đồng bộ gọi đến các service phía sau, dùng cho gateway async.
+    Mỗi service có một httpx.AsyncClient riêng; các request chờ I/O không giữ
+    worker nên một process có thể giữ hàng nghìn upstream call cùng lúc.
+    """
+
+    def __init__(self,
+                 service_urls: Dict[str, str],
+                 max_connections: int = 1000,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 5.0):
+        """
+        Khởi tạo AsyncUpstreamClient.
+
+        Args:
+            service_urls: Mapping tên service -> base URL
+            max_connections: Số kết nối đồng thời tối đa tới mỗi service
+            max_keepalive_connections: Số kết nối keep-alive giữ lại cho mỗi service
+            keepalive_expiry: Thời gian (giây) giữ một kết nối rảnh trước khi đóng
+        """
+        if httpx is None:
+            raise RuntimeError("Gateway async cần thư viện httpx (pip install httpx)")
+
+        self.service_urls = dict(service_urls)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._clients: Dict[str, 'httpx.AsyncClient'] = {}
+
+        self._stats: Dict[str, Dict[str, int]] = {
+            service: {'requests': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+            for service in self.service_urls
+        }
+
+    def client(self, service: str) -> 'httpx.AsyncClient':
+        """Lấy (hoặc tạo) AsyncClient dùng chung cho một service"""
+        client = self._clients.get(service)
+        if client is None:
+            if service not in self.service_urls:
+                raise KeyError(f"Service không được cấu hình: {service}")
+            client = httpx.AsyncClient(base_url=self.service_urls[service], limits=self.limits)
+            self._clients[service] = client
+        return client
+
+    async def request(self, service: str, method: str, path: str, **kwargs) -> 'httpx.Response':
+        """
+        Gửi request bất đồng bộ đến một service.
+
+        Args:
+            service: Tên service trong service_urls
+            method: HTTP method (GET, POST, PUT, ...)
+            path: Đường dẫn bắt đầu bằng '/'
+            **kwargs: Tham số truyền thẳng cho httpx (json, params, headers, timeout, ...)
+        """
+        client = self.client(service)
+        stats = self._stats[service]
+
+        # Chạy trên một event loop nên cập nhật thống kê không cần lock
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+
+        span = _tracer.start_span(f"{method} {service}{path}", kind='client', service=service)
+        kwargs['headers'] = inject_headers(kwargs.get('headers'))
+        start_time = time.perf_counter()
+        status = 'error'
+        error = None
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            error = e
+            stats['errors'] += 1
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start_time, service, method, status)
+            span.set_attribute('status', status)
+            span.finish(error=error)
+            stats['in_flight'] -= 1
+
+    async def get(self, service: str, path: str, **kwargs) -> 'httpx.Response':
+        return await self.request(service, 'GET', path, **kwargs)
+
+    async def post(self, service: str, path: str, **kwargs) -> 'httpx.Response':
+        return await self.request(service, 'POST', path, **kwargs)
+
+    async def put(self, service: str, path: str, **kwargs) -> 'httpx.Response':
+        return await self.request(service, 'PUT', path, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê sử dụng cho từng service"""
+        return {
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'services': {service: dict(stats) for service, stats in self._stats.items()}
+        }
+
+    async def aclose(self):
+        """Đóng tất cả các AsyncClient"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+def create_async_upstream_client(service_urls: Dict[str, str]) -> AsyncUpstreamClient:
+    """
+    Tạo AsyncUpstreamClient với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_ASYNC_MAX_CONNECTIONS: Số kết nối đồng thời tối đa mỗi service (mặc định 1000)
+        GATEWAY_POOL_MAXSIZE: Số kết nối keep-alive giữ lại mỗi service (mặc định 20)
+    """
+    return AsyncUpstreamClient(
+        service_urls,
+        max_connections=int(os.environ.get('GATEWAY_ASYNC_MAX_CONNECTIONS', 1000)),
+        max_keepalive_connections=int(os.environ.get('GATEWAY_POOL_MAXSIZE', 20))
+    )
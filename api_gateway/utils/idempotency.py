@@ -0,0 +1,407 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import asyncio
+import inspect
+import functools
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Tuple
+from flask import request, make_response
+from utils.shared_state import SharedStateSyncer, _syncer
+
+try:
+    import quart
+except ImportError:  # quart chỉ cần thiết cho gateway async (asgi_app.py)
+    quart = None
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Độ dài tối đa của Idempotency-Key do client gửi
+MAX_KEY_LENGTH = 255
+
+class IdempotencyEntry:
+    """Kết quả (hoặc request đang xử lý) của một Idempotency-Key"""
+    __slots__ = ('fingerprint', 'done', 'body', 'status', 'mimetype', 'headers', 'expires_at', 'token')
+
+    def __init__(self, fingerprint: str, expires_at: float, token: Optional[str] = None):
+        self.fingerprint = fingerprint
+        self.token = token
+        self.done = threading.Event()
+        self.body: Optional[bytes] = None
+        self.status: Optional[int] = None
+        self.mimetype: Optional[str] = None
+        self.headers: Dict[str, str] = {}
+        self.expires_at = expires_at
+
+    @property
+    def completed(self) -> bool:
+        return self.status is not None
+
+class IdempotencyStore:
+    """
+    Lưu kết quả request theo Idempotency-Key trong bộ nhớ, có TTL và giới hạn số entry (LRU).
+
+    Request đầu tiên với một key được xử lý bình thường; các request trùng key
+    đến trong lúc đó chờ kết quả của request đầu thay vì chạy lại, các request
+    trùng key đến sau nhận lại đúng response đã lưu.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        """
+        Args:
+            ttl: Thời gian (giây) giữ kết quả của một key
+            max_entries: Số key tối đa được giữ
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, IdempotencyEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.started = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.evictions = 0
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        """
+        Đăng ký xử lý một key.
+
+        Returns:
+            (entry, owner): owner=True nếu request hiện tại phải xử lý và gọi complete()/abandon();
+            ngược lại entry là kết quả đã có hoặc request đang chạy cần chờ
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.completed and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, False
+
+            entry = self._entries[key] = IdempotencyEntry(fingerprint, now + self.ttl)
+            self.started += 1
+            self._evict()
+            return entry, True
+
+    def _evict(self):
+        """Bỏ các key cũ nhất đã có kết quả khi vượt max_entries (gọi khi đang giữ lock)"""
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        for key in list(self._entries):
+            if excess <= 0:
+                break
+            # Không bỏ key đang xử lý, nếu không request trùng sẽ chạy lại
+            if self._entries[key].completed:
+                del self._entries[key]
+                self.evictions += 1
+                excess -= 1
+
+    def complete(self, key: str, entry: IdempotencyEntry, body: bytes, status: int, mimetype: str,
+                 headers: Optional[Dict[str, str]] = None):
+        """Lưu response của request đầu tiên và đánh thức các request đang chờ"""
+        with self._lock:
+            entry.body = body
+            entry.mimetype = mimetype
+            entry.headers = dict(headers or {})
+            entry.expires_at = time.time() + self.ttl
+            entry.status = status
+        entry.done.set()
+
+    def abandon(self, key: str, entry: IdempotencyEntry):
+        """Bỏ key khi request đầu tiên lỗi tạm thời, để lần gửi lại được xử lý lại"""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def wait(self, key: str, entry: IdempotencyEntry, timeout: float) -> Optional[IdempotencyEntry]:
+        """
+        Chờ request đầu tiên của key xong.
+
+        Returns:
+            Entry sau khi chờ (completed=False nghĩa là request đầu đã bỏ key),
+            None nếu hết timeout mà request đầu vẫn đang chạy
+        """
+        return entry if entry.done.wait(timeout) else None
+
+    def record(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'started': self.started,
+                'replayed': self.replayed,
+                'waited': self.waited,
+                'conflicts': self.conflicts,
+                'evictions': self.evictions
+            }
+
+class SharedIdempotencyStore(IdempotencyStore):
+    """
+    IdempotencyStore lưu trong SharedStateStore (SQLite), dùng chung giữa các worker.
+
+    begin() chèn key trong một transaction ghi nên chỉ một worker nhận xử lý;
+    worker khác nhận request trùng key sẽ đọc lại bản ghi theo chu kỳ cho tới khi
+    có kết quả. Bản ghi đang xử lý có hạn (lease): worker xử lý bị kill giữa chừng
+    thì sau lease request gửi lại được nhận xử lý lại thay vì bị 409 mãi.
+    """
+
+    def __init__(self, syncer: SharedStateSyncer, ttl: float = 86400, max_entries: int = 10000,
+                 lease: float = 60, poll_interval: float = 0.05):
+        """
+        Args:
+            syncer: SharedStateSyncer chứa store dùng chung (thread nền dọn key hết hạn)
+            ttl: Thời gian (giây) giữ kết quả của một key
+            max_entries: Chỉ để báo cáo; key được dọn theo TTL
+            lease: Thời gian (giây) tối đa một request giữ key khi đang xử lý
+            poll_interval: Chu kỳ (giây) đọc lại bản ghi khi chờ request đầu tiên
+        """
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.syncer = syncer
+        self.store = syncer.store
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _entry(row) -> IdempotencyEntry:
+        fingerprint, token, status, body, mimetype, headers, expires_at = row
+        entry = IdempotencyEntry(fingerprint, expires_at, token=token)
+        if status is not None:
+            entry.body = bytes(body)
+            entry.mimetype = mimetype
+            entry.headers = json.loads(headers)
+            entry.status = status
+            entry.done.set()
+        return entry
+
+    _SELECT = ('SELECT fingerprint, token, status, body, mimetype, headers, expires_at '
+               'FROM idempotency WHERE key = ?')
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        self.syncer.ensure_started()
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute(self._SELECT, (key,)).fetchone()
+            # Hết hạn: kết quả quá TTL hoặc request đang xử lý quá lease (worker đã chết)
+            if row is not None and row[6] > now:
+                return self._entry(row), False
+
+            entry = IdempotencyEntry(fingerprint, now + self.lease, token=uuid.uuid4().hex)
+            conn.execute(
+                'INSERT OR REPLACE INTO idempotency (key, fingerprint, token, status, body, mimetype, headers, expires_at) '
+                'VALUES (?, ?, ?, NULL, NULL, NULL, NULL, ?)',
+                (key, fingerprint, entry.token, entry.expires_at)
+            )
+
+        self.record('started')
+        return entry, True
+
+    def complete(self, key: str, entry: IdempotencyEntry, body: bytes, status: int, mimetype: str,
+                 headers: Optional[Dict[str, str]] = None):
+        with self.store.transaction() as conn:
+            conn.execute(
+                'UPDATE idempotency SET status = ?, body = ?, mimetype = ?, headers = ?, expires_at = ? '
+                'WHERE key = ? AND token = ?',
+                (status, body, mimetype, json.dumps(dict(headers or {})), time.time() + self.ttl, key, entry.token)
+            )
+        super().complete(key, entry, body, status, mimetype, headers)
+
+    def abandon(self, key: str, entry: IdempotencyEntry):
+        with self.store.transaction() as conn:
+            conn.execute('DELETE FROM idempotency WHERE key = ? AND token = ?', (key, entry.token))
+        entry.done.set()
+
+    def wait(self, key: str, entry: IdempotencyEntry, timeout: float) -> Optional[IdempotencyEntry]:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            rows = self.store.query(self._SELECT, (key,))
+            if not rows or rows[0][1] != entry.token:
+                # Request đầu đã bỏ key (hoặc hết lease và request khác đã nhận lại)
+                return IdempotencyEntry(entry.fingerprint, entry.expires_at, token=entry.token)
+            if rows[0][2] is not None:
+                return self._entry(rows[0])
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['entries'] = self.store.query('SELECT COUNT(*) FROM idempotency')[0][0]
+        stats['lease'] = self.lease
+        stats['shared'] = True
+        return stats
+
+# Thời gian tối đa (giây) một request trùng key chờ request đầu tiên
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('GATEWAY_IDEMPOTENCY_WAIT_TIMEOUT', 30))
+
+def create_idempotency_store() -> IdempotencyStore:
+    """
+    Tạo IdempotencyStore với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_IDEMPOTENCY_TTL: Thời gian giữ kết quả của một key, giây (mặc định 86400)
+        GATEWAY_IDEMPOTENCY_MAX_ENTRIES: Số key tối đa trong bộ nhớ (mặc định 10000)
+        GATEWAY_IDEMPOTENCY_LEASE: Thời gian một request giữ key khi đang xử lý, giây
+            (mặc định 2 lần GATEWAY_IDEMPOTENCY_WAIT_TIMEOUT; chỉ dùng khi chia sẻ giữa worker)
+
+    Nếu GATEWAY_SHARED_STATE_PATH được đặt, trả về SharedIdempotencyStore dùng chung
+    giữa các worker; nếu không, key chỉ được nhớ trong worker đã xử lý request, nên
+    gateway chạy nhiều worker cần bật GATEWAY_SHARED_STATE_PATH để chống trùng đúng.
+    """
+    config = {
+        'ttl': float(os.environ.get('GATEWAY_IDEMPOTENCY_TTL', 86400)),
+        'max_entries': int(os.environ.get('GATEWAY_IDEMPOTENCY_MAX_ENTRIES', 10000))
+    }
+
+    if _syncer is not None:
+        lease = float(os.environ.get('GATEWAY_IDEMPOTENCY_LEASE', 2 * IDEMPOTENCY_WAIT_TIMEOUT))
+        return SharedIdempotencyStore(_syncer, lease=lease, **config)
+    return IdempotencyStore(**config)
+
+# Singleton instance của IdempotencyStore
+_idempotency_store = create_idempotency_store()
+
+def derive_key(*parts: str) -> str:
+    """Key dẫn xuất (ví dụ theo client + key gốc) để chuyển tiếp cho service phía sau"""
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    """Dấu vân tay của request; cùng key nhưng khác nội dung là lỗi của client"""
+    return hashlib.sha256(f"{method} {path}\n".encode('utf-8') + body).hexdigest()
+
+def replay_response(entry: IdempotencyEntry):
+    response = make_response(entry.body, entry.status)
+    response.mimetype = entry.mimetype
+    response.headers.update(entry.headers)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def claim_key(key: str, fingerprint: str) -> Tuple[Optional[IdempotencyEntry], Optional[tuple]]:
+    """
+    Nhận xử lý key, hoặc chờ/lấy kết quả của request đầu tiên có cùng key.
+
+    Returns:
+        (entry, None): entry.completed=False nghĩa là request hiện tại xử lý và phải gọi
+        finish_key(); entry.completed=True là kết quả cần trả lại.
+        (None, (body, status)): lỗi trả ngay cho client (422 khác nội dung, 409 còn đang xử lý)
+    """
+    store = _idempotency_store
+    while True:
+        entry, owner = store.begin(key, fingerprint)
+        if owner:
+            return entry, None
+        if entry.fingerprint != fingerprint:
+            store.record('conflicts')
+            return None, ({"error": "Idempotency-Key đã được dùng cho một request khác"}, 422)
+        if entry.completed:
+            store.record('replayed')
+            return entry, None
+
+        store.record('waited')
+        entry = store.wait(key, entry, IDEMPOTENCY_WAIT_TIMEOUT)
+        if entry is None:
+            return None, ({"error": "Request với Idempotency-Key này vẫn đang được xử lý"}, 409)
+        if entry.completed:
+            store.record('replayed')
+            return entry, None
+        # Request đầu tiên lỗi tạm thời và đã bỏ key: thử nhận xử lý lại
+
+def finish_key(key: str, entry: IdempotencyEntry, status: int, body: bytes, mimetype: str, headers):
+    """Lưu response của request đã nhận key; lỗi 5xx (tạm thời) thì bỏ key để client gửi lại"""
+    if status >= 500:
+        # Lỗi tạm thời (upstream không kết nối được...): cho phép gửi lại
+        _idempotency_store.abandon(key, entry)
+        return
+    saved = {name: headers[name] for name in ('Location', 'Preference-Applied') if name in headers}
+    _idempotency_store.complete(key, entry, body, status, mimetype, saved)
+
+def idempotent(func: Callable) -> Callable:
+    """
+    Decorator cho route POST hỗ trợ header Idempotency-Key.
+    Dùng được cho cả view Flask và view async của Quart (asgi_app.py).
+
+    Key được tính theo client và route. Response (trừ lỗi 5xx) được lưu trong
+    GATEWAY_IDEMPOTENCY_TTL giây; gửi lại cùng key nhận lại response đó kèm
+    header Idempotent-Replayed. Request không có key được xử lý như bình thường.
+    """
+    if inspect.iscoroutinefunction(func):
+        return _async_idempotent(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not client_key:
+            return func(*args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return {"error": f"Idempotency-Key dài tối đa {MAX_KEY_LENGTH} ký tự"}, 400
+
+        key = f"{request.remote_addr}:{request.endpoint}:{client_key}"
+        fingerprint = request_fingerprint(request.method, request.path, request.get_data(cache=True))
+        entry, error = claim_key(key, fingerprint)
+        if error is not None:
+            return error
+        if entry.completed:
+            return replay_response(entry)
+
+        try:
+            response = make_response(func(*args, **kwargs))
+        except Exception:
+            _idempotency_store.abandon(key, entry)
+            raise
+
+        finish_key(key, entry, response.status_code, response.get_data(), response.mimetype, response.headers)
+        return response
+
+    return wrapper
+
+def _async_idempotent(func: Callable) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        current_request = quart.request
+        client_key = current_request.headers.get(IDEMPOTENCY_HEADER)
+        if not client_key:
+            return await func(*args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return {"error": f"Idempotency-Key dài tối đa {MAX_KEY_LENGTH} ký tự"}, 400
+
+        key = f"{current_request.remote_addr}:{current_request.endpoint}:{client_key}"
+        fingerprint = request_fingerprint(current_request.method, current_request.path,
+                                          await current_request.get_data())
+        # Có thể phải chờ request đầu tiên: chạy trong thread pool để không chặn event loop
+        entry, error = await asyncio.get_running_loop().run_in_executor(None, claim_key, key, fingerprint)
+        if error is not None:
+            return error
+        if entry.completed:
+            response = quart.Response(entry.body, status=entry.status, mimetype=entry.mimetype)
+            response.headers.update(entry.headers)
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        try:
+            response = await quart.current_app.make_response(await func(*args, **kwargs))
+        except Exception:
+            await asyncio.to_thread(_idempotency_store.abandon, key, entry)
+            raise
+
+        # SharedIdempotencyStore ghi SQLite: cũng chạy trong thread pool
+        await asyncio.to_thread(finish_key, key, entry, response.status_code, await response.get_data(),
+                                response.mimetype, dict(response.headers))
+        return response
+
+    return wrapper
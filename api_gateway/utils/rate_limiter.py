@@ -1,87 +1,393 @@
+import os
 import time
+import threading
+import inspect
 import functools
-from typing import Callable, Dict, List, Any
-from flask import request, jsonify
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Tuple
+from flask import request
 import logging
+from common.metrics import _registry as _metrics
+from utils.shared_state import SharedStateSyncer, _syncer
+
+try:
+    import quart
+except ImportError:  # quart chỉ cần thiết cho gateway async (asgi_app.py)
+    quart = None
 
 logger = logging.getLogger(__name__)
 
+class _TokenBucketState:
+    """Trạng thái token bucket của một client trên một route"""
+    __slots__ = ('tokens', 'updated_at', 'last_seen')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+        self.last_seen = now
+
+class _WindowCounterState:
+    """Trạng thái sliding window counter của một client trên một route"""
+    __slots__ = ('window', 'current', 'previous', 'last_seen')
+
+    def __init__(self, window: int, now: float):
+        self.window = window
+        self.current = 0
+        self.previous = 0
+        self.last_seen = now
+
+class _Shard:
+    """Một phần của bảng trạng thái, có lock riêng để giảm tranh chấp giữa các thread"""
+    __slots__ = ('lock', 'entries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # OrderedDict theo thứ tự truy cập gần nhất (LRU): đầu là key lâu chưa dùng nhất
+        self.entries: 'OrderedDict[Tuple[str, str], Any]' = OrderedDict()
+
 class RateLimiter:
     """
     Rate Limiter để giới hạn số lượng request trong một khoảng thời gian.
-    Sử dụng thuật toán Sliding Window để theo dõi và giới hạn số lượng request.
+
+    Mỗi cặp (client, route) giữ một trạng thái kích thước cố định nên mỗi lần
+    kiểm tra là O(1). Hỗ trợ hai thuật toán:
+    - sliding_window: Sliding Window Counter, ước lượng số request trong cửa sổ
+      trượt từ bộ đếm của cửa sổ hiện tại và cửa sổ trước
+    - token_bucket: Token Bucket, nạp lại limit token sau mỗi period
+
+    Các key không hoạt động quá idle_timeout giây bị dọn, và tổng số key bị giới
+    hạn bởi max_keys (bỏ key lâu chưa dùng nhất) để bộ nhớ không tăng vô hạn.
     """
-    
-    def __init__(self):
-        # Dictionary lưu trữ request history cho mỗi client
-        # Key: IP address hoặc client identifier
-        # Value: List of timestamps
-        self.request_records: Dict[str, List[float]] = {}
-    
-    def is_allowed(self, client_id: str, limit: int, period: int) -> bool:
+
+    ALGORITHM_SLIDING_WINDOW = 'sliding_window'
+    ALGORITHM_TOKEN_BUCKET = 'token_bucket'
+
+    def __init__(self,
+                 algorithm: str = ALGORITHM_SLIDING_WINDOW,
+                 max_keys: int = 100000,
+                 idle_timeout: float = 600,
+                 shards: int = 16):
+        """
+        Khởi tạo RateLimiter.
+
+        Args:
+            algorithm: 'sliding_window' hoặc 'token_bucket'
+            max_keys: Số cặp (client, route) tối đa được lưu
+            idle_timeout: Thời gian (giây) không hoạt động trước khi key bị dọn
+            shards: Số phân vùng (mỗi phân vùng một lock)
+        """
+        if algorithm not in (self.ALGORITHM_SLIDING_WINDOW, self.ALGORITHM_TOKEN_BUCKET):
+            raise ValueError(f"Thuật toán rate limit không hợp lệ: {algorithm}")
+
+        self.algorithm = algorithm
+        self.max_keys = max_keys
+        self.idle_timeout = idle_timeout
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._max_keys_per_shard = max(1, max_keys // len(self._shards))
+
+        self._stats_lock = threading.Lock()
+        self.evicted = 0
+        self.rejected = 0
+
+    def is_allowed(self, client_id: str, limit: int, period: int, route: Optional[str] = None) -> bool:
         """
         Kiểm tra xem client có bị giới hạn hay không.
-        
+
         Args:
             client_id: Định danh của client (thường là IP)
             limit: Số lượng request tối đa được phép trong period
             period: Khoảng thời gian (giây) để tính giới hạn
-            
+            route: Route đang gọi; mỗi route có hạn mức riêng
+
         Returns:
             bool: True nếu request được phép, False nếu bị giới hạn
         """
-        # Lấy thời gian hiện tại
-        current_time = time.time()
-        
-        # Khởi tạo history cho client nếu chưa có
-        if client_id not in self.request_records:
-            self.request_records[client_id] = []
-        
-        # Lọc bỏ các timestamp cũ (ngoài period)
-        self.request_records[client_id] = [
-            timestamp for timestamp in self.request_records[client_id]
-            if current_time - timestamp < period
-        ]
-        
-        # Kiểm tra giới hạn
-        if len(self.request_records[client_id]) >= limit:
-            logger.warning(f"Rate limit exceeded for client {client_id}: {len(self.request_records[client_id])} requests in {period} seconds")
+        now = time.time()
+        key = (client_id, route or '')
+        shard = self._shards[hash(key) % len(self._shards)]
+
+        with shard.lock:
+            state = shard.entries.get(key)
+            if state is None:
+                state = self._new_state(limit, period, now)
+                shard.entries[key] = state
+                self._evict(shard, now)
+            else:
+                shard.entries.move_to_end(key)
+
+            state.last_seen = now
+
+            if self.algorithm == self.ALGORITHM_TOKEN_BUCKET:
+                allowed = self._consume_token(state, limit, period, now)
+            else:
+                allowed = self._count_in_window(state, limit, period, now)
+
+        if not allowed:
+            with self._stats_lock:
+                self.rejected += 1
+            logger.warning("Rate limit exceeded for client %s on %s: %s requests in %s seconds", client_id, route, limit, period)
+
+        return allowed
+
+    def _new_state(self, limit: int, period: int, now: float):
+        if self.algorithm == self.ALGORITHM_TOKEN_BUCKET:
+            return _TokenBucketState(float(limit), now)
+        return _WindowCounterState(int(now // period), now)
+
+    @staticmethod
+    def _consume_token(state: _TokenBucketState, limit: int, period: int, now: float) -> bool:
+        """Nạp lại token theo thời gian đã trôi qua rồi lấy một token"""
+        refill_rate = limit / period
+        state.tokens = min(float(limit), state.tokens + (now - state.updated_at) * refill_rate)
+        state.updated_at = now
+
+        if state.tokens < 1:
             return False
-        
-        # Thêm timestamp mới
-        self.request_records[client_id].append(current_time)
+
+        state.tokens -= 1
         return True
 
+    @staticmethod
+    def _count_in_window(state: _WindowCounterState, limit: int, period: int, now: float) -> bool:
+        """Ước lượng số request trong cửa sổ trượt [now - period, now]"""
+        window = int(now // period)
+        if window != state.window:
+            # Sang cửa sổ mới: cửa sổ hiện tại trở thành cửa sổ trước (nếu liền kề)
+            state.previous = state.current if window == state.window + 1 else 0
+            state.current = 0
+            state.window = window
+
+        # Phần của cửa sổ trước còn nằm trong cửa sổ trượt
+        elapsed_fraction = (now - window * period) / period
+        estimated = state.previous * (1 - elapsed_fraction) + state.current
+
+        if estimated >= limit:
+            return False
+
+        state.current += 1
+        return True
+
+    def _evict(self, shard: _Shard, now: float):
+        """Dọn các key không hoạt động và giữ số key trong giới hạn (gọi khi đang giữ lock)"""
+        evicted = 0
+        entries = shard.entries
+
+        # Key ở đầu là key lâu chưa dùng nhất nên chỉ cần xét từ đầu
+        while entries:
+            key, state = next(iter(entries.items()))
+            if len(entries) > self._max_keys_per_shard or now - state.last_seen > self.idle_timeout:
+                entries.popitem(last=False)
+                evicted += 1
+            else:
+                break
+
+        if evicted:
+            with self._stats_lock:
+                self.evicted += evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê số key đang lưu, số key bị dọn và số request bị từ chối"""
+        keys = 0
+        for shard in self._shards:
+            with shard.lock:
+                keys += len(shard.entries)
+
+        with self._stats_lock:
+            return {
+                'algorithm': self.algorithm,
+                'keys': keys,
+                'max_keys': self.max_keys,
+                'evicted': self.evicted,
+                'rejected': self.rejected
+            }
+
+class _SharedWindowState(_WindowCounterState):
+    """Trạng thái sliding window counter có phần chưa đồng bộ với các worker khác"""
+    __slots__ = ('period', 'unsynced')
+
+    def __init__(self, window: int, now: float, period: int):
+        super().__init__(window, now)
+        self.period = period
+        # Mapping window -> số request cục bộ chưa ghi vào store
+        self.unsynced: Dict[int, int] = {}
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter dùng chung hạn mức giữa các worker gunicorn trên cùng host.
+
+    Đường xử lý request chỉ đọc/ghi bộ nhớ như RateLimiter thường; số request
+    cục bộ được cộng dồn vào SharedStateStore theo lô bởi thread đồng bộ nền,
+    đồng thời đọc lại tổng của tất cả worker. Hạn mức có thể bị vượt nhẹ trong
+    khoảng một chu kỳ đồng bộ. Chỉ hỗ trợ thuật toán sliding_window.
+    """
+
+    def __init__(self, syncer: SharedStateSyncer, **kwargs):
+        kwargs['algorithm'] = self.ALGORITHM_SLIDING_WINDOW
+        super().__init__(**kwargs)
+        self.syncer = syncer
+        # Các key có thay đổi kể từ lần đồng bộ trước
+        self._dirty: set = set()
+        self._dirty_lock = threading.Lock()
+        syncer.register(self.sync)
+
+    def is_allowed(self, client_id: str, limit: int, period: int, route: Optional[str] = None) -> bool:
+        self.syncer.ensure_started()
+        with self._dirty_lock:
+            self._dirty.add((client_id, route or ''))
+        return super().is_allowed(client_id, limit, period, route)
+
+    def _new_state(self, limit: int, period: int, now: float):
+        return _SharedWindowState(int(now // period), now, period)
+
+    @staticmethod
+    def _count_in_window(state: _SharedWindowState, limit: int, period: int, now: float) -> bool:
+        allowed = RateLimiter._count_in_window(state, limit, period, now)
+        if allowed:
+            state.unsynced[state.window] = state.unsynced.get(state.window, 0) + 1
+        return allowed
+
+    @staticmethod
+    def _counter_key(key: Tuple[str, str], period: int, window: int) -> str:
+        return f"rl|{key[0]}|{key[1]}|{period}|{window}"
+
+    def sync(self):
+        """Ghi số request cục bộ vào store và cập nhật tổng của tất cả worker"""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+
+        deltas: Dict[str, float] = {}
+        read_keys = []
+        snapshot = []
+        max_period = 1
+
+        # 1. Lấy phần chưa đồng bộ ra khỏi từng state
+        for key in dirty:
+            shard = self._shards[hash(key) % len(self._shards)]
+            with shard.lock:
+                state = shard.entries.get(key)
+                if state is None:
+                    continue
+                unsynced, state.unsynced = state.unsynced, {}
+                window, period = state.window, state.period
+
+            for pending_window, count in unsynced.items():
+                counter_key = self._counter_key(key, period, pending_window)
+                deltas[counter_key] = deltas.get(counter_key, 0) + count
+            read_keys.append(self._counter_key(key, period, window))
+            read_keys.append(self._counter_key(key, period, window - 1))
+            snapshot.append((key, shard, window, period))
+            max_period = max(max_period, period)
+
+        # 2. Một transaction cho cả lô
+        try:
+            totals = self.syncer.store.add_counters(deltas, ttl=2 * max_period, read_keys=read_keys)
+        except Exception:
+            # Trả phần chưa ghi lại cho state để lần đồng bộ sau thử lại
+            self._restore(deltas)
+            raise
+
+        # 3. Cập nhật state bằng tổng của tất cả worker
+        for key, shard, window, period in snapshot:
+            with shard.lock:
+                state = shard.entries.get(key)
+                if state is None or state.window != window:
+                    continue
+                state.current = int(totals[self._counter_key(key, period, window)]) + state.unsynced.get(window, 0)
+                state.previous = int(totals[self._counter_key(key, period, window - 1)])
+
+    def _restore(self, deltas: Dict[str, float]):
+        for counter_key, count in deltas.items():
+            _, client_id, route, period, window = counter_key.split("|", 4)
+            key = (client_id, route)
+            shard = self._shards[hash(key) % len(self._shards)]
+            with shard.lock:
+                state = shard.entries.get(key)
+                if state is not None:
+                    state.unsynced[int(window)] = state.unsynced.get(int(window), 0) + int(count)
+            with self._dirty_lock:
+                self._dirty.add(key)
+
+def create_rate_limiter() -> RateLimiter:
+    """
+    Tạo RateLimiter với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_RATE_LIMIT_ALGORITHM: sliding_window hoặc token_bucket (mặc định sliding_window)
+        GATEWAY_RATE_LIMIT_MAX_KEYS: Số cặp (client, route) tối đa (mặc định 100000)
+        GATEWAY_RATE_LIMIT_IDLE_TIMEOUT: Thời gian dọn key không hoạt động, giây (mặc định 600)
+
+    Nếu GATEWAY_SHARED_STATE_PATH được đặt, trả về SharedRateLimiter dùng chung giữa các worker.
+    """
+    config = {
+        'algorithm': os.environ.get('GATEWAY_RATE_LIMIT_ALGORITHM', RateLimiter.ALGORITHM_SLIDING_WINDOW),
+        'max_keys': int(os.environ.get('GATEWAY_RATE_LIMIT_MAX_KEYS', 100000)),
+        'idle_timeout': float(os.environ.get('GATEWAY_RATE_LIMIT_IDLE_TIMEOUT', 600))
+    }
+
+    if _syncer is not None:
+        return SharedRateLimiter(_syncer, **config)
+    return RateLimiter(**config)
+
 # Singleton instance của RateLimiter
-_rate_limiter = RateLimiter()
+_rate_limiter = create_rate_limiter()
+
+# Tắt rate limit toàn bộ bằng GATEWAY_RATE_LIMIT_ENABLED=0 (ví dụ khi chạy benchmark)
+RATE_LIMIT_ENABLED = os.environ.get('GATEWAY_RATE_LIMIT_ENABLED', '1') == '1'
+
+RATE_LIMITED = _metrics.counter('gateway_rate_limited_total', 'Số request bị từ chối vì vượt rate limit', ('route',))
+
+def _rejected(current_request, func: Callable, limit: int, period: int):
+    """Response 429 nếu client của request đã vượt hạn mức của route, None nếu được phép"""
+    # Lấy định danh của client (ở đây dùng IP)
+    client_id = current_request.remote_addr
+
+    # Kiểm tra giới hạn (mỗi route có hạn mức riêng)
+    route = current_request.endpoint or func.__name__
+    if _rate_limiter.is_allowed(client_id, limit, period, route=route):
+        return None
+
+    RATE_LIMITED.inc(route)
+    logger.warning("Rate limit exceeded for %s from %s", current_request.path, client_id)
+    response = {
+        "error": "Đã vượt quá giới hạn request. Vui lòng thử lại sau.",
+        "limit": limit,
+        "period": period
+    }
+    return response, 429  # 429 Too Many Requests
 
 def rate_limit(limit: int = 10, period: int = 60):
     """
     Decorator để áp dụng rate limiting cho API endpoints.
-    
+    Dùng được cho cả view Flask và view async của Quart (asgi_app.py).
+
     Args:
         limit: Số lượng request tối đa được phép trong period
         period: Khoảng thời gian (giây) để tính giới hạn
     """
     def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if RATE_LIMIT_ENABLED:
+                    rejected = _rejected(quart.request, func, limit, period)
+                    if rejected is not None:
+                        return rejected
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # Lấy định danh của client (ở đây dùng IP)
-            client_id = request.remote_addr
-            
-            # Kiểm tra giới hạn
-            if not _rate_limiter.is_allowed(client_id, limit, period):
-                logger.warning(f"Rate limit exceeded for {request.path} from {client_id}")
-                response = {
-                    "error": "Đã vượt quá giới hạn request. Vui lòng thử lại sau.",
-                    "limit": limit,
-                    "period": period
-                }
-                return jsonify(response), 429  # 429 Too Many Requests
-            
+            if RATE_LIMIT_ENABLED:
+                rejected = _rejected(request, func, limit, period)
+                if rejected is not None:
+                    return rejected
+
             # Cho phép request nếu chưa vượt quá giới hạn
             return func(*args, **kwargs)
-        
+
         return wrapper
-    
+
     return decorator
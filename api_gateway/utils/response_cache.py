@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import asyncio
+import inspect
+import functools
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+from flask import request, make_response
+from utils.shared_state import SharedStateSyncer, _syncer
+
+try:
+    import quart
+except ImportError:  # quart chỉ cần thiết cho gateway async (asgi_app.py)
+    quart = None
+
+logger = logging.getLogger(__name__)
+
+# Header của response gốc được lưu cùng body (cursor trang kế tiếp của endpoint danh sách)
+CACHED_HEADERS = ('X-Next-Cursor',)
+
+class CacheEntry:
+    """Một response đã cache"""
+    __slots__ = ('body', 'status', 'mimetype', 'headers', 'etag', 'expires_at')
+
+    def __init__(self, body: bytes, status: int, mimetype: str, expires_at: float,
+                 headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = headers or {}
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.expires_at = expires_at
+
+class ResponseCache:
+    """
+    Cache response của gateway theo key (path + query string).
+    Giới hạn số entry theo LRU, mỗi entry có TTL riêng và ETag tính từ nội dung.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        """
+        Args:
+            max_entries: Số response tối đa được giữ trong cache
+        """
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Tăng mỗi lần invalidate; response lấy từ trước lần invalidate sẽ không được lưu
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def current_generation(self) -> int:
+        """Generation hiện tại, truyền lại cho set() sau khi lấy xong response"""
+        return self.generation
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Lấy entry còn hạn, None nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, body: bytes, status: int, mimetype: str, ttl: float,
+            generation: Optional[int] = None, headers: Optional[Dict[str, str]] = None) -> CacheEntry:
+        """
+        Lưu một response với TTL (giây).
+
+        Args:
+            generation: Giá trị current_generation() lúc bắt đầu lấy response; nếu cache
+                đã bị invalidate từ đó thì response không được lưu
+            headers: Các header cần trả lại cùng body khi cache hit
+        """
+        entry = CacheEntry(body, status, mimetype, time.time() + ttl, headers=headers)
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return entry
+
+    def invalidate(self, prefix: str = ''):
+        """Xoá các entry có key bắt đầu bằng prefix (mặc định xoá tất cả)"""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+            self.generation += 1
+
+        if keys:
+            logger.debug("Đã xoá %s response khỏi cache (prefix: %s)", len(keys), prefix)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+class SharedResponseCache(ResponseCache):
+    """
+    ResponseCache lưu trong SharedStateStore (SQLite), dùng chung giữa các worker.
+
+    invalidate() ở một worker xoá entry của mọi worker ngay lập tức, và generation
+    nằm trong store nên response lấy từ trước lần invalidate ở bất kỳ worker nào
+    cũng không được lưu lại.
+    """
+
+    GENERATION_KEY = 'cache:generation'
+
+    def __init__(self, syncer: SharedStateSyncer, max_entries: int = 1000):
+        """
+        Args:
+            syncer: SharedStateSyncer chứa store dùng chung (thread nền dọn entry hết hạn)
+            max_entries: Số response tối đa được giữ trong store
+        """
+        super().__init__(max_entries=max_entries)
+        self.syncer = syncer
+        self.store = syncer.store
+
+    def current_generation(self) -> int:
+        rows = self.store.query('SELECT value FROM counters WHERE key = ?', (self.GENERATION_KEY,))
+        return int(rows[0][0]) if rows else 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        self.syncer.ensure_started()
+        rows = self.store.query(
+            'SELECT body, status, mimetype, headers FROM responses WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        )
+        with self._lock:
+            if not rows:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        body, status, mimetype, headers = rows[0]
+        return CacheEntry(bytes(body), status, mimetype, 0, headers=json.loads(headers))
+
+    def set(self, key: str, body: bytes, status: int, mimetype: str, ttl: float,
+            generation: Optional[int] = None, headers: Optional[Dict[str, str]] = None) -> CacheEntry:
+        entry = CacheEntry(body, status, mimetype, time.time() + ttl, headers=headers)
+
+        with self.store.transaction() as conn:
+            if generation is not None:
+                rows = conn.execute('SELECT value FROM counters WHERE key = ?', (self.GENERATION_KEY,)).fetchall()
+                if (int(rows[0][0]) if rows else 0) != generation:
+                    return entry
+
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, body, status, mimetype, headers, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, body, status, mimetype, json.dumps(entry.headers), entry.expires_at)
+            )
+            # Vượt max_entries: bỏ các entry sắp hết hạn nhất
+            excess = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    'DELETE FROM responses WHERE key IN '
+                    '(SELECT key FROM responses ORDER BY expires_at LIMIT ?)',
+                    (excess,)
+                )
+
+        if excess > 0:
+            with self._lock:
+                self.evictions += excess
+        return entry
+
+    def invalidate(self, prefix: str = ''):
+        with self.store.transaction() as conn:
+            deleted = conn.execute(
+                'DELETE FROM responses WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)
+            ).rowcount
+            # Generation giữ lâu dài: bộ đếm hết hạn thì worker đang lấy response sẽ so sánh sai
+            conn.execute(
+                'INSERT INTO counters (key, value, expires_at) VALUES (?, 1, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = value + 1',
+                (self.GENERATION_KEY, float('inf'))
+            )
+
+        with self._lock:
+            self.invalidations += deleted
+
+        if deleted:
+            logger.debug("Đã xoá %s response khỏi cache dùng chung (prefix: %s)", deleted, prefix)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['entries'] = self.store.query('SELECT COUNT(*) FROM responses')[0][0]
+        stats['shared'] = True
+        return stats
+
+def create_response_cache() -> ResponseCache:
+    """
+    Tạo ResponseCache với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_CACHE_MAX_ENTRIES: Số response tối đa trong cache (mặc định 1000)
+
+    Nếu GATEWAY_SHARED_STATE_PATH được đặt, trả về SharedResponseCache dùng chung
+    giữa các worker; nếu không, mỗi worker có cache riêng và invalidate_cache() chỉ
+    xoá cache của worker đã xử lý request ghi (các worker khác trả dữ liệu cũ tới hết TTL).
+    """
+    max_entries = int(os.environ.get('GATEWAY_CACHE_MAX_ENTRIES', 1000))
+    if _syncer is not None:
+        return SharedResponseCache(_syncer, max_entries=max_entries)
+    return ResponseCache(max_entries=max_entries)
+
+# Singleton instance của ResponseCache
+_response_cache = create_response_cache()
+
+# Tắt cache toàn bộ bằng GATEWAY_CACHE_ENABLED=0
+CACHE_ENABLED = os.environ.get('GATEWAY_CACHE_ENABLED', '1') == '1'
+
+def cached_response(ttl: float = 30):
+    """
+    Decorator cache response 200 của route GET trong ttl giây.
+    Response được gắn ETag; client gửi If-None-Match trùng sẽ nhận 304.
+    Dùng được cho cả view Flask và view async của Quart (asgi_app.py).
+
+    Args:
+        ttl: Thời gian sống (giây) của response trong cache
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            return _async_cached_response(func, ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED or request.method != 'GET':
+                return func(*args, **kwargs)
+
+            key = request.full_path
+            entry = _response_cache.get(key)
+            cache_status = 'HIT'
+
+            if entry is None:
+                cache_status = 'MISS'
+                generation = _response_cache.current_generation()
+                response = make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+                entry = _response_cache.set(key, response.get_data(), response.status_code,
+                                            response.mimetype, ttl, generation=generation, headers=headers)
+
+            if request.if_none_match.contains(entry.etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(entry.body, entry.status)
+                response.mimetype = entry.mimetype
+                response.headers.update(entry.headers)
+
+            response.set_etag(entry.etag)
+            # Client luôn hỏi lại bằng ETag để thấy ngay các thay đổi đã invalidate cache
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Cache'] = cache_status
+            return response
+
+        return wrapper
+
+    return decorator
+
+def _async_cached_response(func: Callable, ttl: float) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        current_request = quart.request
+        if not CACHE_ENABLED or current_request.method != 'GET':
+            return await func(*args, **kwargs)
+
+        key = current_request.full_path
+        # SharedResponseCache đọc/ghi SQLite: chạy trong thread pool để không chặn event loop
+        entry = await asyncio.to_thread(_response_cache.get, key)
+        cache_status = 'HIT'
+
+        if entry is None:
+            cache_status = 'MISS'
+            generation = await asyncio.to_thread(_response_cache.current_generation)
+            response = await quart.current_app.make_response(await func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+            entry = await asyncio.to_thread(_response_cache.set, key, await response.get_data(), response.status_code,
+                                            response.mimetype, ttl, generation=generation, headers=headers)
+
+        if current_request.if_none_match.contains(entry.etag):
+            response = quart.Response('', status=304)
+        else:
+            response = quart.Response(entry.body, status=entry.status, mimetype=entry.mimetype)
+            response.headers.update(entry.headers)
+
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Cache'] = cache_status
+        return response
+
+    return wrapper
+
+def invalidate_cache(prefix: str = ''):
+    """Xoá các response đã cache có path bắt đầu bằng prefix"""
+    _response_cache.invalidate(prefix)
@@ -1,56 +1,260 @@
+import os
 import time
+import random
+import asyncio
 import logging
-import functools
-from typing import Callable, Any, Optional, List, Union
+import threading
+from typing import Callable, Any, Optional, Dict, Iterable
+
+from common.metrics import _registry as _metrics
 
 logger = logging.getLogger(__name__)
 
-def retry_request(
-    func: Callable,
-    retries: int = 3,
-    delay: float = 0.5,
-    backoff: float = 2,
-    exceptions: Union[List[Exception], tuple] = (Exception,)
-) -> Any:
+RETRIES = _metrics.counter('gateway_retries_total', 'Số lần gateway thử lại request tới upstream', ('reason',))
+RETRIES_DENIED = _metrics.counter('gateway_retries_denied_total', 'Số lần không được thử lại', ('reason',))
+
+# Các method có thể gửi lại mà không gây tác dụng phụ trùng lặp
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# Mã lỗi tạm thời của upstream, đáng để thử lại
+RETRYABLE_STATUS_CODES = frozenset([502, 503, 504])
+
+class RetryStats:
+    """Bộ đếm thống kê retry dùng chung"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            'requests': 0,
+            'retries': 0,
+            'budget_exhausted': 0,
+            'not_idempotent': 0,
+            'retryable_status': 0
+        }
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+_retry_stats = RetryStats()
+
+class RetryBudget:
+    """
+    Ngân sách retry dạng token.
+    Mỗi request gốc nạp thêm ratio token, mỗi lần retry tiêu 1 token, nên số
+    retry không vượt quá ratio * lưu lượng (cộng một mức sàn min_per_second).
+    Khi upstream sập, retry bị cắt thay vì nhân tải lên service đang lỗi.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100):
+        """
+        Args:
+            ratio: Tỉ lệ retry tối đa so với số request gốc (0.2 = 20%)
+            min_per_second: Số retry luôn được phép mỗi giây dù lưu lượng thấp
+            max_tokens: Số token tích luỹ tối đa
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float = 0):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens,
+                           self._tokens + amount + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_request(self):
+        """Ghi nhận một request gốc (không phải retry)"""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_acquire(self) -> bool:
+        """Lấy một token cho một lần retry, False nếu đã hết ngân sách"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+class RetryPolicy:
+    """
+    Chính sách retry cho một route.
+
+    - Chỉ retry method idempotent, hoặc method không an toàn có Idempotency-Key
+    - Retry khi gặp exception hoặc khi upstream trả về mã lỗi tạm thời (502/503/504)
+    - Thời gian chờ dùng decorrelated jitter để các client không retry cùng lúc
+    - Mỗi lần retry phải lấy được token từ RetryBudget của upstream
+    """
+
+    def __init__(self,
+                 max_retries: int = 2,
+                 base_delay: float = 0.1,
+                 max_delay: float = 2.0,
+                 retry_on_status: Iterable[int] = RETRYABLE_STATUS_CODES,
+                 exceptions: tuple = (Exception,)):
+        """
+        Args:
+            max_retries: Số lần thử lại tối đa
+            base_delay: Thời gian chờ tối thiểu giữa các lần thử (giây)
+            max_delay: Thời gian chờ tối đa giữa các lần thử (giây)
+            retry_on_status: Các mã HTTP được xem là lỗi tạm thời
+            exceptions: Các loại exception cần xử lý và thử lại
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on_status = frozenset(retry_on_status)
+        self.exceptions = exceptions
+
+    def next_delay(self, previous_delay: float) -> float:
+        """Decorrelated jitter: ngẫu nhiên trong [base, 3 * lần chờ trước], giới hạn bởi max_delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
+
+    @staticmethod
+    def can_retry_method(method: str, headers: Optional[Dict[str, str]] = None) -> bool:
+        """Method có được phép gửi lại hay không"""
+        if method.upper() in IDEMPOTENT_METHODS:
+            return True
+        return bool(headers) and any(key.lower() == 'idempotency-key' for key in headers)
+
+    def _should_retry_response(self, response: Any) -> bool:
+        return getattr(response, 'status_code', None) in self.retry_on_status
+
+    def _acquire(self, budget: Optional[RetryBudget]) -> bool:
+        if budget is not None and not budget.try_acquire():
+            _retry_stats.incr('budget_exhausted')
+            RETRIES_DENIED.inc('budget_exhausted')
+            logger.warning("Retry budget exhausted, không thử lại")
+            return False
+        return True
+
+    def execute(self, func: Callable, method: str = 'GET',
+                headers: Optional[Dict[str, str]] = None,
+                budget: Optional[RetryBudget] = None) -> Any:
+        """
+        Thực hiện func theo chính sách retry.
+
+        Args:
+            func: Function gửi request, trả về response
+            method: HTTP method của request
+            headers: Header của request (để kiểm tra Idempotency-Key)
+            budget: Ngân sách retry của upstream
+
+        Returns:
+            Response của lần thử cuối cùng
+
+        Raises:
+            Exception: Exception của lần thử cuối cùng nếu không thể thử lại
+        """
+        _retry_stats.incr('requests')
+        if budget is not None:
+            budget.record_request()
+
+        retryable = self.can_retry_method(method, headers)
+        delay = self.base_delay
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = func()
+            except self.exceptions as e:
+                logger.warning("Request failed (attempt %s/%s): %s", attempt + 1, self.max_retries + 1, e)
+                if not retryable:
+                    _retry_stats.incr('not_idempotent')
+                    RETRIES_DENIED.inc('not_idempotent')
+                    raise
+                if attempt >= self.max_retries or not self._acquire(budget):
+                    raise
+                reason = type(e).__name__
+            else:
+                if not self._should_retry_response(response):
+                    return response
+                _retry_stats.incr('retryable_status')
+                if not retryable or attempt >= self.max_retries or not self._acquire(budget):
+                    return response
+                reason = f"status_{response.status_code}"
+                logger.warning("Upstream trả về %s (attempt %s/%s)", response.status_code, attempt + 1, self.max_retries + 1)
+
+            delay = self.next_delay(delay)
+            _retry_stats.incr('retries')
+            RETRIES.inc(reason)
+            logger.info("Retry attempt %s/%s after %.2fs delay", attempt + 1, self.max_retries, delay)
+            time.sleep(delay)
+
+    async def execute_async(self, func: Callable, method: str = 'GET',
+                            headers: Optional[Dict[str, str]] = None,
+                            budget: Optional[RetryBudget] = None) -> Any:
+        """Phiên bản bất đồng bộ của execute() cho coroutine function"""
+        _retry_stats.incr('requests')
+        if budget is not None:
+            budget.record_request()
+
+        retryable = self.can_retry_method(method, headers)
+        delay = self.base_delay
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await func()
+            except self.exceptions as e:
+                logger.warning("Request failed (attempt %s/%s): %s", attempt + 1, self.max_retries + 1, e)
+                if not retryable:
+                    _retry_stats.incr('not_idempotent')
+                    RETRIES_DENIED.inc('not_idempotent')
+                    raise
+                if attempt >= self.max_retries or not self._acquire(budget):
+                    raise
+                reason = type(e).__name__
+            else:
+                if not self._should_retry_response(response):
+                    return response
+                _retry_stats.incr('retryable_status')
+                if not retryable or attempt >= self.max_retries or not self._acquire(budget):
+                    return response
+                reason = f"status_{response.status_code}"
+
+            delay = self.next_delay(delay)
+            _retry_stats.incr('retries')
+            RETRIES.inc(reason)
+            await asyncio.sleep(delay)
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = threading.Lock()
+
+def get_retry_budget(service: str) -> RetryBudget:
     """
-    Thực hiện lại request với cơ chế exponential backoff khi gặp lỗi.
-    
-    Args:
-        func: Function cần thực hiện lại
-        retries: Số lần thử lại tối đa
-        delay: Thời gian chờ ban đầu giữa các lần thử (giây)
-        backoff: Hệ số nhân thời gian chờ sau mỗi lần thử
-        exceptions: Các loại exception cần xử lý và thử lại
-    
-    Returns:
-        Kết quả của function nếu thành công
-        
-    Raises:
-        Exception: Nếu đã thử lại hết số lần mà vẫn không thành công
+    Lấy ngân sách retry của một upstream.
+
+    Biến môi trường:
+        GATEWAY_RETRY_BUDGET_RATIO: Tỉ lệ retry tối đa so với lưu lượng (mặc định 0.2)
+        GATEWAY_RETRY_BUDGET_MIN_PER_SECOND: Số retry tối thiểu mỗi giây (mặc định 1)
     """
-    max_retries = retries
-    current_delay = delay
-    last_exception = None
-    
-    # Thử request
-    for retry in range(max_retries + 1):  # +1 để tính cả lần đầu tiên
-        try:
-            if retry > 0:
-                logger.info(f"Retry attempt {retry}/{max_retries} after {current_delay:.2f}s delay")
-            
-            return func()
-            
-        except exceptions as e:
-            logger.warning(f"Request failed (attempt {retry + 1}/{max_retries + 1}): {str(e)}")
-            last_exception = e
-            
-            # Nếu đã hết số lần thử, ném exception
-            if retry >= max_retries:
-                logger.error(f"Max retries ({max_retries}) exceeded for request")
-                raise last_exception
-            
-            # Chờ trước khi thử lại
-            time.sleep(current_delay)
-            
-            # Tăng thời gian chờ cho lần thử tiếp theo (exponential backoff)
-            current_delay *= backoff
+    budget = _budgets.get(service)
+    if budget is None:
+        with _budgets_lock:
+            budget = _budgets.get(service)
+            if budget is None:
+                budget = RetryBudget(
+                    ratio=float(os.environ.get('GATEWAY_RETRY_BUDGET_RATIO', 0.2)),
+                    min_per_second=float(os.environ.get('GATEWAY_RETRY_BUDGET_MIN_PER_SECOND', 1))
+                )
+                _budgets[service] = budget
+    return budget
+
+def get_retry_stats() -> Dict[str, Any]:
+    """Thống kê retry và số token còn lại trong ngân sách của từng upstream"""
+    stats = _retry_stats.snapshot()
+    stats['budgets'] = {service: round(budget.tokens, 2) for service, budget in list(_budgets.items())}
+    return stats
@@ -0,0 +1,713 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.metrics import _registry as _metrics
+from common.tracing import _tracer
+
+logger = logging.getLogger(__name__)
+
+SAGAS = _metrics.counter('gateway_sagas_total', 'Số saga kết thúc theo trạng thái', ('saga', 'status'))
+SAGA_COMPENSATIONS = _metrics.counter('gateway_saga_compensations_total', 'Số lần chạy bước bù trừ', ('saga', 'step', 'result'))
+
+# Trạng thái của một saga
+RUNNING = 'running'
+COMPLETED = 'completed'
+COMPENSATING = 'compensating'
+COMPENSATED = 'compensated'
+COMPENSATION_FAILED = 'compensation_failed'
+# Bước deferred không thể hoàn thành và cũng không được bù trừ: cần người xử lý
+# (không bị purge() xoá)
+NEEDS_ATTENTION = 'needs_attention'
+
+TERMINAL_STATUSES = (COMPLETED, COMPENSATED, COMPENSATION_FAILED)
+
+class SagaStepError(Exception):
+    """Một bước saga bị upstream từ chối (lỗi nghiệp vụ), kèm response để trả lại client"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+class SagaExistsError(Exception):
+    """Saga với id này đã tồn tại (ví dụ request trùng Idempotency-Key)"""
+
+class SagaStep:
+    """
+    Một bước của saga.
+
+    action(data, results) thực hiện bước và trả về kết quả (JSON) được lưu vào
+    results[name]; compensation(data, results) huỷ tác dụng của bước, raise nếu
+    chưa thành công để được thử lại sau. Cả hai có thể là coroutine function
+    khi dùng với run_async(). Bước có thể bị chạy lại sau khi gateway khởi động
+    lại, nên action cần idempotent (ví dụ gửi Idempotency-Key theo saga id).
+
+    Bước deferred (và các bước sau nó) không được start() chờ: start() trả về
+    ngay khi tới bước này, phần còn lại chạy trong nền. Client đã nhận kết quả
+    thành công, nên lỗi ở các bước này không bao giờ bù trừ các bước trước:
+    lỗi tạm thời (5xx, không rõ kết quả) được thử lại về phía trước, còn lỗi
+    nghiệp vụ (4xx) hoặc hết số lần thử chuyển saga sang needs_attention.
+
+    Bước lỗi không phải SagaStepError (timeout, mất kết nối, circuit mở) có thể
+    đã được upstream thực hiện, nên compensation của nó vẫn được chạy với
+    results[name] = None: compensation cần tự tìm lại tác dụng của bước (ví dụ
+    theo Idempotency-Key) và coi "không tìm thấy" là đã bù trừ xong.
+    """
+
+    def __init__(self, name: str, action: Callable, compensation: Optional[Callable] = None,
+                 deferred: bool = False):
+        self.name = name
+        self.action = action
+        self.compensation = compensation
+        self.deferred = deferred
+
+class SagaStore:
+    """
+    Lưu trạng thái saga và nhật ký từng bước trong SQLite (WAL), dùng chung
+    giữa các worker. Mỗi saga có lease: worker đang chạy saga gia hạn lease
+    sau mỗi bước, lease hết hạn nghĩa là worker đó đã chết và saga được nhận lại.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        """
+        Args:
+            path: File SQLite lưu saga
+            busy_timeout: Thời gian (giây) chờ khi file đang bị worker khác khoá
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sagas ('
+            'id TEXT PRIMARY KEY, name TEXT NOT NULL, status TEXT NOT NULL, data TEXT NOT NULL, '
+            "results TEXT NOT NULL DEFAULT '{}', compensated TEXT NOT NULL DEFAULT '[]', error TEXT, "
+            'attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, '
+            'lease_until REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_sagas_status ON sagas (status, next_attempt_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS saga_log ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, saga_id TEXT NOT NULL, step TEXT, '
+            'event TEXT NOT NULL, detail TEXT, ts REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_saga_log_saga ON saga_log (saga_id)')
+
+    def _connection(self) -> sqlite3.Connection:
+        """Kết nối SQLite riêng cho từng thread (và từng process sau khi fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, saga_id: str, name: str, data: dict, lease_until: float):
+        """Ghi một saga mới ở trạng thái running; raise SagaExistsError nếu id đã tồn tại"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO sagas (id, name, status, data, lease_until, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (saga_id, name, RUNNING, json.dumps(data), lease_until, now, now)
+            )
+            conn.execute('INSERT INTO saga_log (saga_id, step, event, detail, ts) VALUES (?, NULL, ?, NULL, ?)',
+                         (saga_id, 'created', now))
+            conn.execute('COMMIT')
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK')
+            raise SagaExistsError(saga_id)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def restart(self, saga_id: str, data: dict, lease_until: float) -> bool:
+        """
+        Đưa một saga đã bù trừ xong về trạng thái running với data mới, chạy lại từ đầu.
+
+        Returns:
+            False nếu saga không còn ở trạng thái compensated (ví dụ worker khác đã chạy lại trước)
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                "UPDATE sagas SET status = ?, data = ?, results = '{}', compensated = '[]', error = NULL, "
+                'attempts = 0, next_attempt_at = 0, lease_until = ?, updated_at = ? WHERE id = ? AND status = ?',
+                (RUNNING, json.dumps(data), lease_until, now, saga_id, COMPENSATED)
+            )
+            if cursor.rowcount == 1:
+                conn.execute('INSERT INTO saga_log (saga_id, step, event, detail, ts) VALUES (?, NULL, ?, NULL, ?)',
+                             (saga_id, 'restarted', now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def get(self, saga_id: str, with_log: bool = False) -> Optional[Dict[str, Any]]:
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT id, name, status, data, results, compensated, error, attempts, created_at, updated_at '
+            'FROM sagas WHERE id = ?', (saga_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        saga = {
+            'id': row[0],
+            'name': row[1],
+            'status': row[2],
+            'data': json.loads(row[3]),
+            'results': json.loads(row[4]),
+            'compensated': json.loads(row[5]),
+            'error': json.loads(row[6]) if row[6] else None,
+            'attempts': row[7],
+            'created_at': row[8],
+            'updated_at': row[9]
+        }
+        if with_log:
+            saga['log'] = [
+                {'step': step, 'event': event, 'detail': json.loads(detail) if detail else None, 'ts': ts}
+                for step, event, detail, ts in conn.execute(
+                    'SELECT step, event, detail, ts FROM saga_log WHERE saga_id = ? ORDER BY id', (saga_id,)
+                )
+            ]
+        return saga
+
+    def update(self, saga_id: str, event: Optional[Tuple[Optional[str], str, Any]] = None, **fields):
+        """
+        Cập nhật các cột của saga và (tuỳ chọn) ghi một dòng nhật ký trong cùng transaction.
+
+        Args:
+            saga_id: Saga cần cập nhật
+            event: (step, event, detail) ghi vào saga_log
+            fields: Giá trị mới của các cột; results/compensated/error được lưu dạng JSON
+        """
+        now = time.time()
+        for key in ('results', 'compensated', 'error'):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        fields['updated_at'] = now
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                f"UPDATE sagas SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                list(fields.values()) + [saga_id]
+            )
+            if event is not None:
+                step, name, detail = event
+                conn.execute(
+                    'INSERT INTO saga_log (saga_id, step, event, detail, ts) VALUES (?, ?, ?, ?, ?)',
+                    (saga_id, step, name, json.dumps(detail) if detail is not None else None, now)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim_due(self, lease: float, limit: int = 50) -> List[str]:
+        """
+        Nhận các saga cần xử lý: đang chạy nhưng lease đã hết (worker chết giữa chừng)
+        hoặc đang chờ bù trừ và đã tới lượt thử lại.
+
+        Returns:
+            Danh sách id saga đã được gán lease cho process hiện tại
+        """
+        now = time.time()
+        conn = self._connection()
+        candidates = conn.execute(
+            'SELECT id FROM sagas WHERE status IN (?, ?) AND lease_until < ? AND next_attempt_at <= ? '
+            'ORDER BY next_attempt_at LIMIT ?',
+            (RUNNING, COMPENSATING, now, now, limit)
+        ).fetchall()
+
+        claimed = []
+        for (saga_id,) in candidates:
+            # Chỉ một worker đổi được lease_until, các worker khác thấy rowcount = 0
+            cursor = conn.execute(
+                'UPDATE sagas SET lease_until = ? WHERE id = ? AND lease_until < ?',
+                (now + lease, saga_id, now)
+            )
+            if cursor.rowcount == 1:
+                claimed.append(saga_id)
+        return claimed
+
+    def purge(self, older_than: float):
+        """Xoá các saga đã kết thúc trước thời điểm older_than cùng nhật ký của chúng"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                f"DELETE FROM saga_log WHERE saga_id IN (SELECT id FROM sagas WHERE status IN "
+                f"({','.join('?' * len(TERMINAL_STATUSES))}) AND updated_at < ?)",
+                TERMINAL_STATUSES + (older_than,)
+            )
+            conn.execute(
+                f"DELETE FROM sagas WHERE status IN ({','.join('?' * len(TERMINAL_STATUSES))}) AND updated_at < ?",
+                TERMINAL_STATUSES + (older_than,)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def count_by_status(self) -> Dict[str, int]:
+        return dict(self._connection().execute('SELECT status, COUNT(*) FROM sagas GROUP BY status').fetchall())
+
+class SagaOrchestrator:
+    """
+    Điều phối saga: chạy lần lượt các bước, ghi nhật ký từng bước vào SagaStore
+    và khi một bước thất bại thì chạy bù trừ (compensation) các bước đã xong
+    theo thứ tự ngược lại.
+
+    Bù trừ luôn chạy trong nền: bước bù trừ thất bại được thử lại với backoff
+    tăng dần cho tới max_compensation_attempts. Thread nền cũng nhận lại các
+    saga đang chạy dở của worker đã chết (lease hết hạn) và chạy tiếp từ bước
+    chưa hoàn thành.
+    """
+
+    def __init__(self, store: SagaStore, lease: float = 60, poll_interval: float = 1.0,
+                 compensation_base_delay: float = 1.0, compensation_max_delay: float = 60,
+                 max_compensation_attempts: int = 20, max_deferred_attempts: int = 20,
+                 retention: float = 7 * 86400, max_workers: int = 8):
+        """
+        Args:
+            store: Nơi lưu trạng thái saga
+            lease: Thời gian (giây) một worker giữ saga mà không cần gia hạn
+            poll_interval: Chu kỳ (giây) thread nền tìm saga cần xử lý
+            compensation_base_delay: Thời gian chờ (giây) trước lần thử bù trừ thứ hai
+            compensation_max_delay: Thời gian chờ tối đa (giây) giữa các lần thử bù trừ
+            max_compensation_attempts: Số lần thử bù trừ trước khi đánh dấu compensation_failed
+            max_deferred_attempts: Số lần thử bước deferred trước khi đánh dấu needs_attention
+            retention: Thời gian (giây) giữ saga đã kết thúc trước khi xoá
+            max_workers: Số thread chạy saga nền
+        """
+        self.store = store
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.compensation_base_delay = compensation_base_delay
+        self.compensation_max_delay = compensation_max_delay
+        self.max_compensation_attempts = max_compensation_attempts
+        self.max_deferred_attempts = max_deferred_attempts
+        self.retention = retention
+        self.max_workers = max_workers
+
+        self._definitions: Dict[str, List[SagaStep]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._background_tasks = set()
+
+    def define(self, name: str, steps: List[SagaStep]):
+        """Đăng ký các bước của một loại saga"""
+        self._definitions[name] = list(steps)
+
+    def new_id(self, prefix: str = 'SAGA') -> str:
+        return f"{prefix}-{uuid.uuid4().hex[:12].upper()}"
+
+    def get(self, saga_id: str) -> Optional[Dict[str, Any]]:
+        """Trạng thái saga kèm nhật ký các bước"""
+        return self.store.get(saga_id, with_log=True)
+
+    # --- Chạy đồng bộ (Flask) ---
+
+    def retryable(self, saga: Dict[str, Any]) -> bool:
+        """
+        Saga đã bù trừ xong vì lỗi tạm thời (không kết nối được service, upstream
+        trả 5xx) chứ không phải bị từ chối: gửi lại cùng id thì được chạy lại.
+        """
+        if saga['status'] != COMPENSATED:
+            return False
+        status_code = (saga['error'] or {}).get('status_code')
+        return status_code is None or status_code >= 500
+
+    def _create(self, name: str, data: dict, saga_id: Optional[str],
+                retry_data: Optional[Callable[[Dict[str, Any]], dict]]) -> str:
+        """
+        Ghi saga mới xuống store. Nếu id đã tồn tại và retry_data được truyền, saga
+        cũ đã thất bại vì lỗi tạm thời được chạy lại từ đầu với data = retry_data(saga).
+
+        Raises:
+            SagaExistsError: Nếu id đã tồn tại và saga không được chạy lại
+        """
+        saga_id = saga_id or self.new_id()
+        try:
+            self.store.create(saga_id, name, data, lease_until=time.time() + self.lease)
+        except SagaExistsError:
+            saga = self.store.get(saga_id)
+            if retry_data is None or saga is None or saga['name'] != name or not self.retryable(saga):
+                raise
+            if not self.store.restart(saga_id, retry_data(saga), lease_until=time.time() + self.lease):
+                raise
+            logger.info("Saga %s được chạy lại sau lỗi: %s", saga_id, saga['error'])
+        return saga_id
+
+    def start(self, name: str, data: dict, saga_id: Optional[str] = None,
+              retry_data: Optional[Callable[[Dict[str, Any]], dict]] = None) -> Dict[str, Any]:
+        """
+        Tạo saga và chạy các bước ngay trong thread hiện tại, tới bước deferred đầu tiên.
+        Nếu một bước thất bại, trả về ngay; bù trừ được thực hiện trong nền.
+
+        Args:
+            retry_data: Cho phép chạy lại saga cùng id đã thất bại vì lỗi tạm thời
+                (xem retryable()); nhận saga cũ, trả về data cho lần chạy mới
+
+        Returns:
+            Trạng thái saga sau khi chạy (completed, compensating, hoặc running
+            nếu các bước deferred đang chạy trong nền)
+
+        Raises:
+            SagaExistsError: Nếu id đã tồn tại và saga không được chạy lại
+        """
+        saga_id = self._create(name, data, saga_id, retry_data)
+        return self.run(saga_id, foreground=True)
+
+    def submit(self, name: str, data: dict, saga_id: Optional[str] = None,
+               retry_data: Optional[Callable[[Dict[str, Any]], dict]] = None) -> str:
+        """
+        Tạo saga và chạy các bước trong nền, trả về id ngay.
+        Saga đã được ghi xuống store trước khi trả về, nên nếu process chết
+        trước khi chạy xong, worker khác sẽ nhận lại khi lease hết hạn.
+        """
+        saga_id = self._create(name, data, saga_id, retry_data)
+        self._defer(saga_id)
+        return saga_id
+
+    def run(self, saga_id: str, foreground: bool = False) -> Dict[str, Any]:
+        """
+        Chạy tiếp saga từ bước chưa hoàn thành (hoặc bù trừ nếu saga đang bù trừ).
+
+        Args:
+            foreground: Dừng ở bước deferred đầu tiên và giao phần còn lại cho thread nền
+        """
+        saga = self.store.get(saga_id)
+        if saga['status'] == COMPENSATING:
+            self.compensate(saga)
+            return self.store.get(saga_id)
+        if saga['status'] != RUNNING:
+            return saga
+
+        results = saga['results']
+        for step in self._definitions[saga['name']]:
+            if step.name in results:
+                continue
+            if foreground and step.deferred:
+                self._defer(saga_id)
+                return self.store.get(saga_id)
+
+            self.store.update(saga_id, event=(step.name, 'started', None), lease_until=time.time() + self.lease)
+            try:
+                with _tracer.span(f"saga {saga['name']} {step.name}", saga_id=saga_id):
+                    result = step.action(saga['data'], results)
+            except Exception as e:
+                return self._fail(saga, step, e)
+
+            results[step.name] = result
+            self.store.update(saga_id, event=(step.name, 'completed', None), results=results,
+                              lease_until=time.time() + self.lease)
+
+        return self._complete(saga)
+
+    def compensate(self, saga: Dict[str, Any]):
+        """Chạy các bước bù trừ còn lại theo thứ tự ngược; lỗi thì hẹn lần thử sau"""
+        compensated = saga['compensated']
+        for step in self._pending_compensations(saga):
+            try:
+                with _tracer.span(f"saga {saga['name']} compensate {step.name}", saga_id=saga['id']):
+                    step.compensation(saga['data'], saga['results'])
+            except Exception as e:
+                self._compensation_failed(saga, step, e)
+                return
+            compensated.append(step.name)
+            self._compensation_succeeded(saga, step)
+
+        self._compensation_finished(saga)
+
+    def _defer(self, saga_id: str):
+        """Chạy tiếp saga trong thread nền (giữ nguyên trace hiện tại)"""
+        self.ensure_started()
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run_safely, saga_id)
+
+    def _run_safely(self, saga_id: str):
+        try:
+            self.run(saga_id)
+        except Exception as e:
+            # Lease sẽ hết hạn và saga được nhận lại ở chu kỳ sau
+            logger.exception("Lỗi khi chạy saga %s: %s", saga_id, e)
+
+    def ensure_started(self):
+        """Khởi động thread nền (tiếp tục saga dở dang, bù trừ) nếu process hiện tại chưa có"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='saga')
+            thread = threading.Thread(target=self._run_background, name='saga-orchestrator', daemon=True)
+            thread.start()
+
+    def _run_background(self):
+        last_purge = 0.0
+        while True:
+            try:
+                for saga_id in self.store.claim_due(self.lease, limit=self.max_workers * 4):
+                    self._executor.submit(self._run_safely, saga_id)
+                if time.time() - last_purge >= 3600:
+                    last_purge = time.time()
+                    self.store.purge(time.time() - self.retention)
+            except Exception as e:
+                logger.error("Lỗi khi xử lý saga nền: %s", e)
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    # --- Chạy bất đồng bộ (Quart) ---
+    # SagaStore là SQLite (chặn, có thể chờ lock của worker khác): mọi lời gọi store
+    # chạy qua asyncio.to_thread() để không chặn event loop (giữ nguyên trace hiện tại)
+
+    async def get_async(self, saga_id: str) -> Optional[Dict[str, Any]]:
+        """Phiên bản bất đồng bộ của get()"""
+        return await asyncio.to_thread(self.get, saga_id)
+
+    async def start_async(self, name: str, data: dict, saga_id: Optional[str] = None,
+                          retry_data: Optional[Callable[[Dict[str, Any]], dict]] = None) -> Dict[str, Any]:
+        """Phiên bản bất đồng bộ của start(), các bước là coroutine function"""
+        saga_id = await asyncio.to_thread(self._create, name, data, saga_id, retry_data)
+        return await self.run_async(saga_id, foreground=True)
+
+    async def submit_async(self, name: str, data: dict, saga_id: Optional[str] = None,
+                           retry_data: Optional[Callable[[Dict[str, Any]], dict]] = None) -> str:
+        """Phiên bản bất đồng bộ của submit(), saga chạy trong một task của event loop hiện tại"""
+        saga_id = await asyncio.to_thread(self._create, name, data, saga_id, retry_data)
+        self._spawn(self._run_safely_async(saga_id))
+        return saga_id
+
+    async def run_async(self, saga_id: str, foreground: bool = False) -> Dict[str, Any]:
+        saga = await asyncio.to_thread(self.store.get, saga_id)
+        if saga['status'] == COMPENSATING:
+            await self.compensate_async(saga)
+            return await asyncio.to_thread(self.store.get, saga_id)
+        if saga['status'] != RUNNING:
+            return saga
+
+        results = saga['results']
+        for step in self._definitions[saga['name']]:
+            if step.name in results:
+                continue
+            if foreground and step.deferred:
+                self._spawn(self._run_safely_async(saga_id))
+                return await asyncio.to_thread(self.store.get, saga_id)
+
+            await asyncio.to_thread(self.store.update, saga_id, event=(step.name, 'started', None),
+                                    lease_until=time.time() + self.lease)
+            try:
+                with _tracer.span(f"saga {saga['name']} {step.name}", saga_id=saga_id):
+                    result = await step.action(saga['data'], results)
+            except Exception as e:
+                return await asyncio.to_thread(self._fail, saga, step, e)
+
+            results[step.name] = result
+            await asyncio.to_thread(self.store.update, saga_id, event=(step.name, 'completed', None),
+                                    results=results, lease_until=time.time() + self.lease)
+
+        return await asyncio.to_thread(self._complete, saga)
+
+    async def compensate_async(self, saga: Dict[str, Any]):
+        compensated = saga['compensated']
+        for step in self._pending_compensations(saga):
+            try:
+                with _tracer.span(f"saga {saga['name']} compensate {step.name}", saga_id=saga['id']):
+                    await step.compensation(saga['data'], saga['results'])
+            except Exception as e:
+                await asyncio.to_thread(self._compensation_failed, saga, step, e)
+                return
+            compensated.append(step.name)
+            await asyncio.to_thread(self._compensation_succeeded, saga, step)
+
+        await asyncio.to_thread(self._compensation_finished, saga)
+
+    async def _run_safely_async(self, saga_id: str):
+        try:
+            await self.run_async(saga_id)
+        except Exception as e:
+            logger.exception("Lỗi khi chạy saga %s: %s", saga_id, e)
+
+    def _spawn(self, coroutine):
+        # Giữ tham chiếu tới task để không bị GC huỷ giữa chừng
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def run_background_async(self):
+        """Vòng lặp nền cho app bất đồng bộ: tiếp tục saga dở dang và bù trừ"""
+        last_purge = 0.0
+        while True:
+            try:
+                due = await asyncio.to_thread(self.store.claim_due, self.lease, limit=self.max_workers * 4)
+                for saga_id in due:
+                    self._spawn(self._run_safely_async(saga_id))
+                if time.time() - last_purge >= 3600:
+                    last_purge = time.time()
+                    await asyncio.to_thread(self.store.purge, time.time() - self.retention)
+            except Exception as e:
+                logger.error("Lỗi khi xử lý saga nền: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    # --- Chuyển trạng thái dùng chung ---
+
+    def _complete(self, saga: Dict[str, Any]) -> Dict[str, Any]:
+        self.store.update(saga['id'], event=(None, COMPLETED, None), status=COMPLETED, lease_until=0)
+        SAGAS.inc(saga['name'], COMPLETED)
+        return self.store.get(saga['id'])
+
+    def _fail(self, saga: Dict[str, Any], step: SagaStep, error: Exception) -> Dict[str, Any]:
+        """Ghi lỗi của bước và chuyển saga sang bù trừ (do thread nền thực hiện)"""
+        if self._after_commit_point(saga, step):
+            status_code = error.status_code if isinstance(error, SagaStepError) else None
+            if status_code is not None and status_code < 500:
+                return self._needs_attention(saga, step, error)
+            return self._retry_later(saga, step, error)
+
+        if isinstance(error, SagaStepError):
+            detail = {'step': step.name, 'message': str(error), 'status_code': error.status_code, 'body': error.body}
+            logger.warning("Saga %s dừng ở bước %s: %s", saga['id'], step.name, error)
+        else:
+            detail = {'step': step.name, 'message': str(error) or type(error).__name__}
+            logger.error("Saga %s lỗi ở bước %s: %s", saga['id'], step.name, error)
+            if step.compensation is not None:
+                # Không biết upstream đã thực hiện bước hay chưa: vẫn bù trừ, kết quả chưa biết (None)
+                saga['results'][step.name] = None
+
+        if self._pending_compensations(saga):
+            self.store.update(saga['id'], event=(step.name, 'failed', detail), status=COMPENSATING,
+                              results=saga['results'], error=detail, attempts=0, next_attempt_at=0,
+                              lease_until=0)
+            self._wake.set()
+        else:
+            self.store.update(saga['id'], event=(step.name, 'failed', detail), status=COMPENSATED,
+                              error=detail, lease_until=0)
+            SAGAS.inc(saga['name'], COMPENSATED)
+        return self.store.get(saga['id'])
+
+    def _after_commit_point(self, saga: Dict[str, Any], step: SagaStep) -> bool:
+        """Bước là bước deferred đầu tiên hoặc sau nó: các bước trước đã xong và client đã nhận kết quả"""
+        steps = self._definitions[saga['name']]
+        first_deferred = next((i for i, s in enumerate(steps) if s.deferred), None)
+        return first_deferred is not None and steps.index(step) >= first_deferred
+
+    def _retry_later(self, saga: Dict[str, Any], step: SagaStep, error: Exception) -> Dict[str, Any]:
+        """
+        Bước deferred chạy sau khi client đã nhận kết quả, nên lỗi tạm thời (không
+        kết nối được, timeout, 5xx) được thử lại về phía trước thay vì bù trừ cả saga.
+        """
+        attempts = saga['attempts'] + 1
+        if attempts >= self.max_deferred_attempts:
+            return self._needs_attention(saga, step, error, attempts=attempts)
+
+        delay = min(self.compensation_max_delay, self.compensation_base_delay * 2 ** (attempts - 1))
+        detail = {'message': str(error) or type(error).__name__, 'attempt': attempts}
+        logger.warning("Saga %s: bước %s lỗi (lần %s), thử lại sau %.1fs: %s",
+                       saga['id'], step.name, attempts, delay, error)
+        self.store.update(saga['id'], event=(step.name, 'retry', detail), attempts=attempts,
+                          next_attempt_at=time.time() + delay, lease_until=0)
+        return self.store.get(saga['id'])
+
+    def _needs_attention(self, saga: Dict[str, Any], step: SagaStep, error: Exception,
+                         attempts: Optional[int] = None) -> Dict[str, Any]:
+        """Bước deferred không thể hoàn thành: dừng saga mà không bù trừ, chờ người xử lý"""
+        detail = {'step': step.name, 'message': str(error) or type(error).__name__}
+        if isinstance(error, SagaStepError):
+            detail.update(status_code=error.status_code, body=error.body)
+        logger.error("Saga %s cần xử lý thủ công: bước %s thất bại: %s", saga['id'], step.name, error)
+        self.store.update(saga['id'], event=(step.name, NEEDS_ATTENTION, detail), status=NEEDS_ATTENTION,
+                          error=detail, attempts=saga['attempts'] if attempts is None else attempts,
+                          lease_until=0)
+        SAGAS.inc(saga['name'], NEEDS_ATTENTION)
+        return self.store.get(saga['id'])
+
+    def _pending_compensations(self, saga: Dict[str, Any]) -> List[SagaStep]:
+        return [
+            step for step in reversed(self._definitions[saga['name']])
+            if step.compensation is not None and step.name in saga['results']
+            and step.name not in saga['compensated']
+        ]
+
+    def _compensation_succeeded(self, saga: Dict[str, Any], step: SagaStep):
+        SAGA_COMPENSATIONS.inc(saga['name'], step.name, 'success')
+        self.store.update(saga['id'], event=(step.name, 'compensated', None), compensated=saga['compensated'],
+                          lease_until=time.time() + self.lease)
+
+    def _compensation_failed(self, saga: Dict[str, Any], step: SagaStep, error: Exception):
+        SAGA_COMPENSATIONS.inc(saga['name'], step.name, 'error')
+        attempts = saga['attempts'] + 1
+        detail = {'message': str(error) or type(error).__name__, 'attempt': attempts}
+
+        if attempts >= self.max_compensation_attempts:
+            logger.error("Saga %s: bỏ cuộc bù trừ bước %s sau %s lần: %s", saga['id'], step.name, attempts, error)
+            self.store.update(saga['id'], event=(step.name, COMPENSATION_FAILED, detail),
+                              status=COMPENSATION_FAILED, attempts=attempts, lease_until=0)
+            SAGAS.inc(saga['name'], COMPENSATION_FAILED)
+            return
+
+        delay = min(self.compensation_max_delay, self.compensation_base_delay * 2 ** (attempts - 1))
+        logger.warning("Saga %s: bù trừ bước %s thất bại (lần %s), thử lại sau %.1fs: %s",
+                       saga['id'], step.name, attempts, delay, error)
+        self.store.update(saga['id'], event=(step.name, 'compensation_error', detail), attempts=attempts,
+                          next_attempt_at=time.time() + delay, lease_until=0)
+
+    def _compensation_finished(self, saga: Dict[str, Any]):
+        self.store.update(saga['id'], event=(None, COMPENSATED, None), status=COMPENSATED, lease_until=0)
+        SAGAS.inc(saga['name'], COMPENSATED)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.store.path,
+            'sagas': self.store.count_by_status()
+        }
+
+def create_saga_orchestrator() -> SagaOrchestrator:
+    """
+    Tạo SagaOrchestrator theo biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_SAGA_DB: File SQLite lưu saga, dùng chung giữa các worker
+            (mặc định instance/gateway_sagas.db ở thư mục gốc dự án)
+        GATEWAY_SAGA_LEASE: Thời gian (giây) trước khi saga của worker không phản hồi được nhận lại (mặc định 60)
+        GATEWAY_SAGA_COMPENSATION_ATTEMPTS: Số lần thử bù trừ tối đa (mặc định 20)
+        GATEWAY_SAGA_DEFERRED_ATTEMPTS: Số lần thử bước deferred tối đa (mặc định 20)
+        GATEWAY_SAGA_RETENTION_DAYS: Số ngày giữ saga đã kết thúc (mặc định 7)
+    """
+    default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'instance', 'gateway_sagas.db')
+    store = SagaStore(os.environ.get('GATEWAY_SAGA_DB', default_path))
+    return SagaOrchestrator(
+        store,
+        lease=float(os.environ.get('GATEWAY_SAGA_LEASE', 60)),
+        max_compensation_attempts=int(os.environ.get('GATEWAY_SAGA_COMPENSATION_ATTEMPTS', 20)),
+        max_deferred_attempts=int(os.environ.get('GATEWAY_SAGA_DEFERRED_ATTEMPTS', 20)),
+        retention=float(os.environ.get('GATEWAY_SAGA_RETENTION_DAYS', 7)) * 86400
+    )
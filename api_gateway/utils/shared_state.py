@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SharedStateStore:
+    """
+    Kho trạng thái dùng chung giữa các worker gunicorn trên cùng một host,
+    lưu trong một file SQLite (WAL) làm vai trò thay thế cho Redis.
+
+    - counters: bộ đếm cộng dồn nguyên tử (UPSERT value = value + delta), có hạn dùng
+    - states: giá trị JSON theo key, kèm thời điểm cập nhật
+    - responses: response đã cache của gateway (SharedResponseCache)
+    - idempotency: kết quả/request đang xử lý theo Idempotency-Key (SharedIdempotencyStore)
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 2.0):
+        """
+        Args:
+            path: Đường dẫn file SQLite dùng chung
+            busy_timeout: Thời gian (giây) chờ khi file đang bị worker khác khoá
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS counters ('
+                'key TEXT PRIMARY KEY, value REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS states ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, body BLOB NOT NULL, status INTEGER NOT NULL, mimetype TEXT, '
+                'headers TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS idempotency ('
+                'key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, token TEXT NOT NULL, '
+                'status INTEGER, body BLOB, mimetype TEXT, headers TEXT, expires_at REAL NOT NULL)'
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Kết nối SQLite riêng cho từng thread (và từng process sau khi fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add_counters(self, deltas: Dict[str, float], ttl: float,
+                     read_keys: Iterable[str] = ()) -> Dict[str, float]:
+        """
+        Cộng nhiều bộ đếm trong một transaction và đọc lại giá trị mới.
+
+        Args:
+            deltas: Mapping key -> giá trị cần cộng thêm
+            ttl: Thời gian sống (giây) của các bộ đếm được ghi
+            read_keys: Các key chỉ cần đọc (không cộng)
+
+        Returns:
+            Mapping key -> giá trị hiện tại (0 nếu key chưa tồn tại)
+        """
+        now = time.time()
+        keys = list(deltas.keys()) + [key for key in read_keys if key not in deltas]
+        conn = self._connection()
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = value + excluded.value, expires_at = excluded.expires_at',
+                [(key, delta, now + ttl) for key, delta in deltas.items()]
+            )
+            values = {key: 0.0 for key in keys}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, value FROM counters WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                values.update(dict(rows))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return values
+
+    def set_state(self, key: str, value: dict):
+        """Ghi một giá trị trạng thái (JSON)"""
+        self._connection().execute(
+            'INSERT INTO states (key, value, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+            (key, json.dumps(value), time.time())
+        )
+
+    def get_states(self, prefix: str, since: float = 0) -> List[Tuple[str, dict, float]]:
+        """
+        Đọc các trạng thái có key bắt đầu bằng prefix và được cập nhật sau since.
+
+        Returns:
+            Danh sách (key, value, updated_at)
+        """
+        rows = self._connection().execute(
+            'SELECT key, value, updated_at FROM states WHERE key LIKE ? AND updated_at > ?',
+            (prefix + '%', since)
+        ).fetchall()
+        return [(key, json.loads(value), updated_at) for key, value, updated_at in rows]
+
+    def transaction(self):
+        """
+        Transaction ghi (BEGIN IMMEDIATE) trên kết nối của thread hiện tại, dùng với with:
+        commit khi khối lệnh xong, rollback nếu có exception.
+        """
+        return _Transaction(self._connection())
+
+    def query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        """Chạy một câu SELECT ngoài transaction"""
+        return self._connection().execute(sql, tuple(params)).fetchall()
+
+    def purge_expired(self):
+        """Xoá các bộ đếm, response cache và kết quả idempotency đã hết hạn"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('DELETE FROM counters WHERE expires_at < ?', (now,))
+        conn.execute('DELETE FROM responses WHERE expires_at < ?', (now,))
+        conn.execute('DELETE FROM idempotency WHERE expires_at < ?', (now,))
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        return False
+
+class SharedStateSyncer:
+    """
+    Thread nền đồng bộ trạng thái cục bộ với SharedStateStore theo chu kỳ,
+    để đường xử lý request chỉ thao tác trên bộ nhớ.
+    Thread được khởi động lười trong từng process, nên an toàn khi gunicorn fork worker.
+    """
+
+    def __init__(self, store: SharedStateStore, interval: float = 0.05, purge_interval: float = 60):
+        """
+        Args:
+            store: Kho trạng thái dùng chung
+            interval: Chu kỳ đồng bộ (giây)
+            purge_interval: Chu kỳ dọn bộ đếm hết hạn (giây)
+        """
+        self.store = store
+        self.interval = interval
+        self.purge_interval = purge_interval
+        self._jobs: List[Callable] = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def register(self, job: Callable):
+        """Đăng ký một hàm đồng bộ, được gọi mỗi chu kỳ"""
+        with self._lock:
+            self._jobs.append(job)
+
+    def ensure_started(self):
+        """Khởi động thread đồng bộ nếu process hiện tại chưa có"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='shared-state-sync', daemon=True)
+            thread.start()
+
+    def _run(self):
+        last_purge = time.time()
+        while True:
+            time.sleep(self.interval)
+
+            for job in list(self._jobs):
+                try:
+                    job()
+                except Exception as e:
+                    logger.error("Lỗi khi đồng bộ trạng thái dùng chung: %s", e)
+
+            if time.time() - last_purge >= self.purge_interval:
+                last_purge = time.time()
+                try:
+                    self.store.purge_expired()
+                except Exception as e:
+                    logger.error("Lỗi khi dọn bộ đếm hết hạn: %s", e)
+
+def share_circuit_breakers(registry, syncer: SharedStateSyncer):
+    """
+    Chia sẻ trạng thái các Circuit Breaker giữa các worker.
+
+    Khi breaker của một worker mở hoặc đóng, trạng thái được ghi vào store;
+    các worker khác đọc lại trong chu kỳ đồng bộ kế tiếp và áp dụng theo,
+    nên một upstream lỗi chỉ cần bị phát hiện một lần trên cả host.
+
+    Args:
+        registry: CircuitBreakerRegistry cần chia sẻ
+        syncer: SharedStateSyncer dùng để đọc trạng thái từ các worker khác
+    """
+    store = syncer.store
+    applying = threading.local()
+    last_seen = {'updated_at': time.time()}
+
+    def publish(name, old_state, new_state):
+        # Không ghi ngược lại trạng thái vừa nhận từ worker khác
+        if getattr(applying, 'active', False):
+            return
+        syncer.ensure_started()
+        breaker = registry.get(name)
+        store.set_state(f"cb:{name}", {
+            'state': new_state,
+            'opened_at': breaker.opened_at,
+            'pid': os.getpid()
+        })
+
+    def pull():
+        states = store.get_states('cb:', since=last_seen['updated_at'])
+        for key, value, updated_at in states:
+            last_seen['updated_at'] = max(last_seen['updated_at'], updated_at)
+            if value.get('pid') == os.getpid():
+                continue
+
+            applying.active = True
+            try:
+                registry.get(key[len('cb:'):]).apply_shared_state(value['state'], value['opened_at'])
+            finally:
+                applying.active = False
+
+    registry.add_listener(publish)
+    syncer.register(pull)
+
+def create_shared_state_syncer() -> Optional[SharedStateSyncer]:
+    """
+    Tạo SharedStateSyncer nếu được bật qua biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_SHARED_STATE_PATH: File SQLite dùng chung giữa các worker (không đặt = tắt)
+        GATEWAY_SHARED_STATE_SYNC_INTERVAL: Chu kỳ đồng bộ, giây (mặc định 0.05)
+
+    Khi bật, rate limiter, circuit breaker, response cache và idempotency store
+    của gateway dùng chung file này giữa các worker.
+    """
+    path = os.environ.get('GATEWAY_SHARED_STATE_PATH')
+    if not path:
+        return None
+
+    store = SharedStateStore(path)
+    return SharedStateSyncer(store, interval=float(os.environ.get('GATEWAY_SHARED_STATE_SYNC_INTERVAL', 0.05)))
+
+# Syncer dùng chung cho rate limiter, circuit breaker, cache và idempotency (None nếu không bật)
+_syncer = create_shared_state_syncer()
@@ -0,0 +1,144 @@
+import os
+import asyncio
+import threading
+import logging
+from typing import Callable, Dict, Any, Hashable, Optional
+from common.metrics import _registry as _metrics
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """Một lần gọi đang chạy, được chia sẻ cho các request trùng lặp"""
+    __slots__ = ('done', 'result', 'exception', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Gộp các lần gọi trùng nhau đang chạy đồng thời thành một.
+    Request đầu tiên với một key thực hiện lời gọi; các request cùng key đến
+    trong lúc đó chờ và nhận chung kết quả (hoặc exception) của lời gọi đó.
+    Chỉ nên dùng cho các thao tác idempotent (GET).
+    do() dùng cho gateway đồng bộ (mỗi request một thread), do_async() cho gateway
+    async (các request là task trên cùng event loop).
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key: Hashable, func: Callable) -> Any:
+        """
+        Thực hiện func, hoặc chờ lời gọi cùng key đang chạy.
+
+        Args:
+            key: Định danh của lời gọi (ví dụ: service, method, path, params)
+            func: Function thực hiện lời gọi
+
+        Returns:
+            Kết quả của func (dùng chung giữa các request trùng)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.collapsed += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.debug("Single-flight: %s request dùng chung kết quả của %s", call.waiters, key)
+
+    async def do_async(self, key: Hashable, func: Callable) -> Any:
+        """Như do() nhưng func là coroutine function; request trùng chờ kết quả mà không chặn event loop"""
+        with self._lock:
+            future = self._async_calls.get(key)
+            if future is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            # shield: request chờ bị huỷ (client ngắt) không huỷ lời gọi dùng chung
+            return await asyncio.shield(future)
+
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            # Leader tự raise exception này: tránh cảnh báo "exception was never retrieved" khi không ai chờ
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._async_calls[key]
+            if not future.done():
+                # Leader bị huỷ: các request chờ cũng nhận CancelledError thay vì chờ mãi
+                future.cancel()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Số lời gọi thực sự, số request được gộp và số key đang chạy"""
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._calls) + len(self._async_calls)
+            }
+
+# Singleton instance của SingleFlight
+_single_flight = SingleFlight()
+
+def _collect_single_flight_stats():
+    stats = _single_flight.get_stats()
+    return [
+        ('gateway_single_flight_in_flight', 'gauge', 'Số key single-flight đang chạy',
+         [({}, stats['in_flight'])]),
+        ('gateway_single_flight_total', 'counter', 'Số lời gọi single-flight theo kết quả',
+         [({'result': name}, stats[name]) for name in ('executed', 'collapsed')])
+    ]
+
+_metrics.add_collector(_collect_single_flight_stats)
+
+# Gộp các GET giống nhau đang chạy đồng thời thành một upstream call (GATEWAY_SINGLE_FLIGHT=0 để tắt)
+SINGLE_FLIGHT_ENABLED = os.environ.get('GATEWAY_SINGLE_FLIGHT', '1') == '1'
+
+def flight_key(service: str, method: str, path: str, kwargs: Dict[str, Any]) -> Optional[Hashable]:
+    """Key single-flight của một upstream call, None nếu lời gọi không được gộp (không phải GET, có body)"""
+    if not SINGLE_FLIGHT_ENABLED or method != 'GET' or 'json' in kwargs:
+        return None
+    params = kwargs.get('params') or {}
+    return (service, path, tuple(sorted(params.items())))
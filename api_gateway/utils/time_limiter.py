@@ -1,8 +1,13 @@
 import threading
+import asyncio
+import contextvars
 import time
 import logging
-from typing import Callable, Any
+from typing import Callable, Any, Dict, Optional, Tuple
 import functools
+from requests.exceptions import Timeout as RequestsTimeout
+from urllib3.exceptions import ReadTimeoutError
+from common.metrics import _registry as _metrics
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +17,141 @@ class TimeoutException(Exception):
         self.timeout = timeout
         super().__init__(f"Function đã chạy quá thời gian giới hạn ({timeout} giây)")
 
+# Deadline (theo time.monotonic) của time_limit đang bao quanh code hiện tại.
+# Dùng contextvars để deadline đi theo cả các task/thread được chạy với copy_context().
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('time_limit_deadline', default=None)
+
+class TimeLimitStats:
+    """Bộ đếm thống kê cho time_limit"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.abandoned = 0
+        self.in_flight = 0
+    
+    def incr(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'started': self.started,
+                'completed': self.completed,
+                'timed_out': self.timed_out,
+                'abandoned': self.abandoned,
+                'in_flight': self.in_flight
+            }
+
+_stats = TimeLimitStats()
+
+def get_time_limit_stats() -> Dict[str, int]:
+    """
+    Thống kê của time_limit.
+    
+    Returns:
+        Dict gồm started, completed, timed_out, in_flight và abandoned
+        (số thao tác không tôn trọng deadline, chạy xong sau hạn và bị bỏ kết quả)
+    """
+    return _stats.snapshot()
+
+def _collect_time_limit_stats():
+    stats = _stats.snapshot()
+    return [
+        ('gateway_time_limit_in_flight', 'gauge', 'Số thao tác đang chạy trong time_limit',
+         [({}, stats['in_flight'])]),
+        ('gateway_time_limit_total', 'counter', 'Số thao tác time_limit theo kết quả',
+         [({'result': name}, stats[name]) for name in ('started', 'completed', 'timed_out', 'abandoned')])
+    ]
+
+_metrics.add_collector(_collect_time_limit_stats)
+
+def remaining_time() -> Optional[float]:
+    """
+    Thời gian (giây) còn lại trước deadline hiện tại, None nếu không có time_limit nào.
+    
+    Raises:
+        TimeoutException: Nếu deadline đã qua
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutException(0)
+    return remaining
+
+def io_timeout(connect_timeout: float = 2.0) -> Optional[Tuple[float, float]]:
+    """
+    Timeout (connect, read) cho requests, tính theo deadline hiện tại.
+    
+    Read timeout của requests giới hạn từng lần đọc socket chứ không phải tổng
+    thời gian, nên chỉ đủ cho tới khi nhận xong header; body cần được đọc bằng
+    read_body() để deadline áp dụng cho cả response.
+    
+    Args:
+        connect_timeout: Thời gian tối đa (giây) để mở kết nối
+        
+    Returns:
+        Tuple (connect, read) hoặc None nếu không có time_limit nào đang áp dụng
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return None
+    return (min(connect_timeout, remaining), remaining)
+
+def read_body(response, chunk_size: int = 64 * 1024):
+    """
+    Đọc body của response requests (gửi với stream=True) theo deadline hiện tại.
+    
+    Trước mỗi lần đọc, timeout của socket được đặt bằng thời gian còn lại, nên
+    upstream gửi nhỏ giọt từng byte cũng không giữ được request quá deadline.
+    Hết giờ thì kết nối bị đóng (không trả về pool với body đọc dở). Sau khi
+    đọc xong, response dùng như bình thường (content, json()).
+    
+    Raises:
+        TimeoutException: Nếu deadline qua trước khi đọc hết body
+    """
+    raw = response.raw
+    sock = getattr(getattr(raw, '_connection', None), 'sock', None)
+    # urllib3 2.x có read1: trả về ngay khi có dữ liệu, không chờ đủ chunk_size
+    read = getattr(raw, 'read1', None) or raw.read
+    chunks = []
+    try:
+        while True:
+            remaining = remaining_time()
+            if sock is not None and remaining is not None:
+                sock.settimeout(remaining)
+            chunk = read(chunk_size, decode_content=True)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except (ReadTimeoutError, TimeoutError) as e:
+        response.close()
+        raise TimeoutException(0) from e
+    except BaseException:
+        response.close()
+        raise
+    
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+    response.close()
+
 def time_limit(function: Callable, seconds: int = 10) -> Any:
     """
     Thực hiện một function với giới hạn thời gian.
     
+    Function chạy ngay trên thread hiện tại với một deadline. Các thao tác I/O
+    hỗ trợ deadline (UpstreamClient dùng io_timeout() và read_body()) đặt timeout
+    trên socket theo thời gian còn lại trước mỗi lần đọc, nên bị huỷ thật sự khi
+    hết giờ, không để lại thread hay kết nối chạy ngầm. Function không tôn trọng
+    deadline vẫn chạy đến hết nhưng kết quả bị bỏ và được đếm là abandoned.
+    
     Args:
         function: Function cần chạy
         seconds: Thời gian giới hạn (giây)
@@ -26,42 +162,57 @@ def time_limit(function: Callable, seconds: int = 10) -> Any:
     Raises:
         TimeoutException: Nếu function chạy quá thời gian quy định
     """
-    result = None
-    exception = None
-    finished = False
-    
-    # Function sẽ chạy trong thread riêng
-    def target():
-        nonlocal result, exception, finished
-        try:
-            result = function()
-        except Exception as e:
-            exception = e
-        finally:
-            finished = True
-    
-    # Tạo và chạy thread
-    thread = threading.Thread(target=target)
-    thread.daemon = True  # Thread sẽ kết thúc khi main thread kết thúc
-    
-    start_time = time.time()
-    thread.start()
-    
-    # Chờ thread hoàn thành hoặc hết thời gian
-    thread.join(seconds)
-    
-    # Kiểm tra kết quả
-    if not finished:
-        elapsed = time.time() - start_time
-        logger.warning(f"Function timeout after {elapsed:.2f} seconds (limit: {seconds}s)")
-        raise TimeoutException(seconds)
+    start_time = time.monotonic()
+    deadline = start_time + seconds
+    
+    # time_limit lồng nhau: giữ deadline chặt hơn
+    parent_deadline = _deadline.get()
+    if parent_deadline is not None and parent_deadline < deadline:
+        deadline = parent_deadline
     
-    # Nếu có exception xảy ra trong thread, ném lại
-    if exception is not None:
-        raise exception
+    token = _deadline.set(deadline)
+    _stats.incr(started=1, in_flight=1)
     
+    try:
+        result = function()
+    except (RequestsTimeout, TimeoutError, TimeoutException) as e:
+        elapsed = time.monotonic() - start_time
+        logger.warning("Function timeout after %.2f seconds (limit: %ss)", elapsed, seconds)
+        _stats.incr(timed_out=1)
+        raise TimeoutException(seconds) from e
+    finally:
+        _deadline.reset(token)
+        _stats.incr(in_flight=-1)
+    
+    # Function không dừng đúng hạn: không thể huỷ, chỉ có thể bỏ kết quả
+    now = time.monotonic()
+    if now > deadline:
+        elapsed = now - start_time
+        logger.warning("Function overran its deadline after %.2f seconds (limit: %ss), result discarded", elapsed, seconds)
+        _stats.incr(timed_out=1, abandoned=1)
+        raise TimeoutException(seconds)
+    
+    _stats.incr(completed=1)
     return result
 
+async def async_time_limit(function: Callable, seconds: int = 10) -> Any:
+    """
+    Thực hiện một coroutine function với giới hạn thời gian.
+    Khác với time_limit, coroutine bị huỷ thật sự khi hết thời gian.
+    
+    Args:
+        function: Coroutine function cần chạy
+        seconds: Thời gian giới hạn (giây)
+        
+    Raises:
+        TimeoutException: Nếu coroutine chạy quá thời gian quy định
+    """
+    try:
+        return await asyncio.wait_for(function(), timeout=seconds)
+    except asyncio.TimeoutError:
+        logger.warning("Coroutine timeout (limit: %ss)", seconds)
+        raise TimeoutException(seconds)
+
 class TimeLimiter:
     """
     Class decorator để áp dụng giới hạn thời gian cho các method.
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Các path nội bộ của gateway, không ghi lại
+EXCLUDED_PREFIXES = ('/health', '/metrics', '/stats', '/traces', '/static')
+
+class TrafficRecorder:
+    """
+    Ghi lại các request vào gateway thành file JSON lines để phát lại (replay).
+    Mỗi dòng gồm thời điểm, method, path, body, client, status và thời gian xử lý.
+    Request chỉ đưa bản ghi vào hàng đợi; thread nền ghi file theo lô.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_body_bytes: int = 65536,
+                 max_queue: int = 10000):
+        """
+        Args:
+            path: File JSONL ghi traffic
+            sample_rate: Tỉ lệ request được ghi lại (0-1)
+            max_body_bytes: Body lớn hơn sẽ không được lưu (chỉ lưu kích thước)
+            max_queue: Số bản ghi tối đa đang chờ ghi; đầy thì bỏ bản ghi
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self.recorded = 0
+        self.dropped = 0
+
+    def should_record(self, path: str) -> bool:
+        if path.startswith(EXCLUDED_PREFIXES):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, entry: Dict[str, Any]):
+        """Đưa một bản ghi vào hàng đợi ghi file"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def encode_body(self, data: bytes, content_type: Optional[str]) -> Dict[str, Any]:
+        """Body dạng JSON (nếu parse được) hoặc text, kèm kích thước"""
+        if not data:
+            return {}
+        if len(data) > self.max_body_bytes:
+            return {'body_size': len(data), 'body_truncated': True}
+        if content_type and 'json' in content_type:
+            try:
+                return {'json': json.loads(data)}
+            except ValueError:
+                pass
+        return {'body': data.decode('utf-8', errors='replace'), 'content_type': content_type}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='traffic-recorder', daemon=True).start()
+
+    def _run(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        while True:
+            entries = [self._queue.get()]
+            while len(entries) < 500:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+                self.recorded += len(entries)
+            except Exception as e:
+                self.dropped += len(entries)
+                logger.error("Lỗi khi ghi traffic: %s", e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'sample_rate': self.sample_rate,
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+            'pending': self._queue.qsize()
+        }
+
+def create_traffic_recorder() -> Optional[TrafficRecorder]:
+    """
+    Tạo TrafficRecorder nếu được bật qua biến môi trường.
+
+    Biến môi trường:
+        GATEWAY_TRAFFIC_RECORD_PATH: File JSONL ghi traffic (không đặt = tắt)
+        GATEWAY_TRAFFIC_SAMPLE_RATE: Tỉ lệ request được ghi, 0-1 (mặc định 1)
+        GATEWAY_TRAFFIC_MAX_BODY_BYTES: Kích thước body tối đa được lưu (mặc định 65536)
+    """
+    path = os.environ.get('GATEWAY_TRAFFIC_RECORD_PATH')
+    if not path:
+        return None
+    return TrafficRecorder(
+        path,
+        sample_rate=float(os.environ.get('GATEWAY_TRAFFIC_SAMPLE_RATE', 1)),
+        max_body_bytes=int(os.environ.get('GATEWAY_TRAFFIC_MAX_BODY_BYTES', 65536))
+    )
+
+# Recorder dùng chung (None nếu không bật)
+_traffic_recorder = create_traffic_recorder()
+
+def record_traffic(app, recorder: Optional[TrafficRecorder] = None):
+    """
+    Ghi lại các request của một Flask app bằng TrafficRecorder.
+
+    Args:
+        app: Flask app
+        recorder: Recorder sử dụng, mặc định là recorder dùng chung (không làm gì nếu None)
+    """
+    from flask import g, request
+
+    recorder = recorder or _traffic_recorder
+    if recorder is None:
+        return
+
+    @app.before_request
+    def _start_recording():
+        if recorder.should_record(request.path):
+            g.traffic_start = (time.time(), time.perf_counter())
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('traffic_start', None)
+        if start is None:
+            return response
+
+        entry = {
+            'ts': start[0],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'route': request.url_rule.rule if request.url_rule else None,
+            'client': request.remote_addr,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - start[1]) * 1000, 3)
+        }
+        headers = {name: request.headers[name] for name in ('Idempotency-Key', 'Prefer') if name in request.headers}
+        if headers:
+            entry['headers'] = headers
+        entry.update(recorder.encode_body(request.get_data(cache=True), request.content_type))
+        recorder.record(entry)
+        return response
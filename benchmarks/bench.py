@@ -0,0 +1,466 @@
+"""
+Benchmark tải cho API Gateway.
+
+Khởi động (tuỳ chọn) gateway và ba service trên một bản sao tạm của repo, tạo
+tải theo tỉ lệ các kịch bản (xem sản phẩm, đặt hàng, tra cứu đơn) ở chế độ
+open-loop (số request/giây cố định) hoặc closed-loop (số client cố định), rồi
+báo cáo throughput và p50/p95/p99 theo route và theo upstream.
+
+Ví dụ:
+
+    # Tự khởi động stack, closed-loop 16 client trong 30 giây
+    python benchmarks/bench.py --start-stack --mode closed --concurrency 16 --duration 30
+
+    # Open-loop 200 req/s vào gateway đang chạy, lưu kết quả
+    python benchmarks/bench.py --mode open --rate 200 --output benchmarks/results/after.json
+
+    # So sánh hai lần chạy (exit code 1 nếu p95/p99 chậm hơn quá ngưỡng)
+    python benchmarks/bench.py --compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = {
+    'payment': ('payment_service/app.py', 8001),
+    'inventory': ('inventory_service/app.py', 8002),
+    'shipping': ('shipping_service/app.py', 8003),
+}
+
+DEFAULT_MIX = 'browse=70,order=10,track=20'
+
+def percentile(sorted_values, p):
+    """Percentile p (0-100) theo nearest-rank của danh sách đã sắp xếp"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p * len(sorted_values) / 100) - 1))
+    return sorted_values[index]
+
+class Stack:
+    """Chạy gateway và ba service trên một bản sao tạm của repo (không đụng database thật)"""
+
+    def __init__(self, gateway_port=5000, gunicorn_workers=0, env=None):
+        self.gateway_port = gateway_port
+        self.gunicorn_workers = gunicorn_workers
+        self.env = dict(os.environ, **(env or {}))
+        self.workdir = None
+        self.processes = []
+
+    def start(self):
+        self.workdir = tempfile.mkdtemp(prefix='bench-stack-')
+        shutil.copytree(ROOT, os.path.join(self.workdir, 'repo'),
+                        ignore=shutil.ignore_patterns('.git', '__pycache__', 'results', '*.log'))
+        repo = os.path.join(self.workdir, 'repo')
+        log_dir = os.path.join(self.workdir, 'logs')
+        os.makedirs(log_dir)
+
+        for name, (script, port) in SERVICES.items():
+            # Chạy app không qua app.run(debug=True) để tránh reloader
+            command = [sys.executable, '-c',
+                       f"import sys; sys.path.insert(0, '.'); from app import app; "
+                       f"app.run(host='127.0.0.1', port={port}, threaded=True)"]
+            self._spawn(command, os.path.join(repo, os.path.dirname(script)), os.path.join(log_dir, f'{name}.log'))
+
+        gateway_dir = os.path.join(repo, 'api_gateway')
+        if self.gunicorn_workers:
+            command = [sys.executable, '-m', 'gunicorn', '-w', str(self.gunicorn_workers), '--threads', '8',
+                       '-b', f'127.0.0.1:{self.gateway_port}', 'app:app']
+        else:
+            command = [sys.executable, '-c',
+                       f"import sys; sys.path.insert(0, '.'); from app import app; "
+                       f"app.run(host='127.0.0.1', port={self.gateway_port}, threaded=True)"]
+        self._spawn(command, gateway_dir, os.path.join(log_dir, 'gateway.log'))
+
+        self._wait_ready()
+        print(f"Stack đã sẵn sàng (thư mục tạm: {self.workdir})", file=sys.stderr)
+
+    def _spawn(self, command, cwd, log_path):
+        log_file = open(log_path, 'w')
+        self.processes.append(subprocess.Popen(command, cwd=cwd, env=self.env, stdout=log_file,
+                                               stderr=subprocess.STDOUT))
+
+    def _wait_ready(self, timeout=30):
+        urls = [f'http://127.0.0.1:{port}/health' for _, port in SERVICES.values()]
+        urls.append(f'http://127.0.0.1:{self.gateway_port}/health')
+        deadline = time.time() + timeout
+        for url in urls:
+            while True:
+                try:
+                    if requests.get(url, timeout=1).status_code == 200:
+                        break
+                except requests.RequestException:
+                    pass
+                if time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Service không khởi động được: {url}")
+                time.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+class Recorder:
+    """Thu latency và status theo route (mỗi thread ghi list riêng, gộp khi báo cáo)"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+        self.recording = False
+
+    def _buffer(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = []
+            with self._lock:
+                self._buffers.append(buffer)
+        return buffer
+
+    def record(self, route, seconds, status):
+        if self.recording:
+            self._buffer().append((route, seconds, status))
+
+    def summary(self, elapsed):
+        samples = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        errors = defaultdict(int)
+        with self._lock:
+            buffers = list(self._buffers)
+        for buffer in buffers:
+            for route, seconds, status in list(buffer):
+                samples[route].append(seconds)
+                statuses[route][str(status)] += 1
+                if status == 'error' or (isinstance(status, int) and status >= 500):
+                    errors[route] += 1
+
+        routes = {}
+        total = 0
+        for route, values in sorted(samples.items()):
+            values.sort()
+            total += len(values)
+            routes[route] = {
+                'count': len(values),
+                'throughput_rps': round(len(values) / elapsed, 2),
+                'errors': errors[route],
+                'status': dict(statuses[route]),
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3)
+            }
+        return total, routes
+
+class Workload:
+    """Các kịch bản gửi tới gateway"""
+
+    def __init__(self, base_url, recorder, pool_size):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.product_ids = []
+        self.bench_product_id = None
+        self.orders = []
+        self._orders_lock = threading.Lock()
+
+    def call(self, route, method, path, intended_start=None, **kwargs):
+        """Gửi một request; latency tính từ thời điểm dự kiến gửi (tránh coordinated omission)"""
+        start = intended_start if intended_start is not None else time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        self.recorder.record(route, time.perf_counter() - start, status)
+        return response
+
+    def setup(self):
+        response = self.session.get(self.base_url + '/api/products', timeout=10)
+        response.raise_for_status()
+        self.product_ids = [product['id'] for product in response.json()]
+
+        # Sản phẩm riêng cho benchmark, đủ tồn kho để đặt hàng suốt lần chạy
+        response = self.session.post(self.base_url + '/api/products', timeout=10, json={
+            'name': f'Benchmark {int(time.time())}',
+            'description': 'Sản phẩm dùng cho benchmark',
+            'price': 1000,
+            'stock': 10 ** 9
+        })
+        if response.status_code == 201:
+            self.bench_product_id = response.json()['id']
+            self.product_ids.append(self.bench_product_id)
+
+    def browse(self, intended_start=None):
+        self.call('GET /api/products', 'GET', '/api/products', intended_start)
+        if self.product_ids:
+            product_id = random.choice(self.product_ids)
+            self.call('GET /api/products/<id>', 'GET', f'/api/products/{product_id}')
+
+    def order(self, intended_start=None):
+        product_id = self.bench_product_id or (random.choice(self.product_ids) if self.product_ids else 1)
+        response = self.call('POST /api/orders', 'POST', '/api/orders', intended_start, json={
+            'customer_id': f'BENCH-{random.randint(1, 1000)}',
+            'items': [{'product_id': product_id, 'quantity': 1}],
+            'total_amount': 1000,
+            'payment_method': 'credit_card',
+            'shipping_address': 'Benchmark'
+        })
+        if response is not None and response.status_code == 201:
+            body = response.json()
+            with self._orders_lock:
+                self.orders.append((body['payment']['id'], body['shipping']['id']))
+                if len(self.orders) > 1000:
+                    del self.orders[:500]
+
+    def track(self, intended_start=None):
+        with self._orders_lock:
+            order = random.choice(self.orders) if self.orders else None
+        if order is None:
+            return self.browse(intended_start)
+        payment_id, shipping_id = order
+        self.call('GET /api/payments/<id>', 'GET', f'/api/payments/{payment_id}', intended_start)
+        self.call('GET /api/shipping/<id>', 'GET', f'/api/shipping/{shipping_id}')
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - {'browse', 'order', 'track'}
+    if unknown:
+        raise ValueError(f"Kịch bản không hợp lệ: {', '.join(sorted(unknown))}")
+    return weights
+
+def scrape_upstream_histograms(base_url):
+    """Đọc histogram latency upstream từ /metrics của gateway: {service: {le: count}}"""
+    try:
+        text = requests.get(base_url.rstrip('/') + '/metrics', timeout=5).text
+    except requests.RequestException:
+        return {}
+    buckets = defaultdict(lambda: defaultdict(float))
+    for line in text.splitlines():
+        if not line.startswith('gateway_upstream_request_duration_seconds_bucket{'):
+            continue
+        labels, value = line[line.index('{') + 1:].rsplit('} ', 1)
+        fields = dict(item.split('=', 1) for item in labels.split(','))
+        service = fields['service'].strip('"')
+        le = fields['le'].strip('"')
+        buckets[service][float('inf') if le == '+Inf' else float(le)] += float(value)
+    return buckets
+
+def histogram_quantile(q, buckets):
+    """Ước lượng quantile từ histogram tích luỹ (nội suy tuyến tính như Prometheus)"""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if not total:
+        return None
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float('inf'):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+def upstream_summary(before, after):
+    result = {}
+    for service, buckets in after.items():
+        delta = {le: count - before.get(service, {}).get(le, 0) for le, count in buckets.items()}
+        count = delta.get(float('inf'), 0)
+        if not count:
+            continue
+        result[service] = {'count': int(count)}
+        for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            value = histogram_quantile(q, delta)
+            result[service][name] = round(value * 1000, 3) if value is not None else None
+    return result
+
+def run_closed_loop(workload, scenarios, weights, concurrency, end_time):
+    def worker():
+        while time.perf_counter() < end_time:
+            random.choices(scenarios, weights)[0]()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_open_loop(workload, scenarios, weights, rate, concurrency, end_time, poisson):
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    next_time = time.perf_counter()
+    while next_time < end_time:
+        now = time.perf_counter()
+        if next_time > now:
+            time.sleep(next_time - now)
+        scenario = random.choices(scenarios, weights)[0]
+        executor.submit(scenario, next_time)
+        next_time += random.expovariate(rate) if poisson else 1.0 / rate
+    executor.shutdown(wait=True)
+
+def run_benchmark(args):
+    weights = parse_mix(args.mix)
+    stack = None
+    if args.start_stack:
+        env = {
+            # Rate limit của gateway (vài request/phút) sẽ chặn gần hết tải benchmark
+            'GATEWAY_RATE_LIMIT_ENABLED': '1' if args.keep_rate_limits else '0',
+            'LOG_LEVEL': args.log_level,
+            'TRACE_SAMPLE_RATE': os.environ.get('TRACE_SAMPLE_RATE', '0.01')
+        }
+        stack = Stack(gateway_port=int(args.gateway.rsplit(':', 1)[-1].split('/')[0]),
+                      gunicorn_workers=args.gunicorn_workers, env=env)
+        stack.start()
+
+    try:
+        recorder = Recorder()
+        workload = Workload(args.gateway, recorder, pool_size=max(args.concurrency, 10))
+        workload.setup()
+
+        scenario_names = list(weights)
+        scenarios = [getattr(workload, name) for name in scenario_names]
+        scenario_weights = [weights[name] for name in scenario_names]
+
+        def run_for(seconds):
+            end_time = time.perf_counter() + seconds
+            if args.mode == 'open':
+                run_open_loop(workload, scenarios, scenario_weights, args.rate, args.concurrency, end_time,
+                              args.arrival == 'poisson')
+            else:
+                run_closed_loop(workload, scenarios, scenario_weights, args.concurrency, end_time)
+
+        if args.warmup > 0:
+            run_for(args.warmup)
+
+        upstream_before = scrape_upstream_histograms(args.gateway)
+        recorder.recording = True
+        started = time.perf_counter()
+        run_for(args.duration)
+        elapsed = time.perf_counter() - started
+        recorder.recording = False
+        upstream_after = scrape_upstream_histograms(args.gateway)
+
+        total, routes = recorder.summary(elapsed)
+        return {
+            'started_at': datetime.now().isoformat(),
+            'config': {
+                'gateway': args.gateway,
+                'mode': args.mode,
+                'rate': args.rate if args.mode == 'open' else None,
+                'arrival': args.arrival if args.mode == 'open' else None,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'warmup': args.warmup,
+                'mix': weights,
+                'gunicorn_workers': args.gunicorn_workers
+            },
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2),
+            'routes': routes,
+            'upstreams': upstream_summary(upstream_before, upstream_after)
+        }
+    finally:
+        if stack is not None:
+            stack.stop()
+
+def print_report(result):
+    print(f"\n{result['requests']} requests trong {result['elapsed_seconds']}s "
+          f"({result['throughput_rps']} req/s, mode={result['config']['mode']})")
+    print(f"{'route':32} {'count':>7} {'rps':>8} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, stats in result['routes'].items():
+        print(f"{route:32} {stats['count']:>7} {stats['throughput_rps']:>8} {stats['errors']:>5} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+    if result['upstreams']:
+        print(f"\n{'upstream':32} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for service, stats in result['upstreams'].items():
+            print(f"{service:32} {stats['count']:>7} {stats['p50_ms']!s:>9} {stats['p95_ms']!s:>9} {stats['p99_ms']!s:>9}")
+
+def compare(baseline_path, current_path, threshold):
+    """In chênh lệch giữa hai lần chạy; trả về True nếu có route chậm hơn quá ngưỡng (%)"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    regressed = False
+    print(f"Throughput: {baseline['throughput_rps']} -> {current['throughput_rps']} req/s")
+    print(f"{'route':32} {'metric':>7} {'before':>10} {'after':>10} {'change':>9}")
+    for route, stats in current['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            old, new = before[metric], stats[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change > threshold if metric != 'throughput_rps' else change < -threshold
+            flag = '  <-- regression' if worse and metric in ('p95_ms', 'p99_ms', 'throughput_rps') else ''
+            regressed = regressed or bool(flag)
+            print(f"{route:32} {metric[:-3] if metric.endswith('_ms') else 'rps':>7} {old:>10} {new:>10} {change:>8.1f}%{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tải cho API Gateway')
+    parser.add_argument('--gateway', default='http://127.0.0.1:5000', help='URL của gateway')
+    parser.add_argument('--start-stack', action='store_true', help='Tự khởi động gateway và các service')
+    parser.add_argument('--gunicorn-workers', type=int, default=0, help='Chạy gateway bằng gunicorn với N worker')
+    parser.add_argument('--keep-rate-limits', action='store_true', help='Giữ rate limit của gateway khi tự khởi động stack')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL cho stack tự khởi động')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--rate', type=float, default=50, help='Số kịch bản/giây ở chế độ open-loop')
+    parser.add_argument('--arrival', choices=('constant', 'poisson'), default='constant')
+    parser.add_argument('--concurrency', type=int, default=8, help='Số client (closed) hoặc số request đồng thời tối đa (open)')
+    parser.add_argument('--duration', type=float, default=30, help='Thời gian đo (giây)')
+    parser.add_argument('--warmup', type=float, default=5, help='Thời gian làm nóng không tính kết quả (giây)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Tỉ lệ kịch bản (mặc định {DEFAULT_MIX})')
+    parser.add_argument('--output', help='File JSON lưu kết quả')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='So sánh hai file kết quả')
+    parser.add_argument('--threshold', type=float, default=10, help='Ngưỡng regression khi so sánh (%%)')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã lưu kết quả vào {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Phát lại traffic đã ghi bởi gateway (GATEWAY_TRAFFIC_RECORD_PATH) với tốc độ tuỳ chọn.
+
+Khoảng cách thời gian giữa các request được giữ nguyên và chia cho --speed, nên
+hình dạng tải (burst, giờ cao điểm) của capture được tái hiện ở 1x, 10x hoặc 100x.
+
+Ví dụ:
+
+    # Ghi traffic
+    GATEWAY_TRAFFIC_RECORD_PATH=/tmp/traffic.jsonl python api_gateway/app.py
+
+    # Phát lại nhanh gấp 10 lần vào một stack cục bộ mới khởi động
+    python benchmarks/replay.py /tmp/traffic.jsonl --speed 10 --start-stack --output benchmarks/results/replay.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bench import Recorder, Stack, print_report, scrape_upstream_histograms, upstream_summary
+
+def load_capture(path, limit=None):
+    """Đọc capture, sắp theo thời điểm gửi"""
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries[:limit] if limit else entries
+
+def replay(entries, base_url, speed, concurrency, recorder):
+    """
+    Gửi lại các request theo đúng khoảng cách thời gian (chia cho speed).
+
+    Returns:
+        Độ trễ lớn nhất (giây) so với lịch gửi, cho biết máy replay có theo kịp hay không
+    """
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=concurrency))
+    base_url = base_url.rstrip('/')
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    max_lag = 0.0
+
+    def send(entry, intended_start):
+        kwargs = {'headers': dict(entry.get('headers') or {}), 'timeout': 30}
+        if 'json' in entry:
+            kwargs['json'] = entry['json']
+        elif 'body' in entry:
+            kwargs['data'] = entry['body'].encode('utf-8')
+            if entry.get('content_type'):
+                kwargs['headers']['Content-Type'] = entry['content_type']
+        route = f"{entry['method']} {entry.get('route') or entry['path'].split('?')[0]}"
+        try:
+            status = session.request(entry['method'], base_url + entry['path'], **kwargs).status_code
+        except requests.RequestException:
+            status = 'error'
+        recorder.record(route, time.perf_counter() - intended_start, status)
+
+    first_ts = entries[0]['ts']
+    started = time.perf_counter()
+    for entry in entries:
+        if entry.get('body_truncated'):
+            # Body quá lớn nên không được lưu, không thể phát lại chính xác
+            continue
+        intended_start = started + (entry['ts'] - first_ts) / speed
+        now = time.perf_counter()
+        if intended_start > now:
+            time.sleep(intended_start - now)
+        else:
+            max_lag = max(max_lag, now - intended_start)
+        executor.submit(send, entry, intended_start)
+
+    executor.shutdown(wait=True)
+    return max_lag
+
+def main():
+    parser = argparse.ArgumentParser(description='Phát lại traffic đã ghi của gateway')
+    parser.add_argument('capture', help='File JSONL do gateway ghi (GATEWAY_TRAFFIC_RECORD_PATH)')
+    parser.add_argument('--gateway', default='http://127.0.0.1:5000', help='URL của gateway')
+    parser.add_argument('--speed', type=float, default=1, help='Hệ số tốc độ (1, 10, 100, ...)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Số request đồng thời tối đa')
+    parser.add_argument('--limit', type=int, help='Chỉ phát lại N request đầu tiên')
+    parser.add_argument('--start-stack', action='store_true', help='Tự khởi động gateway và các service')
+    parser.add_argument('--keep-rate-limits', action='store_true', help='Giữ rate limit của gateway khi tự khởi động stack')
+    parser.add_argument('--output', help='File JSON lưu kết quả')
+    args = parser.parse_args()
+
+    entries = load_capture(args.capture, args.limit)
+    if not entries:
+        print("Capture không có request nào", file=sys.stderr)
+        sys.exit(1)
+
+    span = entries[-1]['ts'] - entries[0]['ts']
+    print(f"Phát lại {len(entries)} request ({span:.1f}s gốc, ~{span / args.speed:.1f}s ở {args.speed}x)",
+          file=sys.stderr)
+
+    stack = None
+    if args.start_stack:
+        stack = Stack(gateway_port=int(args.gateway.rsplit(':', 1)[-1].split('/')[0]), env={
+            'GATEWAY_RATE_LIMIT_ENABLED': '1' if args.keep_rate_limits else '0',
+            'LOG_LEVEL': 'WARNING',
+            'TRACE_SAMPLE_RATE': os.environ.get('TRACE_SAMPLE_RATE', '0.01')
+        })
+        stack.start()
+
+    try:
+        recorder = Recorder()
+        recorder.recording = True
+        upstream_before = scrape_upstream_histograms(args.gateway)
+        started = time.perf_counter()
+        max_lag = replay(entries, args.gateway, args.speed, args.concurrency, recorder)
+        elapsed = time.perf_counter() - started
+        upstream_after = scrape_upstream_histograms(args.gateway)
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    total, routes = recorder.summary(elapsed)
+    result = {
+        'started_at': datetime.now().isoformat(),
+        'config': {
+            'gateway': args.gateway,
+            'mode': f'replay x{args.speed:g}',
+            'capture': os.path.abspath(args.capture),
+            'speed': args.speed,
+            'concurrency': args.concurrency
+        },
+        'elapsed_seconds': round(elapsed, 3),
+        'max_schedule_lag_ms': round(max_lag * 1000, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+        'routes': routes,
+        'upstreams': upstream_summary(upstream_before, upstream_after)
+    }
+
+    print_report(result)
+    print(f"Độ trễ lớn nhất so với lịch gửi: {result['max_schedule_lag_ms']} ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Đã lưu kết quả vào {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Các module dùng chung giữa API Gateway và các service: metrics Prometheus,
+tracing, cấu hình logging, phân trang theo cursor và export NDJSON.
+"""
@@ -0,0 +1,113 @@
+import os
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from flask import Response, request, stream_with_context
+from sqlalchemy import tuple_
+
+from common.pagination import PaginationError, decode_cursor, encode_cursor, parse_fields, serialize_value
+
+# Số dòng đọc từ database (và ghi ra response) mỗi lần
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+# Field thêm vào mỗi dòng export, truyền lại qua ?cursor= để export tiếp từ sau dòng đó
+CURSOR_FIELD = '_cursor'
+
+def parse_time(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f'{name} phải là thời gian ISO 8601')
+
+def export_rows(session, query, columns: Dict[str, Any], created_at, id_column, args) -> Iterator[Dict[str, Any]]:
+    """
+    Đọc toàn bộ kết quả của query theo thứ tự (created_at, id) tăng dần, từng chunk.
+
+    Mỗi chunk là một câu SELECT riêng lọc theo keyset (created_at, id) > dòng cuối
+    của chunk trước, và transaction đọc được kết thúc ngay sau đó: SQLite của các
+    service không chạy WAL nên một cursor mở suốt thời gian export sẽ chặn mọi
+    commit. Bộ nhớ chỉ giữ một chunk, không phụ thuộc kích thước bảng.
+
+    Tham số được kiểm tra ngay khi gọi (trước khi response bắt đầu), các dòng
+    được đọc khi duyệt iterator trả về.
+
+    Args:
+        session: Session database (db.session)
+        query: Query đã áp dụng các filter
+        columns: {tên field: cột} các field có thể trả về
+        created_at, id_column: Cột dùng làm keyset (cần index (created_at, id))
+        args: Query string của request (since, until, cursor, fields)
+
+    Raises:
+        PaginationError: Tham số không hợp lệ
+    """
+    fields = parse_fields(args.get('fields'), columns)
+    since = parse_time(args.get('since'), 'since')
+    until = parse_time(args.get('until'), 'until')
+    cursor = args.get('cursor')
+    position = decode_cursor(cursor) if cursor else None
+
+    if since:
+        query = query.filter(created_at >= since)
+    if until:
+        query = query.filter(created_at < until)
+    query = query.with_entities(*[columns[name] for name in fields], created_at, id_column)
+
+    def generate():
+        nonlocal position
+        while True:
+            chunk = query
+            if position is not None:
+                chunk = chunk.filter(tuple_(created_at, id_column) > tuple_(*position))
+            rows = chunk.order_by(created_at, id_column).limit(EXPORT_CHUNK_SIZE).all()
+            # Không giữ khoá đọc của SQLite trong lúc chờ client nhận dữ liệu
+            session.rollback()
+
+            for row in rows:
+                item = {name: serialize_value(value) for name, value in zip(fields, row)}
+                item[CURSOR_FIELD] = encode_cursor(row[-2], row[-1])
+                yield item
+
+            if len(rows) < EXPORT_CHUNK_SIZE:
+                return
+            position = (rows[-1][-2], rows[-1][-1])
+
+    return generate()
+
+def ndjson_response(rows: Iterable[Dict[str, Any]]) -> Response:
+    """
+    Stream các dòng dưới dạng NDJSON (mỗi dòng một object JSON), chunked.
+    Nén gzip nếu client gửi Accept-Encoding: gzip; mỗi chunk được flush để
+    client nhận và giải nén được ngay, không phải chờ hết export.
+    """
+    use_gzip = 'gzip' in request.accept_encodings
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None
+
+        def encode(lines):
+            data = ''.join(lines).encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return data
+
+        lines = []
+        for item in rows:
+            lines.append(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n')
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                yield encode(lines)
+                lines = []
+        if lines:
+            yield encode(lines)
+        if compressor is not None:
+            yield compressor.flush()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
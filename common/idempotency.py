@@ -0,0 +1,195 @@
+import time
+import json
+import hashlib
+import functools
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy.exc import IntegrityError
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Độ dài tối đa của Idempotency-Key
+MAX_KEY_LENGTH = 255
+
+class IdempotencyKeys:
+    """
+    Chống trùng request POST theo header Idempotency-Key, lưu trong database của service.
+
+    Model lưu kết quả cần các cột key (khoá chính), request_hash, status_code
+    (None khi request đầu tiên còn đang xử lý), response (JSON) và created_at.
+    Khoá chính bảo đảm chỉ một request (kể cả ở worker khác) giữ được key; request
+    trùng đến sau nhận lại đúng response đã lưu kèm header Idempotent-Replayed.
+
+    Dùng qua decorator idempotent() cho route, hoặc gọi begin()/finish() trực tiếp.
+
+    Request đang xử lý giữ key trong thời gian lease (tính từ created_at). Worker
+    chết giữa chừng để lại bản ghi chưa có status_code; sau khi lease hết, request
+    gửi lại nhận key và được xử lý lại thay vì nhận 409 cho tới hết ttl.
+    """
+
+    def __init__(self, db, model, ttl: timedelta, wait_timeout: float, lease: timedelta):
+        """
+        Args:
+            db: Đối tượng SQLAlchemy của service
+            model: Model lưu kết quả theo key
+            ttl: Thời gian giữ kết quả của một key
+            wait_timeout: Thời gian (giây) request trùng chờ request đầu tiên
+            lease: Thời gian tối đa một request giữ key khi chưa xử lý xong, cần lớn
+                hơn vài lần thời gian xử lý một request
+        """
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lease = lease
+        self._inserts = 0
+
+    def _claimed(self, key, started_at):
+        # Nhớ thời điểm request hiện tại nhận key, để finish() không ghi đè kết quả
+        # khi key đã bị request khác nhận lại sau khi lease hết
+        if 'idempotency_claims' not in g:
+            g.idempotency_claims = {}
+        g.idempotency_claims[key] = started_at
+
+    def begin(self, key, request_hash):
+        """
+        Giữ Idempotency-Key cho request hiện tại.
+
+        Returns:
+            None nếu request hiện tại được xử lý; ngược lại response cần trả về
+            (kết quả đã lưu, 422 nếu key dùng cho nội dung khác, 409 nếu chờ quá lâu)
+        """
+        session = self.db.session
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            record = session.get(self.model, key)
+
+            if record is not None and record.created_at < datetime.now() - self.ttl:
+                session.delete(record)
+                session.commit()
+                record = None
+
+            if record is None:
+                started_at = datetime.now()
+                session.add(self.model(key=key, request_hash=request_hash, created_at=started_at))
+                try:
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    continue
+
+                self._claimed(key, started_at)
+                self._inserts += 1
+                if self._inserts % 100 == 0:
+                    self.model.query.filter(self.model.created_at < datetime.now() - self.ttl).delete()
+                    session.commit()
+                return None
+
+            if record.request_hash != request_hash:
+                return jsonify({'error': 'Idempotency-Key đã được dùng cho một request khác'}), 422
+
+            if record.status_code is not None:
+                response = current_app.response_class(record.response, status=record.status_code,
+                                                      mimetype='application/json')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            if record.created_at < datetime.now() - self.lease:
+                # Request đầu tiên đã chết giữa chừng: nhận lại key. Điều kiện trên
+                # created_at bảo đảm chỉ một request nhận được
+                started_at = datetime.now()
+                taken = self.model.query.filter(
+                    self.model.key == key,
+                    self.model.status_code.is_(None),
+                    self.model.created_at == record.created_at
+                ).update({'created_at': started_at}, synchronize_session=False)
+                session.commit()
+                if taken:
+                    self._claimed(key, started_at)
+                    return None
+                continue
+
+            if time.monotonic() >= deadline:
+                return jsonify({'error': 'Request với Idempotency-Key này vẫn đang được xử lý'}), 409
+
+            # Request đầu tiên vẫn đang xử lý: kết thúc transaction đọc và chờ
+            session.rollback()
+            time.sleep(0.05)
+
+    def lookup(self, key):
+        """
+        Kết quả đã lưu của một key, để tìm lại bản ghi mà request với key đó đã tạo
+        (ví dụ khi bên gọi bị timeout và không biết request đã được xử lý chưa).
+
+        Returns:
+            (record, None) nếu request đã xử lý xong; ngược lại (None, response lỗi):
+            404 nếu service chưa nhận request nào với key này, 409 nếu request còn đang xử lý
+        """
+        record = self.db.session.get(self.model, key)
+        if record is None:
+            return None, (jsonify({'error': f'Không có request nào với Idempotency-Key: {key}'}), 404)
+        if record.status_code is None:
+            return None, (jsonify({'error': 'Request với Idempotency-Key này vẫn đang được xử lý'}), 409)
+        return record, None
+
+    def finish(self, key, body, status_code, **fields):
+        """
+        Lưu kết quả cho Idempotency-Key; lỗi 5xx thì bỏ key để request gửi lại được xử lý lại.
+
+        Args:
+            fields: Giá trị các cột riêng của model (ví dụ id của bản ghi vừa tạo)
+        """
+        session = self.db.session
+        record = session.get(self.model, key)
+        if record is None or record.created_at != g.get('idempotency_claims', {}).get(key):
+            # Lease đã hết và key đã thuộc về request khác
+            return
+        if status_code >= 500:
+            session.delete(record)
+        else:
+            record.status_code = status_code
+            record.response = json.dumps(body)
+            for name, value in fields.items():
+                setattr(record, name, value)
+        session.commit()
+
+    def idempotent(self, record_field: Optional[str] = None) -> Callable:
+        """
+        Decorator cho route POST trả về (body, status code): request có header
+        Idempotency-Key chỉ được xử lý một lần, gửi lại cùng key (kể cả đồng thời)
+        nhận lại đúng response của lần đầu kèm Idempotent-Replayed.
+
+        Args:
+            record_field: Cột của model lưu id của bản ghi vừa tạo (body['id']),
+                để lookup() tìm lại bản ghi theo key
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = request.headers.get(IDEMPOTENCY_HEADER)
+                if not key:
+                    body, status_code = func(*args, **kwargs)
+                    return jsonify(body), status_code
+
+                if len(key) > MAX_KEY_LENGTH:
+                    return jsonify({'error': f'Idempotency-Key dài tối đa {MAX_KEY_LENGTH} ký tự'}), 400
+
+                replay = self.begin(key, hashlib.sha256(request.get_data()).hexdigest())
+                if replay is not None:
+                    return replay
+
+                try:
+                    body, status_code = func(*args, **kwargs)
+                except Exception:
+                    self.finish(key, {}, 500)
+                    raise
+                fields = {record_field: body.get('id')} if record_field else {}
+                self.finish(key, body, status_code, **fields)
+                return jsonify(body), status_code
+
+            return wrapper
+
+        return decorator
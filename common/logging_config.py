@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+# Các thuộc tính chuẩn của LogRecord, không đưa vào phần "extra" của log JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'trace_id'}
+
+class JsonFormatter(logging.Formatter):
+    """Định dạng log thành một dòng JSON"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'service': self.service,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        if getattr(record, 'trace_id', None):
+            entry['trace_id'] = record.trace_id
+        # Các trường truyền qua extra={...}
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DebugSampler(logging.Filter):
+    """Chỉ giữ lại một phần log DEBUG (log nhiều nhất) theo tỉ lệ"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Đưa log vào hàng đợi cho thread nền ghi ra.
+    Thread xử lý request chỉ ghép message; định dạng và I/O do QueueListener làm.
+    Khi hàng đợi đầy thì bỏ log thay vì chặn request.
+    """
+
+    def __init__(self, log_queue: queue.Queue, trace_id: Optional[Callable[[], Optional[str]]] = None):
+        super().__init__(log_queue)
+        self.trace_id = trace_id
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Ghép args ngay (đối tượng trong args có thể thay đổi sau đó), phần còn lại để thread nền làm
+        record.msg = record.getMessage()
+        record.args = None
+        if self.trace_id is not None:
+            record.trace_id = self.trace_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def _stop_listener():
+    """Ghi nốt các log còn trong hàng đợi khi process kết thúc"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def configure_logging(service: str, trace_id: Optional[Callable[[], Optional[str]]] = None) -> logging.Logger:
+    """
+    Cấu hình logging cho một service theo môi trường.
+
+    Mọi log đi qua một hàng đợi có giới hạn tới thread nền (QueueListener), thread
+    này định dạng và ghi ra stdout và/hoặc file, nên I/O ghi log không còn nằm
+    trên đường xử lý request.
+
+    Biến môi trường:
+        LOG_ENV: development hoặc production (mặc định development)
+        LOG_LEVEL: Mức log (mặc định DEBUG ở development, INFO ở production)
+        LOG_FORMAT: text hoặc json (mặc định text ở development, json ở production)
+        LOG_DEBUG_SAMPLE_RATE: Tỉ lệ log DEBUG được giữ, 0-1 (mặc định 1)
+        LOG_DIR: Thư mục ghi file <service>.log (không đặt = không ghi file)
+        LOG_MAX_BYTES: Kích thước tối đa file log trước khi xoay vòng (mặc định 20MB)
+        LOG_STDOUT: Ghi log ra stdout (mặc định 1)
+        LOG_QUEUE_SIZE: Số log tối đa đang chờ ghi (mặc định 10000)
+
+    Args:
+        service: Tên service, dùng trong log JSON và tên file log
+        trace_id: Hàm trả về trace id hiện tại để gắn vào log (tuỳ chọn)
+
+    Returns:
+        Root logger
+    """
+    global _listener
+
+    env = os.environ.get('LOG_ENV', 'development')
+    production = env == 'production'
+    level = os.environ.get('LOG_LEVEL', 'INFO' if production else 'DEBUG').upper()
+    log_format = os.environ.get('LOG_FORMAT', 'json' if production else 'text')
+
+    if log_format == 'json':
+        formatter = JsonFormatter(service)
+    else:
+        formatter = logging.Formatter(f'%(asctime)s [{service}] %(name)s %(levelname)s %(message)s')
+
+    sinks = []
+    if os.environ.get('LOG_STDOUT', '1') == '1':
+        sinks.append(logging.StreamHandler(sys.stdout))
+
+    log_dir = os.environ.get('LOG_DIR')
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+        sinks.append(logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, f"{service}.log"),
+            maxBytes=int(os.environ.get('LOG_MAX_BYTES', 20 * 1024 * 1024)),
+            backupCount=3,
+            encoding='utf-8'
+        ))
+
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+    handler = NonBlockingQueueHandler(log_queue, trace_id=trace_id)
+    handler.addFilter(DebugSampler(float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _stop_listener()
+    _listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    _listener.start()
+
+    return root
+
+atexit.register(_stop_listener)
@@ -0,0 +1,271 @@
+import time
+import threading
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Các mốc (giây) của histogram latency
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Shard:
+    """Giá trị metric do một thread ghi; chỉ thread đó ghi nên không cần khoá"""
+    __slots__ = ('thread', 'values')
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = thread
+        self.values: Dict[tuple, list] = {}
+
+class MetricsRegistry:
+    """
+    Kho metric theo định dạng Prometheus.
+
+    Mỗi thread ghi vào shard riêng (dict thuần, không khoá), nên việc đo trên
+    đường xử lý request gần như không tốn gì. Khi /metrics được gọi, các shard
+    mới được cộng lại; shard của thread đã kết thúc được gộp vào phần tích luỹ.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, '_Metric'] = {}
+        self._collectors: List[Callable] = []
+        self._shards: List[_Shard] = []
+        self._retired: Dict[tuple, list] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[tuple, list]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                # Server tạo thread mới cho mỗi request: thỉnh thoảng gộp shard của thread đã chết
+                if len(self._shards) % 256 == 0:
+                    self._compact()
+            self._local.shard = shard
+        return shard.values
+
+    def _compact(self):
+        """Gộp shard của các thread đã kết thúc vào _retired (gọi khi đang giữ lock)"""
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                _merge(self._retired, shard.values)
+        self._shards = alive
+
+    def register(self, metric: '_Metric') -> '_Metric':
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> 'Counter':
+        return self.register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> 'Histogram':
+        return self.register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector: Callable):
+        """
+        Đăng ký hàm trả về metric tính tại thời điểm scrape (ví dụ số request đang chạy).
+
+        collector() trả về danh sách (name, type, help, [(labels_dict, value), ...])
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _snapshot(self) -> Dict[tuple, list]:
+        with self._lock:
+            self._compact()
+            totals: Dict[tuple, list] = {}
+            _merge(totals, self._retired)
+            for shard in self._shards:
+                # dict() chép nguyên tử dưới GIL, thread chủ vẫn ghi tiếp bình thường
+                _merge(totals, dict(shard.values))
+            return totals
+
+    def render(self) -> str:
+        """Toàn bộ metric theo định dạng text của Prometheus"""
+        totals = self._snapshot()
+        by_metric: Dict[str, List[Tuple[tuple, list]]] = {}
+        for (name, labelvalues), value in totals.items():
+            by_metric.setdefault(name, []).append((labelvalues, value))
+
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labelvalues, value in sorted(by_metric.get(name, []), key=lambda item: item[0]):
+                lines.extend(metric.render(labelvalues, value))
+
+        for collector in list(self._collectors):
+            try:
+                families = collector()
+            except Exception as e:
+                logger.error("Lỗi khi thu thập metric: %s", e)
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, registry: MetricsRegistry, name: str, help_text: str, labelnames: Iterable[str]):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labelvalues: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, labelvalues))
+
+class Counter(_Metric):
+    """Bộ đếm chỉ tăng"""
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount: float = 1):
+        values = self.registry._shard()
+        key = (self.name, tuple(str(value) for value in labelvalues))
+        cell = values.get(key)
+        if cell is None:
+            values[key] = [amount]
+        else:
+            cell[0] += amount
+
+    def render(self, labelvalues: tuple, value: list) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(labelvalues))} {_format_value(value[0])}"]
+
+class Histogram(_Metric):
+    """Histogram với các mốc cố định; lưu số mẫu từng mốc, tổng và số lượng"""
+    type = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames, buckets):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues):
+        values = self.registry._shard()
+        key = (self.name, tuple(str(label) for label in labelvalues))
+        cell = values.get(key)
+        if cell is None:
+            # [đếm theo từng mốc..., +Inf, sum, count]
+            cell = values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self, *labelvalues) -> '_Timer':
+        """Context manager đo thời gian một đoạn code"""
+        return _Timer(self, labelvalues)
+
+    def render(self, labelvalues: tuple, value: list) -> List[str]:
+        labels = self._labels(labelvalues)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-2]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=le))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {value[-1]}")
+        return lines
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'start_time')
+
+    def __init__(self, histogram: Histogram, labelvalues: tuple):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start_time, *self.labelvalues)
+
+def _merge(target: Dict[tuple, list], source: Dict[tuple, list]):
+    for key, value in source.items():
+        cell = target.get(key)
+        if cell is None:
+            target[key] = list(value)
+        else:
+            for index, item in enumerate(value):
+                cell[index] += item
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# Registry dùng chung trong process
+_registry = MetricsRegistry()
+
+REQUESTS = _registry.counter('http_requests_total', 'Số request HTTP đã xử lý', ('route', 'method', 'status'))
+REQUEST_LATENCY = _registry.histogram('http_request_duration_seconds', 'Thời gian xử lý request HTTP', ('route', 'method'))
+DB_QUERY_LATENCY = _registry.histogram('db_query_duration_seconds', 'Thời gian thực thi câu lệnh SQL', ('statement',))
+
+def instrument_app(app, db=None):
+    """
+    Gắn metric vào một Flask app: đếm request, đo latency theo route,
+    đo thời gian câu lệnh SQL (nếu có db) và thêm endpoint GET /metrics.
+
+    Args:
+        app: Flask app
+        db: Đối tượng Flask-SQLAlchemy của service (tuỳ chọn)
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start_time = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start_time = g.pop('metrics_start_time', None)
+        if start_time is not None:
+            route = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.observe(time.perf_counter() - start_time, route, request.method)
+            REQUESTS.inc(route, request.method, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Metric của service theo định dạng Prometheus"""
+        return Response(_registry.render(), mimetype='text/plain; version=0.0.4')
+
+    if db is not None:
+        with app.app_context():
+            instrument_engine(db.engine)
+
+def instrument_engine(engine):
+    """Đo thời gian từng câu lệnh SQL bằng event của SQLAlchemy"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if starts:
+            # Chỉ dùng từ khoá đầu tiên (SELECT/INSERT/...) làm label để không bùng nổ số series
+            DB_QUERY_LATENCY.observe(time.perf_counter() - starts.pop(), statement.split(None, 1)[0].upper())
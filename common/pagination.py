@@ -0,0 +1,121 @@
+import os
+import json
+import base64
+from datetime import datetime, date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# flask/sqlalchemy được import trong hàm: gateway dùng NEXT_CURSOR_HEADER mà không cần SQLAlchemy
+
+# Số dòng mặc định/tối đa mỗi trang của các endpoint danh sách
+DEFAULT_LIMIT = int(os.environ.get('LIST_DEFAULT_LIMIT', 100))
+MAX_LIMIT = int(os.environ.get('LIST_MAX_LIMIT', 1000))
+
+# Header chứa cursor của trang kế tiếp (không có nếu đã hết dữ liệu)
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+class PaginationError(ValueError):
+    """Tham số limit/cursor/fields không hợp lệ (trả về 400)"""
+
+def encode_cursor(created_at: datetime, row_id: Any) -> str:
+    """Cursor là vị trí (created_at, id) của dòng cuối trang, mã hoá base64 cho gọn trong URL"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, TypeError):
+        raise PaginationError('cursor không hợp lệ')
+
+def parse_limit(value: Optional[str]) -> int:
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit phải là số nguyên')
+    if limit <= 0:
+        raise PaginationError('limit phải lớn hơn 0')
+    return min(limit, MAX_LIMIT)
+
+def parse_fields(value: Optional[str], columns: Dict[str, Any]) -> List[str]:
+    """Danh sách field được yêu cầu (mặc định tất cả), theo thứ tự khai báo trong columns"""
+    if not value:
+        return list(columns)
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in columns]
+    if unknown:
+        raise PaginationError(f"Field không hợp lệ: {', '.join(unknown)} (hỗ trợ: {', '.join(columns)})")
+    return [name for name in columns if name in requested]
+
+def serialize_value(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+def paginate(query, columns: Dict[str, Any], created_at, id_column, args,
+             row_hook: Optional[Callable[[Dict[str, Any], Any], None]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Lấy một trang của query theo keyset (created_at, id) giảm dần.
+
+    Trang kế tiếp được lọc bằng WHERE (created_at, id) < cursor thay vì OFFSET,
+    nên chi phí mỗi trang không tăng theo vị trí trang và không bỏ sót/trùng dòng
+    khi có dòng mới được thêm. Chỉ các cột trong fields được SELECT và serialize.
+
+    Args:
+        query: Query đã áp dụng các filter
+        columns: {tên field: cột} các field có thể trả về
+        created_at, id_column: Cột dùng làm keyset (cần index (created_at, id))
+        args: Query string của request (limit, cursor, fields)
+        row_hook: Hàm gọi với (item, id) cho từng dòng, để sửa giá trị không lấy từ database
+
+    Returns:
+        (danh sách dict, cursor của trang kế tiếp hoặc None)
+
+    Raises:
+        PaginationError: Tham số không hợp lệ
+    """
+    from sqlalchemy import tuple_
+
+    limit = parse_limit(args.get('limit'))
+    fields = parse_fields(args.get('fields'), columns)
+
+    cursor = args.get('cursor')
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_at, id_column) < tuple_(cursor_created_at, cursor_id))
+
+    # Lấy thêm một dòng để biết còn trang sau hay không
+    rows = (query
+            .with_entities(*[columns[name] for name in fields], created_at, id_column)
+            .order_by(created_at.desc(), id_column.desc())
+            .limit(limit + 1)
+            .all())
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+
+    items = []
+    for row in rows:
+        item = {name: serialize_value(value) for name, value in zip(fields, row)}
+        if row_hook is not None:
+            row_hook(item, row[-1])
+        items.append(item)
+    return items, next_cursor
+
+def list_response(items: List[Dict[str, Any]], next_cursor: Optional[str]):
+    """Response Flask của endpoint danh sách: body là mảng, cursor trang sau nằm trong header"""
+    from flask import jsonify
+
+    response = jsonify(items)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response, 200
+
+def ensure_indexes(db, *models):
+    """Tạo các index khai báo trên model nếu database đã có bảng từ trước (create_all không thêm index)"""
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
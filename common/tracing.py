@@ -0,0 +1,348 @@
+import os
+import re
+import glob
+import json
+import time
+import queue
+import random
+import tempfile
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Header truyền trace giữa các service (định dạng W3C Trace Context)
+TRACEPARENT_HEADER = 'traceparent'
+# Header trả về cho client để tra cứu trace qua GET /traces/<trace_id>
+TRACE_ID_HEADER = 'X-Trace-Id'
+
+# Span đang hoạt động của request/thread/task hiện tại
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """Một đoạn xử lý có thời gian bắt đầu, thời lượng và span cha"""
+    __slots__ = ('tracer', 'name', 'kind', 'trace_id', 'span_id', 'parent_id', 'sampled',
+                 'attributes', 'start_time', '_start_perf', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, kind: str, trace_id: str,
+                 parent_id: Optional[str], sampled: bool, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start_perf = time.perf_counter()
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Kết thúc span, khôi phục span cha và gửi span cho writer"""
+        duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Kết thúc ở context khác với lúc bắt đầu (ví dụ teardown của request)
+                pass
+            self._token = None
+
+        if not self.sampled:
+            return
+
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'service': self.tracer.service,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start_time,
+            'duration_ms': round(duration_ms, 3),
+            'attributes': self.attributes
+        }
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"
+        self.tracer.writer.write(record)
+
+class SpanWriter:
+    """
+    Ghi span ra file JSON lines bằng thread nền.
+    Đường xử lý request chỉ đưa span vào hàng đợi, không chờ I/O ghi file.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024 * 1024):
+        """
+        Args:
+            directory: Thư mục chứa file span (dùng chung giữa các service trên host)
+            max_bytes: Kích thước tối đa một file trước khi xoay vòng sang .1
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.filename = None
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.dropped = 0
+
+    def write(self, record: Dict[str, Any]):
+        self._ensure_started()
+        self._queue.put(record)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='span-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # Gom các span đang chờ để ghi một lần
+            while len(records) < 500:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(records)
+            except Exception as e:
+                self.dropped += len(records)
+                logger.error("Lỗi khi ghi span: %s", e)
+
+    def _write_batch(self, records: List[Dict[str, Any]]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.filename)
+        if os.path.exists(path) and os.path.getsize(path) > self.max_bytes:
+            os.replace(path, path + '.1')
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records))
+
+class Tracer:
+    """Tạo span, đọc/ghi header traceparent và quyết định sampling"""
+
+    def __init__(self, service: str, writer: SpanWriter, sample_rate: float = 1.0, enabled: bool = True):
+        """
+        Args:
+            service: Tên service ghi vào mỗi span
+            writer: SpanWriter dùng để ghi span
+            sample_rate: Tỉ lệ trace gốc được ghi lại (0-1)
+            enabled: Tắt hẳn tracing khi False
+        """
+        self.writer = writer
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.service = service
+
+    @property
+    def service(self) -> str:
+        return self._service
+
+    @service.setter
+    def service(self, value: str):
+        self._service = value
+        self.writer.filename = f"{value}.jsonl"
+
+    def start_span(self, name: str, kind: str = 'internal', traceparent: Optional[str] = None,
+                   **attributes) -> Span:
+        """
+        Bắt đầu một span và đặt làm span hiện tại.
+
+        Args:
+            name: Tên span (ví dụ: "POST /payments")
+            kind: server, client hoặc internal
+            traceparent: Header traceparent nhận từ service gọi tới (nếu có)
+        """
+        parent = _current_span.get()
+        context = parse_traceparent(traceparent) if traceparent else None
+
+        if context is not None:
+            trace_id, parent_id, sampled = context
+        elif parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            trace_id, parent_id = '%032x' % random.getrandbits(128), None
+            sampled = self.enabled and random.random() < self.sample_rate
+
+        span = Span(self, name, kind, trace_id, parent_id, sampled and self.enabled, attributes)
+        span._token = _current_span.set(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, kind: str = 'internal', **attributes):
+        """Context manager bao một đoạn code bằng span"""
+        span = self.start_span(name, kind, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+        else:
+            span.finish()
+
+def parse_traceparent(value: str):
+    """Tách header traceparent thành (trace_id, parent_span_id, sampled), None nếu sai định dạng"""
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def current_trace_id() -> Optional[str]:
+    """Trace id của span hiện tại (dùng để gắn vào log), None nếu không có"""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Thêm traceparent của span hiện tại vào headers của request gửi đi"""
+    headers = dict(headers or {})
+    span = _current_span.get()
+    if span is not None:
+        headers[TRACEPARENT_HEADER] = span.traceparent
+    return headers
+
+# Trace id theo W3C Trace Context: 32 ký tự hex thường, không phải toàn số 0
+_TRACE_ID_PATTERN = re.compile(r'(?!0{32})[0-9a-f]{32}')
+
+def is_valid_trace_id(trace_id: str) -> bool:
+    return bool(_TRACE_ID_PATTERN.fullmatch(trace_id))
+
+def read_trace(trace_id: str, directory: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Đọc tất cả span của một trace từ các file span trong thư mục, sắp theo thời gian bắt đầu.
+
+    Raises:
+        ValueError: Nếu trace_id không phải trace id hợp lệ (việc quét file tốn kém,
+            chuỗi tuỳ ý còn khớp với dòng của trace khác khi lọc bằng chuỗi)
+    """
+    if not is_valid_trace_id(trace_id):
+        raise ValueError(f"Trace id không hợp lệ: {trace_id!r}")
+    directory = directory or _tracer.writer.directory
+    spans = []
+    for path in glob.glob(os.path.join(directory, '*.jsonl*')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                # Lọc bằng chuỗi trước khi parse JSON để quét file nhanh
+                if trace_id in line:
+                    record = json.loads(line)
+                    if record.get('trace_id') == trace_id:
+                        spans.append(record)
+    spans.sort(key=lambda record: record['start'])
+    return spans
+
+def create_tracer(service: str) -> Tracer:
+    """
+    Tạo Tracer với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        TRACE_ENABLED: Bật/tắt tracing (mặc định 1)
+        TRACE_DIR: Thư mục ghi span, dùng chung giữa các service (mặc định <tmp>/microservice-traces)
+        TRACE_SAMPLE_RATE: Tỉ lệ trace được ghi lại, 0-1 (mặc định 1)
+        TRACE_MAX_BYTES: Kích thước tối đa của một file span (mặc định 50MB)
+    """
+    writer = SpanWriter(
+        os.environ.get('TRACE_DIR', os.path.join(tempfile.gettempdir(), 'microservice-traces')),
+        max_bytes=int(os.environ.get('TRACE_MAX_BYTES', 50 * 1024 * 1024))
+    )
+    return Tracer(
+        service,
+        writer,
+        sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 1)),
+        enabled=os.environ.get('TRACE_ENABLED', '1') == '1'
+    )
+
+# Tracer dùng chung trong process; instrument_tracing đặt lại tên service
+_tracer = create_tracer(os.environ.get('SERVICE_NAME', 'service'))
+
+def instrument_tracing(app, service: str, db=None):
+    """
+    Gắn tracing vào một Flask app: mỗi request là một span server (nối tiếp
+    traceparent nhận được), response có header X-Trace-Id, và mỗi transaction
+    database là một span con (nếu có db).
+
+    Args:
+        app: Flask app
+        service: Tên service ghi vào span
+        db: Đối tượng Flask-SQLAlchemy của service (tuỳ chọn)
+    """
+    from flask import g, request
+
+    _tracer.service = service
+
+    @app.before_request
+    def _start_request_span():
+        g.trace_span = _tracer.start_span(
+            f"{request.method} {request.path}",
+            kind='server',
+            traceparent=request.headers.get(TRACEPARENT_HEADER),
+            route=request.endpoint
+        )
+
+    @app.after_request
+    def _trace_response(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('status', response.status_code)
+            response.headers[TRACE_ID_HEADER] = span.trace_id
+        return response
+
+    @app.teardown_request
+    def _finish_request_span(error=None):
+        span = g.pop('trace_span', None)
+        if span is not None:
+            span.finish(error=error)
+
+    if db is not None:
+        with app.app_context():
+            instrument_engine(db.engine)
+
+def instrument_engine(engine):
+    """Ghi mỗi transaction database (BEGIN đến COMMIT/ROLLBACK) thành một span"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        if _current_span.get() is not None:
+            span = _tracer.start_span('db.transaction', kind='client')
+            # Transaction có thể kết thúc ở context khác, không giữ span ở contextvar
+            _current_span.reset(span._token)
+            span._token = None
+            conn.info['trace_span'] = span
+            conn.info['trace_statements'] = 0
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count_statement(conn, cursor, statement, parameters, context, executemany):
+        if 'trace_span' in conn.info:
+            conn.info['trace_statements'] += 1
+
+    def _end(conn, outcome):
+        span = conn.info.pop('trace_span', None)
+        if span is not None:
+            span.set_attribute('statements', conn.info.pop('trace_statements', 0))
+            span.set_attribute('outcome', outcome)
+            span.finish()
+
+    event.listen(engine, 'commit', lambda conn: _end(conn, 'commit'))
+    event.listen(engine, 'rollback', lambda conn: _end(conn, 'rollback'))
@@ -1,17 +1,35 @@
 import os
+import sys
+import time
 import uuid
 import logging
 import json
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+
+# Package common/ (metrics, tracing, logging, phân trang) nằm ở thư mục gốc dự án;
+# thêm vào sys.path khi service được chạy trực tiếp từ thư mục của nó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from flask import Flask, jsonify, request
-from models import Product, InventoryTransaction, db
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+from models import Product, InventoryTransaction, Reservation, ReservationItem, HotStockCheckpoint, db
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing, current_trace_id
+from common.logging_config import configure_logging
+from write_batcher import create_write_batcher
+from hot_stock import create_hot_stock_store
+from common.pagination import PaginationError, ensure_indexes, list_response, paginate
+from common.export import export_rows, ndjson_response
 
-# Cấu hình logging
-logging.basicConfig(level=logging.DEBUG)
+# Cấu hình logging (hàng đợi + thread nền, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
+configure_logging('inventory', trace_id=current_trace_id)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
+# INVENTORY_DATABASE_URL để dùng database khác (ví dụ file SQLite tạm khi chạy test)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('INVENTORY_DATABASE_URL', 'sqlite:///inventory.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Khởi tạo database
@@ -20,6 +38,7 @@ db.init_app(app)
 # Tạo bảng nếu chưa tồn tại
 with app.app_context():
     db.create_all()
+    ensure_indexes(db, Product, InventoryTransaction)
     
     # Thêm dữ liệu mẫu nếu bảng sản phẩm trống
     if Product.query.count() == 0:
@@ -36,24 +55,56 @@ with app.app_context():
         
         db.session.commit()
 
+# Đếm request, đo latency theo route và thời gian câu lệnh SQL, thêm GET /metrics
+instrument_app(app, db)
+
+# Nhận traceparent từ gateway, ghi span cho request và từng transaction database
+instrument_tracing(app, 'inventory', db)
+
+# Gom các thao tác ghi đồng thời vào chung một transaction (group commit)
+_write_batcher = create_write_batcher(app, db)
+
+# Các field có thể chọn bằng ?fields= ở endpoint danh sách
+PRODUCT_FIELDS = {
+    'id': Product.id,
+    'name': Product.name,
+    'price': Product.price,
+    'stock': Product.stock,
+    'description': Product.description,
+    'created_at': Product.created_at
+}
+
+TRANSACTION_FIELDS = {
+    'id': InventoryTransaction.id,
+    'transaction_id': InventoryTransaction.transaction_id,
+    'product_id': InventoryTransaction.product_id,
+    'quantity': InventoryTransaction.quantity,
+    'prev_stock': InventoryTransaction.prev_stock,
+    'new_stock': InventoryTransaction.new_stock,
+    'transaction_type': InventoryTransaction.transaction_type,
+    'created_at': InventoryTransaction.created_at
+}
+
 @app.route('/products', methods=['GET'])
 def get_products():
-    """Lấy danh sách tất cả sản phẩm"""
+    """
+    Lấy danh sách sản phẩm (mới nhất trước), phân trang theo cursor.
+
+    Query: limit, cursor (từ header X-Next-Cursor của trang trước), fields=id,name,...
+    """
     try:
-        products = Product.query.all()
-        result = [{
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'stock': product.stock,
-            'description': product.description,
-            'created_at': product.created_at.isoformat()
-        } for product in products]
+        def overlay_stock(item, product_id):
+            if 'stock' in item:
+                item['stock'] = _hot_stock.get(product_id, item['stock'])
         
-        return jsonify(result), 200
+        result, next_cursor = paginate(Product.query, PRODUCT_FIELDS, Product.created_at, Product.id,
+                                       request.args, row_hook=overlay_stock)
+        return list_response(result, next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy danh sách sản phẩm: {str(e)}")
+        logger.exception("Lỗi khi lấy danh sách sản phẩm: %s", e)
         return jsonify({'error': f'Lỗi khi lấy danh sách sản phẩm: {str(e)}'}), 500
 
 @app.route('/products/<int:product_id>', methods=['GET'])
@@ -69,7 +120,7 @@ def get_product(product_id):
             'id': product.id,
             'name': product.name,
             'price': product.price,
-            'stock': product.stock,
+            'stock': current_stock(product),
             'description': product.description,
             'created_at': product.created_at.isoformat()
         }
@@ -77,7 +128,7 @@ def get_product(product_id):
         return jsonify(result), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy thông tin sản phẩm {product_id}: {str(e)}")
+        logger.exception("Lỗi khi lấy thông tin sản phẩm %s: %s", product_id, e)
         return jsonify({'error': f'Lỗi khi lấy thông tin sản phẩm: {str(e)}'}), 500
 
 @app.route('/products', methods=['POST'])
@@ -115,11 +166,11 @@ def create_product():
             'created_at': product.created_at.isoformat()
         }
         
-        logger.info(f"Đã tạo sản phẩm mới: {product.name}")
+        logger.info("Đã tạo sản phẩm mới: %s", product.name)
         return jsonify(result), 201
         
     except Exception as e:
-        logger.exception(f"Lỗi khi tạo sản phẩm mới: {str(e)}")
+        logger.exception("Lỗi khi tạo sản phẩm mới: %s", e)
         db.session.rollback()
         return jsonify({'error': f'Lỗi khi tạo sản phẩm mới: {str(e)}'}), 500
 
@@ -143,7 +194,11 @@ def update_product(product_id):
         if 'price' in data:
             product.price = data['price']
         if 'stock' in data:
-            product.stock = data['stock']
+            if _hot_stock.is_hot(product_id):
+                # Tồn kho của sản phẩm hot nằm trong bộ nhớ, được ghi xuống database sau
+                _hot_stock.set_stock(product_id, data['stock'], f"ADJ-{uuid.uuid4().hex[:8].upper()}")
+            else:
+                product.stock = data['stock']
         if 'description' in data:
             product.description = data['description']
         
@@ -153,19 +208,180 @@ def update_product(product_id):
             'id': product.id,
             'name': product.name,
             'price': product.price,
-            'stock': product.stock,
+            'stock': current_stock(product),
             'description': product.description,
             'created_at': product.created_at.isoformat()
         }
         
-        logger.info(f"Đã cập nhật sản phẩm: {product.name}")
+        logger.info("Đã cập nhật sản phẩm: %s", product.name)
         return jsonify(result), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi cập nhật sản phẩm {product_id}: {str(e)}")
+        logger.exception("Lỗi khi cập nhật sản phẩm %s: %s", product_id, e)
         db.session.rollback()
         return jsonify({'error': f'Lỗi khi cập nhật sản phẩm: {str(e)}'}), 500
 
+def parse_items(items):
+    """
+    Kiểm tra danh sách {"product_id", "quantity"} trong body.
+
+    Returns:
+        (items, error): items với product_id đã chuyển sang int, hoặc thông báo lỗi
+    """
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or 'product_id' not in item or 'quantity' not in item:
+            return None, 'Các mục phải có product_id và quantity'
+        try:
+            product_id = int(item['product_id'])
+        except (TypeError, ValueError):
+            return None, f"product_id không hợp lệ: {item['product_id']}"
+        if not isinstance(item['quantity'], int) or isinstance(item['quantity'], bool):
+            return None, 'Số lượng phải là số nguyên'
+        parsed.append({'product_id': product_id, 'quantity': item['quantity']})
+    return parsed, None
+
+def requested_quantities(items):
+    """Gộp số lượng theo product_id (một sản phẩm có thể xuất hiện nhiều lần trong giỏ)"""
+    quantities = {}
+    for item in items:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+    return quantities
+
+def load_products(product_ids):
+    """Lấy nhiều sản phẩm bằng một câu SELECT ... WHERE id IN (...)"""
+    if not product_ids:
+        return {}
+    # populate_existing: adjust_stock không đồng bộ identity map, nên luôn đọc lại tồn kho từ database
+    products = Product.query.filter(Product.id.in_(set(product_ids))).execution_options(populate_existing=True)
+    return {product.id: product for product in products}
+
+def adjust_stock(quantities, decrement):
+    """
+    Cộng hoặc trừ tồn kho của nhiều sản phẩm bằng một câu UPDATE ... CASE.
+
+    Khi trừ, điều kiện stock >= số lượng nằm trong WHERE nên việc kiểm tra và trừ
+    là nguyên tử: hai request đồng thời không thể cùng lấy phần hàng cuối, tồn kho
+    không bao giờ âm. Sản phẩm không tồn tại hoặc không đủ hàng không được cập nhật.
+
+    Returns:
+        {product_id: tồn kho mới} của các sản phẩm đã được cập nhật
+    """
+    if not quantities:
+        return {}
+    delta = case(quantities, value=Product.id)
+    stmt = update(Product).where(Product.id.in_(list(quantities)))
+    if decrement:
+        stmt = stmt.where(Product.stock >= delta).values(stock=Product.stock - delta)
+    else:
+        stmt = stmt.values(stock=Product.stock + delta)
+    rows = db.session.execute(
+        stmt.returning(Product.id, Product.stock),
+        execution_options={'synchronize_session': False}
+    ).all()
+    return {product_id: stock for product_id, stock in rows}
+
+def unavailable_items(quantities, product_ids):
+    """Mô tả lý do các sản phẩm trong product_ids không trừ được tồn kho"""
+    products = load_products(product_ids)
+    result = []
+    for product_id in product_ids:
+        product = products.get(product_id)
+        result.append({
+            'product_id': product_id,
+            'available': False,
+            'message': 'Sản phẩm không tồn tại' if not product else
+                       f'Không đủ tồn kho (yêu cầu: {quantities[product_id]}, hiện có: {current_stock(product)})'
+        })
+    return result
+
+def insert_transactions(transaction_id, quantities, new_stocks, transaction_type, sign, notes=None):
+    """Ghi giao dịch tồn kho cho nhiều sản phẩm bằng một câu INSERT nhiều dòng"""
+    rows = [{
+        'transaction_id': transaction_id,
+        'product_id': product_id,
+        'quantity': sign * quantities[product_id],
+        'prev_stock': new_stock - sign * quantities[product_id],
+        'new_stock': new_stock,
+        'transaction_type': transaction_type,
+        'notes': notes
+    } for product_id, new_stock in new_stocks.items()]
+    if rows:
+        db.session.execute(insert(InventoryTransaction), rows)
+
+def load_hot_stock(product_ids):
+    """Tồn kho trong database của các sản phẩm hot (khi khởi động HotStockStore)"""
+    with app.app_context():
+        return dict(db.session.query(Product.id, Product.stock).filter(Product.id.in_(product_ids)).all())
+
+def hot_stock_checkpoint():
+    """Seq cuối cùng của journal đã được ghi xuống database"""
+    with app.app_context():
+        checkpoint = db.session.get(HotStockCheckpoint, 1)
+        return checkpoint.last_seq if checkpoint else 0
+
+def persist_hot_stock(records):
+    """
+    Ghi các bản ghi journal của tồn kho trong bộ nhớ xuống database: cộng dồn thay
+    đổi của mỗi sản phẩm vào products.stock, thêm giao dịch tồn kho và cập nhật
+    checkpoint trong cùng một transaction (qua batch ghi).
+    """
+    deltas = {}
+    rows = []
+    for record in records:
+        for product_id, delta, prev_stock, new_stock in record['items']:
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+            if record['type']:
+                rows.append({
+                    'transaction_id': record['tx'],
+                    'product_id': product_id,
+                    'quantity': delta,
+                    'prev_stock': prev_stock,
+                    'new_stock': new_stock,
+                    'transaction_type': record['type'],
+                    'notes': record['notes'],
+                    'created_at': datetime.fromisoformat(record['at'])
+                })
+    
+    def write():
+        adjust_stock({product_id: delta for product_id, delta in deltas.items() if delta}, decrement=False)
+        if rows:
+            db.session.execute(insert(InventoryTransaction), rows)
+        db.session.merge(HotStockCheckpoint(id=1, last_seq=records[-1]['seq']))
+    
+    _write_batcher.submit(write)
+
+# Tồn kho trong bộ nhớ cho các sản phẩm hot (INVENTORY_HOT_PRODUCTS), ghi xuống database sau
+_hot_stock = create_hot_stock_store(
+    load_hot_stock, persist_hot_stock, hot_stock_checkpoint,
+    os.path.join(app.instance_path, 'inventory_hot.journal')
+)
+
+def current_stock(product):
+    """Tồn kho hiện tại; sản phẩm hot lấy từ bộ nhớ vì products.stock có thể chưa được cập nhật"""
+    return _hot_stock.get(product.id, product.stock)
+
+def take_hot_stock(quantities):
+    """
+    Trừ tồn kho trong bộ nhớ của các sản phẩm hot: tất cả hoặc không sản phẩm nào.
+    Không ghi giao dịch tồn kho: bên gọi ghi giao dịch khi thao tác của nó thành công.
+
+    Returns:
+        (tồn kho mới, None) hoặc (None, mô tả các sản phẩm không đủ hàng)
+    """
+    if not quantities:
+        return {}, None
+    new_stocks = _hot_stock.apply({product_id: -quantity for product_id, quantity in quantities.items()})
+    if new_stocks is None:
+        short = [product_id for product_id, quantity in quantities.items() if _hot_stock.get(product_id) < quantity]
+        return None, unavailable_items(quantities, short)
+    return new_stocks, None
+
+def give_back_hot_stock(quantities):
+    """Trả lại tồn kho trong bộ nhớ (huỷ phần đã trừ bởi take_hot_stock, huỷ reservation)"""
+    if quantities:
+        _hot_stock.apply(quantities, check=False)
+
 @app.route('/check', methods=['POST'])
 def check_inventory():
     """Kiểm tra tồn kho cho các sản phẩm"""
@@ -177,18 +393,19 @@ def check_inventory():
     if not isinstance(data, list):
         return jsonify({'error': 'Dữ liệu phải là một danh sách các sản phẩm'}), 400
     
+    items, error = parse_items(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
     try:
+        quantities = requested_quantities(items)
+        products = load_products(quantities)
         result = []
         all_available = True
         
-        for item in data:
-            if 'product_id' not in item or 'quantity' not in item:
-                return jsonify({'error': 'Các mục phải có product_id và quantity'}), 400
-            
+        for item in items:
             product_id = item['product_id']
-            quantity = item['quantity']
-            
-            product = Product.query.get(product_id)
+            product = products.get(product_id)
             
             if not product:
                 result.append({
@@ -199,18 +416,20 @@ def check_inventory():
                 all_available = False
                 continue
             
-            if product.stock < quantity:
+            # So với tổng số lượng của sản phẩm trong cả giỏ hàng
+            stock = current_stock(product)
+            if stock < quantities[product_id]:
                 result.append({
                     'product_id': product_id,
                     'available': False,
-                    'message': f'Không đủ tồn kho (yêu cầu: {quantity}, hiện có: {product.stock})'
+                    'message': f'Không đủ tồn kho (yêu cầu: {quantities[product_id]}, hiện có: {stock})'
                 })
                 all_available = False
             else:
                 result.append({
                     'product_id': product_id,
                     'available': True,
-                    'current_stock': product.stock
+                    'current_stock': stock
                 })
         
         return jsonify({
@@ -219,12 +438,52 @@ def check_inventory():
         }), 200 if all_available else 400
         
     except Exception as e:
-        logger.exception(f"Lỗi khi kiểm tra tồn kho: {str(e)}")
+        logger.exception("Lỗi khi kiểm tra tồn kho: %s", e)
         return jsonify({'error': f'Lỗi khi kiểm tra tồn kho: {str(e)}'}), 500
 
+def apply_stock_update(quantities, transaction_id, hot, hot_stocks):
+    """
+    Trừ tồn kho cho một request /update (chạy trong batch ghi).
+
+    Args:
+        quantities: Số lượng cần trừ của các sản phẩm không phải hot
+        hot, hot_stocks: Số lượng và tồn kho mới của các sản phẩm hot đã được trừ
+            trong bộ nhớ; giao dịch 'order' của chúng chỉ được ghi khi cả request thành công
+
+    Returns:
+        (body, status_code)
+    """
+    new_stocks = adjust_stock(quantities, decrement=True)
+    
+    failed = [product_id for product_id in quantities if product_id not in new_stocks]
+    if failed:
+        # Hoàn lại phần đã trừ trong cùng transaction để các thao tác khác trong batch vẫn được commit
+        adjust_stock({product_id: quantities[product_id] for product_id in new_stocks}, decrement=False)
+        return {
+            'error': 'Không đủ tồn kho, không sản phẩm nào được cập nhật',
+            'items': unavailable_items(quantities, failed)
+        }, 400
+    
+    insert_transactions(transaction_id, quantities, new_stocks, 'order', -1)
+    insert_transactions(transaction_id, hot, hot_stocks, 'order', -1)
+    return {
+        'transaction_id': transaction_id,
+        'items': [{
+            'product_id': product_id,
+            'success': True,
+            'prev_stock': new_stock + quantities[product_id],
+            'new_stock': new_stock
+        } for product_id, new_stock in new_stocks.items()]
+    }, 200
+
 @app.route('/update', methods=['POST'])
 def update_inventory():
-    """Cập nhật tồn kho cho các sản phẩm"""
+    """
+    Trừ tồn kho cho các sản phẩm.
+
+    Tất cả sản phẩm được trừ hoặc không sản phẩm nào được trừ: nếu một sản phẩm
+    không tồn tại hoặc không đủ hàng, trả về 400 và tồn kho giữ nguyên.
+    """
     data = request.json
     
     if not data:
@@ -233,70 +492,46 @@ def update_inventory():
     if not isinstance(data, list):
         return jsonify({'error': 'Dữ liệu phải là một danh sách các sản phẩm'}), 400
     
+    items, error = parse_items(data)
+    if error:
+        return jsonify({'error': error}), 400
+    if any(item['quantity'] <= 0 for item in items):
+        return jsonify({'error': 'Số lượng phải lớn hơn 0'}), 400
+    
+    transaction_id = f"INV-{uuid.uuid4().hex[:8].upper()}"
+    hot, cold = _hot_stock.split(requested_quantities(items))
+    
+    # Sản phẩm hot được trừ trong bộ nhớ trước (chưa ghi giao dịch); phần còn lại lỗi
+    # thì trả lại, nên request thất bại không để lại giao dịch 'order' nào
+    hot_stocks, unavailable = take_hot_stock(hot)
+    if unavailable:
+        return jsonify({'error': 'Không đủ tồn kho, không sản phẩm nào được cập nhật', 'items': unavailable}), 400
+    
     try:
-        result = []
-        transaction_id = f"INV-{uuid.uuid4().hex[:8].upper()}"
-        
-        for item in data:
-            if 'product_id' not in item or 'quantity' not in item:
-                return jsonify({'error': 'Các mục phải có product_id và quantity'}), 400
-            
-            product_id = item['product_id']
-            quantity = item['quantity']
-            
-            product = Product.query.get(product_id)
-            
-            if not product:
-                result.append({
-                    'product_id': product_id,
-                    'success': False,
-                    'message': f'Sản phẩm không tồn tại'
-                })
-                continue
-            
-            if product.stock < quantity:
-                result.append({
-                    'product_id': product_id,
-                    'success': False,
-                    'message': f'Không đủ tồn kho (yêu cầu: {quantity}, hiện có: {product.stock})'
-                })
-                continue
-            
-            # Cập nhật tồn kho
-            prev_stock = product.stock
-            product.stock -= quantity
-            
-            # Tạo giao dịch tồn kho
-            transaction = InventoryTransaction(
-                transaction_id=transaction_id,
-                product_id=product_id,
-                quantity=-quantity,  # Giảm tồn kho
-                prev_stock=prev_stock,
-                new_stock=product.stock,
-                transaction_type='order'
-            )
-            
-            db.session.add(transaction)
-            
-            result.append({
-                'product_id': product_id,
-                'success': True,
-                'prev_stock': prev_stock,
-                'new_stock': product.stock
-            })
-        
-        db.session.commit()
-        logger.info(f"Đã cập nhật tồn kho, transaction ID: {transaction_id}")
-        
-        return jsonify({
-            'transaction_id': transaction_id,
-            'items': result
-        }), 200
-        
+        body, status_code = _write_batcher.submit(lambda: apply_stock_update(cold, transaction_id, hot, hot_stocks))
     except Exception as e:
-        logger.exception(f"Lỗi khi cập nhật tồn kho: {str(e)}")
-        db.session.rollback()
+        give_back_hot_stock(hot)
+        logger.exception("Lỗi khi cập nhật tồn kho: %s", e)
         return jsonify({'error': f'Lỗi khi cập nhật tồn kho: {str(e)}'}), 500
+    
+    if status_code != 200:
+        give_back_hot_stock(hot)
+        return jsonify(body), status_code
+    
+    body['items'].extend({
+        'product_id': product_id,
+        'success': True,
+        'prev_stock': new_stock + hot[product_id],
+        'new_stock': new_stock
+    } for product_id, new_stock in hot_stocks.items())
+    logger.info("Đã cập nhật tồn kho, transaction ID: %s", transaction_id)
+    return jsonify(body), status_code
+
+def apply_restock(quantities, transaction_id):
+    """Cộng tồn kho cho một request /restock (chạy trong batch ghi); trả về {product_id: tồn kho mới}"""
+    new_stocks = adjust_stock(quantities, decrement=False)
+    insert_transactions(transaction_id, quantities, new_stocks, 'restock', 1)
+    return new_stocks
 
 @app.route('/restock', methods=['POST'])
 def restock_inventory():
@@ -309,28 +544,30 @@ def restock_inventory():
     if not isinstance(data, list):
         return jsonify({'error': 'Dữ liệu phải là một danh sách các sản phẩm'}), 400
     
+    items, error = parse_items(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
     try:
         result = []
         transaction_id = f"RST-{uuid.uuid4().hex[:8].upper()}"
         
-        for item in data:
-            if 'product_id' not in item or 'quantity' not in item:
-                return jsonify({'error': 'Các mục phải có product_id và quantity'}), 400
-            
-            product_id = item['product_id']
-            quantity = item['quantity']
-            
-            if quantity <= 0:
+        for item in items:
+            if item['quantity'] <= 0:
                 result.append({
-                    'product_id': product_id,
+                    'product_id': item['product_id'],
                     'success': False,
                     'message': 'Số lượng phải lớn hơn 0'
                 })
-                continue
-            
-            product = Product.query.get(product_id)
-            
-            if not product:
+        
+        quantities = requested_quantities(item for item in items if item['quantity'] > 0)
+        hot, cold = _hot_stock.split(quantities)
+        new_stocks = _write_batcher.submit(lambda: apply_restock(cold, transaction_id)) if cold else {}
+        if hot:
+            new_stocks.update(_hot_stock.apply(hot, transaction_id, 'restock'))
+        
+        for product_id in quantities:
+            if product_id not in new_stocks:
                 result.append({
                     'product_id': product_id,
                     'success': False,
@@ -338,31 +575,14 @@ def restock_inventory():
                 })
                 continue
             
-            # Cập nhật tồn kho
-            prev_stock = product.stock
-            product.stock += quantity
-            
-            # Tạo giao dịch tồn kho
-            transaction = InventoryTransaction(
-                transaction_id=transaction_id,
-                product_id=product_id,
-                quantity=quantity,  # Tăng tồn kho
-                prev_stock=prev_stock,
-                new_stock=product.stock,
-                transaction_type='restock'
-            )
-            
-            db.session.add(transaction)
-            
             result.append({
                 'product_id': product_id,
                 'success': True,
-                'prev_stock': prev_stock,
-                'new_stock': product.stock
+                'prev_stock': new_stocks[product_id] - quantities[product_id],
+                'new_stock': new_stocks[product_id]
             })
         
-        db.session.commit()
-        logger.info(f"Đã nhập thêm hàng vào tồn kho, transaction ID: {transaction_id}")
+        logger.info("Đã nhập thêm hàng vào tồn kho, transaction ID: %s", transaction_id)
         
         return jsonify({
             'transaction_id': transaction_id,
@@ -370,46 +590,364 @@ def restock_inventory():
         }), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi nhập thêm hàng vào tồn kho: {str(e)}")
-        db.session.rollback()
+        logger.exception("Lỗi khi nhập thêm hàng vào tồn kho: %s", e)
         return jsonify({'error': f'Lỗi khi nhập thêm hàng vào tồn kho: {str(e)}'}), 500
 
+# Thời gian giữ hàng mặc định/tối đa (giây) và chu kỳ dọn reservation hết hạn
+RESERVATION_TTL = int(os.environ.get('INVENTORY_RESERVATION_TTL', 300))
+RESERVATION_MAX_TTL = int(os.environ.get('INVENTORY_RESERVATION_MAX_TTL', 3600))
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get('INVENTORY_RESERVATION_SWEEP_INTERVAL', 5))
+
+def reservation_to_dict(reservation):
+    return {
+        'id': reservation.id,
+        'status': reservation.status,
+        'reference': reservation.reference,
+        'transaction_id': reservation.transaction_id,
+        'expires_at': reservation.expires_at.isoformat(),
+        'created_at': reservation.created_at.isoformat(),
+        'items': [{
+            'product_id': item.product_id,
+            'quantity': item.quantity,
+            'prev_stock': item.prev_stock,
+            'new_stock': item.new_stock
+        } for item in reservation.items]
+    }
+
+def transition_reservation(reservation_id, from_status, to_status, **values):
+    """
+    Đổi trạng thái reservation nếu nó vẫn đang ở from_status (UPDATE có điều kiện),
+    nên chỉ một trong các request/sweeper chạy đồng thời thực hiện được.
+    """
+    return db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == from_status)
+        .values(status=to_status, updated_at=datetime.now(), **values)
+    ).rowcount == 1
+
+def release_reservation(reservation_id, status='released'):
+    """
+    Trả lại tồn kho của một reservation đang giữ hàng (chạy trong batch ghi).
+
+    Tồn kho của sản phẩm hot không nằm trong transaction: caller trả lại phần đó
+    bằng give_back_hot_stock sau khi batch đã commit.
+
+    Returns:
+        {product_id: số lượng} của sản phẩm hot cần trả lại, hoặc None nếu
+        reservation không còn ở trạng thái held (đã được xử lý)
+    """
+    if not transition_reservation(reservation_id, 'held', status):
+        return None
+    
+    items = ReservationItem.query.filter_by(reservation_id=reservation_id).all()
+    hot, cold = _hot_stock.split({item.product_id: item.quantity for item in items})
+    adjust_stock(cold, decrement=False)
+    return hot
+
+def apply_reservation(quantities, hot_stocks, ttl, reference):
+    """
+    Giữ hàng cho một request POST /reservations (chạy trong batch ghi).
+
+    Args:
+        quantities: {product_id: số lượng} của tất cả sản phẩm
+        hot_stocks: Tồn kho mới của các sản phẩm hot đã được trừ trong bộ nhớ
+
+    Returns:
+        (body, status_code)
+    """
+    if reference:
+        # Request trùng key có thể nằm cùng batch với request đã tạo reservation
+        existing = Reservation.query.filter_by(reference=reference).first()
+        if existing:
+            return reservation_to_dict(existing), 200
+    
+    cold = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in hot_stocks}
+    new_stocks = adjust_stock(cold, decrement=True)
+    
+    failed = [product_id for product_id in cold if product_id not in new_stocks]
+    if failed:
+        # Hoàn lại phần đã trừ trong cùng transaction để các thao tác khác trong batch vẫn được commit
+        adjust_stock({product_id: cold[product_id] for product_id in new_stocks}, decrement=False)
+        return {'all_available': False, 'items': unavailable_items(cold, failed)}, 400
+    new_stocks.update(hot_stocks)
+    
+    reservation = Reservation(
+        id=f"RSV-{uuid.uuid4().hex[:8].upper()}",
+        status='held',
+        reference=reference,
+        expires_at=datetime.now() + timedelta(seconds=ttl)
+    )
+    db.session.add(reservation)
+    db.session.add_all(ReservationItem(
+        reservation_id=reservation.id,
+        product_id=product_id,
+        quantity=quantities[product_id],
+        prev_stock=new_stock + quantities[product_id],
+        new_stock=new_stock
+    ) for product_id, new_stock in new_stocks.items())
+    
+    # Flush ngay để request trùng Idempotency-Key gặp IntegrityError ở đây
+    db.session.flush()
+    return reservation_to_dict(reservation), 201
+
+@app.route('/reservations', methods=['POST'])
+def create_reservation():
+    """
+    Giữ hàng cho một đơn hàng: trừ tồn kho của tất cả sản phẩm hoặc không trừ gì.
+
+    Body: {"items": [{"product_id": 1, "quantity": 2}], "ttl": 300}
+    Hàng được giữ tới khi xác nhận (/confirm), huỷ (/release) hoặc hết ttl giây.
+    Gửi kèm Idempotency-Key để gửi lại an toàn: key đã dùng trả về reservation cũ.
+    """
+    data = request.json
+    
+    if not data or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({'error': 'Dữ liệu phải có danh sách items'}), 400
+    
+    items, error = parse_items(data['items'])
+    if error:
+        return jsonify({'error': error}), 400
+    if any(item['quantity'] <= 0 for item in items):
+        return jsonify({'error': 'Số lượng phải lớn hơn 0'}), 400
+    
+    ttl = data.get('ttl', RESERVATION_TTL)
+    if not isinstance(ttl, (int, float)) or ttl <= 0:
+        return jsonify({'error': 'ttl phải là số giây lớn hơn 0'}), 400
+    ttl = min(ttl, RESERVATION_MAX_TTL)
+    reference = request.headers.get('Idempotency-Key')
+    
+    if reference:
+        existing = Reservation.query.filter_by(reference=reference).first()
+        if existing:
+            return jsonify(reservation_to_dict(existing)), 200
+    
+    quantities = requested_quantities(items)
+    hot = _hot_stock.split(quantities)[0]
+    hot_stocks, unavailable = take_hot_stock(hot)
+    if unavailable:
+        return jsonify({'all_available': False, 'items': unavailable}), 400
+    
+    try:
+        body, status_code = _write_batcher.submit(lambda: apply_reservation(quantities, hot_stocks, ttl, reference))
+    except IntegrityError:
+        # Request trùng Idempotency-Key vừa tạo reservation trước
+        give_back_hot_stock(hot)
+        db.session.rollback()
+        existing = Reservation.query.filter_by(reference=reference).first()
+        if existing:
+            return jsonify(reservation_to_dict(existing)), 200
+        raise
+    except Exception as e:
+        give_back_hot_stock(hot)
+        logger.exception("Lỗi khi giữ hàng: %s", e)
+        return jsonify({'error': f'Lỗi khi giữ hàng: {str(e)}'}), 500
+    
+    if status_code != 201:
+        # Không giữ hàng được (hoặc reservation đã tồn tại): trả lại phần đã trừ trong bộ nhớ
+        give_back_hot_stock(hot)
+    else:
+        logger.info("Đã giữ hàng, reservation ID: %s", body['id'])
+    return jsonify(body), status_code
+
+@app.route('/reservations/<reservation_id>', methods=['GET'])
+def get_reservation(reservation_id):
+    """Lấy thông tin một reservation"""
+    reservation = db.session.get(Reservation, reservation_id)
+    if not reservation:
+        return jsonify({'error': f'Không tìm thấy reservation với ID: {reservation_id}'}), 404
+    return jsonify(reservation_to_dict(reservation)), 200
+
+@app.route('/reservations/by-key/<path:key>', methods=['GET'])
+def get_reservation_by_key(key):
+    """Lấy reservation đã tạo bởi request POST /reservations có Idempotency-Key này"""
+    reservation = Reservation.query.filter_by(reference=key).first()
+    if not reservation:
+        return jsonify({'error': f'Không tìm thấy reservation với Idempotency-Key: {key}'}), 404
+    return jsonify(reservation_to_dict(reservation)), 200
+
+def apply_confirmation(reservation_id):
+    """
+    Xác nhận một reservation (chạy trong batch ghi).
+
+    Returns:
+        (body, status_code, tồn kho hot cần trả lại nếu reservation vừa hết hạn)
+    """
+    reservation = db.session.get(Reservation, reservation_id)
+    
+    if not reservation:
+        return {'error': f'Không tìm thấy reservation với ID: {reservation_id}'}, 404, None
+    
+    transaction_id = f"INV-{uuid.uuid4().hex[:8].upper()}"
+    released = None
+    if reservation.status == 'held' and reservation.expires_at <= datetime.now():
+        released = release_reservation(reservation_id, 'expired')
+    elif reservation.status == 'held' and transition_reservation(
+            reservation_id, 'held', 'confirmed', transaction_id=transaction_id):
+        insert_transactions(
+            transaction_id,
+            {item.product_id: item.quantity for item in reservation.items},
+            {item.product_id: item.new_stock for item in reservation.items},
+            'order', -1, notes=f"Reservation {reservation_id}"
+        )
+    
+    db.session.refresh(reservation)
+    if reservation.status != 'confirmed':
+        return {
+            'error': f'Không thể xác nhận reservation đã {reservation.status}',
+            'status': reservation.status
+        }, 409, released
+    
+    return reservation_to_dict(reservation), 200, None
+
+@app.route('/reservations/<reservation_id>/confirm', methods=['POST'])
+def confirm_reservation(reservation_id):
+    """Xác nhận reservation: hàng đang giữ trở thành giao dịch tồn kho 'order'"""
+    try:
+        body, status_code, released = _write_batcher.submit(lambda: apply_confirmation(reservation_id))
+        give_back_hot_stock(released)
+        
+        if status_code == 200:
+            logger.info("Đã xác nhận reservation %s, transaction ID: %s", reservation_id, body['transaction_id'])
+        return jsonify(body), status_code
+        
+    except Exception as e:
+        logger.exception("Lỗi khi xác nhận reservation: %s", e)
+        return jsonify({'error': f'Lỗi khi xác nhận reservation: {str(e)}'}), 500
+
+def apply_release(reservation_id):
+    """
+    Huỷ một reservation (chạy trong batch ghi).
+
+    Returns:
+        (body, status_code, tồn kho hot cần trả lại)
+    """
+    reservation = db.session.get(Reservation, reservation_id)
+    
+    if not reservation:
+        return {'error': f'Không tìm thấy reservation với ID: {reservation_id}'}, 404, None
+    
+    released = None
+    if reservation.status == 'held':
+        released = release_reservation(reservation_id)
+        db.session.refresh(reservation)
+    
+    if reservation.status == 'confirmed':
+        return {
+            'error': 'Không thể huỷ reservation đã xác nhận',
+            'status': reservation.status
+        }, 409, released
+    
+    return reservation_to_dict(reservation), 200, released
+
+@app.route('/reservations/<reservation_id>/release', methods=['POST'])
+def release_reservation_endpoint(reservation_id):
+    """Huỷ reservation và trả lại tồn kho (gọi lại nhiều lần vẫn an toàn)"""
+    try:
+        body, status_code, released = _write_batcher.submit(lambda: apply_release(reservation_id))
+        give_back_hot_stock(released)
+        
+        if status_code == 200:
+            logger.info("Reservation %s: %s", reservation_id, body['status'])
+        return jsonify(body), status_code
+        
+    except Exception as e:
+        logger.exception("Lỗi khi huỷ reservation: %s", e)
+        return jsonify({'error': f'Lỗi khi huỷ reservation: {str(e)}'}), 500
+
+def sweep_expired_reservations():
+    """Trả lại tồn kho của các reservation đã hết hạn mà chưa được xác nhận"""
+    with app.app_context():
+        expired = [reservation_id for (reservation_id,) in db.session.query(Reservation.id).filter(
+            Reservation.status == 'held',
+            Reservation.expires_at <= datetime.now()
+        ).limit(100)]
+    
+    if expired:
+        released = _write_batcher.submit(
+            lambda: [release_reservation(reservation_id, 'expired') for reservation_id in expired])
+        released = [hot for hot in released if hot is not None]
+        for hot in released:
+            give_back_hot_stock(hot)
+        if released:
+            logger.info("Đã trả lại tồn kho của %d reservation hết hạn", len(released))
+
+_sweeper_pid = None
+_sweeper_lock = threading.Lock()
+
+def ensure_reservation_sweeper():
+    """Khởi động thread dọn reservation hết hạn nếu process hiện tại chưa có"""
+    global _sweeper_pid
+    if _sweeper_pid == os.getpid():
+        return
+    
+    with _sweeper_lock:
+        if _sweeper_pid == os.getpid():
+            return
+        _sweeper_pid = os.getpid()
+        
+        def run():
+            while True:
+                time.sleep(RESERVATION_SWEEP_INTERVAL)
+                try:
+                    sweep_expired_reservations()
+                except Exception as e:
+                    logger.error("Lỗi khi dọn reservation hết hạn: %s", e)
+        
+        threading.Thread(target=run, name='reservation-sweeper', daemon=True).start()
+
+# Tồn kho trong bộ nhớ và sweeper khởi động ở request đầu tiên của process phục vụ
+# request (không chạy trong process giám sát của reloader, nơi chỉ import module)
+app.before_request(_hot_stock.ensure_started)
+app.before_request(ensure_reservation_sweeper)
+
+def filtered_transactions():
+    """Query giao dịch tồn kho theo filter product_id, type của request"""
+    product_id = request.args.get('product_id')
+    transaction_type = request.args.get('type')
+    
+    # Tạo query
+    query = InventoryTransaction.query
+    
+    # Thêm filter nếu có
+    if product_id:
+        query = query.filter_by(product_id=product_id)
+    if transaction_type:
+        query = query.filter_by(transaction_type=transaction_type)
+    return query
+
 @app.route('/transactions', methods=['GET'])
 def get_transactions():
-    """Lấy lịch sử giao dịch tồn kho"""
+    """
+    Lấy lịch sử giao dịch tồn kho (mới nhất trước), phân trang theo cursor.
+
+    Query: product_id, type, limit, cursor, fields
+    """
     try:
-        product_id = request.args.get('product_id')
-        transaction_type = request.args.get('type')
-        
-        # Tạo query
-        query = InventoryTransaction.query
-        
-        # Thêm filter nếu có
-        if product_id:
-            query = query.filter_by(product_id=product_id)
-        if transaction_type:
-            query = query.filter_by(transaction_type=transaction_type)
-        
-        # Thực hiện query và lấy kết quả
-        transactions = query.order_by(InventoryTransaction.created_at.desc()).all()
-        
-        result = [{
-            'id': transaction.id,
-            'transaction_id': transaction.transaction_id,
-            'product_id': transaction.product_id,
-            'quantity': transaction.quantity,
-            'prev_stock': transaction.prev_stock,
-            'new_stock': transaction.new_stock,
-            'transaction_type': transaction.transaction_type,
-            'created_at': transaction.created_at.isoformat()
-        } for transaction in transactions]
-        
-        return jsonify(result), 200
+        result, next_cursor = paginate(filtered_transactions(), TRANSACTION_FIELDS, InventoryTransaction.created_at,
+                                       InventoryTransaction.id, request.args)
+        return list_response(result, next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy lịch sử giao dịch tồn kho: {str(e)}")
+        logger.exception("Lỗi khi lấy lịch sử giao dịch tồn kho: %s", e)
         return jsonify({'error': f'Lỗi khi lấy lịch sử giao dịch tồn kho: {str(e)}'}), 500
 
+@app.route('/transactions/export', methods=['GET'])
+def export_transactions():
+    """
+    Xuất toàn bộ lịch sử giao dịch tồn kho dạng NDJSON (cũ nhất trước), stream theo từng chunk.
+
+    Query: product_id, type, since, until (ISO 8601), cursor (_cursor của dòng cuối đã nhận), fields
+    """
+    try:
+        rows = export_rows(db.session, filtered_transactions(), TRANSACTION_FIELDS,
+                           InventoryTransaction.created_at, InventoryTransaction.id, request.args)
+        return ndjson_response(rows)
+        
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Kiểm tra trạng thái dịch vụ"""
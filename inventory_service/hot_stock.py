@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from common.metrics import _registry as _metrics
+
+logger = logging.getLogger(__name__)
+
+HOT_STOCK_OPERATIONS = _metrics.counter(
+    'inventory_hot_stock_operations_total', 'Số thao tác cộng/trừ tồn kho trong bộ nhớ', ('result',))
+HOT_STOCK_FLUSHES = _metrics.counter(
+    'inventory_hot_stock_flushes_total', 'Số lần ghi tồn kho trong bộ nhớ xuống database', ('outcome',))
+HOT_STOCK_FLUSH_LATENCY = _metrics.histogram(
+    'inventory_hot_stock_flush_duration_seconds', 'Thời gian ghi một lượt journal xuống database')
+
+class HotStockStore:
+    """
+    Tồn kho trong bộ nhớ cho các sản phẩm "hot" (ví dụ đang khuyến mãi).
+
+    Mỗi lần trừ tồn kho của sản phẩm thường là một lần ghi dòng products.stock,
+    nên một sản phẩm chỉ trừ được nhanh bằng tốc độ commit của SQLite. Với sản
+    phẩm hot, tồn kho được giữ trong bộ nhớ và kiểm tra/trừ dưới khoá theo stripe
+    (product_id % stripes), nên các sản phẩm khác stripe không chặn nhau.
+
+    Mỗi thay đổi được ghi vào journal (append-only) trước khi trả kết quả cho caller;
+    thread nền định kỳ ghi các thay đổi trong journal xuống database (write-behind)
+    cùng checkpoint là seq cuối đã ghi, trong một transaction. Khi khởi động, các
+    bản ghi có seq lớn hơn checkpoint được ghi lại, nên process chết giữa chừng
+    không làm mất thay đổi nào đã trả lời caller.
+
+    Tồn kho trong bộ nhớ là nguồn chính xác duy nhất cho sản phẩm hot, nên chỉ một
+    process được dùng journal (khoá bằng flock); service phải chạy một process.
+    """
+
+    def __init__(self, product_ids: Iterable[int], journal_path: str,
+                 load_stock: Callable[[List[int]], Dict[int, int]],
+                 persist: Callable[[List[dict]], None],
+                 checkpoint: Callable[[], int],
+                 stripes: int = 16, flush_interval: float = 0.2, fsync: bool = False):
+        """
+        Args:
+            product_ids: ID các sản phẩm hot
+            journal_path: File journal
+            load_stock: Hàm đọc tồn kho hiện tại trong database, {product_id: stock}
+            persist: Hàm ghi một danh sách bản ghi journal (theo seq) và checkpoint trong một transaction
+            checkpoint: Hàm đọc seq cuối cùng đã được ghi xuống database
+            stripes: Số khoá
+            flush_interval: Chu kỳ (giây) ghi journal xuống database
+            fsync: True để fsync journal sau mỗi lần ghi (chịu được mất điện, chậm hơn)
+        """
+        self.product_ids = frozenset(product_ids)
+        self.journal_path = journal_path
+        self.stripes = max(1, stripes)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._load_stock = load_stock
+        self._persist = persist
+        self._checkpoint = checkpoint
+
+        self._stock: Dict[int, int] = {}
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._lock_file = None
+        self._pending: List[dict] = []
+        self._seq = 0
+        self._flush_lock = threading.Lock()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+        _metrics.add_collector(self._collect)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.product_ids)
+
+    def is_hot(self, product_id: int) -> bool:
+        self.ensure_started()
+        return product_id in self.product_ids
+
+    def split(self, quantities: Dict[int, int]):
+        """Tách {product_id: quantity} thành (sản phẩm hot, sản phẩm còn lại)"""
+        self.ensure_started()
+        hot = {product_id: quantity for product_id, quantity in quantities.items() if product_id in self.product_ids}
+        cold = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in self.product_ids}
+        return hot, cold
+
+    def get(self, product_id: int, default: Optional[int] = None) -> Optional[int]:
+        """Tồn kho hiện tại của sản phẩm hot (default nếu không phải sản phẩm hot)"""
+        if product_id not in self.product_ids:
+            return default
+        self.ensure_started()
+        return self._stock.get(product_id, default)
+
+    def apply(self, changes: Dict[int, int], transaction_id: Optional[str] = None,
+              transaction_type: Optional[str] = None, notes: Optional[str] = None,
+              check: bool = True) -> Optional[Dict[int, int]]:
+        """
+        Cộng/trừ tồn kho của nhiều sản phẩm hot: tất cả hoặc không sản phẩm nào.
+
+        Args:
+            changes: {product_id: thay đổi (âm là trừ)}
+            transaction_id, transaction_type, notes: Giao dịch tồn kho được ghi cùng
+                lúc với tồn kho; transaction_type=None thì chỉ cập nhật tồn kho
+            check: Không cho tồn kho âm
+
+        Returns:
+            {product_id: tồn kho mới}, hoặc None nếu một sản phẩm không đủ hàng
+        """
+        self.ensure_started()
+        product_ids = sorted(changes)
+        unknown = [product_id for product_id in product_ids if product_id not in self._stock]
+        if unknown:
+            raise KeyError(f"Sản phẩm không được quản lý trong bộ nhớ: {unknown}")
+
+        # Lấy khoá theo thứ tự stripe để các thao tác nhiều sản phẩm không deadlock
+        locks = [self._locks[index] for index in sorted({product_id % self.stripes for product_id in product_ids})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            if check and any(self._stock[product_id] + changes[product_id] < 0 for product_id in product_ids):
+                HOT_STOCK_OPERATIONS.inc('rejected')
+                return None
+
+            items = []
+            for product_id in product_ids:
+                prev_stock = self._stock[product_id]
+                items.append([product_id, changes[product_id], prev_stock, prev_stock + changes[product_id]])
+            # Ghi journal trước khi đổi tồn kho trong bộ nhớ: lỗi ghi thì không có gì thay đổi
+            self._append({
+                'tx': transaction_id,
+                'type': transaction_type,
+                'notes': notes,
+                'at': datetime.now().isoformat(),
+                'items': items
+            })
+            for product_id, _, _, new_stock in items:
+                self._stock[product_id] = new_stock
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+        HOT_STOCK_OPERATIONS.inc('applied')
+        return {product_id: new_stock for product_id, _, _, new_stock in items}
+
+    def set_stock(self, product_id: int, stock: int, transaction_id: str,
+                  transaction_type: str = 'adjustment') -> Dict[int, int]:
+        """Đặt tồn kho tuyệt đối (PUT /products) như một giao dịch điều chỉnh"""
+        self.ensure_started()
+        lock = self._locks[product_id % self.stripes]
+        with lock:
+            delta = stock - self._stock[product_id]
+            self._append({
+                'tx': transaction_id,
+                'type': transaction_type,
+                'notes': None,
+                'at': datetime.now().isoformat(),
+                'items': [[product_id, delta, self._stock[product_id], stock]]
+            })
+            self._stock[product_id] = stock
+        return {product_id: stock}
+
+    def _append(self, record: dict):
+        """Gán seq và ghi bản ghi vào journal (gọi khi đang giữ khoá stripe)"""
+        with self._journal_lock:
+            record['seq'] = self._seq + 1
+            self._journal.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._seq += 1
+            self._pending.append(record)
+
+    def ensure_started(self):
+        """Khôi phục từ journal, nạp tồn kho và khởi động thread ghi nền (một lần cho mỗi process)"""
+        if self._started_pid == os.getpid() or not self.enabled:
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._recover()
+            self._started_pid = os.getpid()
+            threading.Thread(target=self._run, name='hot-stock-flusher', daemon=True).start()
+
+    def _recover(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self._lock_file = open(self.journal_path + '.lock', 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(
+                f"Journal {self.journal_path} đang được process khác dùng; "
+                "tồn kho trong bộ nhớ yêu cầu inventory service chạy một process")
+
+        checkpoint = self._checkpoint()
+        records = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Dòng cuối bị ghi dở khi process chết: caller chưa nhận kết quả
+                        logger.warning("Bỏ qua dòng journal không hợp lệ: %r", line[:200])
+                        continue
+                    if record['seq'] > checkpoint:
+                        records.append(record)
+
+        if records:
+            logger.info("Ghi lại %d thay đổi tồn kho từ journal (checkpoint %d)", len(records), checkpoint)
+            self._persist(records)
+        self._seq = max([checkpoint] + [record['seq'] for record in records])
+
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._stock = dict(self._load_stock(sorted(self.product_ids)))
+        missing = self.product_ids - set(self._stock)
+        if missing:
+            logger.warning("Sản phẩm hot không tồn tại, bỏ qua: %s", sorted(missing))
+            self.product_ids = frozenset(self._stock)
+        logger.info("Tồn kho trong bộ nhớ cho %d sản phẩm hot", len(self._stock))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Lỗi khi ghi tồn kho trong bộ nhớ xuống database: %s", e)
+
+    def flush(self):
+        """Ghi các thay đổi chưa ghi xuống database rồi bỏ chúng khỏi journal"""
+        with self._flush_lock:
+            with self._journal_lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return
+
+            started = time.perf_counter()
+            try:
+                self._persist(records)
+            except Exception:
+                with self._journal_lock:
+                    self._pending = records + self._pending
+                HOT_STOCK_FLUSHES.inc('failed')
+                raise
+            HOT_STOCK_FLUSH_LATENCY.observe(time.perf_counter() - started)
+            HOT_STOCK_FLUSHES.inc('committed')
+
+            # Viết lại journal chỉ còn các bản ghi chưa ghi; os.replace là nguyên tử nên
+            # nếu process chết giữa chừng, journal cũ vẫn còn và checkpoint bỏ qua phần đã ghi
+            with self._journal_lock:
+                temp_path = self.journal_path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for record in self._pending:
+                        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(temp_path, self.journal_path)
+                self._journal.close()
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _collect(self):
+        return [
+            ('inventory_hot_stock_products', 'gauge', 'Số sản phẩm có tồn kho trong bộ nhớ', [({}, len(self._stock))]),
+            ('inventory_hot_stock_pending_records', 'gauge', 'Số thay đổi tồn kho chưa ghi xuống database',
+             [({}, len(self._pending))])
+        ]
+
+def create_hot_stock_store(load_stock, persist, checkpoint, default_journal_path: str) -> HotStockStore:
+    """
+    Tạo HotStockStore với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        INVENTORY_HOT_PRODUCTS: Danh sách ID sản phẩm hot, phân cách bằng dấu phẩy (mặc định rỗng: tắt)
+        INVENTORY_HOT_JOURNAL: File journal (mặc định default_journal_path)
+        INVENTORY_HOT_STRIPES: Số khoá (mặc định 16)
+        INVENTORY_HOT_FLUSH_INTERVAL: Chu kỳ ghi xuống database, giây (mặc định 0.2)
+        INVENTORY_HOT_JOURNAL_FSYNC: 1 để fsync journal sau mỗi lần ghi (mặc định 0)
+    """
+    product_ids = [int(value) for value in os.environ.get('INVENTORY_HOT_PRODUCTS', '').split(',') if value.strip()]
+    return HotStockStore(
+        product_ids,
+        os.environ.get('INVENTORY_HOT_JOURNAL', default_journal_path),
+        load_stock=load_stock,
+        persist=persist,
+        checkpoint=checkpoint,
+        stripes=int(os.environ.get('INVENTORY_HOT_STRIPES', 16)),
+        flush_interval=float(os.environ.get('INVENTORY_HOT_FLUSH_INTERVAL', 0.2)),
+        fsync=os.environ.get('INVENTORY_HOT_JOURNAL_FSYNC', '0') == '1'
+    )
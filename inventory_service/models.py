@@ -7,6 +7,7 @@ class Product(db.Model):
     """Model cho sản phẩm"""
     
     __tablename__ = 'products'
+    __table_args__ = (db.Index('ix_products_created_at_id', 'created_at', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -24,6 +25,7 @@ class InventoryTransaction(db.Model):
     """Model cho các giao dịch tồn kho"""
     
     __tablename__ = 'inventory_transactions'
+    __table_args__ = (db.Index('ix_inventory_transactions_created_at_id', 'created_at', 'id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(20), nullable=False)
@@ -37,3 +39,48 @@ class InventoryTransaction(db.Model):
     
     def __repr__(self):
         return f"<InventoryTransaction {self.id} - {self.product_id} - {self.quantity}>"
+
+class Reservation(db.Model):
+    """Model cho việc giữ hàng tạm thời (trừ tồn kho ngay, hết hạn thì trả lại)"""
+    
+    __tablename__ = 'reservations'
+    
+    id = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='held')  # 'held', 'confirmed', 'released', 'expired'
+    reference = db.Column(db.String(100), nullable=True, unique=True)  # Idempotency-Key của request tạo
+    transaction_id = db.Column(db.String(20), nullable=True)  # Giao dịch tồn kho tạo khi xác nhận
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    
+    items = db.relationship('ReservationItem', backref='reservation', lazy=True)
+    
+    def __repr__(self):
+        return f"<Reservation {self.id} - {self.status}>"
+
+class ReservationItem(db.Model):
+    """Model cho từng sản phẩm được giữ trong một reservation"""
+    
+    __tablename__ = 'reservation_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.String(20), db.ForeignKey('reservations.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    prev_stock = db.Column(db.Integer, nullable=False)  # Tồn kho trước khi giữ hàng
+    new_stock = db.Column(db.Integer, nullable=False)  # Tồn kho sau khi giữ hàng
+    
+    def __repr__(self):
+        return f"<ReservationItem {self.reservation_id} - {self.product_id} - {self.quantity}>"
+
+class HotStockCheckpoint(db.Model):
+    """Seq cuối cùng của journal tồn kho trong bộ nhớ đã được ghi xuống database"""
+    
+    __tablename__ = 'hot_stock_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f"<HotStockCheckpoint {self.last_seq}>"
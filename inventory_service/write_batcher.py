@@ -0,0 +1,187 @@
+import os
+import time
+import queue
+import threading
+import logging
+from typing import Any, Callable, List, Optional
+
+from common.metrics import _registry as _metrics
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = _metrics.histogram(
+    'inventory_write_batch_size', 'Số thao tác ghi được commit chung trong một transaction',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+WRITE_BATCH_WAIT = _metrics.histogram(
+    'inventory_write_batch_wait_seconds', 'Thời gian từ lúc gửi thao tác ghi tới khi batch chứa nó được commit')
+WRITE_BATCHES = _metrics.counter(
+    'inventory_write_batches_total', 'Số batch ghi đã xử lý', ('outcome',))
+
+class _Operation:
+    """Một thao tác ghi đang chờ trong hàng đợi"""
+    __slots__ = ('func', 'done', 'result', 'exception', 'submitted_at')
+
+    def __init__(self, func: Callable[[], Any]):
+        self.func = func
+        self.done = threading.Event()
+        self.result = None
+        self.exception: Optional[BaseException] = None
+        self.submitted_at = time.perf_counter()
+
+class WriteBatcher:
+    """
+    Group commit cho các thao tác ghi database.
+
+    SQLite chỉ cho một transaction ghi tại một thời điểm, nên khi nhiều request
+    cùng ghi, mỗi request một commit sẽ phải xếp hàng chờ khoá ("database is locked").
+    Thread ghi gom các thao tác đến trong cửa sổ `window` giây (tối đa `max_batch`
+    thao tác), chạy chúng trong một transaction và commit một lần; mỗi caller vẫn
+    nhận kết quả của riêng mình.
+
+    Thao tác là function không tham số dùng db.session, không tự commit/rollback
+    và không được để lại thay đổi dở dang khi trả về kết quả lỗi nghiệp vụ. Nếu một
+    thao tác raise exception, cả batch được rollback và từng thao tác được chạy lại
+    trong transaction riêng, nên lỗi của một request không ảnh hưởng request khác.
+    """
+
+    def __init__(self, app, db, window: float = 0.002, max_batch: int = 64, enabled: bool = True):
+        """
+        Args:
+            app: Flask app (thread ghi chạy trong app context riêng)
+            db: Đối tượng Flask-SQLAlchemy của service
+            window: Thời gian (giây) chờ gom thêm thao tác sau thao tác đầu tiên
+            max_batch: Số thao tác tối đa trong một transaction
+            enabled: False để mỗi thao tác chạy và commit ngay trong thread của request
+        """
+        self.app = app
+        self.db = db
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.enabled = enabled
+        self._queue: 'queue.Queue[_Operation]' = queue.Queue()
+        self._writer_pid = None
+        self._lock = threading.Lock()
+
+        _metrics.add_collector(self._collect)
+
+    def submit(self, func: Callable[[], Any]) -> Any:
+        """
+        Chạy thao tác ghi trong batch kế tiếp và chờ commit.
+
+        Returns:
+            Kết quả của func sau khi transaction chứa nó đã commit
+
+        Raises:
+            Exception do func (hoặc commit) raise khi chạy riêng
+        """
+        if not self.enabled:
+            return self._run_alone(func)
+
+        self._ensure_writer()
+        operation = _Operation(func)
+        self._queue.put(operation)
+        operation.done.wait()
+        if operation.exception is not None:
+            raise operation.exception
+        return operation.result
+
+    def _ensure_writer(self):
+        """Khởi động thread ghi nếu process hiện tại chưa có (gunicorn fork worker sau khi import)"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            threading.Thread(target=self._run, name='write-batcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._execute(batch)
+            except BaseException as e:
+                # Không để caller nào chờ mãi nếu thread ghi gặp lỗi ngoài dự kiến
+                logger.exception("Lỗi khi xử lý batch ghi: %s", e)
+                for operation in batch:
+                    if not operation.done.is_set():
+                        operation.exception = e
+                        operation.done.set()
+
+    def _collect_batch(self) -> List[_Operation]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute(self, batch: List[_Operation]):
+        session = self.db.session
+        with self.app.app_context():
+            try:
+                results = [operation.func() for operation in batch]
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.warning("Batch ghi %d thao tác lỗi (%s), chạy lại từng thao tác", len(batch), e)
+                WRITE_BATCHES.inc('fallback')
+                for operation in batch:
+                    self._finish(operation, *self._attempt(operation.func))
+                return
+
+        WRITE_BATCHES.inc('committed')
+        WRITE_BATCH_SIZE.observe(len(batch))
+        for operation, result in zip(batch, results):
+            self._finish(operation, result, None)
+
+    def _attempt(self, func: Callable[[], Any]):
+        """Chạy một thao tác trong transaction riêng; trả về (kết quả, exception)"""
+        try:
+            return self._run_alone(func), None
+        except Exception as e:
+            return None, e
+
+    def _run_alone(self, func: Callable[[], Any]) -> Any:
+        session = self.db.session
+        with self.app.app_context():
+            try:
+                result = func()
+                session.commit()
+                return result
+            except Exception:
+                session.rollback()
+                raise
+
+    def _finish(self, operation: _Operation, result: Any, exception: Optional[BaseException]):
+        operation.result = result
+        operation.exception = exception
+        WRITE_BATCH_WAIT.observe(time.perf_counter() - operation.submitted_at)
+        operation.done.set()
+
+    def _collect(self):
+        return [
+            ('inventory_write_batch_window_seconds', 'gauge', 'Cửa sổ gom thao tác ghi (giây)', [({}, self.window)]),
+            ('inventory_write_batch_max_size', 'gauge', 'Số thao tác tối đa trong một batch ghi', [({}, self.max_batch)]),
+            ('inventory_write_batch_enabled', 'gauge', '1 nếu group commit đang bật', [({}, int(self.enabled))]),
+            ('inventory_write_queue_depth', 'gauge', 'Số thao tác ghi đang chờ trong hàng đợi', [({}, self._queue.qsize())])
+        ]
+
+def create_write_batcher(app, db) -> WriteBatcher:
+    """
+    Tạo WriteBatcher với cấu hình đọc từ biến môi trường.
+
+    Biến môi trường:
+        INVENTORY_WRITE_BATCH_ENABLED: 0 để tắt group commit (mặc định 1)
+        INVENTORY_WRITE_BATCH_WINDOW: Cửa sổ gom thao tác, giây (mặc định 0.002)
+        INVENTORY_WRITE_BATCH_MAX: Số thao tác tối đa trong một transaction (mặc định 64)
+    """
+    return WriteBatcher(
+        app, db,
+        window=float(os.environ.get('INVENTORY_WRITE_BATCH_WINDOW', 0.002)),
+        max_batch=int(os.environ.get('INVENTORY_WRITE_BATCH_MAX', 64)),
+        enabled=os.environ.get('INVENTORY_WRITE_BATCH_ENABLED', '1') == '1'
+    )
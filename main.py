@@ -7,31 +7,21 @@ import logging
 import signal
 from api_gateway.app import app
 
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging đã được cấu hình khi import api_gateway.app (configure_logging, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
 logger = logging.getLogger(__name__)
 
 def run_service(cmd, service_name):
     """Chạy một service và ghi log"""
-    logger.info(f"Khởi động {service_name}...")
-    process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True
-    )
-    
-    logger.info(f"Đã khởi động {service_name} (PID: {process.pid})")
+    logger.info("Khởi động %s...", service_name)
+    # Service tự ghi log (stdout kế thừa từ process cha, file theo LOG_DIR),
+    # không đọc lại từng dòng qua pipe nữa
+    process = subprocess.Popen(cmd, shell=True)
     
-    # Ghi log từ service
-    if process.stdout:
-        for line in process.stdout:
-            logger.info(f"[{service_name}] {line.strip()}")
+    logger.info("Đã khởi động %s (PID: %s)", service_name, process.pid)
     
     # Kiểm tra khi service kết thúc
     exit_code = process.wait()
-    logger.info(f"{service_name} đã kết thúc với exit code: {exit_code}")
+    logger.info("%s đã kết thúc với exit code: %s", service_name, exit_code)
 
 def start_services():
     """Khởi động tất cả các service"""
@@ -70,6 +60,8 @@ start_services()
 # Tạo Flask app để Gunicorn có thể tìm thấy
 # Gunicorn sẽ sử dụng biến app này
 # Workflow sẽ chạy lệnh: `gunicorn --bind 0.0.0.0:5000 main:app`
+# Khi chạy nhiều worker (-w N), đặt GATEWAY_SHARED_STATE_PATH=/tmp/gateway_state.db
+# để rate limit, circuit breaker, response cache và Idempotency-Key dùng chung giữa các worker
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -1,17 +1,30 @@
 import os
+import sys
 import uuid
 import logging
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# Package common/ (metrics, tracing, logging, phân trang) nằm ở thư mục gốc dự án;
+# thêm vào sys.path khi service được chạy trực tiếp từ thư mục của nó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from flask import Flask, jsonify, request
-from models import PaymentTransaction, db
+from models import IdempotencyRecord, PaymentTransaction, db
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing, current_trace_id
+from common.logging_config import configure_logging
+from common.pagination import PaginationError, ensure_indexes, list_response, paginate
+from common.export import export_rows, ndjson_response
+from common.idempotency import IdempotencyKeys
 
-# Cấu hình logging
-logging.basicConfig(level=logging.DEBUG)
+# Cấu hình logging (hàng đợi + thread nền, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
+configure_logging('payment', trace_id=current_trace_id)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///payments.db'
+# PAYMENT_DATABASE_URL để dùng database khác (ví dụ file SQLite tạm khi chạy test)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PAYMENT_DATABASE_URL', 'sqlite:///payments.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Khởi tạo database
@@ -20,19 +33,42 @@ db.init_app(app)
 # Tạo bảng nếu chưa tồn tại
 with app.app_context():
     db.create_all()
+    ensure_indexes(db, PaymentTransaction)
+
+# Đếm request, đo latency theo route và thời gian câu lệnh SQL, thêm GET /metrics
+instrument_app(app, db)
+
+# Nhận traceparent từ gateway, ghi span cho request và từng transaction database
+instrument_tracing(app, 'payment', db)
+
+# Kết quả theo Idempotency-Key: thời gian giữ, thời gian request trùng chờ request đầu tiên
+# và lease của request đang xử lý (hết lease thì request gửi lại được xử lý lại)
+_idempotency = IdempotencyKeys(
+    db, IdempotencyRecord,
+    ttl=timedelta(seconds=int(os.environ.get('PAYMENT_IDEMPOTENCY_TTL', 86400))),
+    wait_timeout=float(os.environ.get('PAYMENT_IDEMPOTENCY_WAIT_TIMEOUT', 10)),
+    lease=timedelta(seconds=int(os.environ.get('PAYMENT_IDEMPOTENCY_LEASE', 60)))
+)
 
 @app.route('/payments', methods=['POST'])
+@_idempotency.idempotent(record_field='payment_id')
 def create_payment():
-    """Tạo một giao dịch thanh toán mới"""
-    data = request.json
-    
+    """
+    Tạo một giao dịch thanh toán mới.
+
+    Request có header Idempotency-Key chỉ được xử lý một lần (xem IdempotencyKeys.idempotent).
+    """
+    return process_payment_request(request.json)
+
+def process_payment_request(data):
+    """Tạo và xử lý giao dịch thanh toán, trả về (body, status code)"""
     if not data:
-        return jsonify({'error': 'Không có dữ liệu được gửi'}), 400
+        return {'error': 'Không có dữ liệu được gửi'}, 400
     
     required_fields = ['amount', 'payment_method']
     for field in required_fields:
         if field not in data:
-            return jsonify({'error': f'Thiếu trường dữ liệu: {field}'}), 400
+            return {'error': f'Thiếu trường dữ liệu: {field}'}, 400
     
     try:
         # Tạo một ID giao dịch mới
@@ -57,18 +93,18 @@ def create_payment():
             payment.status = 'completed'
             payment.completed_at = datetime.now()
             db.session.commit()
-            logger.info(f"Thanh toán {payment_id} đã xử lý thành công")
+            logger.info("Thanh toán %s đã xử lý thành công", payment_id)
         else:
             payment.status = 'failed'
             db.session.commit()
-            logger.error(f"Thanh toán {payment_id} xử lý thất bại")
-            return jsonify({
+            logger.error("Thanh toán %s xử lý thất bại", payment_id)
+            return {
                 'id': payment.id,
                 'status': payment.status,
                 'error': 'Không thể xử lý thanh toán'
-            }), 400
+            }, 400
         
-        return jsonify({
+        return {
             'id': payment.id,
             'amount': payment.amount,
             'status': payment.status,
@@ -76,12 +112,12 @@ def create_payment():
             'customer_id': payment.customer_id,
             'created_at': payment.created_at.isoformat(),
             'completed_at': payment.completed_at.isoformat() if payment.completed_at else None
-        }), 201
+        }, 201
         
     except Exception as e:
-        logger.exception(f"Lỗi khi xử lý thanh toán: {str(e)}")
+        logger.exception("Lỗi khi xử lý thanh toán: %s", e)
         db.session.rollback()
-        return jsonify({'error': f'Lỗi khi xử lý thanh toán: {str(e)}'}), 500
+        return {'error': f'Lỗi khi xử lý thanh toán: {str(e)}'}, 500
 
 @app.route('/payments/<payment_id>', methods=['GET'])
 def get_payment(payment_id):
@@ -106,9 +142,19 @@ def get_payment(payment_id):
         }), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy thông tin thanh toán: {str(e)}")
+        logger.exception("Lỗi khi lấy thông tin thanh toán: %s", e)
         return jsonify({'error': f'Lỗi khi lấy thông tin thanh toán: {str(e)}'}), 500
 
+@app.route('/payments/by-key/<path:key>', methods=['GET'])
+def get_payment_by_key(key):
+    """Lấy giao dịch đã tạo bởi request POST /payments có Idempotency-Key này"""
+    record, error = _idempotency.lookup(key)
+    if error is not None:
+        return error
+    if record.payment_id is None:
+        return jsonify({'error': f'Request với Idempotency-Key {key} không tạo thanh toán nào'}), 404
+    return get_payment(record.payment_id)
+
 @app.route('/payments/<payment_id>/refund', methods=['POST'])
 def refund_payment(payment_id):
     """Hoàn tiền một giao dịch thanh toán"""
@@ -134,9 +180,9 @@ def refund_payment(payment_id):
             payment.refunded_at = datetime.now()
             payment.refund_reason = refund_reason
             db.session.commit()
-            logger.info(f"Đã hoàn tiền thanh toán {payment_id}")
+            logger.info("Đã hoàn tiền thanh toán %s", payment_id)
         else:
-            logger.error(f"Không thể hoàn tiền thanh toán {payment_id}")
+            logger.error("Không thể hoàn tiền thanh toán %s", payment_id)
             return jsonify({'error': 'Không thể xử lý yêu cầu hoàn tiền'}), 400
         
         return jsonify({
@@ -147,46 +193,70 @@ def refund_payment(payment_id):
         }), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi hoàn tiền thanh toán: {str(e)}")
+        logger.exception("Lỗi khi hoàn tiền thanh toán: %s", e)
         db.session.rollback()
         return jsonify({'error': f'Lỗi khi hoàn tiền thanh toán: {str(e)}'}), 500
 
+# Các field có thể chọn bằng ?fields= ở endpoint danh sách
+PAYMENT_FIELDS = {
+    'id': PaymentTransaction.id,
+    'amount': PaymentTransaction.amount,
+    'status': PaymentTransaction.status,
+    'payment_method': PaymentTransaction.payment_method,
+    'customer_id': PaymentTransaction.customer_id,
+    'created_at': PaymentTransaction.created_at,
+    'completed_at': PaymentTransaction.completed_at,
+    'refunded': PaymentTransaction.refunded
+}
+
+def filtered_payments():
+    """Query thanh toán theo filter customer_id, status của request"""
+    customer_id = request.args.get('customer_id')
+    status = request.args.get('status')
+    
+    # Tạo query
+    query = PaymentTransaction.query
+    
+    # Thêm filter nếu có
+    if customer_id:
+        query = query.filter_by(customer_id=customer_id)
+    if status:
+        query = query.filter_by(status=status)
+    return query
+
 @app.route('/payments', methods=['GET'])
 def list_payments():
-    """Lấy danh sách các giao dịch thanh toán"""
+    """
+    Lấy danh sách các giao dịch thanh toán (mới nhất trước), phân trang theo cursor.
+
+    Query: customer_id, status, limit, cursor (từ header X-Next-Cursor), fields
+    """
     try:
-        customer_id = request.args.get('customer_id')
-        status = request.args.get('status')
-        
-        # Tạo query
-        query = PaymentTransaction.query
-        
-        # Thêm filter nếu có
-        if customer_id:
-            query = query.filter_by(customer_id=customer_id)
-        if status:
-            query = query.filter_by(status=status)
-        
-        # Thực hiện query và lấy kết quả
-        payments = query.order_by(PaymentTransaction.created_at.desc()).all()
-        
-        result = [{
-            'id': payment.id,
-            'amount': payment.amount,
-            'status': payment.status,
-            'payment_method': payment.payment_method,
-            'customer_id': payment.customer_id,
-            'created_at': payment.created_at.isoformat(),
-            'completed_at': payment.completed_at.isoformat() if payment.completed_at else None,
-            'refunded': payment.refunded
-        } for payment in payments]
-        
-        return jsonify(result), 200
+        result, next_cursor = paginate(filtered_payments(), PAYMENT_FIELDS, PaymentTransaction.created_at,
+                                       PaymentTransaction.id, request.args)
+        return list_response(result, next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy danh sách thanh toán: {str(e)}")
+        logger.exception("Lỗi khi lấy danh sách thanh toán: %s", e)
         return jsonify({'error': f'Lỗi khi lấy danh sách thanh toán: {str(e)}'}), 500
 
+@app.route('/payments/export', methods=['GET'])
+def export_payments():
+    """
+    Xuất toàn bộ thanh toán dạng NDJSON (cũ nhất trước), stream theo từng chunk.
+
+    Query: customer_id, status, since, until (ISO 8601), cursor (_cursor của dòng cuối đã nhận), fields
+    """
+    try:
+        rows = export_rows(db.session, filtered_payments(), PAYMENT_FIELDS,
+                           PaymentTransaction.created_at, PaymentTransaction.id, request.args)
+        return ndjson_response(rows)
+        
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Kiểm tra trạng thái dịch vụ"""
@@ -202,7 +272,7 @@ def process_payment(payment):
     Xử lý giao dịch thanh toán (giả lập)
     Trong thực tế, đây là nơi tích hợp với các cổng thanh toán
     """
-    logger.info(f"Đang xử lý thanh toán {payment.id} với phương thức {payment.payment_method}")
+    logger.debug("Đang xử lý thanh toán %s với phương thức %s", payment.id, payment.payment_method)
     
     # Giả lập thành công 90% số giao dịch
     import random
@@ -213,7 +283,7 @@ def process_refund(payment):
     Xử lý hoàn tiền (giả lập)
     Trong thực tế, đây là nơi tích hợp với các cổng thanh toán
     """
-    logger.info(f"Đang xử lý hoàn tiền cho thanh toán {payment.id}")
+    logger.debug("Đang xử lý hoàn tiền cho thanh toán %s", payment.id)
     
     # Giả lập thành công 95% số yêu cầu hoàn tiền
     import random
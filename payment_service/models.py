@@ -7,6 +7,7 @@ class PaymentTransaction(db.Model):
     """Model cho các giao dịch thanh toán"""
     
     __tablename__ = 'payment_transactions'
+    __table_args__ = (db.Index('ix_payment_transactions_created_at_id', 'created_at', 'id'),)
     
     id = db.Column(db.String(20), primary_key=True)
     amount = db.Column(db.Float, nullable=False)
@@ -25,3 +26,21 @@ class PaymentTransaction(db.Model):
     
     def __repr__(self):
         return f"<Payment {self.id} - {self.amount} - {self.status}>"
+
+class IdempotencyRecord(db.Model):
+    """Kết quả của request POST /payments theo Idempotency-Key"""
+    
+    __tablename__ = 'idempotency_records'
+    
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    
+    # None khi request đầu tiên còn đang xử lý
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    payment_id = db.Column(db.String(20), nullable=True)
+    
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    
+    def __repr__(self):
+        return f"<IdempotencyRecord {self.key} - {self.status_code}>"
@@ -6,29 +6,14 @@ import signal
 import sys
 
 def run_service(command, service_name):
-    """Chạy một service và xuất log ra màn hình"""
+    """Chạy một service; service tự ghi log ra màn hình (và file nếu đặt LOG_DIR)"""
     print(f"Bắt đầu {service_name}...")
     
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        shell=True
-    )
+    # stdout/stderr kế thừa trực tiếp từ process cha, không chuyển qua pipe và thread đọc từng dòng
+    process = subprocess.Popen(command, shell=True)
     
     print(f"Đã bắt đầu {service_name} (PID: {process.pid})")
     
-    # Tạo một thread để đọc và hiển thị output
-    def log_output():
-        if process.stdout:  # Kiểm tra để tránh lỗi NoneType
-            for line in process.stdout:
-                print(f"[{service_name}] {line.strip()}")
-    
-    log_thread = threading.Thread(target=log_output)
-    log_thread.daemon = True
-    log_thread.start()
-    
     return process
 
 def main():
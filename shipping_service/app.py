@@ -1,13 +1,25 @@
 import os
+import sys
 import uuid
 import logging
 import json
 from datetime import datetime, timedelta
+
+# Package common/ (metrics, tracing, logging, phân trang) nằm ở thư mục gốc dự án;
+# thêm vào sys.path khi service được chạy trực tiếp từ thư mục của nó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from flask import Flask, jsonify, request
-from models import ShippingOrder, ShippingStatus, ShippingLocation, db
+from models import IdempotencyRecord, ShippingOrder, ShippingStatus, ShippingLocation, db
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing, current_trace_id
+from common.logging_config import configure_logging
+from common.pagination import PaginationError, ensure_indexes, list_response, paginate
+from common.export import export_rows, ndjson_response
+from common.idempotency import IdempotencyKeys
 
-# Cấu hình logging
-logging.basicConfig(level=logging.DEBUG)
+# Cấu hình logging (hàng đợi + thread nền, theo LOG_ENV/LOG_LEVEL/LOG_DIR)
+configure_logging('shipping', trace_id=current_trace_id)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -20,19 +32,42 @@ db.init_app(app)
 # Tạo bảng nếu chưa tồn tại
 with app.app_context():
     db.create_all()
+    ensure_indexes(db, ShippingOrder)
+
+# Đếm request, đo latency theo route và thời gian câu lệnh SQL, thêm GET /metrics
+instrument_app(app, db)
+
+# Nhận traceparent từ gateway, ghi span cho request và từng transaction database
+instrument_tracing(app, 'shipping', db)
+
+# Kết quả theo Idempotency-Key: thời gian giữ, thời gian request trùng chờ request đầu tiên
+# và lease của request đang xử lý (hết lease thì request gửi lại được xử lý lại)
+_idempotency = IdempotencyKeys(
+    db, IdempotencyRecord,
+    ttl=timedelta(seconds=int(os.environ.get('SHIPPING_IDEMPOTENCY_TTL', 86400))),
+    wait_timeout=float(os.environ.get('SHIPPING_IDEMPOTENCY_WAIT_TIMEOUT', 10)),
+    lease=timedelta(seconds=int(os.environ.get('SHIPPING_IDEMPOTENCY_LEASE', 60)))
+)
 
 @app.route('/shipping', methods=['POST'])
+@_idempotency.idempotent(record_field='shipping_id')
 def create_shipping():
-    """Tạo một đơn vận chuyển mới"""
-    data = request.json
-    
+    """
+    Tạo một đơn vận chuyển mới.
+
+    Request có header Idempotency-Key chỉ được xử lý một lần (xem IdempotencyKeys.idempotent).
+    """
+    return process_shipping_request(request.json)
+
+def process_shipping_request(data):
+    """Tạo đơn vận chuyển, trả về (body, status code)"""
     if not data:
-        return jsonify({'error': 'Không có dữ liệu được gửi'}), 400
+        return {'error': 'Không có dữ liệu được gửi'}, 400
     
     required_fields = ['customer_id', 'address', 'items']
     for field in required_fields:
         if field not in data:
-            return jsonify({'error': f'Thiếu trường dữ liệu: {field}'}), 400
+            return {'error': f'Thiếu trường dữ liệu: {field}'}, 400
     
     try:
         # Tạo một ID vận chuyển mới
@@ -79,21 +114,21 @@ def create_shipping():
         # Commit lần thứ hai để lưu các đối tượng liên quan
         db.session.commit()
         
-        logger.info(f"Đã tạo đơn vận chuyển mới: {shipping_id}")
+        logger.info("Đã tạo đơn vận chuyển mới: %s", shipping_id)
         
-        return jsonify({
+        return {
             'id': shipping.id,
             'customer_id': shipping.customer_id,
             'payment_id': shipping.payment_id,
             'status': shipping.status,
             'estimated_delivery': shipping.estimated_delivery.isoformat(),
             'created_at': shipping.created_at.isoformat()
-        }), 201
+        }, 201
         
     except Exception as e:
-        logger.exception(f"Lỗi khi tạo đơn vận chuyển: {str(e)}")
+        logger.exception("Lỗi khi tạo đơn vận chuyển: %s", e)
         db.session.rollback()
-        return jsonify({'error': f'Lỗi khi tạo đơn vận chuyển: {str(e)}'}), 500
+        return {'error': f'Lỗi khi tạo đơn vận chuyển: {str(e)}'}, 500
 
 @app.route('/shipping/<shipping_id>', methods=['GET'])
 def get_shipping(shipping_id):
@@ -140,9 +175,19 @@ def get_shipping(shipping_id):
         return jsonify(result), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy thông tin đơn vận chuyển: {str(e)}")
+        logger.exception("Lỗi khi lấy thông tin đơn vận chuyển: %s", e)
         return jsonify({'error': f'Lỗi khi lấy thông tin đơn vận chuyển: {str(e)}'}), 500
 
+@app.route('/shipping/by-key/<path:key>', methods=['GET'])
+def get_shipping_by_key(key):
+    """Lấy đơn vận chuyển đã tạo bởi request POST /shipping có Idempotency-Key này"""
+    record, error = _idempotency.lookup(key)
+    if error is not None:
+        return error
+    if record.shipping_id is None:
+        return jsonify({'error': f'Request với Idempotency-Key {key} không tạo đơn vận chuyển nào'}), 404
+    return get_shipping(record.shipping_id)
+
 @app.route('/shipping/<shipping_id>/update', methods=['PUT'])
 def update_shipping(shipping_id):
     """Cập nhật trạng thái đơn vận chuyển"""
@@ -199,7 +244,7 @@ def update_shipping(shipping_id):
         
         db.session.commit()
         
-        logger.info(f"Đã cập nhật trạng thái đơn vận chuyển {shipping_id} thành {new_status}")
+        logger.info("Đã cập nhật trạng thái đơn vận chuyển %s thành %s", shipping_id, new_status)
         
         return jsonify({
             'id': shipping.id,
@@ -208,45 +253,69 @@ def update_shipping(shipping_id):
         }), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi cập nhật trạng thái đơn vận chuyển: {str(e)}")
+        logger.exception("Lỗi khi cập nhật trạng thái đơn vận chuyển: %s", e)
         db.session.rollback()
         return jsonify({'error': f'Lỗi khi cập nhật trạng thái đơn vận chuyển: {str(e)}'}), 500
 
+# Các field có thể chọn bằng ?fields= ở endpoint danh sách
+SHIPPING_FIELDS = {
+    'id': ShippingOrder.id,
+    'customer_id': ShippingOrder.customer_id,
+    'payment_id': ShippingOrder.payment_id,
+    'status': ShippingOrder.status,
+    'estimated_delivery': ShippingOrder.estimated_delivery,
+    'delivered_at': ShippingOrder.delivered_at,
+    'created_at': ShippingOrder.created_at
+}
+
+def filtered_shipping():
+    """Query đơn vận chuyển theo filter customer_id, status của request"""
+    customer_id = request.args.get('customer_id')
+    status = request.args.get('status')
+    
+    # Tạo query
+    query = ShippingOrder.query
+    
+    # Thêm filter nếu có
+    if customer_id:
+        query = query.filter_by(customer_id=customer_id)
+    if status:
+        query = query.filter_by(status=status)
+    return query
+
 @app.route('/shipping', methods=['GET'])
 def list_shipping():
-    """Lấy danh sách các đơn vận chuyển"""
+    """
+    Lấy danh sách các đơn vận chuyển (mới nhất trước), phân trang theo cursor.
+
+    Query: customer_id, status, limit, cursor (từ header X-Next-Cursor), fields
+    """
     try:
-        customer_id = request.args.get('customer_id')
-        status = request.args.get('status')
-        
-        # Tạo query
-        query = ShippingOrder.query
-        
-        # Thêm filter nếu có
-        if customer_id:
-            query = query.filter_by(customer_id=customer_id)
-        if status:
-            query = query.filter_by(status=status)
-        
-        # Thực hiện query và lấy kết quả
-        shipping_orders = query.order_by(ShippingOrder.created_at.desc()).all()
-        
-        result = [{
-            'id': order.id,
-            'customer_id': order.customer_id,
-            'payment_id': order.payment_id,
-            'status': order.status,
-            'estimated_delivery': order.estimated_delivery.isoformat(),
-            'delivered_at': order.delivered_at.isoformat() if order.delivered_at else None,
-            'created_at': order.created_at.isoformat()
-        } for order in shipping_orders]
-        
-        return jsonify(result), 200
+        result, next_cursor = paginate(filtered_shipping(), SHIPPING_FIELDS, ShippingOrder.created_at,
+                                       ShippingOrder.id, request.args)
+        return list_response(result, next_cursor)
         
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception(f"Lỗi khi lấy danh sách đơn vận chuyển: {str(e)}")
+        logger.exception("Lỗi khi lấy danh sách đơn vận chuyển: %s", e)
         return jsonify({'error': f'Lỗi khi lấy danh sách đơn vận chuyển: {str(e)}'}), 500
 
+@app.route('/shipping/export', methods=['GET'])
+def export_shipping():
+    """
+    Xuất toàn bộ đơn vận chuyển dạng NDJSON (cũ nhất trước), stream theo từng chunk.
+
+    Query: customer_id, status, since, until (ISO 8601), cursor (_cursor của dòng cuối đã nhận), fields
+    """
+    try:
+        rows = export_rows(db.session, filtered_shipping(), SHIPPING_FIELDS,
+                           ShippingOrder.created_at, ShippingOrder.id, request.args)
+        return ndjson_response(rows)
+        
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/tracking/<shipping_id>', methods=['GET'])
 def track_shipping(shipping_id):
     """Theo dõi đơn vận chuyển (API công khai cho khách hàng)"""
@@ -288,7 +357,7 @@ def track_shipping(shipping_id):
         return jsonify(result), 200
         
     except Exception as e:
-        logger.exception(f"Lỗi khi theo dõi đơn vận chuyển: {str(e)}")
+        logger.exception("Lỗi khi theo dõi đơn vận chuyển: %s", e)
         return jsonify({'error': f'Lỗi khi theo dõi đơn vận chuyển: {str(e)}'}), 500
 
 @app.route('/health', methods=['GET'])
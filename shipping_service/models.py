@@ -7,6 +7,7 @@ class ShippingOrder(db.Model):
     """Model cho đơn vận chuyển"""
     
     __tablename__ = 'shipping_orders'
+    __table_args__ = (db.Index('ix_shipping_orders_created_at_id', 'created_at', 'id'),)
     
     id = db.Column(db.String(20), primary_key=True)
     customer_id = db.Column(db.String(50), nullable=False)
@@ -49,3 +50,21 @@ class ShippingLocation(db.Model):
     
     def __repr__(self):
         return f"<ShippingLocation {self.id} - {self.shipping_id} - {self.location}>"
+
+class IdempotencyRecord(db.Model):
+    """Kết quả của request POST /shipping theo Idempotency-Key"""
+    
+    __tablename__ = 'idempotency_records'
+    
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    
+    # None khi request đầu tiên còn đang xử lý
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    shipping_id = db.Column(db.String(20), nullable=True)
+    
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    
+    def __repr__(self):
+        return f"<IdempotencyRecord {self.key} - {self.status_code}>"
@@ -0,0 +1,100 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Không ghi trace ra đĩa, chỉ log cảnh báo trở lên khi chạy test
+os.environ.setdefault('TRACE_ENABLED', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+def load_service(directory):
+    """
+    Import app.py của một service (payment_service, inventory_service...).
+
+    Các service cùng có module top-level tên app và models, nên module của service
+    được bỏ khỏi sys.modules sau khi import để service khác import được bản của nó;
+    module trả về vẫn dùng bình thường.
+    """
+    service_dir = os.path.join(ROOT, directory)
+    local = [name[:-3] for name in os.listdir(service_dir) if name.endswith('.py')]
+    shadowed = {name: sys.modules.pop(name) for name in local if name in sys.modules}
+    sys.path.insert(0, service_dir)
+    try:
+        return importlib.import_module('app')
+    finally:
+        sys.path.remove(service_dir)
+        for name in local:
+            sys.modules.pop(name, None)
+        sys.modules.update(shadowed)
+
+class FakeResponse:
+    """Response tối thiểu (status_code, json(), text) thay cho response của requests/httpx"""
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+    @property
+    def text(self):
+        return str(self.body)
+
+@pytest.fixture
+def saga_store(tmp_path):
+    from utils.saga import SagaStore
+    return SagaStore(str(tmp_path / 'sagas.db'))
+
+@pytest.fixture(scope='session')
+def payment_service(tmp_path_factory):
+    path = tmp_path_factory.mktemp('payment')
+    os.environ['PAYMENT_DATABASE_URL'] = f"sqlite:///{path / 'payments.db'}"
+    os.environ['PAYMENT_IDEMPOTENCY_WAIT_TIMEOUT'] = '0.2'
+    os.environ['PAYMENT_IDEMPOTENCY_LEASE'] = '1'
+    return load_service('payment_service')
+
+@pytest.fixture
+def payment_client(payment_service, monkeypatch):
+    # Thanh toán giả lập thất bại ngẫu nhiên 10%: luôn thành công trong test
+    monkeypatch.setattr(payment_service, 'process_payment', lambda payment: True)
+    return payment_service.app.test_client()
+
+# Sản phẩm hot của inventory service trong test (trong dữ liệu mẫu; make_product tạo sản phẩm thường)
+HOT_PRODUCTS = (4, 5)
+
+@pytest.fixture(scope='session')
+def inventory_service(tmp_path_factory):
+    path = tmp_path_factory.mktemp('inventory')
+    os.environ['INVENTORY_DATABASE_URL'] = f"sqlite:///{path / 'inventory.db'}"
+    # Test gọi sweep_expired_reservations() và _hot_stock.flush() trực tiếp thay vì chờ thread nền
+    os.environ['INVENTORY_RESERVATION_SWEEP_INTERVAL'] = '3600'
+    os.environ['INVENTORY_HOT_PRODUCTS'] = ','.join(map(str, HOT_PRODUCTS))
+    os.environ['INVENTORY_HOT_JOURNAL'] = str(path / 'inventory_hot.journal')
+    os.environ['INVENTORY_HOT_FLUSH_INTERVAL'] = '3600'
+    return load_service('inventory_service')
+
+@pytest.fixture
+def inventory_client(inventory_service):
+    return inventory_service.app.test_client()
+
+@pytest.fixture
+def make_product(inventory_service):
+    """Tạo sản phẩm mới với tồn kho cho trước, trả về id (mỗi test dùng sản phẩm riêng)"""
+    def make(stock):
+        with inventory_service.app.app_context():
+            product = inventory_service.Product(name=f'Test {stock}', price=1000, stock=stock)
+            inventory_service.db.session.add(product)
+            inventory_service.db.session.commit()
+            return product.id
+    return make
+
+def product_stock(client, product_id):
+    return client.get(f'/products/{product_id}').get_json()['stock']
+
+def product_transactions(client, product_id):
+    return client.get(f'/transactions?product_id={product_id}').get_json()
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from bench import compare, histogram_quantile, percentile
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+
+    assert [percentile(values, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+def test_histogram_quantile_interpolates_within_bucket():
+    buckets = {0.1: 50, 0.5: 90, 1.0: 100, float('inf'): 100}
+
+    assert histogram_quantile(0.5, buckets) == pytest.approx(0.1)
+    assert histogram_quantile(0.7, buckets) == pytest.approx(0.3)
+    assert histogram_quantile(0.95, buckets) == pytest.approx(0.75)
+    assert histogram_quantile(0.5, {float('inf'): 0}) is None
+
+def test_histogram_quantile_in_overflow_bucket_returns_largest_bound():
+    assert histogram_quantile(0.99, {0.1: 10, 1.0: 90, float('inf'): 100}) == 1.0
+
+def write_result(path, p95_ms, throughput_rps):
+    route = {'p50_ms': 10.0, 'p95_ms': p95_ms, 'p99_ms': 40.0, 'throughput_rps': throughput_rps}
+    path.write_text(json.dumps({'throughput_rps': throughput_rps, 'routes': {'GET /api/products': route}}))
+    return str(path)
+
+@pytest.mark.parametrize('p95_ms, throughput_rps, regressed', [
+    (21.0, 100, False),
+    (30.0, 100, True),
+    (20.0, 80, True)
+])
+def test_compare_flags_slower_tail_or_lower_throughput(tmp_path, p95_ms, throughput_rps, regressed):
+    baseline = write_result(tmp_path / 'before.json', 20.0, 100)
+    current = write_result(tmp_path / 'after.json', p95_ms, throughput_rps)
+
+    assert compare(baseline, current, threshold=10) is regressed
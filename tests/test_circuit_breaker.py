@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitBreakerOpenException, SlidingWindow
+
+def fail():
+    raise ConnectionError('upstream down')
+
+def make_breaker(**kwargs):
+    kwargs.setdefault('failure_threshold', 4)
+    kwargs.setdefault('window_size', 4)
+    kwargs.setdefault('recovery_timeout', 0.05)
+    return CircuitBreaker(name='test', **kwargs)
+
+def test_opens_when_failure_rate_exceeds_threshold():
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.call(lambda: 'ok')
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+    assert breaker.state == CircuitBreaker.STATE_OPEN
+    with pytest.raises(CircuitBreakerOpenException):
+        breaker.call(lambda: 'ok')
+
+def test_stays_closed_below_minimum_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+    assert breaker.state == CircuitBreaker.STATE_CLOSED
+
+def test_half_open_probe_closes_breaker_on_success():
+    breaker = make_breaker(failure_threshold=1, window_size=1)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == CircuitBreaker.STATE_OPEN
+
+    time.sleep(0.1)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CircuitBreaker.STATE_CLOSED
+
+def test_half_open_probe_reopens_breaker_on_failure():
+    breaker = make_breaker(failure_threshold=1, window_size=1)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+
+    time.sleep(0.1)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.state == CircuitBreaker.STATE_OPEN
+
+def test_count_window_forgets_old_outcomes():
+    window = SlidingWindow(SlidingWindow.COUNT_BASED, window_size=3)
+    for failed in (True, True, False, False, False):
+        window.record(failed=failed, slow=False)
+
+    assert (window.total_calls, window.failed_calls) == (3, 0)
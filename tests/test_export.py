@@ -0,0 +1,81 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(2026, 1, 1)
+
+@pytest.fixture
+def chunk_size(inventory_service, monkeypatch):
+    """Chunk 2 dòng để vài dòng dữ liệu đã đi qua nhiều chunk"""
+    monkeypatch.setitem(inventory_service.export_rows.__globals__, 'EXPORT_CHUNK_SIZE', 2)
+    return 2
+
+@pytest.fixture
+def history(inventory_service, make_product):
+    """Sản phẩm mới với 5 giao dịch cách nhau một giờ; trả về (product_id, id các giao dịch)"""
+    product_id = make_product(10)
+    with inventory_service.app.app_context():
+        rows = [inventory_service.InventoryTransaction(
+            transaction_id=f'EXP-{index}', product_id=product_id, quantity=-1, prev_stock=10 - index,
+            new_stock=9 - index, transaction_type='order', created_at=START + timedelta(hours=index)
+        ) for index in range(5)]
+        inventory_service.db.session.add_all(rows)
+        inventory_service.db.session.commit()
+        return product_id, [row.id for row in rows]
+
+def export(client, product_id, headers=None, **params):
+    response = client.get('/transactions/export', query_string=dict(params, product_id=product_id),
+                          headers=headers or {})
+    assert response.status_code == 200
+    return response
+
+def lines(data):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+def test_export_streams_every_row_oldest_first_in_chunks(inventory_client, history, chunk_size):
+    product_id, ids = history
+
+    response = export(inventory_client, product_id, fields='id,transaction_id')
+
+    assert response.mimetype == 'application/x-ndjson'
+    rows = lines(response.get_data())
+    assert [row['id'] for row in rows] == ids
+    assert set(rows[0]) == {'id', 'transaction_id', '_cursor'}
+
+    chunks = list(inventory_client.get('/transactions/export', query_string={'product_id': product_id},
+                                       buffered=False).iter_encoded())
+    assert [len(lines(chunk)) for chunk in chunks] == [2, 2, 1]
+
+def test_export_resumes_after_cursor(inventory_client, history, chunk_size):
+    product_id, ids = history
+    rows = lines(export(inventory_client, product_id).get_data())
+
+    rest = lines(export(inventory_client, product_id, cursor=rows[1]['_cursor']).get_data())
+
+    assert [row['id'] for row in rest] == ids[2:]
+
+def test_since_is_inclusive_and_until_exclusive(inventory_client, history):
+    product_id, ids = history
+
+    rows = lines(export(inventory_client, product_id, since=(START + timedelta(hours=1)).isoformat(),
+                        until=(START + timedelta(hours=3)).isoformat()).get_data())
+
+    assert [row['id'] for row in rows] == ids[1:3]
+
+def test_gzip_output_decodes_to_same_rows(inventory_client, history, chunk_size):
+    product_id, _ = history
+    plain = export(inventory_client, product_id).get_data()
+
+    response = export(inventory_client, product_id, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert lines(gzip.decompress(response.get_data())) == lines(plain)
+
+@pytest.mark.parametrize('params', [{'since': 'yesterday'}, {'cursor': 'not-a-cursor'}, {'fields': 'id,password'}])
+def test_invalid_parameters_are_rejected_before_streaming(inventory_client, params):
+    response = inventory_client.get('/transactions/export', query_string=params)
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
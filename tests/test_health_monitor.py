@@ -0,0 +1,46 @@
+import asyncio
+
+from conftest import FakeResponse
+from utils.health_monitor import AsyncHealthMonitor, HealthMonitor
+
+class FakeClient:
+    """Client có service 'payment' không kết nối được"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, service, path, timeout=None):
+        self.calls.append(service)
+        if service == 'payment':
+            raise ConnectionError('payment down')
+        return FakeResponse(200, {'status': 'ok'})
+
+class FakeAsyncClient(FakeClient):
+    async def get(self, service, path, timeout=None):
+        return FakeClient.get(self, service, path, timeout)
+
+def assert_snapshot(monitor):
+    snapshot = monitor.snapshot()
+    assert snapshot['inventory']['status'] == 'up'
+    assert snapshot['inventory']['details'] == {'status': 'ok'}
+    assert snapshot['payment'] == dict(snapshot['payment'], status='down', details={}, stale=False)
+    assert all('latency_ms' in result and 'staleness_seconds' in result for result in snapshot.values())
+
+def test_refresh_probes_every_service():
+    monitor = HealthMonitor(FakeClient(), ['inventory', 'payment'])
+    assert not monitor.has_snapshot()
+
+    monitor.refresh()
+
+    assert monitor.has_snapshot()
+    assert_snapshot(monitor)
+
+def test_async_monitor_reads_cached_snapshot_until_refreshed():
+    client = FakeAsyncClient()
+    monitor = AsyncHealthMonitor(client, ['inventory', 'payment'])
+
+    asyncio.run(monitor.refresh_async())
+    assert_snapshot(monitor)
+    assert_snapshot(monitor)
+
+    assert sorted(client.calls) == ['inventory', 'payment']
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from common.metrics import _registry as metrics
+from utils.hedging import Hedger
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    hedger = Hedger(default_delay=0.02, min_delay=0.01)
+    calls = []
+
+    def read():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return 'primary'
+        return 'hedge'
+
+    assert hedger.execute(('inventory', 'get_products'), read) == 'hedge'
+
+    stats = hedger.get_stats()
+    assert (stats['hedged'], stats['hedge_wins']) == (1, 1)
+    assert all(name.startswith('hedge') for name in calls)
+
+def test_saturated_pool_runs_on_caller_thread_without_hedge():
+    hedger = Hedger(default_delay=0.01, min_delay=0.01, max_workers=1)
+    release = threading.Event()
+    blocker = threading.Thread(target=hedger.execute, args=('key', lambda: release.wait(5)))
+    blocker.start()
+    while hedger.get_stats()['busy'] < 1:
+        time.sleep(0.001)
+
+    try:
+        assert hedger.execute('key', threading.current_thread) is threading.current_thread()
+    finally:
+        release.set()
+        blocker.join()
+
+    stats = hedger.get_stats()
+    assert stats['saturated'] == 1
+    assert stats['busy'] == 0
+
+def test_hedging_counters_are_exported():
+    rendered = metrics.render()
+    assert 'gateway_hedge_requests_total' in rendered
+    assert 'gateway_hedge_wins_total{winner="hedge"}' in rendered
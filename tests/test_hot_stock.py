@@ -0,0 +1,84 @@
+from conftest import HOT_PRODUCTS, product_stock, product_transactions
+
+HOT = HOT_PRODUCTS[0]
+
+def database_stock(inventory_service, product_id):
+    with inventory_service.app.app_context():
+        return inventory_service.db.session.get(inventory_service.Product, product_id).stock
+
+def test_failed_update_gives_back_hot_stock_without_transactions(inventory_service, inventory_client, make_product):
+    cold = make_product(1)
+    before = product_stock(inventory_client, HOT)
+    transactions_before = len(product_transactions(inventory_client, HOT))
+
+    response = inventory_client.post('/update', json=[{'product_id': HOT, 'quantity': 2},
+                                                      {'product_id': cold, 'quantity': 5}])
+    inventory_service._hot_stock.flush()
+
+    assert response.status_code == 400
+    assert product_stock(inventory_client, HOT) == before
+    assert database_stock(inventory_service, HOT) == before
+    assert len(product_transactions(inventory_client, HOT)) == transactions_before
+
+def test_successful_update_records_hot_stock_once(inventory_service, inventory_client, make_product):
+    cold = make_product(5)
+    before = product_stock(inventory_client, HOT)
+
+    response = inventory_client.post('/update', json=[{'product_id': HOT, 'quantity': 2},
+                                                      {'product_id': cold, 'quantity': 1}])
+    inventory_service._hot_stock.flush()
+
+    assert response.status_code == 200
+    assert product_stock(inventory_client, HOT) == before - 2
+    assert database_stock(inventory_service, HOT) == before - 2
+    transaction_id = response.get_json()['transaction_id']
+    rows = [t for t in product_transactions(inventory_client, HOT) if t['transaction_id'] == transaction_id]
+    assert [(t['quantity'], t['transaction_type'], t['new_stock']) for t in rows] == [(-2, 'order', before - 2)]
+
+def test_short_hot_product_rejects_whole_update(inventory_client, make_product):
+    cold = make_product(5)
+    before = product_stock(inventory_client, HOT)
+
+    response = inventory_client.post('/update', json=[{'product_id': HOT, 'quantity': before + 1},
+                                                      {'product_id': cold, 'quantity': 1}])
+
+    assert response.status_code == 400
+    assert product_stock(inventory_client, HOT) == before
+    assert product_stock(inventory_client, cold) == 5
+
+def test_failed_reservation_gives_back_hot_stock(inventory_client, make_product):
+    cold = make_product(1)
+    before = product_stock(inventory_client, HOT)
+
+    response = inventory_client.post('/reservations', json={'items': [{'product_id': HOT, 'quantity': 1},
+                                                                      {'product_id': cold, 'quantity': 2}]})
+
+    assert response.status_code == 400
+    assert product_stock(inventory_client, HOT) == before
+
+def test_released_reservation_gives_back_hot_stock(inventory_client):
+    before = product_stock(inventory_client, HOT)
+    reservation = inventory_client.post('/reservations', json={'items': [{'product_id': HOT, 'quantity': 1}]}).get_json()
+    assert product_stock(inventory_client, HOT) == before - 1
+
+    inventory_client.post(f"/reservations/{reservation['id']}/release")
+
+    assert product_stock(inventory_client, HOT) == before
+
+def test_unflushed_journal_is_replayed_on_restart(inventory_service, tmp_path):
+    HotStockStore = type(inventory_service._hot_stock)
+    persisted = []
+
+    def make_store(checkpoint):
+        return HotStockStore([1], str(tmp_path / 'hot.journal'), load_stock=lambda ids: {1: 10},
+                             persist=persisted.extend, checkpoint=lambda: checkpoint, flush_interval=3600)
+
+    crashed = make_store(checkpoint=0)
+    crashed.apply({1: -3}, 'INV-1', 'order')
+    crashed.apply({1: -2}, 'INV-2', 'order')
+    # Process chết trước khi ghi xuống database: giải phóng journal cho process mới
+    crashed._lock_file.close()
+
+    make_store(checkpoint=1).ensure_started()
+
+    assert [(record['seq'], record['tx']) for record in persisted] == [(2, 'INV-2')]
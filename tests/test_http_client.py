@@ -0,0 +1,63 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from utils.http_client import UpstreamClient
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Trả về 'ok' sau số giây ghi trong path, giữ kết nối keep-alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(float(self.path.strip('/') or 0))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+def test_sequential_requests_reuse_one_connection(upstream):
+    client = UpstreamClient({'inventory': upstream})
+    for _ in range(5):
+        assert client.get('inventory', '/').text == 'ok'
+
+    stats = client.get_stats()['services']['inventory']
+    assert stats['requests'] == 5
+    assert stats['in_flight'] == 0
+    assert stats['open_connections'] == 1
+    assert stats['idle_connections'] == 1
+    client.close()
+
+def test_in_flight_counts_concurrent_requests(upstream):
+    client = UpstreamClient({'inventory': upstream}, pool_maxsize=4)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: client.get('inventory', '/0.2'), range(4)))
+
+    stats = client.get_stats()['services']['inventory']
+    assert stats['max_in_flight'] == 4
+    assert stats['in_flight'] == 0
+    assert stats['idle_connections'] == 4
+    client.close()
+
+def test_failed_request_is_counted_and_leaves_flight():
+    client = UpstreamClient({'inventory': 'http://127.0.0.1:1'})
+    with pytest.raises(requests.ConnectionError):
+        client.get('inventory', '/')
+
+    stats = client.get_stats()['services']['inventory']
+    assert (stats['requests'], stats['errors'], stats['in_flight']) == (1, 1, 0)
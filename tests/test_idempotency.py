@@ -0,0 +1,97 @@
+import uuid
+import hashlib
+import json
+import functools
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import FakeResponse
+from orders import payment_step, retry_order_data, step_key, sync_step
+from utils.saga import COMPENSATED, COMPLETED, SagaExistsError, SagaOrchestrator, SagaStep, SagaStepError
+
+PAYMENT = {'amount': 100000, 'payment_method': 'credit_card', 'customer_id': 'C1'}
+
+def post_payment(client, key, body=PAYMENT):
+    return client.post('/payments', json=body, headers={'Idempotency-Key': key})
+
+def test_retry_with_same_key_replays_first_payment(payment_client):
+    key = uuid.uuid4().hex
+    first = post_payment(payment_client, key)
+    retry = post_payment(payment_client, key)
+
+    assert first.status_code == 201
+    assert retry.status_code == 201
+    assert retry.get_json()['id'] == first.get_json()['id']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert payment_client.get(f'/payments/by-key/{key}').get_json()['id'] == first.get_json()['id']
+
+def test_same_key_with_different_body_is_rejected(payment_client):
+    key = uuid.uuid4().hex
+    post_payment(payment_client, key)
+
+    response = post_payment(payment_client, key, dict(PAYMENT, amount=1))
+    assert response.status_code == 422
+
+def test_in_progress_key_is_taken_over_after_lease(payment_service, payment_client):
+    key = uuid.uuid4().hex
+    request_hash = hashlib.sha256(json.dumps(PAYMENT).encode()).hexdigest()
+    record_model = payment_service.IdempotencyRecord
+
+    with payment_service.app.app_context():
+        # Worker giữ key đã chết trước khi lưu kết quả
+        payment_service.db.session.add(record_model(key=key, request_hash=request_hash))
+        payment_service.db.session.commit()
+
+    # Trong lease: request gửi lại chờ rồi nhận 409
+    assert payment_client.post('/payments', data=json.dumps(PAYMENT), content_type='application/json',
+                               headers={'Idempotency-Key': key}).status_code == 409
+
+    with payment_service.app.app_context():
+        record = payment_service.db.session.get(record_model, key)
+        record.created_at = datetime.now() - timedelta(seconds=5)
+        payment_service.db.session.commit()
+
+    response = payment_client.post('/payments', data=json.dumps(PAYMENT), content_type='application/json',
+                                   headers={'Idempotency-Key': key})
+    assert response.status_code == 201
+    with payment_service.app.app_context():
+        assert payment_service.db.session.get(record_model, key).payment_id == response.get_json()['id']
+
+def test_order_retried_after_transient_failure_uses_new_step_keys(saga_store):
+    keys = []
+    payment_up = []
+
+    def call_service(service, method, path, **kwargs):
+        keys.append(kwargs['headers']['Idempotency-Key'])
+        if not payment_up:
+            raise ConnectionError('payment service down')
+        return FakeResponse(201, {'id': 'PAY-1'})
+
+    orchestrator = SagaOrchestrator(saga_store, compensation_base_delay=0)
+    orchestrator.define('create_order', [SagaStep('payment', sync_step(payment_step, call_service))])
+    data = dict(PAYMENT, total_amount=100000, order_id='ORD-1')
+    retry = functools.partial(retry_order_data, data=data)
+
+    saga = orchestrator.start('create_order', data, saga_id='ORD-1', retry_data=retry)
+    assert saga['status'] == COMPENSATED
+
+    payment_up.append(True)
+    saga = orchestrator.start('create_order', data, saga_id='ORD-1', retry_data=retry)
+
+    assert saga['status'] == COMPLETED
+    assert keys == ['ORD-1:payment', 'ORD-1:payment:2']
+    assert step_key(saga['data'], 'payment') == 'ORD-1:payment:2'
+
+def test_rejected_order_is_not_retried(saga_store):
+    def declined(data, results):
+        raise SagaStepError('declined', 402, {'error': 'declined'})
+
+    orchestrator = SagaOrchestrator(saga_store)
+    orchestrator.define('create_order', [SagaStep('payment', declined)])
+    data = {'order_id': 'ORD-1'}
+    retry = functools.partial(retry_order_data, data=data)
+
+    orchestrator.start('create_order', data, saga_id='ORD-1', retry_data=retry)
+    with pytest.raises(SagaExistsError):
+        orchestrator.start('create_order', data, saga_id='ORD-1', retry_data=retry)
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import product_stock, product_transactions
+
+def update(client, items):
+    return client.post('/update', json=items)
+
+def test_update_takes_stock_of_every_item(inventory_client, make_product):
+    first, second = make_product(10), make_product(4)
+
+    response = update(inventory_client, [{'product_id': first, 'quantity': 3},
+                                         {'product_id': second, 'quantity': 4}])
+
+    assert response.status_code == 200
+    assert product_stock(inventory_client, first) == 7
+    assert product_stock(inventory_client, second) == 0
+    transactions = product_transactions(inventory_client, first)
+    assert [(t['quantity'], t['transaction_type']) for t in transactions] == [(-3, 'order')]
+
+def test_update_changes_nothing_when_one_item_is_short(inventory_client, make_product):
+    first, second = make_product(10), make_product(1)
+
+    response = update(inventory_client, [{'product_id': first, 'quantity': 3},
+                                         {'product_id': second, 'quantity': 2}])
+
+    assert response.status_code == 400
+    assert [item['product_id'] for item in response.get_json()['items']] == [second]
+    assert product_stock(inventory_client, first) == 10
+    assert product_stock(inventory_client, second) == 1
+    assert product_transactions(inventory_client, first) == []
+
+def test_update_changes_nothing_when_a_product_does_not_exist(inventory_client, make_product):
+    product_id = make_product(10)
+
+    response = update(inventory_client, [{'product_id': product_id, 'quantity': 1},
+                                         {'product_id': 999999, 'quantity': 1}])
+
+    assert response.status_code == 400
+    assert product_stock(inventory_client, product_id) == 10
+
+def test_quantities_of_repeated_product_are_summed(inventory_client, make_product):
+    product_id = make_product(3)
+
+    response = update(inventory_client, [{'product_id': product_id, 'quantity': 2},
+                                         {'product_id': product_id, 'quantity': 2}])
+
+    assert response.status_code == 400
+    assert product_stock(inventory_client, product_id) == 3
+
+def test_concurrent_updates_never_oversell(inventory_service, make_product):
+    product_id = make_product(5)
+
+    def buy(_):
+        with inventory_service.app.test_client() as client:
+            return update(client, [{'product_id': product_id, 'quantity': 1}]).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(buy, range(12)))
+
+    assert statuses.count(200) == 5
+    assert statuses.count(400) == 7
+    assert product_stock(inventory_service.app.test_client(), product_id) == 0
@@ -0,0 +1,54 @@
+import json
+import queue
+import logging
+
+from common.logging_config import DebugSampler, JsonFormatter, NonBlockingQueueHandler
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+def test_full_queue_drops_records_instead_of_blocking():
+    log_queue = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(log_queue)
+    logger = make_logger('test.full_queue', handler)
+
+    # Không có QueueListener đọc hàng đợi: put chặn sẽ treo test
+    for index in range(5):
+        logger.info('request %d', index)
+
+    assert handler.dropped == 3
+    assert [log_queue.get_nowait().msg for _ in range(2)] == ['request 0', 'request 1']
+
+def test_record_is_formatted_before_queueing_with_trace_id():
+    log_queue = queue.Queue()
+    logger = make_logger('test.prepare', NonBlockingQueueHandler(log_queue, trace_id=lambda: 'a' * 32))
+    items = ['x']
+
+    logger.info('items %s', items)
+    items.append('y')
+
+    record = log_queue.get_nowait()
+    assert (record.msg, record.args, record.trace_id) == ("items ['x']", None, 'a' * 32)
+
+def test_json_formatter_includes_trace_id_and_extra_fields():
+    log_queue = queue.Queue()
+    logger = make_logger('test.json', NonBlockingQueueHandler(log_queue, trace_id=lambda: 'abc'))
+    logger.warning('slow call', extra={'upstream': 'inventory', 'duration_ms': 812})
+
+    entry = json.loads(JsonFormatter('api_gateway').format(log_queue.get_nowait()))
+
+    assert entry['msg'] == 'slow call'
+    assert entry['level'] == 'WARNING'
+    assert entry['trace_id'] == 'abc'
+    assert (entry['upstream'], entry['duration_ms']) == ('inventory', 812)
+
+def test_debug_sampler_keeps_other_levels():
+    sampler = DebugSampler(0)
+    record = lambda level: logging.LogRecord('test', level, '', 0, 'msg', None, None)
+
+    assert not sampler.filter(record(logging.DEBUG))
+    assert sampler.filter(record(logging.INFO))
@@ -0,0 +1,63 @@
+import re
+import threading
+
+from flask import Flask
+
+from common.metrics import MetricsRegistry, instrument_app
+
+def samples(text, name):
+    """Các dòng mẫu (không phải # HELP/# TYPE) của metric name"""
+    return [line for line in text.splitlines() if re.match(rf'{name}[{{ ]', line)]
+
+def test_counter_sums_all_threads_and_escapes_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter('jobs_total', 'Số job', ('queue',))
+
+    threads = [threading.Thread(target=lambda: [counter.inc('a"b') for _ in range(100)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    text = registry.render()
+    assert '# HELP jobs_total Số job\n# TYPE jobs_total counter\n' in text
+    assert samples(text, 'jobs_total') == ['jobs_total{queue="a\\"b"} 400']
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3):
+        latency.observe(value)
+
+    assert samples(registry.render(), 'latency_seconds_bucket') == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4'
+    ]
+    assert samples(registry.render(), 'latency_seconds_sum') == ['latency_seconds_sum 4.05']
+    assert samples(registry.render(), 'latency_seconds_count') == ['latency_seconds_count 4']
+
+def test_collector_is_rendered_at_scrape_time():
+    registry = MetricsRegistry()
+    in_flight = [3]
+    registry.add_collector(lambda: [('in_flight', 'gauge', 'Đang chạy', [({'service': 'inventory'}, in_flight[0])])])
+
+    assert samples(registry.render(), 'in_flight') == ['in_flight{service="inventory"} 3']
+    in_flight[0] = 1
+    assert samples(registry.render(), 'in_flight') == ['in_flight{service="inventory"} 1']
+
+def test_metrics_endpoint_counts_requests_by_route():
+    app = Flask(__name__)
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+    instrument_app(app)
+    client = app.test_client()
+    for _ in range(2):
+        client.get('/ping')
+
+    response = client.get('/metrics')
+
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_requests_total counter' in text
+    assert 'http_requests_total{route="ping",method="GET",status="200"} 2' in samples(text, 'http_requests_total')
+    assert 'http_request_duration_seconds_count{route="ping",method="GET"} 2' in text
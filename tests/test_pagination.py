@@ -0,0 +1,47 @@
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def all_pages(client, path, **params):
+    """Đọc hết các trang của một endpoint danh sách, trả về (các dòng, số trang)"""
+    rows, pages = [], 0
+    while True:
+        response = client.get(path, query_string=params)
+        assert response.status_code == 200
+        rows.extend(response.get_json())
+        pages += 1
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            return rows, pages
+        params['cursor'] = cursor
+
+def test_pages_cover_every_product_once_newest_first(inventory_service, inventory_client, make_product):
+    for stock in range(5):
+        make_product(stock)
+    with inventory_service.app.app_context():
+        total = inventory_service.Product.query.count()
+
+    rows, pages = all_pages(inventory_client, '/products', limit=2, fields='id,created_at')
+
+    ids = [row['id'] for row in rows]
+    assert len(ids) == len(set(ids)) == total
+    assert pages == (total + 1) // 2
+    keys = [(row['created_at'], row['id']) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+
+def test_rows_added_between_pages_are_not_repeated(inventory_client, make_product):
+    first = inventory_client.get('/products', query_string={'limit': 3, 'fields': 'id'})
+    seen = [row['id'] for row in first.get_json()]
+    make_product(1)
+
+    rest, _ = all_pages(inventory_client, '/products', limit=3, fields='id', cursor=first.headers[NEXT_CURSOR_HEADER])
+
+    assert not set(seen) & {row['id'] for row in rest}
+
+def test_fields_selects_only_requested_columns(inventory_client):
+    rows = inventory_client.get('/products', query_string={'limit': 1, 'fields': 'id,stock'}).get_json()
+
+    assert set(rows[0]) == {'id', 'stock'}
+
+def test_invalid_parameters_are_rejected(inventory_client):
+    assert inventory_client.get('/products', query_string={'cursor': 'not-a-cursor'}).status_code == 400
+    assert inventory_client.get('/products', query_string={'fields': 'id,password'}).status_code == 400
+    assert inventory_client.get('/products', query_string={'limit': 'many'}).status_code == 400
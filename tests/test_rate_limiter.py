@@ -0,0 +1,56 @@
+import pytest
+
+from utils.rate_limiter import RateLimiter
+
+@pytest.mark.parametrize('algorithm', [RateLimiter.ALGORITHM_SLIDING_WINDOW, RateLimiter.ALGORITHM_TOKEN_BUCKET])
+def test_rejects_requests_over_limit(algorithm):
+    limiter = RateLimiter(algorithm=algorithm)
+    allowed = [limiter.is_allowed('10.0.0.1', limit=3, period=60, route='orders') for _ in range(5)]
+
+    assert allowed == [True, True, True, False, False]
+    assert limiter.get_stats()['rejected'] == 2
+
+def test_limits_are_per_client_and_route():
+    limiter = RateLimiter()
+    assert limiter.is_allowed('10.0.0.1', limit=1, period=60, route='orders')
+    assert not limiter.is_allowed('10.0.0.1', limit=1, period=60, route='orders')
+
+    assert limiter.is_allowed('10.0.0.2', limit=1, period=60, route='orders')
+    assert limiter.is_allowed('10.0.0.1', limit=1, period=60, route='products')
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('utils.rate_limiter.time.time', lambda: now[0])
+    limiter = RateLimiter(algorithm=RateLimiter.ALGORITHM_TOKEN_BUCKET)
+    for _ in range(2):
+        assert limiter.is_allowed('client', limit=2, period=10)
+    assert not limiter.is_allowed('client', limit=2, period=10)
+
+    now[0] += 5
+    assert limiter.is_allowed('client', limit=2, period=10)
+    assert not limiter.is_allowed('client', limit=2, period=10)
+
+def test_sliding_window_weights_previous_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('utils.rate_limiter.time.time', lambda: now[0])
+    limiter = RateLimiter()
+    for _ in range(4):
+        assert limiter.is_allowed('client', limit=4, period=10)
+
+    # Đầu cửa sổ mới: 4 request của cửa sổ trước vẫn trọn vẹn trong cửa sổ trượt
+    now[0] = 1010.0
+    assert not limiter.is_allowed('client', limit=4, period=10)
+
+    # Giữa cửa sổ mới: chỉ còn một nửa của cửa sổ trước được tính
+    now[0] = 1015.0
+    assert limiter.is_allowed('client', limit=4, period=10)
+    assert limiter.is_allowed('client', limit=4, period=10)
+    assert not limiter.is_allowed('client', limit=4, period=10)
+
+def test_number_of_tracked_clients_is_bounded():
+    limiter = RateLimiter(max_keys=16, shards=1)
+    for client in range(100):
+        limiter.is_allowed(f'10.0.0.{client}', limit=5, period=60)
+
+    assert limiter.get_stats()['keys'] == 16
+    assert limiter.get_stats()['evicted'] == 84
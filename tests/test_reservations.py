@@ -0,0 +1,77 @@
+import time
+
+from conftest import product_stock
+
+def reserve(client, items, ttl=300, key=None):
+    headers = {'Idempotency-Key': key} if key else {}
+    return client.post('/reservations', json={'items': items, 'ttl': ttl}, headers=headers)
+
+def test_reservation_holds_stock_for_all_items_or_none(inventory_client, make_product):
+    plenty, scarce = make_product(10), make_product(1)
+
+    response = reserve(inventory_client, [{'product_id': plenty, 'quantity': 3},
+                                          {'product_id': scarce, 'quantity': 2}])
+    assert response.status_code == 400
+    assert product_stock(inventory_client, plenty) == 10
+    assert product_stock(inventory_client, scarce) == 1
+
+    response = reserve(inventory_client, [{'product_id': plenty, 'quantity': 3},
+                                          {'product_id': scarce, 'quantity': 1}])
+    assert response.status_code == 201
+    assert response.get_json()['status'] == 'held'
+    assert product_stock(inventory_client, plenty) == 7
+    assert product_stock(inventory_client, scarce) == 0
+
+def test_expired_reservation_is_swept_and_stock_returned(inventory_service, inventory_client, make_product):
+    product_id = make_product(5)
+    reservation = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}], ttl=0.05).get_json()
+    assert product_stock(inventory_client, product_id) == 3
+
+    time.sleep(0.1)
+    inventory_service.sweep_expired_reservations()
+
+    assert inventory_client.get(f"/reservations/{reservation['id']}").get_json()['status'] == 'expired'
+    assert product_stock(inventory_client, product_id) == 5
+
+def test_confirming_expired_reservation_fails_and_returns_stock(inventory_client, make_product):
+    product_id = make_product(5)
+    reservation = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}], ttl=0.05).get_json()
+
+    time.sleep(0.1)
+    response = inventory_client.post(f"/reservations/{reservation['id']}/confirm")
+
+    assert response.status_code == 409
+    assert response.get_json()['status'] == 'expired'
+    assert product_stock(inventory_client, product_id) == 5
+
+def test_confirmed_reservation_does_not_expire(inventory_service, inventory_client, make_product):
+    product_id = make_product(5)
+    reservation = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}], ttl=0.2).get_json()
+    assert inventory_client.post(f"/reservations/{reservation['id']}/confirm").status_code == 200
+
+    time.sleep(0.3)
+    inventory_service.sweep_expired_reservations()
+
+    assert inventory_client.get(f"/reservations/{reservation['id']}").get_json()['status'] == 'confirmed'
+    assert product_stock(inventory_client, product_id) == 3
+
+def test_release_is_idempotent(inventory_client, make_product):
+    product_id = make_product(5)
+    reservation = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}]).get_json()
+
+    for _ in range(2):
+        response = inventory_client.post(f"/reservations/{reservation['id']}/release")
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'released'
+    assert product_stock(inventory_client, product_id) == 5
+
+def test_same_key_returns_existing_reservation(inventory_client, make_product):
+    product_id = make_product(5)
+    first = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}], key='ORD-1:inventory')
+    retry = reserve(inventory_client, [{'product_id': product_id, 'quantity': 2}], key='ORD-1:inventory')
+
+    assert first.status_code == 201
+    assert retry.status_code == 200
+    assert retry.get_json()['id'] == first.get_json()['id']
+    assert product_stock(inventory_client, product_id) == 3
+    assert inventory_client.get('/reservations/by-key/ORD-1:inventory').get_json()['id'] == first.get_json()['id']
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from utils.response_cache import ResponseCache, SharedResponseCache
+from utils.shared_state import SharedStateStore, SharedStateSyncer
+
+@pytest.fixture
+def shared_syncer(tmp_path):
+    return SharedStateSyncer(SharedStateStore(str(tmp_path / 'shared.db')))
+
+@pytest.fixture(params=['local', 'shared'])
+def cache(request, shared_syncer):
+    if request.param == 'local':
+        return ResponseCache(max_entries=10)
+    return SharedResponseCache(shared_syncer, max_entries=10)
+
+def test_entry_is_served_until_it_expires(cache):
+    cache.set('/api/products', b'[]', 200, 'application/json', ttl=0.1)
+    assert cache.get('/api/products').body == b'[]'
+
+    time.sleep(0.15)
+    assert cache.get('/api/products') is None
+
+def test_invalidate_removes_entries_under_prefix(cache):
+    cache.set('/api/products?limit=5', b'[]', 200, 'application/json', ttl=30)
+    cache.set('/api/products/1', b'{}', 200, 'application/json', ttl=30)
+    cache.set('/api/payments', b'[]', 200, 'application/json', ttl=30)
+
+    cache.invalidate('/api/products')
+
+    assert cache.get('/api/products?limit=5') is None
+    assert cache.get('/api/products/1') is None
+    assert cache.get('/api/payments') is not None
+
+def test_response_fetched_before_invalidate_is_not_stored(cache):
+    generation = cache.current_generation()
+    cache.invalidate('/api/products')
+
+    cache.set('/api/products', b'stale', 200, 'application/json', ttl=30, generation=generation)
+
+    assert cache.get('/api/products') is None
+
+def test_number_of_entries_is_bounded(cache):
+    for index in range(10):
+        cache.set(f'/api/products/{index}', b'{}', 200, 'application/json', ttl=30 + index)
+
+    cache.set('/api/products/10', b'{}', 200, 'application/json', ttl=60)
+
+    assert cache.get('/api/products/10') is not None
+    assert cache.get_stats()['entries'] == 10
+
+def test_invalidate_in_one_worker_is_seen_by_others(shared_syncer):
+    worker_a = SharedResponseCache(shared_syncer)
+    worker_b = SharedResponseCache(shared_syncer)
+    worker_a.set('/api/products', b'[]', 200, 'application/json', ttl=30)
+    assert worker_b.get('/api/products') is not None
+
+    worker_b.invalidate('/api/products')
+
+    assert worker_a.get('/api/products') is None
+
+def test_local_cache_evicts_least_recently_used_entry():
+    cache = ResponseCache(max_entries=2)
+    cache.set('/api/products/1', b'{}', 200, 'application/json', ttl=30)
+    cache.set('/api/products/2', b'{}', 200, 'application/json', ttl=30)
+    cache.get('/api/products/1')
+
+    cache.set('/api/products/3', b'{}', 200, 'application/json', ttl=30)
+
+    assert cache.get('/api/products/2') is None
+    assert cache.get('/api/products/1') is not None
@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import FakeResponse
+from orders import confirm_inventory_step, release_inventory_step, refund_payment_step, sync_step
+from utils.saga import (COMPENSATED, COMPENSATING, COMPLETED, NEEDS_ATTENTION, RUNNING, SagaOrchestrator,
+                        SagaStep, SagaStepError)
+
+class Crash(BaseException):
+    """Process chết giữa một bước (không đi qua except Exception của orchestrator)"""
+
+def make_orchestrator(store, **kwargs):
+    kwargs.setdefault('compensation_base_delay', 0)
+    return SagaOrchestrator(store, **kwargs)
+
+def action(calls, name, result=None, error=None):
+    """Bước saga ghi tên vào calls rồi trả về result (hoặc raise error)"""
+    def run(data, results):
+        calls.append(name)
+        if error is not None:
+            raise error
+        return result
+    return run
+
+def undo(calls, name):
+    """Compensation của bước name, ghi lại kết quả của bước mà nó nhận được"""
+    def run(data, results):
+        calls.append(('undo', name, results[name]))
+    return run
+
+def test_resume_after_crash_skips_completed_steps(saga_store):
+    calls = []
+    crashed = []
+
+    def ship(data, results):
+        if not crashed:
+            crashed.append(True)
+            raise Crash()
+        calls.append('ship')
+        return {'id': 'SHP-1'}
+
+    steps = [
+        SagaStep('pay', action(calls, 'pay', {'id': 'PAY-1'})),
+        SagaStep('ship', ship)
+    ]
+    first = make_orchestrator(saga_store, lease=0.05)
+    first.define('order', steps)
+    with pytest.raises(Crash):
+        first.start('order', {}, saga_id='S1')
+    assert saga_store.get('S1')['status'] == RUNNING
+
+    # Worker khác nhận lại saga khi lease của worker đã chết hết hạn
+    second = make_orchestrator(saga_store, lease=60)
+    second.define('order', steps)
+    assert second.store.claim_due(60) == []
+    time.sleep(0.1)
+    assert second.store.claim_due(60) == ['S1']
+    saga = second.run('S1')
+
+    assert saga['status'] == COMPLETED
+    assert saga['results'] == {'pay': {'id': 'PAY-1'}, 'ship': {'id': 'SHP-1'}}
+    assert calls == ['pay', 'ship']
+
+def test_rejected_step_compensates_previous_steps_in_reverse(saga_store):
+    calls = []
+    orchestrator = make_orchestrator(saga_store)
+    orchestrator.define('order', [
+        SagaStep('reserve', action(calls, 'reserve', {'id': 'R'}), undo(calls, 'reserve')),
+        SagaStep('pay', action(calls, 'pay', {'id': 'P'}), undo(calls, 'pay')),
+        SagaStep('ship', action(calls, 'ship', error=SagaStepError('rejected', 422, {'error': 'address'})),
+                 undo(calls, 'ship'))
+    ])
+
+    saga = orchestrator.start('order', {}, saga_id='S1')
+    assert saga['status'] == COMPENSATING
+    saga = orchestrator.run('S1')
+
+    assert saga['status'] == COMPENSATED
+    assert saga['error']['status_code'] == 422
+    # Bước bị từ chối không có gì để bù trừ
+    assert calls[3:] == [('undo', 'pay', {'id': 'P'}), ('undo', 'reserve', {'id': 'R'})]
+
+def test_step_with_unknown_outcome_is_compensated(saga_store):
+    calls = []
+    orchestrator = make_orchestrator(saga_store)
+    orchestrator.define('order', [
+        SagaStep('reserve', action(calls, 'reserve', {'id': 'R'}), undo(calls, 'reserve')),
+        SagaStep('pay', action(calls, 'pay', error=ConnectionError('timeout')), undo(calls, 'pay'))
+    ])
+
+    saga = orchestrator.start('order', {}, saga_id='S1')
+    assert saga['results']['pay'] is None
+    saga = orchestrator.run('S1')
+
+    assert saga['status'] == COMPENSATED
+    assert calls[2:] == [('undo', 'pay', None), ('undo', 'reserve', {'id': 'R'})]
+
+def test_failed_compensation_is_retried(saga_store):
+    attempts = []
+
+    def undo_reserve(data, results):
+        attempts.append(results['reserve'])
+        if len(attempts) == 1:
+            raise ConnectionError('inventory down')
+
+    orchestrator = make_orchestrator(saga_store)
+    orchestrator.define('order', [
+        SagaStep('reserve', lambda data, results: {'id': 'R'}, undo_reserve),
+        SagaStep('pay', action([], 'pay', error=SagaStepError('declined', 402)))
+    ])
+
+    orchestrator.start('order', {}, saga_id='S1')
+    saga = orchestrator.run('S1')
+    assert saga['status'] == COMPENSATING
+    assert saga['attempts'] == 1
+    assert saga['compensated'] == []
+
+    saga = orchestrator.run('S1')
+    assert saga['status'] == COMPENSATED
+    assert saga['compensated'] == ['reserve']
+    assert len(attempts) == 2
+
+def deferred_order(orchestrator, calls, confirm):
+    """Saga giống create_order: hai bước có bù trừ rồi một bước deferred"""
+    orchestrator.define('order', [
+        SagaStep('pay', action(calls, 'pay', {'id': 'P'}), undo(calls, 'pay')),
+        SagaStep('ship', action(calls, 'ship', {'id': 'S'}), undo(calls, 'ship')),
+        SagaStep('confirm', confirm, deferred=True)
+    ])
+    # Chạy như thread nền (không qua start() để test không phụ thuộc thread)
+    orchestrator.store.create('S1', 'order', {}, lease_until=0)
+
+def test_deferred_step_retries_server_error_without_compensating(saga_store):
+    calls = []
+    errors = [SagaStepError('confirm: upstream trả về 503', 503), ConnectionError('timeout')]
+
+    def confirm(data, results):
+        calls.append('confirm')
+        if errors:
+            raise errors.pop(0)
+        return {'status': 'confirmed'}
+
+    orchestrator = make_orchestrator(saga_store)
+    deferred_order(orchestrator, calls, confirm)
+
+    saga = orchestrator.run('S1')
+    assert saga['status'] == RUNNING
+    assert saga['attempts'] == 1
+    saga = orchestrator.run('S1')
+    assert saga['status'] == RUNNING
+    saga = orchestrator.run('S1')
+
+    assert saga['status'] == COMPLETED
+    assert calls == ['pay', 'ship', 'confirm', 'confirm', 'confirm']
+
+def test_rejected_deferred_step_needs_attention_without_compensating(saga_store):
+    calls = []
+    orchestrator = make_orchestrator(saga_store)
+    deferred_order(orchestrator, calls, action(calls, 'confirm', error=SagaStepError('hết hàng', 409)))
+
+    saga = orchestrator.run('S1')
+
+    assert saga['status'] == NEEDS_ATTENTION
+    assert saga['error']['status_code'] == 409
+    assert saga['compensated'] == []
+    assert calls == ['pay', 'ship', 'confirm']
+    # Không bị nhận lại bởi thread nền và không bị purge
+    assert saga_store.claim_due(60) == []
+    saga_store.purge(time.time() + 1)
+    assert saga_store.get('S1') is not None
+
+def test_deferred_step_gives_up_after_max_attempts(saga_store):
+    calls = []
+    orchestrator = make_orchestrator(saga_store, max_deferred_attempts=2)
+    deferred_order(orchestrator, calls, action(calls, 'confirm', error=ConnectionError('timeout')))
+
+    assert orchestrator.run('S1')['status'] == RUNNING
+    saga = orchestrator.run('S1')
+
+    assert saga['status'] == NEEDS_ATTENTION
+    assert ('undo', 'pay', {'id': 'P'}) not in calls
+
+def test_confirm_renews_expired_reservation():
+    sent = []
+
+    def call_service(service, method, path, **kwargs):
+        sent.append((method, path, kwargs.get('headers')))
+        if path == '/reservations/RSV-1/confirm':
+            return FakeResponse(409, {'error': 'expired', 'status': 'expired'})
+        if path == '/reservations':
+            return FakeResponse(201, {'id': 'RSV-2', 'status': 'held'})
+        return FakeResponse(200, {'id': 'RSV-2', 'status': 'confirmed'})
+
+    confirm = sync_step(confirm_inventory_step, call_service)
+    result = confirm({'order_id': 'ORD-1', 'items': [{'product_id': 1, 'quantity': 1}]},
+                     {'reserve_inventory': {'id': 'RSV-1'}})
+
+    assert result['status'] == 'confirmed'
+    assert sent == [
+        ('POST', '/reservations/RSV-1/confirm', None),
+        ('POST', '/reservations', {'Idempotency-Key': 'ORD-1:inventory:renew'}),
+        ('POST', '/reservations/RSV-2/confirm', None)
+    ]
+
+def test_confirm_rejects_when_renewal_is_out_of_stock():
+    def call_service(service, method, path, **kwargs):
+        if path == '/reservations':
+            return FakeResponse(400, {'error': 'Không đủ hàng'})
+        return FakeResponse(409, {'error': 'expired', 'status': 'expired'})
+
+    confirm = sync_step(confirm_inventory_step, call_service)
+    with pytest.raises(SagaStepError) as error:
+        confirm({'order_id': 'ORD-1', 'items': []}, {'reserve_inventory': {'id': 'RSV-1'}})
+    assert error.value.status_code == 400
+
+def test_release_looks_up_reservation_by_key_when_outcome_unknown():
+    sent = []
+
+    def call_service(service, method, path, **kwargs):
+        sent.append((method, path))
+        if path.startswith('/reservations/by-key/'):
+            return FakeResponse(200, {'id': 'RSV-1', 'status': 'held'})
+        return FakeResponse(200, {'id': 'RSV-1', 'status': 'released'})
+
+    release = sync_step(release_inventory_step, call_service)
+    release({'order_id': 'ORD-1'}, {'reserve_inventory': None})
+
+    assert sent == [('GET', '/reservations/by-key/ORD-1:inventory'), ('POST', '/reservations/RSV-1/release')]
+
+def test_refund_skips_payment_that_was_never_created():
+    sent = []
+
+    def call_service(service, method, path, **kwargs):
+        sent.append((method, path))
+        return FakeResponse(404, {'error': 'not found'})
+
+    refund = sync_step(refund_payment_step, call_service)
+    refund({'order_id': 'ORD-1'}, {'payment': None})
+
+    assert sent == [('GET', '/payments/by-key/ORD-1:payment')]
+
+def test_async_saga_keeps_store_calls_off_the_event_loop(saga_store):
+    loop_threads = []
+    store_threads = []
+    update = saga_store.update
+
+    def record_update(*args, **kwargs):
+        store_threads.append(threading.current_thread())
+        return update(*args, **kwargs)
+
+    saga_store.update = record_update
+
+    async def pay(data, results):
+        loop_threads.append(threading.current_thread())
+        return {'id': 'P'}
+
+    orchestrator = make_orchestrator(saga_store)
+    orchestrator.define('order', [SagaStep('pay', pay)])
+    saga = asyncio.run(orchestrator.start_async('order', {}, saga_id='S1'))
+
+    assert saga['status'] == COMPLETED
+    assert store_threads and loop_threads[0] not in store_threads
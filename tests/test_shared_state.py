@@ -0,0 +1,54 @@
+import multiprocessing
+
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry
+from utils.rate_limiter import SharedRateLimiter
+from utils.shared_state import SharedStateStore, SharedStateSyncer, share_circuit_breakers
+
+def make_syncer(path):
+    # Chu kỳ dài: test tự gọi các job đồng bộ thay vì chờ thread nền
+    return SharedStateSyncer(SharedStateStore(path), interval=3600)
+
+def run_sync_jobs(syncer):
+    for job in syncer._jobs:
+        job()
+
+def test_workers_share_one_rate_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr('utils.rate_limiter.time.time', lambda: 1000.0)
+    path = str(tmp_path / 'shared.db')
+    worker_a = SharedRateLimiter(make_syncer(path))
+    worker_b = SharedRateLimiter(make_syncer(path))
+
+    for _ in range(3):
+        assert worker_a.is_allowed('10.0.0.1', limit=4, period=60)
+    worker_a.sync()
+
+    # Worker B chỉ thấy 1 request của nó cho tới khi đồng bộ với store
+    assert worker_b.is_allowed('10.0.0.1', limit=4, period=60)
+    worker_b.sync()
+
+    assert not worker_b.is_allowed('10.0.0.1', limit=4, period=60)
+    assert worker_b.is_allowed('10.0.0.2', limit=4, period=60)
+
+def open_breaker_in_other_worker(path):
+    registry = CircuitBreakerRegistry({'failure_threshold': 1, 'window_size': 1, 'recovery_timeout': 60})
+    share_circuit_breakers(registry, make_syncer(path))
+    with pytest.raises(ConnectionError):
+        registry.get('inventory').call(lambda: (_ for _ in ()).throw(ConnectionError('down')))
+
+def test_breaker_opened_by_another_worker_is_adopted(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    syncer = make_syncer(path)
+    registry = CircuitBreakerRegistry({'failure_threshold': 1, 'window_size': 1, 'recovery_timeout': 60})
+    share_circuit_breakers(registry, syncer)
+    assert registry.get('inventory').state == CircuitBreaker.STATE_CLOSED
+
+    worker = multiprocessing.get_context('fork').Process(target=open_breaker_in_other_worker, args=(path,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    run_sync_jobs(syncer)
+    assert registry.get('inventory').state == CircuitBreaker.STATE_OPEN
+    assert registry.get('payment').state == CircuitBreaker.STATE_CLOSED
@@ -0,0 +1,108 @@
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import _registry as metrics
+from utils.single_flight import SingleFlight, _single_flight
+
+def run_concurrently(single_flight, count, func):
+    """Gọi single_flight.do cùng một key từ count thread; lời gọi chỉ kết thúc khi mọi thread đã vào"""
+    release = threading.Event()
+
+    def upstream():
+        release.wait(5)
+        return func()
+
+    def call(_):
+        try:
+            return single_flight.do(('inventory', 'GET', '/products'), upstream)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(call, index) for index in range(count)]
+        deadline = time.monotonic() + 5
+        while single_flight.get_stats()['collapsed'] < count - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        return [future.result() for future in futures]
+
+def test_identical_concurrent_calls_reach_upstream_once():
+    single_flight = SingleFlight()
+    upstream_calls = []
+
+    results = run_concurrently(single_flight, 10, lambda: upstream_calls.append(1) or {'items': []})
+
+    assert len(upstream_calls) == 1
+    assert results == [{'items': []}] * 10
+    assert single_flight.get_stats() == {'executed': 1, 'collapsed': 9, 'in_flight': 0}
+
+def test_exception_is_raised_in_every_waiter():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise ConnectionError('inventory down')
+
+    results = run_concurrently(single_flight, 5, fail)
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert single_flight.get_stats()['executed'] == 1
+
+def test_later_call_runs_again():
+    single_flight = SingleFlight()
+    single_flight.do('key', lambda: 1)
+
+    assert single_flight.do('key', lambda: 2) == 2
+    assert single_flight.get_stats()['executed'] == 2
+
+def run_concurrently_async(single_flight, count, func):
+    """Như run_concurrently() nhưng là count task trên cùng event loop, dùng do_async"""
+    async def main():
+        release = asyncio.Event()
+
+        async def upstream():
+            await release.wait()
+            return func()
+
+        async def call():
+            try:
+                return await single_flight.do_async(('inventory', 'GET', '/products'), upstream)
+            except Exception as e:
+                return e
+
+        tasks = [asyncio.create_task(call()) for _ in range(count)]
+        while single_flight.get_stats()['collapsed'] < count - 1:
+            await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    return asyncio.run(main())
+
+def test_async_identical_concurrent_calls_reach_upstream_once():
+    single_flight = SingleFlight()
+    upstream_calls = []
+
+    results = run_concurrently_async(single_flight, 10, lambda: upstream_calls.append(1) or {'items': []})
+
+    assert len(upstream_calls) == 1
+    assert results == [{'items': []}] * 10
+    assert single_flight.get_stats() == {'executed': 1, 'collapsed': 9, 'in_flight': 0}
+
+def test_async_exception_is_raised_in_every_waiter():
+    single_flight = SingleFlight()
+
+    def fail():
+        raise ConnectionError('inventory down')
+
+    results = run_concurrently_async(single_flight, 5, fail)
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert single_flight.get_stats()['in_flight'] == 0
+
+def test_single_flight_counters_are_exported():
+    _single_flight.do('export', lambda: None)
+
+    rendered = metrics.render()
+    assert 'gateway_single_flight_total{result="executed"}' in rendered
+    assert 'gateway_single_flight_total{result="collapsed"}' in rendered
@@ -0,0 +1,60 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from utils.time_limiter import TimeoutException, io_timeout, read_body, remaining_time, time_limit
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """Gửi header ngay, sau đó mỗi 0.1 giây một byte body"""
+
+    def do_GET(self):
+        size = int(self.path.strip('/') or 0)
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        for _ in range(size):
+            self.wfile.write(b'x')
+            self.wfile.flush()
+            time.sleep(0.1)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def trickle_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+def fetch(url):
+    response = requests.get(url, stream=True, timeout=io_timeout())
+    read_body(response)
+    return response.content
+
+def test_deadline_applies_to_whole_body(trickle_server):
+    started = time.monotonic()
+    with pytest.raises(TimeoutException):
+        time_limit(lambda: fetch(f'{trickle_server}/30'), seconds=0.5)
+
+    # Mỗi byte đến trước read timeout, nhưng tổng thời gian vẫn bị giới hạn
+    assert time.monotonic() - started < 1.5
+
+def test_body_within_deadline_is_returned(trickle_server):
+    assert time_limit(lambda: fetch(f'{trickle_server}/3'), seconds=2) == b'xxx'
+
+def test_nested_limit_keeps_tighter_deadline():
+    def inner():
+        return remaining_time()
+
+    assert time_limit(lambda: time_limit(inner, seconds=10), seconds=1) <= 1
+    assert remaining_time() is None
+
+def test_result_of_overrunning_function_is_discarded():
+    with pytest.raises(TimeoutException):
+        time_limit(lambda: time.sleep(0.2), seconds=0.05)
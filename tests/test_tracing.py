@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from common.tracing import is_valid_trace_id, read_trace
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+
+def test_trace_id_must_be_32_lowercase_hex():
+    assert is_valid_trace_id(TRACE_ID)
+    assert not is_valid_trace_id(TRACE_ID.upper())
+    assert not is_valid_trace_id(TRACE_ID[:-1])
+    assert not is_valid_trace_id('0' * 32)
+    assert not is_valid_trace_id('"')
+
+def test_read_trace_returns_only_spans_of_the_trace(tmp_path):
+    other = '0af7651916cd43dd8448eb211c80319c'
+    lines = [
+        {'trace_id': TRACE_ID, 'name': 'call', 'start': 2},
+        {'trace_id': other, 'name': 'other', 'start': 0, 'parent': TRACE_ID},
+        {'trace_id': TRACE_ID, 'name': 'GET /api/products', 'start': 1}
+    ]
+    (tmp_path / 'gateway.jsonl').write_text(''.join(json.dumps(line) + '\n' for line in lines))
+
+    assert [span['name'] for span in read_trace(TRACE_ID, str(tmp_path))] == ['GET /api/products', 'call']
+
+def test_read_trace_rejects_invalid_id(tmp_path):
+    with pytest.raises(ValueError):
+        read_trace('"', str(tmp_path))
@@ -0,0 +1,78 @@
+import time
+import threading
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from bench import Recorder
+from replay import load_capture, replay
+from utils.traffic_recorder import TrafficRecorder, record_traffic
+
+def make_app(received):
+    app = Flask(__name__)
+
+    @app.route('/api/products', methods=['GET'])
+    def products():
+        received.append(('GET', request.full_path, None, None))
+        return jsonify([])
+
+    @app.route('/api/orders', methods=['POST'])
+    def orders():
+        received.append(('POST', request.path, request.get_json(), request.headers.get('Idempotency-Key')))
+        return jsonify({'id': 'ORD-1'}), 201
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({'status': 'ok'})
+
+    return app
+
+@pytest.fixture
+def target():
+    """Server nhận traffic phát lại, ghi lại các request nhận được"""
+    received = []
+    server = make_server('127.0.0.1', 0, make_app(received), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', received
+    server.shutdown()
+
+def capture(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / 'traffic.jsonl'))
+    app = make_app([])
+    record_traffic(app, recorder)
+    client = app.test_client()
+
+    client.get('/api/products?limit=5')
+    client.get('/health')
+    client.post('/api/orders', json={'items': [{'product_id': 1, 'quantity': 2}]},
+                headers={'Idempotency-Key': 'K1'})
+
+    deadline = time.monotonic() + 5
+    while recorder.get_stats()['recorded'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return recorder.path
+
+def test_recorded_requests_are_loaded_in_order(tmp_path):
+    entries = load_capture(capture(tmp_path))
+
+    assert [(entry['method'], entry['path'], entry['status']) for entry in entries] == [
+        ('GET', '/api/products?limit=5', 200),
+        ('POST', '/api/orders', 201)
+    ]
+    assert entries[1]['json'] == {'items': [{'product_id': 1, 'quantity': 2}]}
+    assert entries[1]['headers'] == {'Idempotency-Key': 'K1'}
+
+def test_replay_sends_recorded_requests(tmp_path, target):
+    base_url, received = target
+    recorder = Recorder()
+    recorder.recording = True
+
+    replay(load_capture(capture(tmp_path)), base_url, speed=100, concurrency=2, recorder=recorder)
+
+    assert sorted(received) == [
+        ('GET', '/api/products?limit=5', None, None),
+        ('POST', '/api/orders', {'items': [{'product_id': 1, 'quantity': 2}]}, 'K1')
+    ]
+    _, routes = recorder.summary(elapsed=1)
+    assert routes['POST /api/orders']['status'] == {'201': 1}
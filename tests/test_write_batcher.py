@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import event
+
+from conftest import product_stock
+
+@pytest.fixture
+def commits(inventory_service):
+    """Số transaction đã commit trên engine của inventory service trong lúc test chạy"""
+    with inventory_service.app.app_context():
+        engine = inventory_service.db.engine
+    count = []
+    listener = lambda conn: count.append(threading.get_ident())
+    event.listen(engine, 'commit', listener)
+    yield count
+    event.remove(engine, 'commit', listener)
+
+def make_batcher(inventory_service, **kwargs):
+    WriteBatcher = type(inventory_service._write_batcher)
+    return WriteBatcher(inventory_service.app, inventory_service.db, **kwargs)
+
+def take_one(inventory_service, product_id):
+    """Thao tác ghi: trừ 1 khỏi tồn kho, trả về product_id"""
+    def operation():
+        Product = inventory_service.Product
+        Product.query.filter_by(id=product_id).update({Product.stock: Product.stock - 1})
+        return product_id
+    return operation
+
+def submit_all(batcher, operations):
+    """Gửi các thao tác cùng lúc; trả về kết quả hoặc exception của từng thao tác"""
+    start = threading.Barrier(len(operations))
+
+    def submit(operation):
+        start.wait()
+        try:
+            return batcher.submit(operation)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(operations)) as executor:
+        return list(executor.map(submit, operations))
+
+def test_concurrent_writes_share_one_commit(inventory_service, inventory_client, make_product, commits):
+    products = [make_product(5) for _ in range(8)]
+    batcher = make_batcher(inventory_service, window=0.2)
+    commits.clear()
+
+    results = submit_all(batcher, [take_one(inventory_service, product_id) for product_id in products])
+
+    assert results == products
+    assert len(commits) == 1
+    assert [product_stock(inventory_client, product_id) for product_id in products] == [4] * 8
+
+def test_failing_operation_does_not_affect_the_rest_of_the_batch(inventory_service, inventory_client,
+                                                                  make_product, commits):
+    products = [make_product(5) for _ in range(3)]
+    batcher = make_batcher(inventory_service, window=0.2)
+
+    def fail():
+        take_one(inventory_service, products[0])()
+        raise ValueError('invalid operation')
+
+    commits.clear()
+    results = submit_all(batcher, [take_one(inventory_service, product_id) for product_id in products] + [fail])
+
+    assert results[:3] == products
+    assert isinstance(results[3], ValueError)
+    # Batch lỗi được rollback, ba thao tác hợp lệ commit riêng
+    assert len(commits) == 3
+    assert [product_stock(inventory_client, product_id) for product_id in products] == [4, 4, 4]
+
+def test_disabled_batcher_commits_in_calling_thread(inventory_service, inventory_client, make_product, commits):
+    product_id = make_product(5)
+    batcher = make_batcher(inventory_service, enabled=False)
+    commits.clear()
+
+    assert batcher.submit(take_one(inventory_service, product_id)) == product_id
+    assert commits == [threading.get_ident()]
+    assert product_stock(inventory_client, product_id) == 4